@@ -0,0 +1,328 @@
+"""
+Asyncio serving engine.
+
+An HTTP/1.1 server on asyncio that runs the Flask app for request handling
+but moves all byte streaming into the event loop:
+
+- Requests are parsed on the loop; idle keep-alive connections cost a socket
+  and a small coroutine, not a thread.
+- The WSGI app runs on a bounded thread pool only to build the response.
+  For /stream it returns the `wsgi.file_wrapper` offered here (see
+  streaming.open_range_body), which is then copied to the socket with
+  loop.sendfile (os.sendfile on Unix, read/write fallback elsewhere).
+- Other bodies (multipart ranges, HTML, JSON) are iterated on the pool and
+  written with writer.drain() after every chunk, so a slow client applies
+  backpressure instead of growing buffers.
+
+Thousands of open playback connections can therefore share one process and
+a handful of threads.
+"""
+
+import io
+import sys
+import signal
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import unquote_to_bytes
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+MAX_HEADER_BYTES = 16384
+MAX_REQUEST_BODY = 1024 * 1024   # only small API bodies are expected
+WRITE_BUFFER_HIGH = 256 * 1024   # transport buffer size that triggers backpressure
+
+_HTTP_VERSIONS = ('HTTP/1.0', 'HTTP/1.1')
+
+
+class AsyncFileWrapper:
+    """
+    `wsgi.file_wrapper` implementation. The server recognises it and sends
+    Content-Length bytes from the file's current position with sendfile.
+    """
+
+    def __init__(self, filelike, block_size: int = 65536) -> None:
+        self.filelike = filelike
+        self.block_size = block_size
+
+    def __iter__(self):
+        # Plain iteration for anything that does not special-case the wrapper
+        while True:
+            data = self.filelike.read(self.block_size)
+            if not data:
+                break
+            yield data
+
+    def close(self) -> None:
+        self.filelike.close()
+
+
+class _BadRequest(Exception):
+    def __init__(self, status: str) -> None:
+        super().__init__(status)
+        self.status = status
+
+
+def raise_fd_limit() -> None:
+    """Raises the soft open-file limit to the hard limit, connections are file descriptors."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY:
+            hard = 1 << 16
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+class AsyncWSGIServer:
+    """Serves a WSGI app over asyncio with sendfile-backed file responses."""
+
+    def __init__(self, app: Callable, host: str, port: int, threads: int = 16,
+                 max_connections: int = 10000, keepalive: float = 75.0,
+                 backlog: int = 2048) -> None:
+        self.app = app
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.keepalive = keepalive
+        self.backlog = backlog
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='aio-wsgi')
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+
+    # --- Lifecycle ---
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port, backlog=self.backlog, limit=MAX_HEADER_BYTES)
+        sockets = self._server.sockets or []
+        if sockets:
+            self.port = sockets[0].getsockname()[1]
+        logger.info(f"asyncio engine serving on {self.host}:{self.port}")
+
+    async def shutdown(self, graceful_timeout: float) -> None:
+        """Stops accepting, lets in-flight connections finish, then cancels the rest."""
+        if self._server is not None:
+            self._server.close()
+        pending = set(self._connections)
+        if pending:
+            logger.info(f"Waiting up to {graceful_timeout:.0f}s for {len(pending)} connections")
+            _, still_running = await asyncio.wait(pending, timeout=graceful_timeout)
+            for task in still_running:
+                task.cancel()
+            if still_running:
+                await asyncio.wait(still_running)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    # --- Connections ---
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        if len(self._connections) >= self.max_connections:
+            writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            writer.close()
+            return
+        if task is not None:
+            self._connections.add(task)
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keepalive)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._write_error(writer, '431 Request Header Fields Too Large')
+                    break
+                try:
+                    keep_alive = await self._handle_request(head, reader, writer)
+                except _BadRequest as e:
+                    await self._write_error(writer, e.status)
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.error(f"Error serving connection: {e}")
+        finally:
+            if task is not None:
+                self._connections.discard(task)
+            writer.close()
+
+    async def _write_error(self, writer: asyncio.StreamWriter, status: str) -> None:
+        body = status.encode('latin-1')
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode('latin-1') + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    # --- Requests ---
+    def _build_environ(self, head: bytes, writer: asyncio.StreamWriter) -> Tuple[Dict[str, Any], str, Dict[str, str]]:
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise _BadRequest('400 Bad Request')
+        if version not in _HTTP_VERSIONS:
+            raise _BadRequest('505 HTTP Version Not Supported')
+
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise _BadRequest('400 Bad Request')
+            key = name.strip().lower()
+            value = value.strip()
+            headers[key] = f"{headers[key]}, {value}" if key in headers else value
+
+        path, _, query = target.partition('?')
+        peer = writer.get_extra_info('peername') or ('', 0)
+        environ: Dict[str, Any] = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'RAW_URI': target,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0],
+            'REMOTE_PORT': str(peer[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': AsyncFileWrapper,
+            # Body chunks go to transport.write, which takes memoryviews too
+            'media_server.buffer_chunks': True,   # see streaming.BUFFER_CHUNKS_KEY
+        }
+        for key, value in headers.items():
+            if key == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            elif key == 'content-length':
+                environ['CONTENT_LENGTH'] = value
+            else:
+                environ['HTTP_' + key.upper().replace('-', '_')] = value
+        return environ, version, headers
+
+    async def _handle_request(self, head: bytes, reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter) -> bool:
+        """Serves one request. Returns True if the connection may be reused."""
+        environ, version, headers = self._build_environ(head, writer)
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise _BadRequest('411 Length Required')
+        try:
+            body_length = int(headers.get('content-length', '0') or 0)
+        except ValueError:
+            raise _BadRequest('400 Bad Request')
+        if body_length > MAX_REQUEST_BODY:
+            raise _BadRequest('413 Payload Too Large')
+        body = await reader.readexactly(body_length) if body_length else b''
+        environ['wsgi.input'] = io.BytesIO(body)
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = 'close' not in connection if version == 'HTTP/1.1' else 'keep-alive' in connection
+
+        response_start: List[Any] = []
+
+        def start_response(status: str, response_headers: List[Tuple[str, str]], exc_info=None):
+            if exc_info and response_start:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response_start[:] = [status, response_headers]
+            return lambda data: None  # the legacy write() callable is not supported
+
+        loop = asyncio.get_running_loop()
+        app_iter = await loop.run_in_executor(self.executor, self.app, environ, start_response)
+        try:
+            status, response_headers = response_start
+            content_length: Optional[int] = None
+            for name, value in response_headers:
+                if name.lower() == 'content-length':
+                    content_length = int(value)
+            omit_body = environ['REQUEST_METHOD'] == 'HEAD' or status[:3] in ('204', '304') or status[0] == '1'
+            chunked = content_length is None and not omit_body and version == 'HTTP/1.1'
+            if content_length is None and not omit_body and not chunked:
+                keep_alive = False
+
+            head_lines = [f"{version} {status}"]
+            head_lines.extend(f"{name}: {value}" for name, value in response_headers)
+            if chunked:
+                head_lines.append("Transfer-Encoding: chunked")
+            head_lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+            writer.write(('\r\n'.join(head_lines) + '\r\n\r\n').encode('latin-1'))
+
+            if omit_body:
+                await writer.drain()
+            elif isinstance(app_iter, AsyncFileWrapper) and content_length is not None:
+                await self._send_file(writer, app_iter, content_length)
+            else:
+                await self._send_iterable(writer, app_iter, chunked)
+        finally:
+            close = getattr(app_iter, 'close', None)
+            if close is not None:
+                await loop.run_in_executor(self.executor, close)
+        return keep_alive
+
+    async def _send_file(self, writer: asyncio.StreamWriter, wrapper: AsyncFileWrapper, count: int) -> None:
+        await writer.drain()
+        if count <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        offset = wrapper.filelike.tell()
+        # Waits for socket writability between sendfile calls, so slow
+        # clients are served at their own pace without buffering the file
+        await loop.sendfile(writer.transport, wrapper.filelike, offset, count, fallback=True)
+
+    async def _send_iterable(self, writer: asyncio.StreamWriter, app_iter, chunked: bool) -> None:
+        loop = asyncio.get_running_loop()
+        iterator = iter(app_iter)
+        done = object()
+        while True:
+            chunk = await loop.run_in_executor(self.executor, next, iterator, done)
+            if chunk is done:
+                break
+            if not chunk:
+                continue
+            if chunked:
+                writer.write(f"{len(chunk):X}\r\n".encode('ascii') + chunk + b"\r\n")
+            else:
+                writer.write(chunk)
+            await writer.drain()
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+async def _serve_until_stopped(server: AsyncWSGIServer, graceful_timeout: float) -> None:
+    await server.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: KeyboardInterrupt still ends asyncio.run
+    await stop.wait()
+    logger.info("Shutting down asyncio engine")
+    await server.shutdown(graceful_timeout)
+
+
+def serve(app: Callable, host: str, port: int, threads: int, max_connections: int,
+          keepalive: float, backlog: int, graceful_timeout: float) -> None:
+    """Runs the asyncio engine until SIGINT/SIGTERM."""
+    raise_fd_limit()
+    server = AsyncWSGIServer(app, host, port, threads=threads, max_connections=max_connections,
+                             keepalive=keepalive, backlog=backlog)
+    try:
+        asyncio.run(_serve_until_stopped(server, graceful_timeout))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Benchmark: shared block cache with N clients seeking through one file
+---------------------------------------------------------------------
+N threads play the same video: each reads 1MB ranges sequentially and now
+and then seeks, mostly to a few shared positions (chapter marks, the spot
+everyone skips to). Compares the former uncached path (open, seek, 64KB
+reads per request) with reads through block_cache.BlockCache, on storage
+that costs --storage-ms per MB read (simulated NAS/USB latency; the page
+cache makes local disks look free).
+
+Reports MB/s delivered, p50/p99 range latency, MB read from storage and
+the cache hit ratio.
+
+Usage: python benchmarks/bench_block_cache.py [--clients 1 4 16]
+       [--storage-ms 10] [--budget-mb 64] [--size-mb 256]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+from typing import Callable, Iterator, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from block_cache import BlockCache  # noqa: E402
+
+RANGE_SIZE = 1 << 20
+RANGES_PER_CLIENT = 64
+HOT_SPOTS = 4  # shared seek targets
+
+
+class SlowStorageCache(BlockCache):
+    """BlockCache whose block reads pay the simulated storage cost."""
+
+    def __init__(self, storage_s_per_byte: float, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.storage_s_per_byte = storage_s_per_byte
+        self.bytes_read = 0
+
+    def _read_blocks(self, fd: int, block_no: int, count: int) -> bytes:
+        data = super()._read_blocks(fd, block_no, count)
+        self.bytes_read += len(data)
+        time.sleep(len(data) * self.storage_s_per_byte)
+        return data
+
+
+def run_clients(clients: int, file_size: int, read_range: Callable[[int, int], Iterator[bytes]],
+                seed: int) -> List[float]:
+    latencies: List[float] = []
+    lock = threading.Lock()
+    hot_spots = [random.Random(seed).randrange(0, file_size - RANGE_SIZE * 8) for _ in range(HOT_SPOTS)]
+
+    def client(index: int) -> None:
+        rng = random.Random(seed + index)
+        position = rng.choice(hot_spots)
+        local: List[float] = []
+        for _ in range(RANGES_PER_CLIENT):
+            if rng.random() < 0.1:
+                position = rng.choice(hot_spots) if rng.random() < 0.8 else rng.randrange(0, file_size - RANGE_SIZE)
+            started = time.perf_counter()
+            for _chunk in read_range(position, RANGE_SIZE):
+                pass
+            local.append(time.perf_counter() - started)
+            position = (position + RANGE_SIZE) % (file_size - RANGE_SIZE)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies
+
+
+def report(mode: str, clients: int, elapsed: float, latencies: List[float],
+           storage_bytes: int, hit_ratio: str) -> None:
+    latencies.sort()
+    delivered = len(latencies) * RANGE_SIZE
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"{mode:>9} {clients:>7} {delivered / elapsed / 1e6:>9.1f} {p50:>9.1f} {p99:>9.1f} "
+          f"{storage_bytes / 1e6:>10.1f} {hit_ratio:>6}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--storage-ms', type=float, default=10.0, help="simulated storage cost per MB")
+    parser.add_argument('--budget-mb', type=int, default=64)
+    parser.add_argument('--size-mb', type=int, default=256)
+    args = parser.parse_args()
+    s_per_byte = args.storage_ms / 1000 / (1 << 20)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.mp4')
+        with open(path, 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1 << 20))
+        file_size = args.size_mb << 20
+
+        print(f"{args.size_mb} MB file, {RANGES_PER_CLIENT} x 1MB ranges per client, "
+              f"storage {args.storage_ms} ms/MB, cache budget {args.budget_mb} MB")
+        print(f"{'mode':>9} {'clients':>7} {'MB/s':>9} {'p50 ms':>9} {'p99 ms':>9} "
+              f"{'storage MB':>10} {'hits':>6}")
+        for clients in args.clients:
+            storage_bytes = [0]
+            count_lock = threading.Lock()
+
+            def uncached_range(start: int, length: int) -> Iterator[bytes]:
+                with open(path, 'rb') as f:
+                    f.seek(start)
+                    remaining = length
+                    while remaining > 0:
+                        chunk = f.read(min(remaining, 65536))
+                        if not chunk:
+                            break
+                        with count_lock:
+                            storage_bytes[0] += len(chunk)
+                        time.sleep(len(chunk) * s_per_byte)
+                        remaining -= len(chunk)
+                        yield chunk
+
+            started = time.perf_counter()
+            latencies = run_clients(clients, file_size, uncached_range, seed=clients)
+            report('uncached', clients, time.perf_counter() - started, latencies, storage_bytes[0], '-')
+
+            cache = SlowStorageCache(s_per_byte, budget=args.budget_mb << 20)
+            st = os.stat(path)
+            started = time.perf_counter()
+            latencies = run_clients(clients, file_size,
+                                    lambda start, length: cache.iter_range(path, start, length, st),
+                                    seed=clients)
+            stats = cache.stats()
+            report('cached', clients, time.perf_counter() - started, latencies, cache.bytes_read,
+                   f"{stats['hit_ratio']:.0%}")
+
+
+if __name__ == '__main__':
+    main()
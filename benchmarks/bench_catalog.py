@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark: catalog lookup, listing, search and the index page for large libraries
+----------------------------------------------------------------------------------
+First compares VideoCatalog.get (hash index) with the former linear scan
+over a list of dicts, for catalogs of 10 to --videos entries; lookups
+target the last entry, the linear scan's worst case. Then builds a
+synthetic catalog of --videos entries and measures, through the Flask
+test client:
+
+- the index page size and render time (the playlist is no longer inlined),
+- the first /api/videos page per sort order (first call builds the order),
+- substring and prefix searches (first call builds the search index)
+  against a linear scan over the filenames,
+- following cursors through a filtered listing.
+
+Usage: python benchmarks/bench_catalog.py [--videos 100000]
+"""
+
+import os
+import sys
+import time
+import timeit
+import logging
+import argparse
+import tempfile
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server  # noqa: E402
+from catalog import VideoCatalog  # noqa: E402
+from library import natural_sort_key  # noqa: E402
+
+LOOKUP_SIZES = (10, 100, 1000, 10000, 100000)
+
+
+def timed(func: Callable[[], object], repeat: int = 1) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def linear_lookup(videos: List[Dict[str, str]], filename: str) -> Optional[Dict[str, str]]:
+    for video in videos:
+        if video['filename'] == filename:
+            return video
+    return None
+
+
+def bench_lookup(max_size: int) -> None:
+    print(f"{'entries':>8} {'catalog ns/op':>14} {'linear ns/op':>14}")
+    for size in [size for size in LOOKUP_SIZES if size < max_size] + [max_size]:
+        videos = [{'filename': f"Episode {i:06d}.mkv", 'path': f"/library/Episode {i:06d}.mkv"}
+                  for i in range(size)]
+        catalog = VideoCatalog(videos)
+        target = videos[-1]['filename']
+
+        number = 200000
+        catalog_ns = timeit.timeit(lambda: catalog.get(target), number=number) / number * 1e9
+        linear_number = max(10, number // size)
+        linear_ns = timeit.timeit(lambda: linear_lookup(videos, target), number=linear_number) / linear_number * 1e9
+        print(f"{size:>8} {catalog_ns:>14.1f} {linear_ns:>14.1f}")
+    print()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--videos', type=int, default=100000)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    bench_lookup(args.videos)
+
+    videos = [{'filename': f'Series {i % 500}/Season {i % 7}/Episode {i}.mp4',
+               'path': f'/library/{i}.mp4', 'size': (i * 7919) % 5_000_000_000, 'mtime_ns': i * 10**9}
+              for i in range(args.videos)]
+    videos.sort(key=lambda video: natural_sort_key(video['filename']))
+    with tempfile.TemporaryDirectory() as tmp:
+        server.init_server_state([], metadata_db=os.path.join(tmp, 'metadata.db'),
+                                 hls_cache_dir=os.path.join(tmp, 'hls'),
+                                 thumbnail_cache_dir=os.path.join(tmp, 'thumbnails'))
+        server.CATALOG = server.VideoCatalog(videos)  # skip probing the fake files
+        client = server.app.test_client()
+
+        page = client.get('/')
+        inline_bytes = len(repr(server.CATALOG.filenames()))
+        print(f"{args.videos} videos")
+        print(f"index page: {len(page.data) / 1024:.1f} KB (an inlined playlist alone was {inline_bytes / 1e6:.1f} MB), "
+              f"{timed(lambda: client.get('/'), 5):.2f} ms")
+
+        for sort in ('name', '-size', '-mtime'):
+            first = timed(lambda: client.get(f'/api/videos?sort={sort}'))
+            warm = timed(lambda: client.get(f'/api/videos?sort={sort}'), 20)
+            print(f"/api/videos sort={sort:<7} first {first:8.2f} ms, then {warm:6.2f} ms")
+
+        names = [name.lower() for name in server.CATALOG.filenames()]
+        linear = timed(lambda: [name for name in names if 'episode 4242' in name], 5)
+        first = timed(lambda: client.get('/api/videos?q=episode%204242'))
+        warm = timed(lambda: client.get('/api/videos?q=episode%204242'), 20)
+        print(f"substring search  first {first:8.2f} ms, then {warm:6.2f} ms (linear scan {linear:.2f} ms)")
+        warm = timed(lambda: client.get('/api/videos?prefix=series%2042/'), 20)
+        print(f"prefix search     {warm:6.2f} ms")
+
+        pages = 0
+        cursor = ''
+        started = time.perf_counter()
+        while True:
+            data = client.get(f'/api/videos?q=season%203&limit=500{cursor}').json
+            pages += 1
+            if not data['next_cursor']:
+                break
+            cursor = f"&cursor={data['next_cursor']}"
+        print(f"filtered listing: {data['total']} matches in {pages} pages, "
+              f"{(time.perf_counter() - started) * 1000 / pages:.2f} ms per page")
+        etag = client.get('/api/videos').headers['ETag']
+        revalidate = timed(lambda: client.get('/api/videos', headers={'If-None-Match': etag}), 20)
+        print(f"revalidation (304): {revalidate:.2f} ms")
+        server.shutdown_server_state()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark: chunk sizing strategies for generator streaming
+----------------------------------------------------------
+Streams a byte range over a socket pair with streaming.iter_file_range
+using fixed 64KB chunks, fixed 1MB chunks and adaptive chunks, to a fast
+client and to a client throttled to a video-like rate, with the block
+cache off and on (the default; chunks are cache blocks then, and the
+strategy sizes the reads filling misses).
+The file is evicted from the page cache (POSIX_FADV_DONTNEED) before each
+run, so read-ahead hints matter as on a cold library.
+
+Reports time to first byte, throughput and syscalls (preads, counted per
+chunk or per cache fill, plus socket sends, counted per chunk).
+
+Usage: python benchmarks/bench_chunking.py [--size-mb 128] [--throttle-mbps 40]
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import threading
+from typing import Dict, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import streaming  # noqa: E402
+import readahead  # noqa: E402
+
+STRATEGIES = (
+    ('fixed 64KB', dict(chunk_size=64 * 1024, adaptive=False)),
+    ('fixed 1MB', dict(chunk_size=1024 * 1024, adaptive=False)),
+    ('adaptive', dict(adaptive=True)),
+)
+
+
+def evict_from_page_cache(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        if readahead.HAS_FADVISE:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def run(path: str, length: int, throttle: Optional[float], options: Dict) -> Dict[str, float]:
+    sender_sock, receiver_sock = socket.socketpair()
+    result: Dict[str, float] = {}
+    started = time.perf_counter()
+
+    def receive() -> None:
+        buf = bytearray(1 << 20)
+        received = 0
+        while received < length:
+            n = receiver_sock.recv_into(buf, min(len(buf), 256 * 1024))
+            if not n:
+                break
+            if received == 0:
+                result['ttfb'] = time.perf_counter() - started
+            received += n
+            if throttle:
+                # Sleep until the client is back on its target rate
+                ahead = received / throttle - (time.perf_counter() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        result['elapsed'] = time.perf_counter() - started
+        receiver_sock.close()
+
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+    chunks = 0
+    fills = streaming.BLOCK_CACHE.misses
+    for chunk in streaming.iter_file_range(path, 0, length, **options):
+        sender_sock.sendall(chunk)
+        chunks += 1
+    sender_sock.close()
+    receiver.join()
+    preads = streaming.BLOCK_CACHE.misses - fills if streaming.BLOCK_CACHE.enabled else chunks
+    result['syscalls'] = preads + chunks
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=128)
+    parser.add_argument('--throttle-mbps', type=float, default=40.0, help="throttled client rate, Mbit/s")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=os.path.expanduser('~')) as tmp:
+        path = os.path.join(tmp, 'bench.mp4')
+        with open(path, 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1 << 20))
+        full = args.size_mb << 20
+        throttle = args.throttle_mbps * 1e6 / 8
+        # The throttled client watches 5 seconds' worth
+        clients = (('fast client', full, None), (f'{args.throttle_mbps:g} Mbit/s', int(throttle * 5), throttle))
+
+        print(f"{args.size_mb} MB file, page cache evicted before each run")
+        print(f"{'client':>14} {'cache':>6} {'strategy':>11} {'TTFB ms':>9} {'MB/s':>9} {'syscalls':>9}")
+        budget = streaming.BLOCK_CACHE.budget
+        for client_name, length, rate in clients:
+            for cache in ('off', 'on'):
+                streaming.BLOCK_CACHE.budget = budget if cache == 'on' else 0
+                for name, options in STRATEGIES:
+                    streaming.BLOCK_CACHE.clear()
+                    evict_from_page_cache(path)
+                    r = run(path, length, rate, options)
+                    print(f"{client_name:>14} {cache:>6} {name:>11} {r['ttfb'] * 1000:>9.2f} "
+                          f"{length / r['elapsed'] / 1e6:>9.1f} {r['syscalls']:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Benchmark: consistent-hash ring balance, movement and lookup cost
+------------------------------------------------------------------
+Places --videos synthetic filenames on rings of 2 to --nodes nodes
+(cluster.HashRing) and reports, for each size,
+
+  balance   the most and least loaded node relative to an even share,
+  moved     the share of videos changing owner when that node joined,
+            next to the ideal 1/n (a modulo hash would move most of them),
+  lookup    the time of one Cluster.locate-style preference() lookup.
+
+Usage: python benchmarks/bench_cluster.py [--videos 100000] [--nodes 8] [--vnodes 64]
+"""
+
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cluster  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--videos', type=int, default=100_000)
+    parser.add_argument('--nodes', type=int, default=8)
+    parser.add_argument('--vnodes', type=int, default=cluster.VNODES)
+    args = parser.parse_args()
+
+    filenames = [f"Show {i // 100:04d}/Episode {i % 100:02d}.mkv" for i in range(args.videos)]
+    nodes = [f"http://10.0.0.{i + 1}:5000" for i in range(args.nodes)]
+    previous = None
+    print(f"{args.videos} videos, {args.vnodes} points per node")
+    print(f"{'nodes':>5} {'max load':>9} {'min load':>9} {'moved':>7} {'ideal':>7} {'lookup (us)':>12}")
+    for count in range(1, args.nodes + 1):
+        ring = cluster.HashRing(nodes[:count], args.vnodes)
+        started = time.perf_counter()
+        owners = [ring.preference(filename)[0] for filename in filenames]
+        lookup = (time.perf_counter() - started) / len(filenames)
+        if count == 1:
+            previous = owners
+            continue
+        load = Counter(owners)
+        share = len(filenames) / count
+        moved = sum(1 for old, new in zip(previous, owners) if old != new) / len(filenames)
+        print(f"{count:>5} {max(load.values()) / share:>9.2f} {min(load.values()) / share:>9.2f} "
+              f"{moved:>7.1%} {1 / count:>7.1%} {lookup * 1e6:>12.2f}")
+        previous = owners
+
+
+if __name__ == '__main__':
+    main()
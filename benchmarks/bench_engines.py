@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Benchmark: asyncio engine vs threaded generator streaming
+---------------------------------------------------------
+Starts the server once per engine on a generated video and, while it holds
+I idle keep-alive connections (each has made one request) and S slow
+consumers (each streaming the whole file at a throttled rate), measures
+the latency of small range requests from a separate client. Reports the
+probe p50/p99, how many idle connections the server actually kept open, and
+its thread count and RSS under that load.
+
+The ``dev`` engine is the thread-per-connection Werkzeug server with the
+generator backend; ``asyncio`` serves the same app from an event loop with
+loop.sendfile.
+
+Usage: python benchmarks/bench_engines.py [--engines asyncio dev]
+       [--idle 1000] [--slow 50] [--slow-rate-kb 256] [--size-mb 64]
+"""
+
+import os
+import sys
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aio_server import raise_fd_limit  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER_SCRIPT = """
+import sys, functools, logging
+sys.path.insert(0, {repo!r})
+logging.basicConfig(level=logging.WARNING)
+import server, serving
+videos = [{{'filename': 'bench.mp4', 'path': {video!r}}}]
+config = serving.ServingConfig(engine={engine!r}, host='127.0.0.1', port={port},
+                               threads=16, max_connections=100000, keepalive=300)
+serving.run(server.app, config,
+            init_state=functools.partial(server.init_server_state, videos, metadata_db={db!r}),
+            shutdown_state=server.shutdown_server_state)
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_stats(pid: int) -> Dict[str, int]:
+    stats = {'threads': 0, 'rss_mb': 0}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    stats['threads'] = int(line.split()[1])
+                elif line.startswith('VmRSS:'):
+                    stats['rss_mb'] = int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return stats
+
+
+async def read_headers(reader: asyncio.StreamReader) -> Tuple[int, bool]:
+    """Reads a response head. Returns (Content-Length, keep_alive)."""
+    head = await reader.readuntil(b'\r\n\r\n')
+    content_length, keep_alive = 0, True
+    for line in head.lower().split(b'\r\n'):
+        if line.startswith(b'content-length:'):
+            content_length = int(line.split(b':')[1])
+        elif line.startswith(b'connection:') and b'close' in line:
+            keep_alive = False
+    return content_length, keep_alive
+
+
+async def range_request(reader, writer, start: int, length: int) -> bool:
+    """Fetches one range, returns whether the server keeps the connection open."""
+    writer.write(f"GET /stream/bench.mp4 HTTP/1.1\r\nHost: bench\r\n"
+                 f"Range: bytes={start}-{start + length - 1}\r\n\r\n".encode('ascii'))
+    body, keep_alive = await read_headers(reader)
+    await reader.readexactly(body)
+    return keep_alive
+
+
+async def open_idle(port: int, connections: list) -> None:
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        if await asyncio.wait_for(range_request(reader, writer, 0, 1024), 10):
+            connections.append(writer)
+        else:
+            writer.close()  # the server does not hold idle connections
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+        pass
+
+
+async def slow_consumer(port: int, rate: int, stop: asyncio.Event) -> None:
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port, limit=rate)
+        writer.write(b"GET /stream/bench.mp4 HTTP/1.1\r\nHost: bench\r\n\r\n")
+        await read_headers(reader)
+        while not stop.is_set():
+            if not await reader.read(rate // 10):
+                break
+            await asyncio.sleep(0.1)
+        writer.close()
+    except (OSError, asyncio.IncompleteReadError):
+        pass
+
+
+async def run_load(port: int, pid: int, file_size: int, idle: int, slow: int,
+                   slow_rate: int, probes: int) -> None:
+    idle_connections: List[asyncio.StreamWriter] = []
+    for batch in range(0, idle, 200):
+        await asyncio.gather(*(open_idle(port, idle_connections) for _ in range(min(200, idle - batch))))
+    stop = asyncio.Event()
+    slow_tasks = [asyncio.ensure_future(slow_consumer(port, slow_rate, stop)) for _ in range(slow)]
+    await asyncio.sleep(2.0)
+
+    latencies: List[float] = []
+    errors = 0
+    writer = None
+    for _ in range(probes):
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            start = random.randrange(file_size - 65536)
+            keep_alive = await asyncio.wait_for(range_request(reader, writer, start, 65536), 10)
+            latencies.append(time.perf_counter() - started)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            errors += 1
+            keep_alive = False
+        if not keep_alive and writer is not None:
+            writer.close()
+            writer = None
+    stats = process_stats(pid)
+
+    stop.set()
+    if writer is not None:
+        writer.close()
+    for w in idle_connections:
+        w.close()
+    await asyncio.gather(*slow_tasks)
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else float('nan')
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000 if latencies else float('nan')
+    print(f"{len(idle_connections):>6} {slow:>6} {p50:>9.1f} {p99:>9.1f} {errors:>7} "
+          f"{stats['threads']:>8} {stats['rss_mb']:>7}", end='')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engines', nargs='+', default=['asyncio', 'dev'])
+    parser.add_argument('--idle', type=int, default=1000, help="idle keep-alive connections")
+    parser.add_argument('--slow', type=int, default=50, help="throttled full-file streams")
+    parser.add_argument('--slow-rate-kb', type=int, default=256, help="KB/s per slow stream")
+    parser.add_argument('--probes', type=int, default=200)
+    parser.add_argument('--size-mb', type=int, default=64)
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, 'bench.mp4')
+        with open(video, 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1 << 20))
+        file_size = args.size_mb << 20
+
+        print(f"{args.size_mb} MB file, slow streams at {args.slow_rate_kb} KB/s, 64KB probe ranges")
+        print(f"{'engine':>8} {'idle':>6} {'slow':>6} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7} "
+              f"{'threads':>8} {'RSS MB':>7}")
+        for engine in args.engines:
+            port = free_port()
+            script = SERVER_SCRIPT.format(repo=REPO_DIR, video=video, engine=engine, port=port,
+                                          db=os.path.join(tmp, f'{engine}.sqlite3'))
+            proc = subprocess.Popen([sys.executable, '-c', script],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                deadline = time.time() + 30
+                while time.time() < deadline:
+                    try:
+                        socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                        break
+                    except OSError:
+                        time.sleep(0.2)
+                print(f"{engine:>8} ", end='')
+                asyncio.run(run_load(port, proc.pid, file_size, args.idle, args.slow,
+                                     args.slow_rate_kb * 1024, args.probes))
+                print()
+            finally:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=35)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark: seek latency next to a bulk download, with and without shaping
+-------------------------------------------------------------------------
+One "VLC" client pulls a whole file over two connections in 1MB chunks
+while four viewers seek (256KB ranges at random offsets, 64KB chunks).
+Storage is simulated as a single disk: reads are serialised and cost
+--disk-mbs. Runs the same load through shaping.Shaper unshaped, with the
+fair-share scheduler, and with the scheduler plus a per-client cap.
+
+Reports seek p50/p99, bulk throughput and the scheduler's mean queue wait
+for interactive and bulk reads.
+
+Usage: python benchmarks/bench_fair_share.py [--disk-mbs 100] [--seconds 5]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+from typing import Dict, Iterator, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shaping import Shaper  # noqa: E402
+
+BULK_CHUNK = 1 << 20
+SEEK_CHUNK = 64 * 1024
+SEEK_SIZE = 256 * 1024
+VIEWERS = 4
+
+
+class SimulatedDisk:
+    def __init__(self, bytes_per_second: float) -> None:
+        self.bytes_per_second = bytes_per_second
+        self.lock = threading.Lock()
+
+    def read(self, length: int, chunk: int) -> Iterator[bytes]:
+        remaining = length
+        while remaining > 0:
+            n = min(chunk, remaining)
+            with self.lock:
+                time.sleep(n / self.bytes_per_second)
+            remaining -= n
+            yield b'\0' * n
+
+
+def run(shaper: Shaper, disk: SimulatedDisk, seconds: float) -> Dict[str, float]:
+    deadline = time.monotonic() + seconds
+    seek_latencies: List[float] = []
+    bulk_bytes = [0]
+    lock = threading.Lock()
+
+    def bulk() -> None:
+        while time.monotonic() < deadline:
+            for chunk in shaper.shape(disk.read(64 * BULK_CHUNK, BULK_CHUNK), 'vlc', 64 * BULK_CHUNK):
+                with lock:
+                    bulk_bytes[0] += len(chunk)
+                if time.monotonic() >= deadline:
+                    break
+
+    def viewer(index: int) -> None:
+        rng = random.Random(index)
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            for _chunk in shaper.shape(disk.read(SEEK_SIZE, SEEK_CHUNK), f'viewer{index}', SEEK_SIZE):
+                pass
+            with lock:
+                seek_latencies.append(time.monotonic() - started)
+            time.sleep(rng.uniform(0.05, 0.2))  # think time between seeks
+
+    threads = [threading.Thread(target=bulk) for _ in range(2)]
+    threads += [threading.Thread(target=viewer, args=(i,)) for i in range(VIEWERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    seek_latencies.sort()
+    scheduler = shaper.stats()['scheduler']
+    return {
+        'p50': seek_latencies[len(seek_latencies) // 2] * 1000,
+        'p99': seek_latencies[min(len(seek_latencies) - 1, int(len(seek_latencies) * 0.99))] * 1000,
+        'seeks': len(seek_latencies),
+        'bulk_mbs': bulk_bytes[0] / seconds / 1e6,
+        'wait_interactive': scheduler['mean_wait_ms']['interactive'] if scheduler else float('nan'),
+        'wait_bulk': scheduler['mean_wait_ms']['bulk'] if scheduler else float('nan'),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--disk-mbs', type=float, default=100.0, help="simulated disk throughput, MB/s")
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+    disk = SimulatedDisk(args.disk_mbs * 1e6)
+
+    modes = (
+        ('unshaped', Shaper(io_slots=0, client_rate=0, global_rate=0)),
+        ('fair-share', Shaper(io_slots=1, client_rate=0, global_rate=0)),
+        ('fair+cap 200Mbit', Shaper(io_slots=1, client_rate=200e6 / 8, global_rate=0)),
+    )
+    print(f"disk {args.disk_mbs:g} MB/s, 1 bulk client x 2 connections, {VIEWERS} seeking viewers, "
+          f"{args.seconds:g}s per mode")
+    print(f"{'mode':>17} {'seek p50 ms':>12} {'seek p99 ms':>12} {'seeks':>6} {'bulk MB/s':>10} "
+          f"{'wait int ms':>12} {'wait bulk ms':>13}")
+    for name, shaper in modes:
+        r = run(shaper, disk, args.seconds)
+        print(f"{name:>17} {r['p50']:>12.1f} {r['p99']:>12.1f} {r['seeks']:>6} "
+              f"{r['bulk_mbs']:>10.1f} {r['wait_interactive']:>12.2f} {r['wait_bulk']:>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
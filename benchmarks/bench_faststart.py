@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark: player startup on a non-faststart MP4, with and without the virtual layout
+-------------------------------------------------------------------------------------
+Writes a synthetic MP4 laid out as [ftyp][mdat][moov] with --chunks entries
+in its stco table, then plays the part of a browser starting playback
+through the Flask test client: request bytes=0-, walk the top-level boxes
+as they arrive and, on reaching mdat before moov, abort and request the
+bytes after mdat. Startup time is modelled as one round trip (--rtt-ms)
+per request plus the measured server time.
+
+Also reports the one-off cost of analysing the file (reading and patching
+moov), which the server pays on the first request only.
+
+Usage: python benchmarks/bench_faststart.py [--mdat-mb 64] [--chunks 200000] [--rtt-ms 50]
+"""
+
+import os
+import sys
+import time
+import struct
+import argparse
+import tempfile
+from typing import Dict, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import faststart  # noqa: E402
+import server  # noqa: E402
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def write_mp4(path: str, mdat_size: int, chunks: int) -> None:
+    """An MP4 skeleton with the moov box after the media data."""
+    ftyp = box(b'ftyp', b'isom\0\0\2\0isomiso2mp41')
+    mdat_start = len(ftyp) + 8
+    step = mdat_size // chunks
+    stco = box(b'stco', struct.pack(f'>II{chunks}I', 0, chunks, *(mdat_start + i * step for i in range(chunks))))
+    moov = box(b'moov', box(b'trak', box(b'mdia', box(b'minf', box(b'stbl', stco)))))
+    with open(path, 'wb') as f:
+        f.write(ftyp)
+        f.write(struct.pack('>I4s', 8 + mdat_size, b'mdat'))
+        block = os.urandom(1 << 20)
+        for offset in range(0, mdat_size, len(block)):
+            f.write(block[:min(len(block), mdat_size - offset)])
+        f.write(moov)
+
+
+def read_until_moov(client, start: int) -> Tuple[int, bool]:
+    """
+    Requests bytes={start}- and reads it as a browser does, until the moov
+    box is complete or mdat begins. Returns (offset after mdat, moov found).
+    """
+    response = client.get('/stream/bench.mp4', headers={'Range': f'bytes={start}-'}, buffered=False)
+    buffer = bytearray()
+    offset = 0
+    try:
+        for chunk in response.response:
+            buffer += chunk
+            while offset + 8 <= len(buffer):
+                size, box_type = struct.unpack_from('>I4s', buffer, offset)
+                if box_type == b'mdat':
+                    return start + offset + size, False
+                if offset + size > len(buffer):
+                    break
+                if box_type == b'moov':
+                    return start + offset + size, True
+                offset += size
+    finally:
+        response.close()
+    return start + offset, False
+
+
+def start_playback(client, rtt: float) -> Dict[str, float]:
+    """Fetches until the moov box is complete; returns requests and modelled startup time."""
+    requests = 0
+    started = time.perf_counter()
+    offset, found = 0, False
+    while not found and requests < 4:
+        offset, found = read_until_moov(client, offset)
+        requests += 1
+    server_ms = (time.perf_counter() - started) * 1000
+    return {'requests': requests, 'server_ms': server_ms, 'startup_ms': server_ms + requests * rtt * 1000}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mdat-mb', type=int, default=64)
+    parser.add_argument('--chunks', type=int, default=200000, help="entries in the stco table")
+    parser.add_argument('--rtt-ms', type=float, default=50.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.mp4')
+        write_mp4(path, args.mdat_mb << 20, args.chunks)
+        started = time.perf_counter()
+        layout = faststart.analyze(path)
+        analyse_ms = (time.perf_counter() - started) * 1000
+        assert layout is not None
+        print(f"{args.mdat_mb} MB mdat, moov {len(layout.moov) / 1024:.0f} KB ({args.chunks} chunk offsets), "
+              f"RTT {args.rtt_ms:g} ms; first analysis {analyse_ms:.1f} ms")
+        print(f"{'layout':>10} {'requests':>9} {'server ms':>10} {'startup ms':>11}")
+
+        server.init_server_state([{'filename': 'bench.mp4', 'path': path}],
+                                 metadata_db=os.path.join(tmp, 'metadata.db'), hls_cache_dir=os.path.join(tmp, 'hls'))
+        client = server.app.test_client()
+        for name, enabled in (('on disk', False), ('faststart', True)):
+            faststart.ENABLED = enabled
+            start_playback(client, 0)  # warm the page cache and the layout cache
+            r = start_playback(client, args.rtt_ms / 1000)
+            print(f"{name:>10} {r['requests']:>9} {r['server_ms']:>10.2f} {r['startup_ms']:>11.1f}")
+        server.shutdown_server_state()
+
+
+if __name__ == '__main__':
+    main()
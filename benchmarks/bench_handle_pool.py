@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-request open vs pooled handles for small ranges
+--------------------------------------------------------------
+Simulates scrubbing: T threads request small, overlapping ranges (4-256KB)
+of one file. Compares the former path (open, seek, 64KB reads, close per
+request) with handle_pool.HandlePool using pread and mmap. Both include the
+os.stat the server makes per request. The file is in the page cache, so the
+numbers isolate syscall and Python overhead.
+
+Usage: python benchmarks/bench_handle_pool.py [--threads 1 8] [--requests 20000]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from handle_pool import HandlePool  # noqa: E402
+
+CHUNK = 65536
+
+
+def read_open_per_request(path: str, start: int, length: int) -> int:
+    total = 0
+    os.stat(path)  # send_video_range_request stats the file either way
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while total < length:
+            data = f.read(min(CHUNK, length - total))
+            if not data:
+                break
+            total += len(data)
+    return total
+
+
+def make_pooled_reader(pool: HandlePool) -> Callable[[str, int, int], int]:
+    def read_pooled(path: str, start: int, length: int) -> int:
+        total = 0
+        with pool.open(path, os.stat(path)) as handle:
+            while total < length:
+                data = handle.pread(min(CHUNK, length - total), start + total)
+                if not data:
+                    break
+                total += len(data)
+        return total
+    return read_pooled
+
+
+def run(reader: Callable[[str, int, int], int], path: str, size: int, threads: int, requests: int) -> float:
+    per_thread = requests // threads
+
+    def worker(seed: int) -> None:
+        rng = random.Random(seed)
+        position = rng.randrange(size // 2)
+        for _ in range(per_thread):
+            length = rng.choice((4096, 16384, 65536, 262144))
+            position = max(0, min(size - length, position + rng.randrange(-length, 2 * length)))
+            reader(path, position, length)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return per_thread * threads / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--size-mb', type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.mp4')
+        with open(path, 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1 << 20))
+        size = args.size_mb << 20
+        read_open_per_request(path, 0, size)  # warm the page cache
+
+        print(f"{args.requests} small ranges on a {args.size_mb} MB file (page cache warm)")
+        print(f"{'threads':>7} {'open/close':>12} {'pool pread':>12} {'pool mmap':>12}   (ranges/s)")
+        for threads in args.threads:
+            results = [
+                run(read_open_per_request, path, size, threads, args.requests),
+                run(make_pooled_reader(HandlePool(use_mmap=False)), path, size, threads, args.requests),
+                run(make_pooled_reader(HandlePool(use_mmap=True)), path, size, threads, args.requests),
+            ]
+            print(f"{threads:>7} " + " ".join(f"{r:>12.0f}" for r in results))
+
+
+if __name__ == '__main__':
+    main()
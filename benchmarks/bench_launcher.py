@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark: launcher cold start, headless vs interactive
+--------------------------------------------------------
+Starts cli.py in a fresh process and measures the time until GET / is
+answered (time to first request) and the process's resident memory at
+that point, for
+
+  headless     cli.py --headless
+  interactive  cli.py on a pseudo-terminal, with --port and --library
+               given so nothing is prompted (it still prints the QR code)
+  eager        the interactive launcher with cv2, numpy, qrcode and
+               tkinter imported up front, as it used to
+
+Each mode serves --dir (default: a library of one short MP4, whose
+header is probed without OpenCV, so the launcher itself is measured
+rather than the library scan) on the dev engine, with caches in a
+temporary directory. Reports the median of --runs. Linux only (reads
+VmRSS from /proc).
+
+Usage: python benchmarks/bench_launcher.py [--runs 5] [--dir /path/to/videos]
+"""
+
+import os
+import pty
+import sys
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import tempfile
+import urllib.request
+from typing import List, Tuple
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(REPO, 'cli.py')
+EAGER_PRELUDE = ("import sys, runpy; import cv2, numpy, qrcode, tkinter; "
+                 "sys.argv = sys.argv[1:]; runpy.run_path(sys.argv[0], run_name='__main__')")
+TIMEOUT = 60.0
+
+
+def write_sample(path: str) -> None:
+    """Writes a one second 160x120 MP4."""
+    import cv2
+    import numpy as np
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 25, (160, 120))
+    for i in range(25):
+        writer.write(np.full((120, 160, 3), i * 10, dtype=np.uint8))
+    writer.release()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid: int) -> float:
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def start(mode: str, library: str, cache_dir: str) -> Tuple[float, float]:
+    """Returns (seconds to the first answered request, RSS in MB) of one launch."""
+    port = free_port()
+    options = ['--library', library, '--port', str(port), '--host', '127.0.0.1', '--engine', 'dev',
+               '--cache-dir', cache_dir, '--rescan-interval', '0']
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    stdin, master = subprocess.DEVNULL, None
+    if mode == 'headless':
+        command = [sys.executable, CLI, '--headless'] + options
+    else:
+        master, slave = pty.openpty()  # a terminal, so the launcher stays interactive
+        stdin = slave
+        command = [sys.executable, CLI] + options
+        if mode == 'eager':
+            command = [sys.executable, '-c', EAGER_PRELUDE, CLI] + options
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=REPO, env=env, stdin=stdin,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if master is not None:
+        os.close(slave)
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"{mode} launcher exited with status {process.returncode}")
+            if time.perf_counter() - started > TIMEOUT:
+                raise RuntimeError(f"{mode} launcher did not answer within {TIMEOUT:.0f}s")
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1) as response:
+                    response.read()
+                break
+            except OSError:
+                time.sleep(0.005)
+        elapsed = time.perf_counter() - started
+        return elapsed, rss_mb(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+        if master is not None:
+            os.close(master)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--dir', help="library to serve (default: one short sample video)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        library = args.dir
+        if library is None:
+            library = os.path.join(tmp, 'library')
+            os.makedirs(library)
+            write_sample(os.path.join(library, 'sample.mp4'))
+        print(f"{'mode':<12} {'first request (ms)':>19} {'RSS (MB)':>9}")
+        for mode in ('headless', 'interactive', 'eager'):
+            results: List[Tuple[float, float]] = [start(mode, library, os.path.join(tmp, 'cache'))
+                                                  for _ in range(args.runs)]
+            print(f"{mode:<12} {statistics.median(r[0] for r in results) * 1000:>19.0f} "
+                  f"{statistics.median(r[1] for r in results):>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cost of the metrics and of per-request logging
+----------------------------------------------------------
+Measures a sharded counter increment and histogram observation against a
+lock-protected counter, from --threads threads at once, then range
+requests per second through the Flask test client in each access log
+mode, with log records written to a file as a real deployment would.
+
+Usage: python benchmarks/bench_metrics.py [--threads 8] [--seconds 2]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import threading
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics  # noqa: E402
+import server  # noqa: E402
+
+OPERATIONS = 200000
+
+
+def per_operation_ns(operation: Callable[[], None], threads: int) -> float:
+    def run() -> None:
+        for _ in range(OPERATIONS):
+            operation()
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) / (OPERATIONS * threads) * 1e9
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=2.0, help="measuring time per access log mode")
+    args = parser.parse_args()
+
+    counter = metrics.Counter('bench_total', "benchmark counter", ('video',))
+    histogram = metrics.Histogram('bench_seconds', "benchmark histogram")
+    lock = threading.Lock()
+    locked = {'value': 0}
+
+    def locked_inc() -> None:
+        with lock:
+            locked['value'] += 1
+
+    print(f"{args.threads} threads")
+    print(f"locked counter      {per_operation_ns(locked_inc, args.threads):7.0f} ns/op")
+    print(f"sharded counter     {per_operation_ns(lambda: counter.inc(65536, ('a.mp4',)), args.threads):7.0f} ns/op")
+    print(f"sharded histogram   {per_operation_ns(lambda: histogram.observe(0.003), args.threads):7.0f} ns/op")
+    assert counter.collect()[('a.mp4',)] == 65536 * OPERATIONS * args.threads
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.dat')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(1 << 20))
+        handler = logging.FileHandler(os.path.join(tmp, 'server.log'))
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        logging.basicConfig(level=logging.INFO, handlers=[handler])
+        server.init_server_state([{'filename': 'bench.dat', 'path': path}],
+                                 metadata_db=os.path.join(tmp, 'metadata.db'), hls_cache_dir=os.path.join(tmp, 'hls'),
+                                 thumbnail_cache_dir=os.path.join(tmp, 'thumbnails'), wait_for_metadata=True)
+        client = server.app.test_client()
+        print(f"{'access log':<12} {'req/s':>8}")
+        for mode in metrics.ACCESS_LOG_MODES:
+            metrics.set_access_log(mode)
+            count = 0
+            started = time.perf_counter()
+            while time.perf_counter() - started < args.seconds:
+                client.get('/stream/bench.dat', headers={'Range': f'bytes={count % 1000 * 1024}-{count % 1000 * 1024 + 4095}'})
+                count += 1
+            print(f"{mode:<12} {count / (time.perf_counter() - started):>8.0f}")
+        server.shutdown_server_state()
+
+
+if __name__ == '__main__':
+    main()
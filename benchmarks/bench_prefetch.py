@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark: start-up latency of the next playlist item with prefetching
+------------------------------------------------------------------------
+Writes --videos files of --size-mb MB and plays them back to back the way
+a browser does: a request for the first MB of a video, then one for its
+last 5%. Each start request is timed (until its whole first MB arrived) with
+the files evicted from the page cache (POSIX_FADV_DONTNEED) beforehand,
+with prefetching off (every start is cold) and on (the request near the
+end of the previous video queued the start of the next one, and the
+benchmark waits for the prefetcher before moving on).
+
+Eviction has no effect on tmpfs; run it with --dir on a disk-backed
+filesystem. The block cache is cleared along with the page cache.
+
+Usage: python benchmarks/bench_prefetch.py [--videos 8] [--size-mb 64] [--dir /var/tmp]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import prefetch  # noqa: E402
+import server  # noqa: E402
+import streaming  # noqa: E402
+
+FIRST_BYTES = 1024 * 1024
+DURATION = 600.0  # seconds of playback per video, for the bitrate
+
+
+def evict(paths: List[str]) -> None:
+    streaming.BLOCK_CACHE.clear()
+    streaming.HANDLE_POOL.close_all()
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def wait_for_prefetcher(timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = server.PREFETCHER.stats()
+        if not stats['queued'] and stats['running'] is None:
+            return
+        time.sleep(0.01)
+
+
+def play(client, videos: List[dict], paths: List[str], size: int, prefetching: bool) -> List[float]:
+    latencies = []
+    evict(paths)
+    for video in videos:
+        started = time.perf_counter()
+        response = client.get(f"/stream/{video['filename']}", headers={'Range': f'bytes=0-{FIRST_BYTES - 1}'})
+        assert response.status_code == 206 and len(response.data) == FIRST_BYTES, response.status_code
+        latencies.append(time.perf_counter() - started)
+        # Playback reaching the last 5% (longer than a tail probe) queues the next video when prefetching
+        response = client.get(f"/stream/{video['filename']}", headers={'Range': f'bytes={size * 19 // 20}-'})
+        assert response.status_code == 206, response.status_code
+        if prefetching:
+            wait_for_prefetcher()
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--videos', type=int, default=8)
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--dir', default=None, help="where to write the test files (default: the temp dir)")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    size = args.size_mb * 1024 * 1024
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        videos = []
+        for i in range(args.videos):
+            path = os.path.join(tmp, f'episode{i + 1}.bin')
+            with open(path, 'wb') as f:
+                for _ in range(args.size_mb):
+                    f.write(os.urandom(1024 * 1024))
+                f.flush()
+                os.fsync(f.fileno())  # only clean pages can be evicted
+            videos.append({'filename': os.path.basename(path), 'path': path})
+        paths = [video['path'] for video in videos]
+
+        print(f"{args.videos} videos of {args.size_mb} MB in {tmp}, first {FIRST_BYTES // 1024} KB timed")
+        print(f"{'prefetch':<9} {'first (ms)':>11} {'next avg (ms)':>14} {'next max (ms)':>14}")
+        for prefetching in (False, True):
+            prefetch.ENABLED = prefetching
+            server.init_server_state([], metadata_db=os.path.join(tmp, 'metadata.db'),
+                                     hls_cache_dir=os.path.join(tmp, 'hls'),
+                                     thumbnail_cache_dir=os.path.join(tmp, 'thumbnails'))
+            server.CATALOG = server.VideoCatalog(videos)  # skip probing the fake files
+            for video in videos:
+                server.VIDEO_METADATA_CACHE[video['filename']] = {'duration': DURATION}
+            latencies = play(server.app.test_client(), videos, paths, size, prefetching)
+            following = latencies[1:] or latencies
+            print(f"{'on' if prefetching else 'off':<9} {latencies[0] * 1000:>11.2f} "
+                  f"{sum(following) / len(following) * 1000:>14.2f} {max(following) * 1000:>14.2f}")
+            server.shutdown_server_state()
+
+
+if __name__ == '__main__':
+    main()
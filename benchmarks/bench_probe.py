@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark: container header probe vs OpenCV probe
+-------------------------------------------------
+Probes every video in a directory with containers.probe_container and with
+cv2.VideoCapture, each in a fresh subprocess so the peak RSS of one does not
+hide the other, and reports the mean per-file probe time and peak RSS.
+
+Usage: python benchmarks/bench_probe.py /path/to/videos [--repeat 3]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+from typing import Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv', '.webm')
+
+
+def load_probe(mode: str) -> Callable[[str], bool]:
+    """Imports the probing module up front, its import cost is not part of the per-file time."""
+    if mode == 'header':
+        import containers
+        return lambda path: containers.probe_container(path) is not None
+    import cv2
+
+    def probe_opencv(path: str) -> bool:
+        cap = cv2.VideoCapture(path)
+        try:
+            if not cap.isOpened():
+                return False
+            cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+            cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+            cap.get(cv2.CAP_PROP_FPS)
+            cap.get(cv2.CAP_PROP_FRAME_COUNT)
+            return True
+        finally:
+            cap.release()
+    return probe_opencv
+
+
+def run_worker(mode: str, paths, repeat: int) -> None:
+    probe = load_probe(mode)
+    ok = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            ok += probe(path)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        max_rss //= 1024
+    print(json.dumps({"mode": mode, "ok": ok, "probes": len(paths) * repeat,
+                      "seconds": elapsed, "max_rss_kb": max_rss}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', nargs='?')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--worker', choices=('header', 'opencv'), help=argparse.SUPPRESS)
+    parser.add_argument('--paths', nargs='*', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.paths, args.repeat)
+        return
+    if not args.directory:
+        parser.error("a directory of videos is required")
+
+    paths = sorted(os.path.join(args.directory, name) for name in os.listdir(args.directory)
+                   if name.lower().endswith(VIDEO_EXTENSIONS))
+    if not paths:
+        print(f"No videos found in {args.directory}")
+        return
+
+    print(f"Probing {len(paths)} files x {args.repeat}")
+    print(f"{'mode':>8} {'ms/file':>10} {'ok':>6} {'peak RSS (MB)':>14}")
+    for mode in ('header', 'opencv'):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', mode, '--repeat', str(args.repeat),
+             '--paths', *paths],
+            check=True, capture_output=True, text=True, cwd=ROOT).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>8} {result['seconds'] / result['probes'] * 1000:>10.3f} "
+              f"{result['ok']:>6} {result['max_rss_kb'] / 1024:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark: requests per second for the index page and metadata JSON
+---------------------------------------------------------------------
+Serves a synthetic catalog of --videos entries with metadata already
+cached, and measures req/s through the Flask test client for / and
+/api/video_info with the render cache off (template, jsonify and local IP
+lookup on every request, as before) and on (pre-rendered bodies, gzip or
+brotli negotiated from Accept-Encoding, cached local IP).
+
+Usage: python benchmarks/bench_render.py [--videos 10000] [--seconds 2]
+"""
+
+import os
+import sys
+import gzip
+import time
+import logging
+import argparse
+import tempfile
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import precompressed  # noqa: E402
+import server  # noqa: E402
+import utils  # noqa: E402
+
+
+def requests_per_second(client, url: str, headers: Dict[str, str], seconds: float) -> float:
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200, response.status_code
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--videos', type=int, default=10000)
+    parser.add_argument('--seconds', type=float, default=2.0, help="measuring time per case")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'video.mp4')
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 1024)
+        videos = [{'filename': f'Series {i % 100}/Episode {i}.mp4', 'path': path} for i in range(args.videos)]
+        server.init_server_state([], metadata_db=os.path.join(tmp, 'metadata.db'),
+                                 hls_cache_dir=os.path.join(tmp, 'hls'),
+                                 thumbnail_cache_dir=os.path.join(tmp, 'thumbnails'))
+        server.CATALOG = server.VideoCatalog(videos)  # skip probing the fake files
+        for video in videos:
+            server.VIDEO_METADATA_CACHE[video['filename']] = {
+                'filename': video['filename'], 'path': path, 'duration': 1325.4, 'width': 1920, 'height': 1080,
+                'fps': 23.976, 'frame_count': 31778, 'codec': 'avc1', 'mime_type': 'video/mp4'}
+        client = server.app.test_client()
+        info_url = f"/api/video_info/{videos[len(videos) // 2]['filename']}"
+
+        print(f"{args.videos} videos, encodings offered: {', '.join(precompressed.ENCODINGS)}")
+        print(f"{'endpoint':<16} {'Accept-Encoding':<18} {'off req/s':>10} {'on req/s':>10} {'bytes off':>10} {'bytes on':>9}")
+        for url, name in (('/', '/'), (info_url, '/api/video_info')):
+            for accept in ('identity', 'gzip, deflate, br'):
+                headers = {'Accept-Encoding': accept}
+                results = {}
+                for enabled in (False, True):
+                    precompressed.ENABLED = enabled
+                    utils.LOCAL_IP_MAX_AGE = 300.0 if enabled else 0.0  # 0 resolves on every call
+                    server.RENDER_CACHE.clear()
+                    response = client.get(url, headers=headers)
+                    data = response.data
+                    if response.headers.get('Content-Encoding') == 'gzip':
+                        data = gzip.decompress(data)
+                    results[enabled] = (requests_per_second(client, url, headers, args.seconds),
+                                        len(response.data), data)
+                assert results[False][2] == results[True][2], "cached body differs"
+                print(f"{name:<16} {accept:<18} {results[False][0]:>10.0f} {results[True][0]:>10.0f} "
+                      f"{results[False][1]:>10} {results[True][1]:>9}")
+        server.shutdown_server_state()
+
+
+if __name__ == '__main__':
+    main()
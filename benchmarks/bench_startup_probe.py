@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Benchmark: startup time with serial vs pooled metadata probing
+--------------------------------------------------------------
+Measures how long init_server_state takes to return (time until the server
+can accept requests) and how long until all metadata is cached, for the old
+serial behaviour (1 worker, blocking) and pooled probing.
+
+By default the probe is simulated with a fixed latency per file, standing in
+for a container open on NAS storage. Pass --dir to probe real videos with
+server.get_video_info instead.
+
+Usage: python benchmarks/bench_startup_probe.py [--files 400] [--latency-ms 20]
+       python benchmarks/bench_startup_probe.py --dir /path/to/videos
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=400, help="number of simulated files")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="simulated probe latency per file")
+    parser.add_argument('--dir', help="directory of real videos to probe")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    if args.dir:
+        import cli
+        video_files = cli.scan_directory_for_videos(args.dir)
+    else:
+        real_probe = server.get_video_info
+
+        def simulated_probe(path: str):
+            time.sleep(args.latency_ms / 1000.0)
+            return {"filename": os.path.basename(path), "path": path}
+
+        server.get_video_info = simulated_probe
+        video_files = [{"filename": f"video_{i}.mp4", "path": f"/nonexistent/video_{i}.mp4"}
+                       for i in range(args.files)]
+
+    print(f"{'mode':>22} {'ready (s)':>10} {'all cached (s)':>15}")
+    for workers in args.workers:
+        blocking = workers == 1
+        start = time.perf_counter()
+        server.init_server_state(video_files, probe_workers=workers, wait_for_metadata=blocking)
+        ready = time.perf_counter() - start
+        server.PROBER.wait()
+        cached = time.perf_counter() - start
+        label = "serial (old behaviour)" if blocking else f"pooled, {workers} workers"
+        print(f"{label:>22} {ready:>10.3f} {cached:>15.3f}")
+
+    if not args.dir:
+        server.get_video_info = real_probe
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Load test: /stream range requests
+---------------------------------
+Opens C keep-alive connections to a running server (asyncio, so 500
+clients don't need 500 threads) and has each issue back-to-back GETs for
+random byte ranges of one video for a fixed duration. Reports requests/s,
+throughput, p50/p99 latency and errors per concurrency level.
+
+Usage:
+  python benchmarks/loadtest.py --url http://127.0.0.1:5000 --video movie.mp4
+         [--concurrency 10 100 500] [--duration 10] [--range-size 65536]
+"""
+
+import sys
+import time
+import random
+import asyncio
+import argparse
+from typing import List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+
+async def read_response(reader: asyncio.StreamReader) -> Tuple[int, int, bool]:
+    """Reads one response. Returns (status, body bytes, keep_alive)."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by server")
+    status = int(status_line.split()[1])
+    content_length = 0
+    keep_alive = True
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            content_length = int(value.strip())
+        elif name == 'connection' and value.strip().lower() == 'close':
+            keep_alive = False
+    remaining = content_length
+    while remaining:
+        chunk = await reader.read(min(remaining, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Truncated response body")
+        remaining -= len(chunk)
+    return status, content_length, keep_alive
+
+
+async def client(host: str, port: int, path: str, file_size: int, range_size: int,
+                 deadline: float, latencies: List[float], counters: List[int]) -> None:
+    reader: Optional[asyncio.StreamReader] = None
+    writer: Optional[asyncio.StreamWriter] = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            start = random.randrange(0, max(file_size - range_size, 1))
+            request = (f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+                       f"Range: bytes={start}-{start + range_size - 1}\r\n\r\n")
+            sent_at = time.perf_counter()
+            writer.write(request.encode('ascii'))
+            status, body_bytes, keep_alive = await read_response(reader)
+            latencies.append(time.perf_counter() - sent_at)
+            counters[1] += body_bytes
+            if status not in (200, 206):
+                counters[2] += 1
+            if not keep_alive:
+                writer.close()
+                writer = None
+        except (OSError, ConnectionError, ValueError, IndexError):
+            counters[2] += 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+
+async def probe_size(host: str, port: int, path: str) -> int:
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nRange: bytes=0-0\r\n"
+                 f"Connection: close\r\n\r\n".encode('ascii'))
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    for line in data.split(b'\r\n'):
+        if line.lower().startswith(b'content-range:'):
+            return int(line.rsplit(b'/', 1)[1])
+    raise RuntimeError(f"Server did not answer a range request for {path}: {data[:200]!r}")
+
+
+async def run_level(host: str, port: int, path: str, file_size: int, concurrency: int,
+                    duration: float, range_size: int) -> None:
+    latencies: List[float] = []
+    counters = [0, 0, 0]  # unused, bytes, errors
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(client(host, port, path, file_size, range_size, deadline, latencies, counters)
+                           for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        if not latencies:
+            return float('nan')
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print(f"{concurrency:>11} {len(latencies) / elapsed:>10.1f} {counters[1] / elapsed / 1e6:>10.1f} "
+          f"{percentile(0.50):>9.1f} {percentile(0.99):>9.1f} {counters[2]:>7}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--video', required=True, help="video filename as listed by the server")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument('--range-size', type=int, default=65536, help="bytes per range request")
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    host, port = url.hostname or '127.0.0.1', url.port or 80
+    path = f"/stream/{quote(args.video)}"
+
+    file_size = asyncio.run(probe_size(host, port, path))
+    print(f"{args.url}{path}: {file_size} bytes, {args.range_size} byte ranges, {args.duration}s per level")
+    print(f"{'concurrency':>11} {'req/s':>10} {'MB/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for concurrency in args.concurrency:
+        asyncio.run(run_level(host, port, path, file_size, concurrency, args.duration, args.range_size))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
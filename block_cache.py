@@ -0,0 +1,285 @@
+"""
+Shared block cache for video reads.
+
+Files are read in fixed-size, aligned blocks that are kept in memory up to
+a byte budget, so several clients watching (and seeking through) the same
+video are served from RAM instead of re-reading slow storage (NAS, USB
+disks) for every range request.
+
+Eviction is a segmented LRU: new blocks enter a probationary segment and
+move to a protected segment on their second hit. A single client streaming
+a large file end to end therefore only cycles the probationary segment and
+cannot flush the blocks that several clients share.
+
+Blocks are keyed by path and file identity (size, mtime, inode), so a file
+replaced on disk never serves stale data; its old blocks simply age out.
+
+FileReaders tells popular files (read by several clients at once) from
+single viewers, so the streaming layer can route only the former through
+the cache (see streaming.open_range_body).
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+import readahead
+from handle_pool import HandlePool
+from readahead import AdaptiveChunker
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+DEFAULT_BLOCK_SIZE = int(os.environ.get('MEDIA_SERVER_BLOCK_SIZE_KB', '256')) * 1024
+DEFAULT_BUDGET = int(os.environ.get('MEDIA_SERVER_BLOCK_CACHE_MB', '64')) * 1024 * 1024
+PROTECTED_FRACTION = 0.8  # share of the budget reserved for blocks hit more than once
+# A file read by this many clients within HOT_WINDOW seconds is popular; 0 disables the distinction
+HOT_READERS = int(os.environ.get('MEDIA_SERVER_HOT_READERS', '2'))
+HOT_WINDOW = 60.0
+
+FileKey = Tuple[str, int, int, int]   # (path, size, mtime_ns, inode)
+BlockKey = Tuple[FileKey, int]        # (file key, block number)
+
+
+def file_key(path: str, st: os.stat_result) -> FileKey:
+    return path, st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class BlockCache:
+    """Thread-safe segmented LRU cache of file blocks with a memory budget."""
+
+    def __init__(self, budget: int = DEFAULT_BUDGET, block_size: int = DEFAULT_BLOCK_SIZE,
+                 handles: Optional[HandlePool] = None) -> None:
+        if block_size <= 0:
+            raise ValueError("block_size must be positive")
+        self.budget = budget
+        self.block_size = block_size
+        # Misses read through pooled descriptors when a pool is given
+        self.handles = handles
+        self._probation: 'OrderedDict[BlockKey, bytes]' = OrderedDict()
+        self._protected: 'OrderedDict[BlockKey, bytes]' = OrderedDict()
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+        self._lock = threading.Lock()
+        # Blocks being read from disk; concurrent misses wait for one read
+        self._loading: Dict[BlockKey, threading.Event] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget >= self.block_size
+
+    # --- Lookup ---
+    def _lookup(self, key: BlockKey) -> Optional[bytes]:
+        """Returns a cached block and updates its recency. Caller holds the lock."""
+        block = self._protected.get(key)
+        if block is not None:
+            self._protected.move_to_end(key)
+            return block
+        block = self._probation.pop(key, None)
+        if block is not None:
+            # Second hit: promote, demoting the coldest protected blocks if needed
+            self._probation_bytes -= len(block)
+            self._protected[key] = block
+            self._protected_bytes += len(block)
+            protected_budget = int(self.budget * PROTECTED_FRACTION)
+            while self._protected_bytes > protected_budget and len(self._protected) > 1:
+                old_key, old_block = self._protected.popitem(last=False)
+                self._protected_bytes -= len(old_block)
+                self._probation[old_key] = old_block
+                self._probation_bytes += len(old_block)
+            self._evict()
+        return block
+
+    def _insert(self, key: BlockKey, block: bytes) -> None:
+        """Adds a freshly read block to the probationary segment. Caller holds the lock."""
+        if key in self._probation or key in self._protected:
+            return
+        self._probation[key] = block
+        self._probation_bytes += len(block)
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._probation_bytes + self._protected_bytes > self.budget:
+            if self._probation:
+                _, block = self._probation.popitem(last=False)
+                self._probation_bytes -= len(block)
+            elif self._protected:
+                _, block = self._protected.popitem(last=False)
+                self._protected_bytes -= len(block)
+            else:
+                break
+            self.evictions += 1
+
+    def get_block(self, key: BlockKey, fd: int, run: int = 1) -> bytes:
+        """
+        Returns block `key`, reading it with pread from `fd` on a miss. A miss
+        fills up to `run` consecutive blocks (those neither cached nor being
+        read already) with a single read.
+        """
+        while True:
+            with self._lock:
+                block = self._lookup(key)
+                if block is not None:
+                    self.hits += 1
+                    return block
+                loading = self._loading.get(key)
+                if loading is None:
+                    self.misses += 1
+                    loading = threading.Event()
+                    keys = [key]
+                    while len(keys) < run:
+                        following = (key[0], key[1] + len(keys))
+                        if following in self._loading or following in self._probation or following in self._protected:
+                            break
+                        keys.append(following)
+                    for block_key in keys:
+                        self._loading[block_key] = loading
+                    break
+            # Another thread is reading this block; use its result
+            loading.wait()
+
+        try:
+            data = self._read_blocks(fd, key[1], len(keys))
+            block_size = self.block_size
+            blocks = [data] if len(keys) == 1 else [data[i * block_size:(i + 1) * block_size]
+                                                    for i in range(len(keys))]
+            with self._lock:
+                for block_key, block in zip(keys, blocks):
+                    if block or block_key == key:
+                        self._insert(block_key, block)
+            return blocks[0]
+        finally:
+            with self._lock:
+                for block_key in keys:
+                    del self._loading[block_key]
+            loading.set()
+
+    def _read_blocks(self, fd: int, block_no: int, count: int) -> bytes:
+        return os.pread(fd, count * self.block_size, block_no * self.block_size)
+
+    def is_resident(self, path: str, st: os.stat_result, position: int) -> bool:
+        """Whether the block holding `position` is cached (without counting a lookup)."""
+        key = (file_key(path, st), position // self.block_size)
+        with self._lock:
+            return key in self._probation or key in self._protected
+
+    # --- Range reads ---
+    def iter_range(self, path: str, start: int, length: int,
+                   st: Optional[os.stat_result] = None,
+                   chunker: Optional[AdaptiveChunker] = None) -> Iterator[Union[bytes, memoryview]]:
+        """
+        Yields `length` bytes of the file starting at `start`, block by block.
+        Whole blocks are yielded as the cached objects themselves, the
+        partial blocks at either end as memoryview slices of them, so no
+        data is copied. The file is opened (or taken from the handle pool)
+        only if a block has to be read.
+
+        Misses are filled the way uncached streams read: a `chunker` measures
+        the client's throughput from the blocks it takes, each fill reads as
+        many blocks as its chunk size covers, and the kernel is kept reading
+        its window ahead (without a chunker: one block per read and the
+        minimum window).
+        """
+        if st is None:
+            st = os.stat(path)
+        fkey = file_key(path, st)
+        end = min(start + length, st.st_size)
+        block_size = self.block_size
+        run = 1
+        handle = None
+        f = None
+        fd = -1
+        advised_until = start
+        try:
+            position = start
+            while position < end:
+                block_no = position // block_size
+                key = (fkey, block_no)
+                with self._lock:
+                    block = self._lookup(key)
+                    if block is not None:
+                        self.hits += 1
+                if block is None:
+                    if fd < 0:
+                        if self.handles is not None:
+                            handle = self.handles.acquire(path, st)
+                            fd = handle.fd
+                        else:
+                            f = open(path, 'rb')
+                            fd = f.fileno()
+                        readahead.advise_sequential(fd, position, end - position)
+                    if chunker is not None:
+                        run = max(1, min(chunker.chunk_size // block_size, (end - 1) // block_size - block_no + 1))
+                    window = chunker.readahead_window() if chunker is not None else readahead.MIN_READAHEAD
+                    if advised_until < end and position + window // 2 >= advised_until:
+                        advised_from = max(advised_until, position)
+                        advised_until = min(position + window, end)
+                        readahead.advise_willneed(fd, advised_from, advised_until - advised_from)
+                    block = self.get_block(key, fd, run)
+                block_start = block_no * block_size
+                offset = position - block_start
+                available = min(len(block), end - block_start)
+                if available <= offset:
+                    break  # file shorter than its stat said (truncated meanwhile)
+                chunk: Union[bytes, memoryview] = block
+                if offset or available < len(block):
+                    chunk = memoryview(block)[offset:available]
+                if chunker is not None:
+                    chunker.sent(len(chunk))
+                yield chunk
+                position = block_start + available
+        finally:
+            if handle is not None:
+                self.handles.release(handle)
+            if f is not None:
+                f.close()
+
+    # --- Maintenance ---
+    def clear(self) -> None:
+        with self._lock:
+            self._probation.clear()
+            self._protected.clear()
+            self._probation_bytes = self._protected_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "blocks": len(self._probation) + len(self._protected),
+                "bytes": self._probation_bytes + self._protected_bytes,
+                "budget": self.budget,
+                "block_size": self.block_size,
+            }
+
+
+class FileReaders:
+    """Remembers which clients read each file recently, to tell popular files from single viewers."""
+
+    def __init__(self, window: float = HOT_WINDOW, max_files: int = 4096) -> None:
+        self.window = window
+        self.max_files = max_files
+        self._readers: 'OrderedDict[str, Dict[str, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, path: str, client: str) -> int:
+        """Records a read of `path` by `client`; returns how many clients read it within the window."""
+        now = time.monotonic()
+        with self._lock:
+            readers = self._readers.pop(path, {})
+            readers[client] = now
+            for other in [other for other, seen in readers.items() if now - seen > self.window]:
+                del readers[other]
+            self._readers[path] = readers
+            while len(self._readers) > self.max_files:
+                self._readers.popitem(last=False)
+            return len(readers)
@@ -0,0 +1,312 @@
+"""
+Video catalog: the set of videos the server can stream.
+
+Entries are compact `__slots__` objects indexed by filename, by numeric ID
+and by a short ID derived from the file path, so every lookup done on the
+/stream and /api paths is a single dict access regardless of the library
+size. Catalogs are immutable; library rescans build an updated copy that
+reuses the unchanged entries (and their IDs) and is swapped in atomically.
+
+For the paginated listing API each catalog also lazily builds, once:
+
+- its sort orders (natural name, size, mtime), used with keyset cursors
+  so pages stay consistent while the library changes between requests,
+  plus the orderings of recent searches, so following their cursors is a
+  bisect instead of a walk over the whole library;
+- a search index: every lowercased filename joined into one string, which
+  str.find scans for substrings at C speed, and a sorted list of
+  filenames and basenames for prefix search with bisect;
+- a version hash of its contents, used as the listing ETag.
+"""
+
+import json
+import base64
+import bisect
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from library import natural_sort_key
+
+logger = logging.getLogger(__name__)
+
+SORT_ORDERS = ('name', 'size', 'mtime')
+FILTERED_LISTINGS_CACHED = 32  # recent (order, query, prefix) listings kept per catalog
+_ORDER_KEYS: Dict[str, Callable[['VideoEntry'], tuple]] = {
+    'name': lambda entry: (entry.sort_key, entry.id),
+    'size': lambda entry: (entry.size or 0, entry.sort_key, entry.id),
+    'mtime': lambda entry: (entry.mtime_ns or 0, entry.sort_key, entry.id),
+}
+
+
+class CursorError(ValueError):
+    """A pagination cursor is malformed or belongs to another sort order."""
+
+
+def make_short_id(path: str) -> str:
+    """Returns a stable 12 character ID for a video path."""
+    return hashlib.blake2b(path.encode('utf-8', 'surrogateescape'), digest_size=6).hexdigest()
+
+
+class VideoEntry:
+    """A single video in the catalog."""
+    __slots__ = ('id', 'short_id', 'filename', 'path', 'size', 'mtime_ns', 'sort_key')
+
+    def __init__(self, video_id: int, filename: str, path: str,
+                 size: Optional[int] = None, mtime_ns: Optional[int] = None) -> None:
+        self.id = video_id
+        self.short_id = make_short_id(path)
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sort_key = natural_sort_key(filename)  # computed once per entry
+
+    @classmethod
+    def from_video(cls, video_id: int, video: Dict[str, Any]) -> 'VideoEntry':
+        """Builds an entry from a scanner dict (size and mtime_ns are optional)."""
+        return cls(video_id, video['filename'], video['path'], video.get('size'), video.get('mtime_ns'))
+
+    def to_dict(self) -> Dict[str, object]:
+        return {'id': self.id, 'short_id': self.short_id, 'filename': self.filename, 'path': self.path}
+
+    def summary(self) -> Dict[str, object]:
+        """Public listing fields (no server paths)."""
+        return {'id': self.id, 'short_id': self.short_id, 'filename': self.filename, 'size': self.size,
+                'mtime': self.mtime_ns // 1_000_000_000 if self.mtime_ns is not None else None}
+
+    def __repr__(self) -> str:
+        return f"VideoEntry(id={self.id}, filename={self.filename!r})"
+
+
+class VideoCatalog:
+    """
+    Immutable, ordered collection of VideoEntry objects.
+    Entries keep the order the files were given (the natural sort order
+    produced by the scanner). Numeric IDs are assigned in that order and
+    stay stable across updated() calls; IDs of removed videos are not reused.
+    """
+
+    def __init__(self, video_files: Iterable[Dict[str, Any]] = ()) -> None:
+        self._entries: List[VideoEntry] = []
+        self._by_filename: Dict[str, VideoEntry] = {}
+        self._by_id: Dict[int, VideoEntry] = {}
+        self._by_short_id: Dict[str, VideoEntry] = {}
+        self._next_id = 0
+        # Built on first use, see the module docstring
+        self._version: Optional[str] = None
+        self._orders: Dict[str, Tuple[List[tuple], List[VideoEntry]]] = {}
+        self._filtered: Dict[Tuple[str, str, str], Tuple[List[tuple], List[VideoEntry]]] = {}
+        self._search_index: Optional[Tuple[str, List[int], List[Tuple[str, int]]]] = None
+        for video in video_files:
+            self._add(VideoEntry.from_video(self._next_id, video))
+
+    def _add(self, entry: VideoEntry) -> None:
+        if entry.filename in self._by_filename:
+            logger.warning(f"Duplicate video filename '{entry.filename}' ignored ({entry.path})")
+            return
+        if entry.short_id in self._by_short_id:
+            logger.warning(f"Short ID collision for {entry.path}, it is only reachable by filename")
+        else:
+            self._by_short_id[entry.short_id] = entry
+        self._entries.append(entry)
+        self._by_filename[entry.filename] = entry
+        self._by_id[entry.id] = entry
+        self._next_id = max(self._next_id, entry.id + 1)
+
+    def updated(self, added: Iterable[Dict[str, Any]], removed: Iterable[str],
+                sort_key: Optional[Callable[[str], Any]] = None,
+                changed: Iterable[Dict[str, Any]] = ()) -> 'VideoCatalog':
+        """
+        Returns a new catalog without the `removed` filenames and with the
+        `added` files, reusing the existing entries. `changed` files keep
+        their IDs but get their new size and mtime. When `sort_key` is given
+        the result is ordered by it (applied to filenames), otherwise new
+        files are appended.
+        """
+        removed_set = set(removed)
+        changed_by_name = {video['filename']: video for video in changed}
+        entries = [entry if entry.filename not in changed_by_name
+                   else VideoEntry.from_video(entry.id, changed_by_name[entry.filename])
+                   for entry in self._entries if entry.filename not in removed_set]
+        next_id = self._next_id
+        for video in added:
+            if video['filename'] in self._by_filename and video['filename'] not in removed_set:
+                continue
+            entries.append(VideoEntry.from_video(next_id, video))
+            next_id += 1
+        if sort_key is not None:
+            entries.sort(key=lambda entry: sort_key(entry.filename))
+
+        catalog = VideoCatalog()
+        for entry in entries:
+            catalog._add(entry)
+        catalog._next_id = max(catalog._next_id, next_id)
+        return catalog
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[VideoEntry]:
+        return iter(self._entries)
+
+    def __contains__(self, filename: object) -> bool:
+        return filename in self._by_filename
+
+    def get(self, filename: str) -> Optional[VideoEntry]:
+        """Looks up a video by filename."""
+        return self._by_filename.get(filename)
+
+    def get_by_id(self, video_id: int) -> Optional[VideoEntry]:
+        """Looks up a video by numeric ID."""
+        return self._by_id.get(video_id)
+
+    def get_by_short_id(self, short_id: str) -> Optional[VideoEntry]:
+        """Looks up a video by short ID."""
+        return self._by_short_id.get(short_id)
+
+    def filenames(self) -> List[str]:
+        """Returns all filenames in catalog order."""
+        return [entry.filename for entry in self._entries]
+
+    # --- Listing ---
+    @property
+    def version(self) -> str:
+        """Hash of the catalog contents; changes whenever a file is added, removed or modified."""
+        if self._version is None:
+            digest = hashlib.blake2b(digest_size=8)
+            for entry in self._entries:
+                digest.update(f"{entry.id}\0{entry.filename}\0{entry.size}\0{entry.mtime_ns}\n"
+                              .encode('utf-8', 'surrogateescape'))
+            self._version = digest.hexdigest()
+        return self._version
+
+    def _ordering(self, order: str) -> Tuple[List[tuple], List[VideoEntry]]:
+        """Returns (sort keys, entries) in ascending `order`."""
+        ordering = self._orders.get(order)
+        if ordering is None:
+            key = _ORDER_KEYS[order]
+            keys = [key(entry) for entry in self._entries]
+            if all(keys[i] <= keys[i + 1] for i in range(len(keys) - 1)):
+                # Catalogs are usually built in natural order already
+                ordering = (keys, list(self._entries))
+            else:
+                pairs = sorted(zip(keys, self._entries), key=lambda pair: pair[0])
+                ordering = ([pair[0] for pair in pairs], [pair[1] for pair in pairs])
+            self._orders[order] = ordering
+        return ordering
+
+    def next_after(self, filename: str, order: str = 'name') -> Optional[VideoEntry]:
+        """The video following `filename` in ascending `order` (the playlist order for 'name')."""
+        entry = self._by_filename.get(filename)
+        if entry is None:
+            return None
+        keys, entries = self._ordering(order)
+        i = bisect.bisect_right(keys, _ORDER_KEYS[order](entry))
+        return entries[i] if i < len(entries) else None
+
+    def listing(self, order: str, query: str = '', prefix: str = '') -> Tuple[List[tuple], List[VideoEntry]]:
+        """Returns (sort keys, entries) in ascending `order`, restricted to a search if given."""
+        if not query and not prefix:
+            return self._ordering(order)
+        cache_key = (order, query.lower(), prefix.lower())
+        listing = self._filtered.get(cache_key)
+        if listing is None:
+            ids = self.search(query, prefix)
+            keys, entries = self._ordering(order)
+            if len(ids) * 8 < len(entries):
+                key = _ORDER_KEYS[order]
+                matched = sorted((key(self._by_id[video_id]), self._by_id[video_id]) for video_id in ids)
+            else:
+                matched = [(k, entry) for k, entry in zip(keys, entries) if entry.id in ids]
+            listing = ([pair[0] for pair in matched], [pair[1] for pair in matched])
+            if len(self._filtered) >= FILTERED_LISTINGS_CACHED:
+                self._filtered.pop(next(iter(self._filtered)))
+            self._filtered[cache_key] = listing
+        return listing
+
+    def _search(self) -> Tuple[str, List[int], List[Tuple[str, int]]]:
+        if self._search_index is None:
+            names = [entry.filename.lower() for entry in self._entries]
+            starts: List[int] = []
+            position = 0
+            for name in names:
+                starts.append(position)
+                position += len(name) + 1
+            prefixes = [(name, i) for i, name in enumerate(names)]
+            prefixes += [(name.rsplit('/', 1)[1], i) for i, name in enumerate(names) if '/' in name]
+            prefixes.sort()
+            self._search_index = ('\n'.join(names), starts, prefixes)
+        return self._search_index
+
+    def search(self, query: Optional[str] = None, prefix: Optional[str] = None) -> Set[int]:
+        """
+        Returns the IDs of videos whose filename contains `query` and whose
+        filename or basename starts with `prefix` (case-insensitive).
+        """
+        text, starts, prefixes = self._search()
+        matches: Optional[Set[int]] = None
+        if query:
+            query = query.lower().replace('\n', '')
+            matches = set()
+            position = text.find(query)
+            while position != -1:
+                index = bisect.bisect_right(starts, position) - 1
+                matches.add(self._entries[index].id)
+                # Continue after this filename, it matched already
+                following = starts[index + 1] if index + 1 < len(starts) else len(text)
+                position = text.find(query, following)
+        if prefix:
+            prefix = prefix.lower()
+            low = bisect.bisect_left(prefixes, (prefix, -1))
+            high = bisect.bisect_left(prefixes, (prefix + '\U0010ffff', -1))
+            prefixed = {self._entries[i].id for _, i in prefixes[low:high]}
+            matches = prefixed if matches is None else matches & prefixed
+        return matches if matches is not None else {entry.id for entry in self._entries}
+
+    def page(self, order: str = 'name', descending: bool = False, limit: int = 50,
+             cursor: Optional[str] = None, query: str = '', prefix: str = ''
+             ) -> Tuple[List[VideoEntry], Optional[str], int]:
+        """
+        Returns up to `limit` entries in the given order following `cursor`,
+        restricted to a search if given, the cursor of the next page (None
+        on the last page) and the number of matching entries.
+        Raises CursorError for invalid cursors.
+        """
+        keys, entries = self.listing(order, query, prefix)
+        if cursor:
+            after = _decode_cursor(cursor, order, descending)
+            try:
+                position = (bisect.bisect_left(keys, after) - 1 if descending
+                            else bisect.bisect_right(keys, after))
+            except TypeError:
+                raise CursorError("Invalid cursor")
+        else:
+            position = len(entries) - 1 if descending else 0
+        if descending:
+            low = max(0, position - limit + 1)
+            result = entries[low:position + 1][::-1]
+            more = low > 0
+        else:
+            result = entries[position:position + limit]
+            more = position + limit < len(entries)
+        if not more or not result:
+            return result, None, len(entries)
+        last_key = keys[low] if descending else keys[position + limit - 1]
+        return result, _encode_cursor(order, descending, last_key), len(entries)
+
+
+def _encode_cursor(order: str, descending: bool, key: tuple) -> str:
+    payload = json.dumps([order, descending, key], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor: str, order: str, descending: bool) -> tuple:
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_order, cursor_descending, key = json.loads(payload)
+    except (ValueError, TypeError):
+        raise CursorError("Malformed cursor")
+    if cursor_order != order or cursor_descending != descending or not isinstance(key, list):
+        raise CursorError("Cursor belongs to a different sort order")
+    return tuple(key)
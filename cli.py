@@ -1,40 +1,87 @@
 #!/usr/bin/env python3
 """
-Video Streaming Server - CLI Interactive Launcher
--------------------------------------------------
-Prompts user for port and video file, then starts the server
-and displays a QR code for the stream's M3U playlist.
+Video Streaming Server - CLI Launcher
+-------------------------------------
+Interactive mode (the default on a terminal): prompts for the port and a
+video directory, then starts the server and displays a QR code for the
+web interface.
+
+Headless mode (--headless, MEDIA_SERVER_HEADLESS=1, or when stdin is not a
+terminal) never prompts, so the server can run as a service. Settings
+are taken, in increasing order of precedence, from
+
+  1. a config file (--config or MEDIA_SERVER_CONFIG): an INI file with a
+     [media-server] section using the setting names below,
+  2. MEDIA_SERVER_<NAME> environment variables,
+  3. command line options.
+
+In interactive mode, a configured port or library skips its prompt.
+Heavy modules (qrcode, tkinter, and OpenCV in server.py / thumbnails.py)
+are only imported on the code paths that use them.
+
+Usage: python cli.py [--headless] [--config FILE] [--library DIR ...] [--port N] ...
 """
 
 import os
 import sys
+import time
 import logging
-import re # Added for natural sorting
+import argparse
+import functools
+import configparser
 # import signal # signal_handler is defined but not used if server.stop_server() is not implemented
-# import time
-import qrcode # For QR code generation
 import utils # Ensures utils is imported
-import server
-import tkinter as tk
-from tkinter import filedialog
+import serving
+import library
+import cluster
+from library import VIDEO_EXTENSIONS # Shared with the server's rescans
+from library import natural_sort_key # noqa: F401 -- moved to library, still importable from here
 import socket # socket is used by prompt_for_port and was used by old get_local_ip
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Callable, Optional
 
 # --- Configuration ---
 DEFAULT_PORT = 5000
+CONFIG_SECTION = 'media-server'
 
 # Configure logging (optional, can be simplified if debug arg removed)
 logging.basicConfig(level=logging.INFO, 
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Define common video extensions
-VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv', '.webm')
+# Seconds between background library rescans (0 disables them)
+RESCAN_INTERVAL = float(os.environ.get('MEDIA_SERVER_RESCAN_INTERVAL', '60'))
+
+
+def _parse_roots(value: str) -> List[str]:
+    """Library roots separated by os.pathsep or newlines."""
+    return [root.strip() for line in value.splitlines() for root in line.split(os.pathsep) if root.strip()]
 
-# --- Natural Sort Helper ---
-def natural_sort_key(s: str, _nsre=re.compile(r'([0-9]+)')) -> List[Any]:
-    """Key for natural sorting (handles numbers in strings properly)."""
-    return [int(text) if text.isdigit() else text.lower() for text in _nsre.split(s)]
+
+def _parse_bool(value: str) -> bool:
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# Launcher settings: name -> parser of its config file / environment value
+SETTINGS: Dict[str, Callable[[str], Any]] = {
+    'library': _parse_roots,
+    'port': int,
+    'host': str,
+    'engine': str,
+    'workers': int,
+    'threads': int,
+    'max_connections': int,
+    'probe_workers': int,
+    'rescan_interval': float,
+    'cache_dir': str,
+    'metadata_db': str,
+    'hls_cache_dir': str,
+    'thumbnail_cache_dir': str,
+    'qr_code': _parse_bool,
+    'cluster_nodes': cluster.parse_nodes,
+    'cluster_self': cluster.normalize_url,
+}
+# Settings handed to serving.ServingConfig
+SERVING_SETTINGS = ('port', 'host', 'engine', 'workers', 'threads', 'max_connections')
 
 # --- Functions ---
 
@@ -72,6 +119,8 @@ def prompt_for_port() -> int:
 
 def select_video_directory() -> Optional[str]:
     """Opens a dialog to select a directory and returns its absolute path."""
+    import tkinter as tk  # only the interactive launcher needs a GUI toolkit
+    from tkinter import filedialog
     root = tk.Tk()
     root.withdraw()  # Hide the main Tkinter window
     directory_path = filedialog.askdirectory(title="Select Directory Containing Video Files")
@@ -83,29 +132,18 @@ def select_video_directory() -> Optional[str]:
         print("No directory selected.")
         return None
 
-def scan_directory_for_videos(directory_path: str) -> List[Dict[str, str]]:
-    """Scans the given directory for video files and returns a list of dictionaries."""
+def scan_directory_for_videos(directory_path: str) -> List[Dict[str, Any]]:
+    """
+    Scans the given directory (recursively) for video files and returns a list
+    of dictionaries, naturally sorted by their path relative to the directory.
+    """
     video_files = []
     if not os.path.isdir(directory_path):
         print(f"Error: {directory_path} is not a valid directory.")
         return video_files
 
     print(f"Scanning for videos in: {directory_path}...")
-    temp_video_list = []
-    for item in os.listdir(directory_path):
-        item_path = os.path.join(directory_path, item)
-        if os.path.isfile(item_path):
-            _ , ext_part = os.path.splitext(item)
-            ext_lower = ext_part.lower()
-            if ext_lower in VIDEO_EXTENSIONS:
-                temp_video_list.append({
-                    "filename": item, 
-                    "path": os.path.abspath(item_path)
-                })
-    
-    # Sort the collected video files naturally by filename
-    # The key for sorting is a dictionary's 'filename' value
-    video_files = sorted(temp_video_list, key=lambda x: natural_sort_key(x['filename']))
+    video_files = library.scan_library([directory_path])
 
     if video_files:
         print(f"Found and sorted {len(video_files)} video file(s):")
@@ -117,6 +155,7 @@ def scan_directory_for_videos(directory_path: str) -> List[Dict[str, str]]:
 
 def display_qr_code_for_web_interface(port: int) -> None:
     """Displays QR code for the web interface URL."""
+    import qrcode # For QR code generation, imported only when one is shown
     local_ip = utils.get_local_ip() # Changed to use utils.get_local_ip()
     web_interface_url = f"http://{local_ip}:{port}/"
 
@@ -146,51 +185,177 @@ def display_qr_code_for_web_interface(port: int) -> None:
         print("You can still access the web interface using the URL above.")
     print("="*50 + "\n")
 
-def main() -> None:
-    """Main function to run the CLI application."""
-    # signal.signal(signal.SIGINT, signal_handler) # Commented out as server.stop_server() needs review
-
-    print("Starting Video Stream Server Setup...")
-    selected_port = prompt_for_port()
-    video_directory = select_video_directory()
-    if not video_directory:
-        print("No video directory selected. Exiting.")
-        return
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--headless', action='store_true', default=None,
+                        help="never prompt (default when stdin is not a terminal)")
+    parser.add_argument('--config', help="INI config file with a [media-server] section")
+    parser.add_argument('--library', action='append', metavar='DIR',
+                        help="library root to serve; repeat for several roots")
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--host', help="address to listen on (default 0.0.0.0)")
+    parser.add_argument('--engine', choices=serving.ENGINES, help="serving engine (default dev)")
+    parser.add_argument('--workers', type=int, help="worker processes for the gunicorn engine")
+    parser.add_argument('--threads', type=int, help="request threads per worker")
+    parser.add_argument('--max-connections', type=int, help="simultaneous connections per worker")
+    parser.add_argument('--probe-workers', type=int, help="metadata probing workers")
+    parser.add_argument('--rescan-interval', type=float, help="seconds between library rescans, 0 disables them")
+    parser.add_argument('--cache-dir', help="directory for the metadata, HLS and thumbnail caches")
+    parser.add_argument('--metadata-db', help="metadata cache database (default in --cache-dir)")
+    parser.add_argument('--hls-cache-dir', help="HLS segment cache (default in --cache-dir)")
+    parser.add_argument('--thumbnail-cache-dir', help="thumbnail cache (default in --cache-dir)")
+    parser.add_argument('--no-qr-code', dest='qr_code', action='store_false', default=None,
+                        help="do not print the QR code")
+    parser.add_argument('--cluster-nodes', type=cluster.parse_nodes, metavar='URLS',
+                        help="comma separated base URLs of all cluster nodes, this one included")
+    parser.add_argument('--cluster-self', type=cluster.normalize_url, metavar='URL',
+                        help="this node's base URL in --cluster-nodes")
+    return parser.parse_args(argv)
 
-    video_files_list = scan_directory_for_videos(video_directory)
-    if not video_files_list:
-        print("No video files found in the selected directory. Exiting.")
-        return
+def load_settings(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Merges the config file, MEDIA_SERVER_* variables and command line options
+    (in increasing precedence). Raises ValueError for unreadable or invalid values.
+    """
+    settings: Dict[str, Any] = {}
+    config_path = args.config or os.environ.get('MEDIA_SERVER_CONFIG')
+    if config_path:
+        parser = configparser.ConfigParser()
+        if not parser.read(config_path):
+            raise ValueError(f"Cannot read config file {config_path}")
+        if parser.has_section(CONFIG_SECTION):
+            for name, raw in parser.items(CONFIG_SECTION):
+                name = name.replace('-', '_')
+                if name not in SETTINGS:
+                    raise ValueError(f"Unknown setting '{name}' in {config_path}")
+                try:
+                    settings[name] = SETTINGS[name](raw)
+                except ValueError:
+                    raise ValueError(f"Invalid value for '{name}' in {config_path}: {raw!r}")
+    for name, convert in SETTINGS.items():
+        raw = os.environ.get(f'MEDIA_SERVER_{name.upper()}')
+        if raw:
+            try:
+                settings[name] = convert(raw)
+            except ValueError:
+                raise ValueError(f"Invalid value for MEDIA_SERVER_{name.upper()}: {raw!r}")
+    settings.update({name: value for name, value in vars(args).items() if name in SETTINGS and value is not None})
+    if settings.get('library'):
+        settings['library'] = [os.path.abspath(os.path.expanduser(root)) for root in settings['library']]
+    cache_dir = settings.get('cache_dir')
+    if cache_dir:
+        cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        settings.setdefault('metadata_db', os.path.join(cache_dir, 'metadata.sqlite3'))
+        settings.setdefault('hls_cache_dir', os.path.join(cache_dir, 'hls'))
+        settings.setdefault('thumbnail_cache_dir', os.path.join(cache_dir, 'thumbnails'))
+    return settings
 
-    # For server.py, video_info_cache might be populated directly in server.py
-    # based on the list of files. Or server.py is adapted to handle a list.
-    # We are passing the list of video dicts.
-    
-    print(f"\nAttempting to start server on port {selected_port} with {len(video_files_list)} videos...")
-    
+def start_server(video_files: List[Dict[str, Any]], roots: List[str], settings: Dict[str, Any],
+                 show_qr_code: bool) -> int:
+    """Runs the server until it is stopped; returns the exit status."""
+    import server  # Flask and the server modules load only once there is something to serve
+    port = settings.get('port', DEFAULT_PORT)
     try:
-        # Modify how server is started to pass the list of videos
-        # server.start_server will need to be adapted to accept this list
-        server.init_server_state(video_files=video_files_list) # New function to set up video list
-        
-        display_qr_code_for_web_interface(selected_port)
-        
+        # The serving engine runs this once, or once per worker process for pre-fork engines
+        init_state = functools.partial(server.init_server_state, video_files=video_files,
+                                       probe_workers=settings.get('probe_workers'),
+                                       metadata_db=settings.get('metadata_db'),
+                                       library_roots=roots,
+                                       rescan_interval=settings.get('rescan_interval', RESCAN_INTERVAL),
+                                       hls_cache_dir=settings.get('hls_cache_dir'),
+                                       thumbnail_cache_dir=settings.get('thumbnail_cache_dir'),
+                                       cluster_nodes=settings.get('cluster_nodes'),
+                                       cluster_self=settings.get('cluster_self'))
+        # Anything not configured here comes from MEDIA_SERVER_* variables
+        serving_config = serving.ServingConfig.from_env(
+            **{name: settings[name] for name in SERVING_SETTINGS if name in settings})
+        serving_config.validate()
+
+        if show_qr_code:
+            display_qr_code_for_web_interface(port)
+
         # Use utils.get_local_ip() for the informational print message
-        print(f"Server starting on http://{utils.get_local_ip()}:{selected_port}")
+        print(f"Server starting on http://{utils.get_local_ip()}:{port} ({serving_config.engine} engine)")
         print("Press Ctrl+C to stop the server.")
-        
-        # Changed debug to False as a general good practice for "release"
-        server.app.run(host='0.0.0.0', port=selected_port, threaded=True, debug=False) 
-        
+
+        serving.run(server.app, serving_config, init_state=init_state,
+                    shutdown_state=server.shutdown_server_state)
+        return 0
+
     except OSError as e:
         if e.errno == 98: # Address already in use
-            print(f"ERROR: Port {selected_port} is already in use. Please try a different port.")
+            print(f"ERROR: Port {port} is already in use. Please try a different port.")
         else:
             print(f"An OS error occurred: {e}")
     except Exception as e:
         print(f"Failed to start server: {e}")
         import traceback
         traceback.print_exc()
+    return 1
+
+def run_headless(settings: Dict[str, Any]) -> int:
+    """Starts the server from the settings alone; returns the exit status."""
+    roots = settings.get('library') or []
+    if not roots:
+        logger.error("No library configured: pass --library, set MEDIA_SERVER_LIBRARY "
+                     "or 'library' in the config file")
+        return 2
+    missing = [root for root in roots if not os.path.isdir(root)]
+    if missing:
+        logger.error(f"Library root(s) not found: {', '.join(missing)}")
+        return 2
+    started = time.perf_counter()
+    video_files = library.scan_library(roots)
+    # An empty library is served too; rescans pick up videos added later
+    logger.info(f"Found {len(video_files)} video file(s) in {len(roots)} root(s) "
+                f"in {time.perf_counter() - started:.2f}s")
+    return start_server(video_files, roots, settings, show_qr_code=settings.get('qr_code', False))
+
+def run_interactive(settings: Dict[str, Any]) -> int:
+    """Prompts for whatever is not configured, then starts the server; returns the exit status."""
+    # signal.signal(signal.SIGINT, signal_handler) # Commented out as server.stop_server() needs review
+
+    print("Starting Video Stream Server Setup...")
+    if 'port' not in settings:
+        settings['port'] = prompt_for_port()
+    roots = settings.get('library')
+    if not roots:
+        video_directory = select_video_directory()
+        if not video_directory:
+            print("No video directory selected. Exiting.")
+            return 1
+        roots = [video_directory]
+
+    if len(roots) == 1:
+        video_files_list = scan_directory_for_videos(roots[0])
+    else:
+        video_files_list = library.scan_library(roots)
+    if not video_files_list:
+        print("No video files found in the selected directory. Exiting.")
+        return 1
+
+    # For server.py, video_info_cache might be populated directly in server.py
+    # based on the list of files. Or server.py is adapted to handle a list.
+    # We are passing the list of video dicts.
+
+    print(f"\nAttempting to start server on port {settings['port']} with {len(video_files_list)} videos...")
+    return start_server(video_files_list, roots, settings, show_qr_code=settings.get('qr_code', True))
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Main function to run the CLI application."""
+    args = parse_args(argv)
+    try:
+        settings = load_settings(args)
+    except ValueError as e:
+        logger.error(str(e))
+        return 2
+    headless = args.headless
+    if headless is None:
+        headless = (_parse_bool(os.environ.get('MEDIA_SERVER_HEADLESS', '0'))
+                    or not sys.stdin or not sys.stdin.isatty())
+    if headless:
+        return run_headless(settings)
+    return run_interactive(settings)
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    sys.exit(main())
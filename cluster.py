@@ -0,0 +1,413 @@
+"""
+Cluster mode: one library sharded over several server instances.
+
+Each node serves the videos of its own library roots. The nodes are listed
+in MEDIA_SERVER_CLUSTER_NODES (base URLs, comma separated, this node
+included) and each one is told its own URL in MEDIA_SERVER_CLUSTER_SELF.
+A consistent-hash ring (HashRing, VNODES points per node) maps every
+filename to the nodes in the order they take it over; the first REPLICAS
+of them own the video. Any node answers for the whole library:
+
+- the listing (/, /api/videos, /api/videos/metadata) merges the catalogs of
+  the healthy nodes, fetched from their /api/cluster/videos whenever their
+  catalog version changes; metadata probed meanwhile is fetched as a delta
+  of the entries that changed since the generation held (MetadataChanges),
+- requests for one video (/stream, /api/video_info, keyframes, HLS,
+  thumbnails) are served locally when this node is the one to serve it
+  (Cluster.locate), otherwise redirected (307, /stream only, in the
+  'redirect' routing mode) or proxied to that node.
+
+Every HEALTH_INTERVAL seconds each peer's /api/cluster/health is polled.
+After FAIL_THRESHOLD failures in a row a node leaves the ring, on its
+first success it joins again; the ring only moves the videos of the node
+that joined or left. A video is served by its first owner that holds a
+copy, or by any healthy node that does (copies on several nodes keep it
+available while one is down).
+
+Files are never copied or moved between nodes: the ring decides who
+should hold a video, not who does. When nodes join or leave, routing
+follows the copies wherever they are, but storage stays where it was until
+an operator moves it. /api/cluster/status reports the local files this
+node does not own and the owned files it lacks; acting on that report
+(e.g. with rsync) is left to the operator.
+"""
+
+import os
+import json
+import time
+import bisect
+import hashlib
+import logging
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import metrics
+from catalog import VideoCatalog
+from library import natural_sort_key
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+DEFAULT_NODES = os.environ.get('MEDIA_SERVER_CLUSTER_NODES', '')
+DEFAULT_SELF = os.environ.get('MEDIA_SERVER_CLUSTER_SELF', '')
+DEFAULT_REPLICAS = int(os.environ.get('MEDIA_SERVER_CLUSTER_REPLICAS', '1'))
+DEFAULT_ROUTING = os.environ.get('MEDIA_SERVER_CLUSTER_ROUTING', 'redirect')
+HEALTH_INTERVAL = float(os.environ.get('MEDIA_SERVER_CLUSTER_HEALTH_INTERVAL', '5'))
+FAIL_THRESHOLD = int(os.environ.get('MEDIA_SERVER_CLUSTER_FAIL_THRESHOLD', '3'))
+REQUEST_TIMEOUT = 5.0
+VNODES = 64
+ROUTINGS = ('redirect', 'proxy')
+PLACEMENT_LIST_LIMIT = 100      # filenames listed per category in the placement report
+PROXY_CHUNK_SIZE = 256 * 1024
+# Marks requests already routed by a node, which their target must serve itself
+HOP_HEADER = 'X-Cluster-Hop'    # on proxied requests
+HOP_PARAM = 'cluster_hop'       # on redirects
+PROXIED_REQUEST_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since', 'Accept-Encoding')
+PROXIED_RESPONSE_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'Content-Encoding',
+                            'Accept-Ranges', 'ETag', 'Last-Modified', 'Cache-Control', 'Vary',
+                            'Retry-After', 'X-Keyframe-Time', 'X-Rendition')
+
+CLUSTER_ROUTED = metrics.REGISTRY.register(metrics.Counter(
+    'media_server_cluster_routed_total', "Requests for a video by routing (local, redirect, proxy)", ('routing',)))
+CLUSTER_MEMBERSHIP = metrics.REGISTRY.register(metrics.Counter(
+    'media_server_cluster_membership_changes_total', "Nodes joining or leaving the ring", ('event',)))
+
+# Cluster peers are internal addresses, never reached through an HTTP proxy from the environment
+_OPENER = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+
+def parse_nodes(value: str) -> List[str]:
+    """Parses comma separated node base URLs. Raises ValueError."""
+    nodes = []
+    for item in value.split(','):
+        node = normalize_url(item)
+        if node and node not in nodes:
+            nodes.append(node)
+    return nodes
+
+
+def normalize_url(value: str) -> str:
+    """A node base URL without trailing slashes. Raises ValueError."""
+    node = value.strip().rstrip('/')
+    if node and not node.startswith(('http://', 'https://')):
+        raise ValueError(f"Invalid cluster node '{node}', expected e.g. http://10.0.0.2:5000")
+    return node
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8', 'surrogateescape'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent-hash ring with `vnodes` points per node."""
+
+    def __init__(self, nodes: List[str], vnodes: int = VNODES) -> None:
+        self.nodes = sorted(set(nodes))
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [point[0] for point in points]
+        self._owners = [point[1] for point in points]
+
+    def preference(self, key: str) -> List[str]:
+        """Every node, in the order they take over `key`: its primary owner first."""
+        result: List[str] = []
+        if not self._hashes:
+            return result
+        start = bisect.bisect(self._hashes, _hash(key))
+        for i in range(len(self._owners)):
+            node = self._owners[(start + i) % len(self._owners)]
+            if node not in result:
+                result.append(node)
+                if len(result) == len(self.nodes):
+                    break
+        return result
+
+    def owners(self, key: str, count: int) -> List[str]:
+        return self.preference(key)[:count]
+
+
+class MetadataChanges:
+    """
+    Generations of a node's metadata: each stored result bumps the
+    generation, so peers holding an older one fetch only the videos whose
+    metadata changed since. Tokens carry a random epoch; a new instance
+    (a restart, a new catalog) invalidates every token handed out before.
+    """
+
+    def __init__(self) -> None:
+        self.epoch = os.urandom(4).hex()
+        self.generation = 0
+        self._changed: Dict[str, int] = {}   # filename -> generation of its last change
+        self._lock = threading.Lock()
+
+    def record(self, filename: str) -> None:
+        with self._lock:
+            self.generation += 1
+            self._changed[filename] = self.generation
+
+    def token(self) -> str:
+        with self._lock:
+            return f"{self.epoch}.{self.generation}"
+
+    def since(self, token: str) -> Optional[List[str]]:
+        """Filenames whose metadata changed after `token`, None if it is not one of ours (send everything)."""
+        epoch, _, generation = token.partition('.')
+        if epoch != self.epoch or not generation.isdigit():
+            return None
+        with self._lock:
+            if int(generation) > self.generation:
+                return None
+            return [filename for filename, changed in self._changed.items() if changed > int(generation)]
+
+
+class _Peer:
+    __slots__ = ('url', 'healthy', 'failures', 'version', 'metadata', 'videos', 'checked', 'error')
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.healthy = False        # until its first successful check
+        self.failures = 0
+        self.version: Optional[str] = None    # catalog version
+        self.metadata: Optional[str] = None   # MetadataChanges token
+        # filename -> {'size', 'mtime_ns', 'metadata'}
+        self.videos: Dict[str, Dict[str, Any]] = {}
+        self.checked: Optional[float] = None
+        self.error: Optional[str] = None
+
+
+class Cluster:
+    """
+    This node's view of the cluster: peer health, the ring over the healthy
+    nodes and their catalogs. `local` returns this node's current catalog.
+    """
+
+    def __init__(self, nodes: List[str], self_url: str, local: Callable[[], VideoCatalog],
+                 replicas: int = DEFAULT_REPLICAS, routing: str = DEFAULT_ROUTING,
+                 interval: float = HEALTH_INTERVAL) -> None:
+        self_url = normalize_url(self_url)
+        if self_url not in nodes:
+            raise ValueError(f"This node ({self_url or 'MEDIA_SERVER_CLUSTER_SELF unset'}) is not "
+                             f"one of the cluster nodes {', '.join(nodes)}")
+        if routing not in ROUTINGS:
+            raise ValueError(f"Unknown cluster routing '{routing}', expected one of {', '.join(ROUTINGS)}")
+        if replicas < 1:
+            raise ValueError("Cluster replicas must be at least 1")
+        self.self_url = self_url
+        self.local = local
+        self.replicas = replicas
+        self.routing = routing
+        self.interval = interval
+        self._peers = {url: _Peer(url) for url in nodes if url != self_url}
+        self._ring = HashRing([self_url])   # peers join on their first successful check
+        self._lock = threading.Lock()
+        self._listing = VideoCatalog()
+        self._listing_key: Optional[tuple] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='cluster-health', daemon=True)
+
+    # --- Health checks ---
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Cluster health check failed: {e}")
+            self._stop.wait(self.interval)
+
+    def check(self) -> bool:
+        """Polls every peer once; returns whether a node joined or left the ring."""
+        changed = False
+        for peer in list(self._peers.values()):
+            changed |= self._check_peer(peer)
+        if changed:
+            with self._lock:
+                self._ring = HashRing([self.self_url] + [p.url for p in self._peers.values() if p.healthy])
+                members = len(self._ring.nodes)
+            report = self.placement()
+            logger.info(f"Cluster ring has {members} node(s); {report['misplaced_count']} local video(s) "
+                        f"owned elsewhere, {report['missing_count']} owned video(s) missing here")
+        return changed
+
+    def _check_peer(self, peer: _Peer) -> bool:
+        try:
+            health = _get_json(f"{peer.url}/api/cluster/health")
+            if health.get('node') != peer.url:
+                raise ValueError(f"answers as {health.get('node')!r}")
+            if health.get('version') != peer.version or peer.metadata is None:
+                self._fetch_videos(peer, None)
+            elif health.get('metadata') != peer.metadata:
+                self._fetch_videos(peer, peer.metadata)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            peer.checked, peer.error = time.time(), str(e)
+            peer.failures += 1
+            if peer.healthy and peer.failures >= FAIL_THRESHOLD:
+                peer.healthy = False
+                CLUSTER_MEMBERSHIP.inc(labels=('leave',))
+                logger.warning(f"Cluster node {peer.url} left the ring after {peer.failures} failed checks: {e}")
+                return True
+            logger.debug(f"Cluster node {peer.url} check failed: {e}")
+            return False
+        peer.checked, peer.error, peer.failures = time.time(), None, 0
+        if not peer.healthy:
+            peer.healthy = True
+            CLUSTER_MEMBERSHIP.inc(labels=('join',))
+            logger.info(f"Cluster node {peer.url} joined the ring with {len(peer.videos)} video(s)")
+            return True
+        return False
+
+    def _fetch_videos(self, peer: _Peer, since: Optional[str]) -> None:
+        """Fetches a peer's catalog, or the metadata changed after token `since` if it still applies."""
+        url = f"{peer.url}/api/cluster/videos"
+        if since is not None:
+            url += '?' + urllib.parse.urlencode({'since': since})
+        listing = _get_json(url)
+        if listing.get('delta') and listing['version'] != peer.version:
+            listing = _get_json(f"{peer.url}/api/cluster/videos")  # the catalog changed meanwhile
+        with self._lock:
+            if listing.get('delta'):
+                videos = dict(peer.videos)
+                for video in listing['videos']:
+                    if video['filename'] in videos:
+                        videos[video['filename']] = video
+            else:
+                videos = {video['filename']: video for video in listing['videos']}
+            peer.videos, peer.version, peer.metadata = videos, listing['version'], listing['metadata']
+
+    # --- Routing ---
+    def locate(self, filename: str) -> Optional[str]:
+        """
+        The node to serve a video from: its first owner holding a copy
+        (this node first if it is one), else this node or the first healthy
+        holder in ring order. None if no healthy node has it.
+        """
+        holders = {url for url, peer in self._peers.items() if peer.healthy and filename in peer.videos}
+        if filename in self.local():
+            holders.add(self.self_url)
+        if not holders:
+            return None
+        preference = self._ring.preference(filename)
+        owners = preference[:self.replicas]
+        if self.self_url in owners and self.self_url in holders:
+            return self.self_url
+        for node in owners:
+            if node in holders:
+                return node
+        if self.self_url in holders:
+            return self.self_url
+        for node in preference:
+            if node in holders:
+                return node
+        return None
+
+    # --- Listing ---
+    def listing(self) -> VideoCatalog:
+        """
+        The catalog of every healthy node, this one's first. Updated rather
+        than rebuilt when a node's catalog changes, so video IDs stay stable.
+        """
+        local = self.local()
+        with self._lock:
+            peers = sorted((p for p in self._peers.values() if p.healthy), key=lambda p: p.url)
+            key = (local.version,) + tuple((peer.url, peer.version) for peer in peers)
+            if key == self._listing_key:
+                return self._listing
+            videos: Dict[str, Dict[str, Any]] = {}
+            for entry in local:
+                videos[entry.filename] = {'filename': entry.filename, 'path': entry.path,
+                                          'size': entry.size, 'mtime_ns': entry.mtime_ns}
+            for peer in peers:
+                for filename, video in peer.videos.items():
+                    if filename not in videos:
+                        videos[filename] = {'filename': filename, 'path': f"{peer.url}/{filename}",
+                                            'size': video.get('size'), 'mtime_ns': video.get('mtime_ns')}
+            previous = self._listing
+            removed = [filename for filename in previous.filenames() if filename not in videos]
+            added, changed = [], []
+            for filename, video in videos.items():
+                entry = previous.get(filename)
+                if entry is None:
+                    added.append(video)
+                elif (entry.path, entry.size, entry.mtime_ns) != (video['path'], video['size'], video['mtime_ns']):
+                    changed.append(video)
+            added.sort(key=lambda video: natural_sort_key(video['filename']))
+            self._listing = previous.updated(added, removed, sort_key=natural_sort_key, changed=changed)
+            self._listing_key = key
+            return self._listing
+
+    def remote_metadata(self, filename: str) -> Optional[Dict[str, Any]]:
+        """Metadata of a video held by a healthy peer, as that peer last published it."""
+        for peer in list(self._peers.values()):
+            if peer.healthy:
+                video = peer.videos.get(filename)
+                if video is not None and video.get('metadata') is not None:
+                    return video['metadata']
+        return None
+
+    # --- Placement ---
+    def placement(self) -> Dict[str, Any]:
+        """
+        How the local files match the ring: videos held here that this node
+        does not own, and videos it owns that only other nodes hold. Only a
+        report: nothing is fetched or deleted to act on it.
+        """
+        local = self.local()
+        with self._lock:
+            ring = self._ring
+            remote = {filename for peer in self._peers.values() if peer.healthy for filename in peer.videos}
+        misplaced = [filename for filename in local.filenames()
+                     if self.self_url not in ring.owners(filename, self.replicas)]
+        missing = sorted((filename for filename in remote
+                          if filename not in local and self.self_url in ring.owners(filename, self.replicas)),
+                         key=natural_sort_key)
+        return {"owned": len(local) - len(misplaced),
+                "misplaced_count": len(misplaced), "misplaced": misplaced[:PLACEMENT_LIST_LIMIT],
+                "missing_count": len(missing), "missing": missing[:PLACEMENT_LIST_LIMIT]}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            peers = {url: {"healthy": peer.healthy, "failures": peer.failures, "videos": len(peer.videos),
+                           "version": peer.version, "checked": peer.checked, "error": peer.error}
+                     for url, peer in self._peers.items()}
+            ring = list(self._ring.nodes)
+        return {"self": self.self_url, "routing": self.routing, "replicas": self.replicas,
+                "ring": ring, "peers": peers}
+
+
+def _get_json(url: str) -> Dict[str, Any]:
+    request = urllib.request.Request(url, headers={'Accept': 'application/json', HOP_HEADER: '1'})
+    with _OPENER.open(request, timeout=REQUEST_TIMEOUT) as response:
+        return json.loads(response.read())
+
+
+def forward(url: str, headers: Dict[str, str]) -> Tuple[int, List[Tuple[str, str]], Iterator[bytes]]:
+    """
+    Sends a GET to another node; returns its status, the response headers
+    worth passing on and an iterator over the body. Raises OSError if the
+    node cannot be reached.
+    """
+    request = urllib.request.Request(url, headers=dict(headers, **{HOP_HEADER: '1'}))
+    try:
+        upstream = _OPENER.open(request, timeout=REQUEST_TIMEOUT)
+    except urllib.error.HTTPError as e:
+        upstream = e  # 304 and errors carry a response too
+    passed = [(name, upstream.headers[name]) for name in PROXIED_RESPONSE_HEADERS if name in upstream.headers]
+    return upstream.getcode(), passed, _iter_body(upstream)
+
+
+def _iter_body(upstream) -> Iterator[bytes]:
+    try:
+        while True:
+            data = upstream.read(PROXY_CHUNK_SIZE)
+            if not data:
+                return
+            yield data
+    finally:
+        upstream.close()
@@ -0,0 +1,71 @@
+"""
+HTTP validators and conditional request handling.
+
+Videos get a strong ETag derived from (inode, size, mtime) so it changes
+whenever the file is replaced or rewritten, plus a Last-Modified date.
+These drive If-None-Match / If-Modified-Since (304 Not Modified) and
+If-Range (serve the range only if the client's copy is still current).
+"""
+
+import os
+from datetime import datetime, timezone
+from typing import Mapping, Optional, Tuple
+
+from werkzeug.http import http_date, parse_date, parse_etags, unquote_etag
+
+# --- Cache-Control policy per route ---
+# Video bytes never change without the ETag changing, so clients may reuse
+# them for a while and revalidate cheaply afterwards.
+CACHE_CONTROL_STREAM = 'public, max-age=3600'
+# Metadata is small and may be re-probed, always revalidate.
+CACHE_CONTROL_METADATA = 'no-cache'
+
+
+def file_validators(st: os.stat_result, weak: bool = False, variant: str = '') -> Tuple[str, str]:
+    """
+    Returns (ETag header value, Last-Modified header value) for a stat result.
+    Weak ETags are used for representations derived from the file (e.g. its
+    metadata JSON) rather than its bytes. A `variant` tags byte layouts that
+    differ from the file on disk (e.g. the faststart view) so a client never
+    combines ranges of both.
+    """
+    suffix = f'-{variant}' if variant else ''
+    etag = f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}{suffix}"'
+    if weak:
+        etag = 'W/' + etag
+    last_modified = http_date(datetime.fromtimestamp(int(st.st_mtime), tz=timezone.utc))
+    return etag, last_modified
+
+
+def is_not_modified(headers: Mapping[str, str], etag: str, last_modified: str) -> bool:
+    """
+    Evaluates If-None-Match and If-Modified-Since. If-None-Match takes
+    precedence and uses weak comparison, as RFC 7232 requires for GET.
+    """
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        tag, _ = unquote_etag(etag)
+        return parse_etags(if_none_match).contains_weak(tag)
+
+    if_modified_since = parse_date(headers.get('If-Modified-Since'))
+    if if_modified_since is not None:
+        modified = parse_date(last_modified)
+        return modified is not None and modified <= if_modified_since
+    return False
+
+
+def if_range_allows(headers: Mapping[str, str], etag: str, last_modified: str) -> bool:
+    """
+    Returns True if a Range header may be honoured. With If-Range the range
+    is only served when the validator still matches (strong comparison for
+    ETags, exact match for dates); otherwise the full file must be sent.
+    """
+    if_range: Optional[str] = headers.get('If-Range')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        tag, is_weak = unquote_etag(if_range)
+        current, current_weak = unquote_etag(etag)
+        return not is_weak and not current_weak and tag == current
+    return if_range == last_modified
@@ -0,0 +1,473 @@
+"""
+Lightweight container header parsing.
+
+Reads width, height, fps, duration, frame count and codec straight from the
+container headers instead of initialising an FFmpeg decoder through OpenCV:
+
+- MP4/MOV: `moov` -> `mvhd`, and per track `tkhd`, `mdhd`, `hdlr`,
+  `stsd`, `stts` (the frame count is exact, summed from `stts`).
+- Matroska/WebM: EBML `Segment` -> `Info` and `Tracks`, following the
+  `SeekHead` when they are stored after the clusters.
+- AVI: `hdrl` -> `avih`, the video `strh` and the OpenDML `dmlh`.
+
+Only the header structures are read (seeking past media data), so probing
+costs a few small reads per file. probe_container() returns None for
+anything it does not understand and the caller falls back to OpenCV.
+"""
+
+import os
+import struct
+import logging
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Refuse to load header structures larger than this into memory.
+MAX_HEADER_SIZE = 64 * 1024 * 1024
+
+_MP4_TOP_LEVEL = {b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot', b'uuid'}
+
+
+class ContainerError(Exception):
+    """The file is truncated or does not match the container structure."""
+
+
+def _result(width: int, height: int, fps: float, duration: float,
+            frame_count: int, codec: str) -> Dict[str, Any]:
+    return {
+        "width": width,
+        "height": height,
+        "fps": fps,
+        "duration": duration,
+        "frame_count": frame_count,
+        "codec": codec,
+    }
+
+
+# --- MP4 / MOV ---
+def iter_boxes(data: memoryview, offset: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int]]:
+    """
+    Yields (type, payload_start, box_end) for the boxes in data[offset:end].
+    Offsets are relative to `data`.
+    """
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise ContainerError("Truncated largesize box header")
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise ContainerError(f"Invalid size for box {box_type!r}")
+        yield bytes(box_type), offset + header, offset + size
+        offset += size
+
+
+def find_box(data: memoryview, path: List[bytes], offset: int = 0, end: Optional[int] = None) -> Optional[Tuple[int, int]]:
+    """Returns (payload_start, box_end) of the first box matching a type path."""
+    for box_type, start, box_end in iter_boxes(data, offset, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return start, box_end
+            found = find_box(data, path[1:], start, box_end)
+            if found:
+                return found
+    return None
+
+
+def read_top_level_box(f: BinaryIO, wanted: bytes, file_size: int) -> Optional[Tuple[int, bytes]]:
+    """
+    Walks the top-level boxes of an MP4 file by seeking over their payloads
+    and returns (file offset of the box, full box bytes) for `wanted`.
+    """
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        if len(header) < 8:
+            return None
+        size, box_type = struct.unpack_from('>I4s', header)
+        if size == 1:
+            if len(header) < 16:
+                return None
+            size = struct.unpack_from('>Q', header, 8)[0]
+        elif size == 0:
+            size = file_size - offset
+        if size < 8:
+            raise ContainerError(f"Invalid size for top-level box {box_type!r}")
+        if box_type == wanted:
+            if size > MAX_HEADER_SIZE:
+                raise ContainerError(f"{wanted!r} box too large ({size} bytes)")
+            f.seek(offset)
+            data = f.read(size)
+            if len(data) < size:
+                raise ContainerError(f"Truncated {wanted!r} box")
+            return offset, data
+        offset += size
+    return None
+
+
+def _full_box_version(data: memoryview, start: int) -> int:
+    return data[start]
+
+
+def parse_mp4_moov(moov: bytes) -> Optional[Dict[str, Any]]:
+    """Extracts video properties from a complete `moov` box."""
+    data = memoryview(moov)
+    _, moov_start, moov_end = next(iter_boxes(data))
+
+    movie_duration = 0.0
+    mvhd = find_box(data, [b'mvhd'], moov_start, moov_end)
+    if mvhd:
+        start = mvhd[0]
+        if _full_box_version(data, start) == 1:
+            timescale, duration = struct.unpack_from('>IQ', data, start + 20)
+        else:
+            timescale, duration = struct.unpack_from('>II', data, start + 12)
+        if timescale:
+            movie_duration = duration / timescale
+
+    for box_type, trak_start, trak_end in iter_boxes(data, moov_start, moov_end):
+        if box_type != b'trak':
+            continue
+        hdlr = find_box(data, [b'mdia', b'hdlr'], trak_start, trak_end)
+        if not hdlr or bytes(data[hdlr[0] + 8:hdlr[0] + 12]) != b'vide':
+            continue
+
+        width = height = 0
+        tkhd = find_box(data, [b'tkhd'], trak_start, trak_end)
+        if tkhd:
+            start = tkhd[0]
+            dims_offset = start + (88 if _full_box_version(data, start) == 1 else 76)
+            if dims_offset + 8 <= tkhd[1]:
+                width_fixed, height_fixed = struct.unpack_from('>II', data, dims_offset)
+                width, height = width_fixed >> 16, height_fixed >> 16
+
+        track_duration = movie_duration
+        mdhd = find_box(data, [b'mdia', b'mdhd'], trak_start, trak_end)
+        if mdhd:
+            start = mdhd[0]
+            if _full_box_version(data, start) == 1:
+                timescale, duration = struct.unpack_from('>IQ', data, start + 20)
+            else:
+                timescale, duration = struct.unpack_from('>II', data, start + 12)
+            if timescale and duration:
+                track_duration = duration / timescale
+
+        codec = ''
+        stsd = find_box(data, [b'mdia', b'minf', b'stbl', b'stsd'], trak_start, trak_end)
+        if stsd and stsd[0] + 16 <= stsd[1]:
+            entry = stsd[0] + 8
+            codec = bytes(data[entry + 4:entry + 8]).decode('latin-1').strip()
+            if (not width or not height) and entry + 36 <= stsd[1]:
+                width, height = struct.unpack_from('>HH', data, entry + 32)
+
+        frame_count = 0
+        stts = find_box(data, [b'mdia', b'minf', b'stbl', b'stts'], trak_start, trak_end)
+        if stts:
+            entry_count = struct.unpack_from('>I', data, stts[0] + 4)[0]
+            entries_start = stts[0] + 8
+            if entries_start + entry_count * 8 > stts[1]:
+                raise ContainerError("Truncated stts box")
+            frame_count = sum(struct.unpack_from('>I', data, entries_start + i * 8)[0]
+                              for i in range(entry_count))
+
+        fps = frame_count / track_duration if track_duration > 0 else 0.0
+        return _result(width, height, fps, track_duration, frame_count, codec)
+    return None
+
+
+def probe_mp4(f: BinaryIO, file_size: int) -> Optional[Dict[str, Any]]:
+    found = read_top_level_box(f, b'moov', file_size)
+    if found is None:
+        return None
+    return parse_mp4_moov(found[1])
+
+
+# --- Matroska / WebM ---
+EBML_ID = 0x1A45DFA3
+EBML_DOCTYPE = 0x4282
+MKV_SEGMENT = 0x18538067
+MKV_SEEKHEAD = 0x114D9B74
+MKV_SEEK = 0x4DBB
+MKV_SEEK_ID = 0x53AB
+MKV_SEEK_POSITION = 0x53AC
+MKV_INFO = 0x1549A966
+MKV_TIMECODE_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_TYPE = 0x83
+MKV_CODEC_ID = 0x86
+MKV_DEFAULT_DURATION = 0x23E383
+MKV_VIDEO = 0xE0
+MKV_PIXEL_WIDTH = 0xB0
+MKV_PIXEL_HEIGHT = 0xBA
+MKV_CLUSTER = 0x1F43B675
+MKV_CUES = 0x1C53BB6B
+
+UNKNOWN_SIZE = -1
+
+
+def read_vint(data: bytes, offset: int, keep_marker: bool) -> Tuple[int, int]:
+    """
+    Decodes an EBML variable-length integer at `offset`.
+    Returns (value, length). Element IDs keep the length marker bit, sizes
+    drop it; an all-ones size decodes to UNKNOWN_SIZE.
+    """
+    if offset >= len(data):
+        raise ContainerError("Truncated EBML integer")
+    first = data[offset]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8 or offset + length > len(data):
+        raise ContainerError("Invalid EBML integer")
+    value = first if keep_marker else first & (mask - 1)
+    all_ones = (first & (mask - 1)) == mask - 1
+    for byte in data[offset + 1:offset + length]:
+        value = (value << 8) | byte
+        all_ones = all_ones and byte == 0xFF
+    if not keep_marker and all_ones:
+        return UNKNOWN_SIZE, length
+    return value, length
+
+
+def iter_ebml(data: bytes, offset: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, int, int]]:
+    """Yields (element id, payload_start, payload_end) for elements in data[offset:end]."""
+    end = len(data) if end is None else end
+    while offset < end:
+        element_id, id_length = read_vint(data, offset, keep_marker=True)
+        size, size_length = read_vint(data, offset + id_length, keep_marker=False)
+        start = offset + id_length + size_length
+        stop = end if size == UNKNOWN_SIZE else start + size
+        if stop > end:
+            raise ContainerError(f"EBML element 0x{element_id:X} overruns its parent")
+        yield element_id, start, stop
+        offset = stop
+
+
+def _ebml_uint(data: bytes, start: int, end: int) -> int:
+    return int.from_bytes(data[start:end], 'big')
+
+
+def _ebml_float(data: bytes, start: int, end: int) -> float:
+    if end - start == 4:
+        return struct.unpack('>f', data[start:end])[0]
+    if end - start == 8:
+        return struct.unpack('>d', data[start:end])[0]
+    return 0.0
+
+
+def read_ebml_element_header(f: BinaryIO, offset: int) -> Tuple[int, int, int]:
+    """Reads the element header at a file offset. Returns (id, payload offset, size)."""
+    f.seek(offset)
+    header = f.read(12)
+    element_id, id_length = read_vint(header, 0, keep_marker=True)
+    size, size_length = read_vint(header, id_length, keep_marker=False)
+    return element_id, offset + id_length + size_length, size
+
+
+def read_ebml_element(f: BinaryIO, offset: int) -> Tuple[int, bytes]:
+    """Reads a complete element (with a known size) at a file offset."""
+    element_id, payload_offset, size = read_ebml_element_header(f, offset)
+    if size == UNKNOWN_SIZE or size > MAX_HEADER_SIZE:
+        raise ContainerError(f"Cannot load EBML element 0x{element_id:X} of size {size}")
+    f.seek(payload_offset)
+    payload = f.read(size)
+    if len(payload) < size:
+        raise ContainerError(f"Truncated EBML element 0x{element_id:X}")
+    return element_id, payload
+
+
+def find_mkv_segment_elements(f: BinaryIO, file_size: int, wanted: Tuple[int, ...]) -> Tuple[int, Dict[int, bytes]]:
+    """
+    Locates top-level Segment children by scanning up to the first Cluster
+    and then following the SeekHead. Returns (segment data offset,
+    {element id: payload}) for the elements in `wanted` that were found.
+    """
+    element_id, payload_offset, size = read_ebml_element_header(f, 0)
+    if element_id != EBML_ID:
+        raise ContainerError("Missing EBML header")
+    offset = payload_offset + size
+    element_id, segment_start, segment_size = read_ebml_element_header(f, offset)
+    if element_id != MKV_SEGMENT:
+        raise ContainerError("Missing Matroska Segment")
+    segment_end = file_size if segment_size == UNKNOWN_SIZE else min(file_size, segment_start + segment_size)
+
+    found: Dict[int, bytes] = {}
+    seek_positions: Dict[int, int] = {}
+    offset = segment_start
+    while offset < segment_end and not all(w in found for w in wanted):
+        element_id, payload_offset, size = read_ebml_element_header(f, offset)
+        if element_id == MKV_CLUSTER or size == UNKNOWN_SIZE:
+            break
+        if element_id in wanted or element_id == MKV_SEEKHEAD:
+            _, payload = read_ebml_element(f, offset)
+            if element_id == MKV_SEEKHEAD:
+                for seek_id, start, stop in iter_ebml(payload):
+                    if seek_id != MKV_SEEK:
+                        continue
+                    target_id = target_pos = None
+                    for child_id, c_start, c_stop in iter_ebml(payload, start, stop):
+                        if child_id == MKV_SEEK_ID:
+                            target_id = _ebml_uint(payload, c_start, c_stop)
+                        elif child_id == MKV_SEEK_POSITION:
+                            target_pos = _ebml_uint(payload, c_start, c_stop)
+                    if target_id is not None and target_pos is not None:
+                        seek_positions.setdefault(target_id, segment_start + target_pos)
+            else:
+                found[element_id] = payload
+        offset = payload_offset + size
+
+    for element_id in wanted:
+        if element_id not in found and element_id in seek_positions:
+            target_id, payload = read_ebml_element(f, seek_positions[element_id])
+            if target_id == element_id:
+                found[element_id] = payload
+    return segment_start, found
+
+
+def probe_matroska(f: BinaryIO, file_size: int) -> Optional[Dict[str, Any]]:
+    _, elements = find_mkv_segment_elements(f, file_size, (MKV_INFO, MKV_TRACKS))
+    if MKV_TRACKS not in elements:
+        return None
+
+    duration = 0.0
+    info = elements.get(MKV_INFO)
+    if info is not None:
+        timecode_scale = 1000000
+        raw_duration = 0.0
+        for element_id, start, stop in iter_ebml(info):
+            if element_id == MKV_TIMECODE_SCALE:
+                timecode_scale = _ebml_uint(info, start, stop)
+            elif element_id == MKV_DURATION:
+                raw_duration = _ebml_float(info, start, stop)
+        duration = raw_duration * timecode_scale / 1e9
+
+    tracks = elements[MKV_TRACKS]
+    for element_id, start, stop in iter_ebml(tracks):
+        if element_id != MKV_TRACK_ENTRY:
+            continue
+        track_type = 0
+        codec = ''
+        default_duration = 0
+        width = height = 0
+        for child_id, c_start, c_stop in iter_ebml(tracks, start, stop):
+            if child_id == MKV_TRACK_TYPE:
+                track_type = _ebml_uint(tracks, c_start, c_stop)
+            elif child_id == MKV_CODEC_ID:
+                codec = tracks[c_start:c_stop].decode('ascii', 'replace').rstrip('\x00')
+            elif child_id == MKV_DEFAULT_DURATION:
+                default_duration = _ebml_uint(tracks, c_start, c_stop)
+            elif child_id == MKV_VIDEO:
+                for video_id, v_start, v_stop in iter_ebml(tracks, c_start, c_stop):
+                    if video_id == MKV_PIXEL_WIDTH:
+                        width = _ebml_uint(tracks, v_start, v_stop)
+                    elif video_id == MKV_PIXEL_HEIGHT:
+                        height = _ebml_uint(tracks, v_start, v_stop)
+        if track_type != 1:
+            continue
+        fps = 1e9 / default_duration if default_duration else 0.0
+        # Matroska stores no frame count, estimate it like OpenCV does
+        frame_count = int(round(duration * fps)) if fps else 0
+        return _result(width, height, fps, duration, frame_count, codec)
+    return None
+
+
+# --- AVI ---
+def probe_avi(f: BinaryIO, file_size: int) -> Optional[Dict[str, Any]]:
+    f.seek(12)
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != b'LIST' or header[8:12] != b'hdrl':
+        return None
+    hdrl_size = struct.unpack_from('<I', header, 4)[0] - 4
+    if hdrl_size > MAX_HEADER_SIZE:
+        raise ContainerError("hdrl list too large")
+    hdrl = f.read(hdrl_size)
+
+    width = height = 0
+    us_per_frame = total_frames = 0
+    fps = 0.0
+    stream_frames = 0
+    codec = ''
+    odml_frames = 0
+
+    def iter_chunks(data: bytes, offset: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+        while offset + 8 <= end:
+            chunk_id, size = struct.unpack_from('<4sI', data, offset)
+            start = offset + 8
+            yield chunk_id, start, min(start + size, end)
+            offset = start + size + (size & 1)
+
+    for chunk_id, start, end in iter_chunks(hdrl, 0, len(hdrl)):
+        if chunk_id == b'avih' and end - start >= 40:
+            us_per_frame = struct.unpack_from('<I', hdrl, start)[0]
+            total_frames = struct.unpack_from('<I', hdrl, start + 16)[0]
+            width, height = struct.unpack_from('<II', hdrl, start + 32)
+        elif chunk_id == b'LIST' and hdrl[start:start + 4] == b'strl' and not codec:
+            for sub_id, s_start, s_end in iter_chunks(hdrl, start + 4, end):
+                if sub_id == b'strh' and s_end - s_start >= 36 and hdrl[s_start:s_start + 4] == b'vids':
+                    codec = hdrl[s_start + 4:s_start + 8].decode('latin-1').strip('\x00 ')
+                    scale, rate = struct.unpack_from('<II', hdrl, s_start + 20)
+                    stream_frames = struct.unpack_from('<I', hdrl, s_start + 32)[0]
+                    if scale:
+                        fps = rate / scale
+        elif chunk_id == b'LIST' and hdrl[start:start + 4] == b'odml':
+            for sub_id, s_start, s_end in iter_chunks(hdrl, start + 4, end):
+                if sub_id == b'dmlh' and s_end - s_start >= 4:
+                    odml_frames = struct.unpack_from('<I', hdrl, s_start)[0]
+
+    if not width or not height:
+        return None
+    if not fps and us_per_frame:
+        fps = 1e6 / us_per_frame
+    # avih only counts the first RIFF chunk of OpenDML files
+    frame_count = odml_frames or stream_frames or total_frames
+    duration = frame_count / fps if fps > 0 else 0.0
+    return _result(width, height, fps, duration, frame_count, codec)
+
+
+# --- Dispatch ---
+def detect_container(head: bytes) -> Optional[str]:
+    """Identifies the container from the first bytes of a file."""
+    if len(head) >= 4 and int.from_bytes(head[:4], 'big') == EBML_ID:
+        return 'matroska'
+    if len(head) >= 12 and head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+        return 'avi'
+    if len(head) >= 8 and head[4:8] in _MP4_TOP_LEVEL:
+        return 'mp4'
+    return None
+
+
+_PROBES = {
+    'mp4': probe_mp4,
+    'matroska': probe_matroska,
+    'avi': probe_avi,
+}
+
+
+def probe_container(video_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Reads video properties from the container headers.
+    Returns None if the format is unsupported or the headers are unusable.
+    """
+    try:
+        with open(video_path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            container = detect_container(f.read(12))
+            if container is None:
+                return None
+            info = _PROBES[container](f, file_size)
+    except (OSError, ContainerError, struct.error, ValueError) as e:
+        logger.debug(f"Header probe failed for {video_path}: {e}")
+        return None
+    if info is None or not info['width'] or not info['height']:
+        return None
+    return info
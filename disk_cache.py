@@ -0,0 +1,189 @@
+"""
+Size-bounded on-disk cache for generated files (HLS segments, ...).
+
+Entries are files below a root directory, addressed by relative keys such
+as "<video key>/seg_12.m4s". The index (size and recency per key) is kept
+in memory and rebuilt from the directory on startup, ordered by file
+modification time. When the total size exceeds the budget, least recently
+used entries are deleted.
+
+Several processes (gunicorn workers) may share a root. Each keeps its own
+index: a lookup picks up entries another process added and drops entries
+another process evicted, so every index follows the shared directory and
+all of them enforce the budget on about the same view. Files are produced
+in per-process working directories next to the root (never inside it, so
+no process indexes or deletes another's work in progress), and claim()
+lets one process produce an entry while the others wait for it to appear.
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import IO, Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: only single-process engines run there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_ROOT = os.environ.get(
+    'MEDIA_SERVER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'media-server'))
+
+
+class DiskCache:
+    """LRU cache of files under `root`, limited to `max_bytes`."""
+
+    def __init__(self, root: str, max_bytes: int) -> None:
+        self.root = os.path.abspath(root)
+        # Working directories and claims, shared by the processes using the root
+        self.work_root = self.root + '.work'
+        self.max_bytes = max_bytes
+        self._index: 'OrderedDict[str, int]' = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.root, exist_ok=True)
+        os.makedirs(self.work_root, exist_ok=True)
+        self._remove_stale_workdirs()
+        self._load_index()
+
+    def _load_index(self) -> None:
+        entries: List[tuple] = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                full_path = os.path.join(directory, name)
+                try:
+                    st = os.stat(full_path)
+                except OSError:
+                    continue
+                key = os.path.relpath(full_path, self.root).replace(os.sep, '/')
+                entries.append((st.st_mtime, key, st.st_size))
+        entries.sort()
+        with self._lock:
+            for _, key, size in entries:
+                self._index[key] = size
+                self._total += size
+            self._evict()
+        if entries:
+            logger.info(f"Disk cache {self.root}: {len(entries)} files, {self._total / 1e6:.1f} MB")
+
+    def path_for(self, key: str) -> str:
+        """Filesystem path of a key (whether or not it is cached)."""
+        return os.path.join(self.root, *key.split('/'))
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the path of a cached entry and marks it recently used, or None."""
+        path = self.path_for(key)
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            size = None
+        with self._lock:
+            if size is None:
+                # Not produced yet, or evicted by another process
+                self._total -= self._index.pop(key, 0)
+                self.misses += 1
+                return None
+            if key in self._index:
+                self._index.move_to_end(key)
+            else:
+                # Produced by another process sharing the root
+                self._index[key] = size
+                self._total += size
+                self._evict()
+            self.hits += 1
+            return path
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._index:
+                return True
+        return os.path.exists(self.path_for(key))
+
+    def put_file(self, key: str, source_path: str) -> str:
+        """Moves `source_path` into the cache under `key` and returns its new path."""
+        destination = self.path_for(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(source_path, destination)
+        size = os.path.getsize(destination)
+        with self._lock:
+            self._total += size - self._index.pop(key, 0)
+            self._index[key] = size
+            self._evict()
+        return destination
+
+    # --- Producing entries ---
+    def make_workdir(self, prefix: str) -> str:
+        """A new directory to produce entries in, removed by the caller (or on restart if it crashes)."""
+        process_dir = os.path.join(self.work_root, str(os.getpid()))
+        os.makedirs(process_dir, exist_ok=True)
+        return tempfile.mkdtemp(prefix=prefix, dir=process_dir)
+
+    def claim(self, name: str) -> Optional[IO]:
+        """
+        Claims producing `name` among the processes sharing the root.
+        Returns a handle to pass to release(), or None while another
+        process holds the claim.
+        """
+        handle = open(os.path.join(self.work_root, f'{name}.lock'), 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return None
+        return handle
+
+    def release(self, handle: IO) -> None:
+        try:
+            os.remove(handle.name)
+        except OSError:
+            pass
+        handle.close()
+
+    def _remove_stale_workdirs(self) -> None:
+        """Removes the working directories of processes that are gone."""
+        if os.name != 'posix':
+            return
+        for name in os.listdir(self.work_root):
+            if not name.isdigit() or int(name) == os.getpid():
+                continue
+            try:
+                os.kill(int(name), 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except OSError:
+                continue   # alive, owned by another user
+            shutil.rmtree(os.path.join(self.work_root, name), ignore_errors=True)
+
+    def _evict(self) -> None:
+        """Deletes least recently used entries until within budget. Caller holds the lock."""
+        while self._total > self.max_bytes and len(self._index) > 1:
+            key, size = self._index.popitem(last=False)
+            self._total -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path_for(key))
+            except OSError as e:
+                # e.g. still open on Windows; it will be found again on restart
+                logger.debug(f"Could not evict {key}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "root": self.root,
+                "files": len(self._index),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,243 @@
+"""
+Virtual "faststart" view of MP4 files.
+
+MP4 files written without faststart store the `moov` box (the sample
+tables the player needs before it can decode anything) after the media
+data. A browser then requests the start of the file, finds `mdat`, and
+issues a second range request to the tail for `moov` before playback can
+start, one extra round trip per video.
+
+Instead of rewriting such files, the server serves them in a virtual
+layout with `moov` moved in front of the first `mdat`:
+
+    on disk:  [ftyp][mdat ........][moov]
+    virtual:  [ftyp][moov'][mdat ........]
+
+The virtual file has the same size. Everything between the insertion point
+and the original `moov` shifts by the size of `moov`, so the chunk offsets
+in every track's `stco`/`co64` table that point into that region are
+patched (moov'). Only the patched `moov` is kept in memory; all other
+bytes are read from the file at their translated offsets (map_range).
+
+Files that are already faststart, fragmented (`moof`), carry several
+`moov` boxes, or whose `stco` offsets would overflow 32 bits get no layout
+and are served as they are.
+"""
+
+import os
+import struct
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+from containers import ContainerError, MAX_HEADER_SIZE, find_box, iter_boxes
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+ENABLED = os.environ.get('MEDIA_SERVER_FASTSTART', '1') != '0'
+# Bytes of patched moov boxes kept in memory
+DEFAULT_CACHE_BYTES = int(os.environ.get('MEDIA_SERVER_FASTSTART_CACHE_MB', '64')) * 1024 * 1024
+MAX_ENTRIES = 4096  # including files that need no layout
+MP4_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+
+
+class FaststartLayout:
+    """Maps the moov-first virtual layout of a file onto the file on disk."""
+
+    def __init__(self, size: int, insert_at: int, moov_offset: int, moov: bytes) -> None:
+        self.size = size
+        self.insert_at = insert_at
+        self.moov_offset = moov_offset
+        self.moov = moov
+        moov_end = moov_offset + len(moov)
+        # (virtual start, virtual end, file offset, or None for the patched moov)
+        segments = [
+            (0, insert_at, 0),
+            (insert_at, insert_at + len(moov), None),
+            (insert_at + len(moov), moov_end, insert_at),
+            (moov_end, size, moov_end),
+        ]
+        self.segments = [segment for segment in segments if segment[1] > segment[0]]
+
+    def map_range(self, start: int, length: int) -> List[Tuple[int, int, Optional[bytes]]]:
+        """
+        Splits a virtual byte range into pieces: (file offset, length, None)
+        for bytes read from the file, (0, length, data) for patched moov bytes.
+        """
+        end = start + length
+        pieces: List[Tuple[int, int, Optional[bytes]]] = []
+        for segment_start, segment_end, file_offset in self.segments:
+            low, high = max(start, segment_start), min(end, segment_end)
+            if low >= high:
+                continue
+            if file_offset is None:
+                pieces.append((0, high - low, self.moov[low - segment_start:high - segment_start]))
+            else:
+                pieces.append((file_offset + low - segment_start, high - low, None))
+        return pieces
+
+    def virtual_offset(self, file_offset: int) -> Optional[int]:
+        """Translates a file offset outside the original moov box to its offset in the layout."""
+        for segment_start, segment_end, segment_file_offset in self.segments:
+            if segment_file_offset is not None and 0 <= file_offset - segment_file_offset < segment_end - segment_start:
+                return segment_start + file_offset - segment_file_offset
+        return None
+
+
+def is_candidate(path: str) -> bool:
+    """Whether a file may be an MP4/MOV worth analysing."""
+    return path.lower().endswith(MP4_EXTENSIONS)
+
+
+def _top_level_boxes(f: BinaryIO, file_size: int) -> List[Tuple[bytes, int, int]]:
+    """Returns (type, offset, size) of every top-level box, seeking over payloads."""
+    boxes = []
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        size, box_type = struct.unpack_from('>I4s', header)
+        if size == 1:
+            if len(header) < 16:
+                raise ContainerError("Truncated largesize box header")
+            size = struct.unpack_from('>Q', header, 8)[0]
+        elif size == 0:
+            size = file_size - offset
+        if size < 8 or offset + size > file_size:
+            raise ContainerError(f"Invalid size for top-level box {box_type!r}")
+        boxes.append((box_type, offset, size))
+        offset += size
+    return boxes
+
+
+def _patch_chunk_offsets(moov: bytearray, low: int, high: int, delta: int) -> int:
+    """
+    Adds `delta` to every stco/co64 chunk offset in [low, high).
+    Returns the number of tables patched.
+    """
+    data = memoryview(moov)
+    patched = 0
+    try:
+        _, moov_start, moov_end = next(iter_boxes(data))
+        for trak_type, trak_start, trak_end in iter_boxes(data, moov_start, moov_end):
+            if trak_type != b'trak':
+                continue
+            stbl = find_box(data, [b'mdia', b'minf', b'stbl'], trak_start, trak_end)
+            if not stbl:
+                continue
+            for box_type, start, end in iter_boxes(data, stbl[0], stbl[1]):
+                if box_type == b'stco':
+                    code, limit = 'I', 0xFFFFFFFF
+                elif box_type == b'co64':
+                    code, limit = 'Q', 0xFFFFFFFFFFFFFFFF
+                else:
+                    continue
+                count = struct.unpack_from('>I', data, start + 4)[0]
+                table_format = f'>{count}{code}'
+                if start + 8 + struct.calcsize(table_format) > end:
+                    raise ContainerError(f"Truncated {box_type!r} box")
+                offsets = [offset + delta if low <= offset < high else offset
+                           for offset in struct.unpack_from(table_format, data, start + 8)]
+                if offsets and max(offsets) > limit:
+                    raise ContainerError("Patched chunk offset does not fit in stco")
+                struct.pack_into(table_format, data, start + 8, *offsets)
+                patched += 1
+    finally:
+        data.release()
+    return patched
+
+
+def analyze(path: str, st: Optional[os.stat_result] = None) -> Optional[FaststartLayout]:
+    """Returns the faststart layout of a file, or None if it needs none (or is not an MP4 we can patch)."""
+    try:
+        with open(path, 'rb') as f:
+            file_size = st.st_size if st is not None else os.fstat(f.fileno()).st_size
+            boxes = _top_level_boxes(f, file_size)
+            types = [box[0] for box in boxes]
+            if types.count(b'moov') != 1 or b'moof' in types or b'mdat' not in types:
+                return None
+            moov_index = types.index(b'moov')
+            mdat_index = types.index(b'mdat')
+            if mdat_index > moov_index:
+                return None  # already faststart
+            _, moov_offset, moov_size = boxes[moov_index]
+            if moov_size > MAX_HEADER_SIZE:
+                raise ContainerError(f"moov box too large ({moov_size} bytes)")
+            f.seek(moov_offset)
+            moov = bytearray(f.read(moov_size))
+            if len(moov) < moov_size:
+                raise ContainerError("Truncated moov box")
+        insert_at = boxes[mdat_index][1]
+        if not _patch_chunk_offsets(moov, insert_at, moov_offset, moov_size):
+            return None
+    except (OSError, ContainerError, struct.error) as e:
+        logger.debug(f"No faststart layout for {path}: {e}")
+        return None
+    logger.info(f"Serving {os.path.basename(path)} with moov relocated "
+                f"({moov_size} bytes from offset {moov_offset} to {insert_at})")
+    return FaststartLayout(file_size, insert_at, moov_offset, bytes(moov))
+
+
+class LayoutCache:
+    """
+    Faststart layouts per file path, validated against the file's size and
+    mtime and bounded by the bytes of patched moov boxes held.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[str, Tuple[Tuple[int, int], Optional[FaststartLayout]]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str, st: os.stat_result) -> Optional[FaststartLayout]:
+        """Returns the layout for a file (None if it is served as is), analysing it on first use."""
+        identity = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == identity:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # Analysed outside the lock; concurrent first requests may both do the work
+        layout = analyze(path, st)
+        with self._lock:
+            self._remove(path)
+            self._entries[path] = (identity, layout)
+            if layout is not None:
+                self._bytes += len(layout.moov)
+            while len(self._entries) > 1 and (self._bytes > self.max_bytes or len(self._entries) > MAX_ENTRIES):
+                self._remove(next(iter(self._entries)))
+        return layout
+
+    def _remove(self, path: str) -> None:
+        entry = self._entries.pop(path, None)
+        if entry is not None and entry[1] is not None:
+            self._bytes -= len(entry[1].moov)
+
+    def invalidate(self, paths: Iterable[str]) -> None:
+        with self._lock:
+            for path in paths:
+                self._remove(path)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": ENABLED,
+                "files": len(self._entries),
+                "relocated": sum(1 for _, layout in self._entries.values() if layout is not None),
+                "moov_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
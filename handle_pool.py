@@ -0,0 +1,201 @@
+"""
+Pool of open video files for range requests.
+
+Browsers scrub with many small, overlapping range requests; opening,
+seeking and closing the file for each one costs more than the read itself.
+HandlePool keeps a bounded number of read-only descriptors per path,
+reference counted so a handle is never closed while a response is still
+reading from it. Reads use os.pread (or an optional mmap), so concurrent
+responses share one descriptor without touching its file offset.
+
+Handles are checked against the file identity (size, mtime, inode) on
+every acquire and replaced when the file changed on disk; handles idle for
+longer than `idle_timeout` are closed on the next acquire.
+
+mmap is off by default (MEDIA_SERVER_HANDLE_POOL_MMAP=1 enables it): a file
+truncated while mapped raises SIGBUS in the reading process.
+"""
+
+import os
+import mmap
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+DEFAULT_MAX_HANDLES = int(os.environ.get('MEDIA_SERVER_HANDLE_POOL_SIZE', '64'))
+DEFAULT_IDLE_TIMEOUT = float(os.environ.get('MEDIA_SERVER_HANDLE_IDLE_TIMEOUT', '30'))
+DEFAULT_USE_MMAP = os.environ.get('MEDIA_SERVER_HANDLE_POOL_MMAP', '0') == '1'
+
+
+def _identity(st: os.stat_result) -> Tuple[int, int, int]:
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class PooledFile:
+    """An open, read-only file shared by concurrent readers."""
+    __slots__ = ('path', 'identity', 'fd', 'mmap', 'refs', 'last_used', 'retired')
+
+    def __init__(self, path: str, st: os.stat_result, use_mmap: bool) -> None:
+        self.path = path
+        self.identity = _identity(st)
+        self.fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        self.mmap: Optional[mmap.mmap] = None
+        if use_mmap and st.st_size > 0:
+            try:
+                self.mmap = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                logger.debug(f"mmap failed for {path}, using pread: {e}")
+        self.refs = 0
+        self.last_used = time.monotonic()
+        self.retired = False  # replaced or evicted; closed once the last reader releases it
+
+    @property
+    def size(self) -> int:
+        return self.identity[0]
+
+    def pread(self, length: int, offset: int) -> bytes:
+        """Reads up to `length` bytes at `offset` without moving any file position."""
+        if self.mmap is not None:
+            return self.mmap[offset:offset + length]
+        return os.pread(self.fd, length, offset)
+
+    def close(self) -> None:
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class HandlePool:
+    """Bounded, reference-counted pool of PooledFile objects keyed by path."""
+
+    def __init__(self, max_handles: int = DEFAULT_MAX_HANDLES, idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 use_mmap: bool = DEFAULT_USE_MMAP) -> None:
+        self.max_handles = max_handles
+        self.idle_timeout = idle_timeout
+        self.use_mmap = use_mmap
+        self._handles: 'OrderedDict[str, PooledFile]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.hits = 0
+        self.opens = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def acquire(self, path: str, st: Optional[os.stat_result] = None) -> PooledFile:
+        """
+        Returns an open handle for `path` with its reference count raised;
+        pass it to release() when done. `st` is the file's current stat
+        result if the caller already has one.
+        """
+        if st is None:
+            st = os.stat(path)
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep > self.idle_timeout / 2:
+                self._sweep(now)
+            handle = self._handles.get(path)
+            if handle is not None:
+                if handle.identity == _identity(st):
+                    self.hits += 1
+                    handle.refs += 1
+                    handle.last_used = now
+                    self._handles.move_to_end(path)
+                    return handle
+                self.invalidations += 1
+                self._retire(self._handles.pop(path))
+
+        new_handle = PooledFile(path, st, self.use_mmap)
+        with self._lock:
+            self.opens += 1
+            new_handle.refs = 1
+            current = self._handles.get(path)
+            if current is not None and current.identity == new_handle.identity:
+                # Another thread opened it meanwhile; use theirs
+                current.refs += 1
+                new_handle.refs = 0
+                new_handle.close()
+                return current
+            if current is not None:
+                self._retire(self._handles.pop(path))
+            self._handles[path] = new_handle
+            self._enforce_limit()
+            return new_handle
+
+    def release(self, handle: PooledFile) -> None:
+        with self._lock:
+            handle.refs -= 1
+            handle.last_used = time.monotonic()
+            if handle.refs <= 0 and handle.retired:
+                handle.close()
+
+    @contextmanager
+    def open(self, path: str, st: Optional[os.stat_result] = None) -> Iterator[PooledFile]:
+        handle = self.acquire(path, st)
+        try:
+            yield handle
+        finally:
+            self.release(handle)
+
+    def invalidate(self, paths: Iterable[str]) -> None:
+        """Drops the handles of files known to have changed or been removed."""
+        with self._lock:
+            for path in paths:
+                handle = self._handles.pop(path, None)
+                if handle is not None:
+                    self.invalidations += 1
+                    self._retire(handle)
+
+    # --- Internal, called with the lock held ---
+    def _retire(self, handle: PooledFile) -> None:
+        handle.retired = True
+        if handle.refs <= 0:
+            handle.close()
+
+    def _enforce_limit(self) -> None:
+        if len(self._handles) <= self.max_handles:
+            return
+        # Least recently used first; handles in use stay (the pool may exceed
+        # its limit briefly under load rather than block readers)
+        for path in list(self._handles):
+            if len(self._handles) <= self.max_handles:
+                break
+            if self._handles[path].refs == 0:
+                self.evictions += 1
+                self._retire(self._handles.pop(path))
+
+    def _sweep(self, now: float) -> None:
+        self._last_sweep = now
+        for path in list(self._handles):
+            handle = self._handles[path]
+            if handle.refs == 0 and now - handle.last_used > self.idle_timeout:
+                self.evictions += 1
+                self._retire(self._handles.pop(path))
+
+    # --- Maintenance ---
+    def close_all(self) -> None:
+        with self._lock:
+            for handle in self._handles.values():
+                self._retire(handle)
+            self._handles.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open": len(self._handles),
+                "in_use": sum(1 for handle in self._handles.values() if handle.refs > 0),
+                "hits": self.hits,
+                "opens": self.opens,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "max_handles": self.max_handles,
+                "mmap": self.use_mmap,
+            }
@@ -0,0 +1,436 @@
+"""
+HLS (fMP4) remuxing and transcoding pipeline.
+
+Browsers cannot play MKV/AVI/FLV/WMV containers and seek poorly in MP4s
+without faststart. This module remuxes videos into HLS with fragmented MP4
+segments using ffmpeg with `-c copy` (no re-encode, so it is cheap, but
+the codecs must already be browser compatible). The same pipeline
+transcodes the lower resolution renditions of the bitrate ladder
+(ladder.py); each rendition has its own segments.
+
+- The playlist is computed from the probed duration and the keyframe
+  index (see SegmentPlan), so it can be returned before any ffmpeg work.
+- Segments are produced lazily around the playhead. A request for a
+  missing segment starts an ffmpeg job producing JOB_SEGMENTS segments,
+  unless a running job will reach the segment soon. Concurrent requests
+  for a segment wait for the same job. A job that fails marks its
+  rendition of the video as failed; for FAILURE_RETRY_SECONDS later
+  requests get HLSUnavailable at once instead of restarting ffmpeg until
+  they time out.
+  Playing close to the end of the produced segments starts the next job
+  ahead of time. At most `max_jobs` run at once, of which at most
+  `max_transcodes` transcode (a CPU-bound process each); beyond that the
+  job nobody has waited on for longest is stopped.
+- Finished segments are moved into a size-bounded DiskCache keyed by the
+  video's identity (path, size, mtime) and the rendition, so changed files
+  never serve stale segments. Processes sharing the cache (gunicorn
+  workers) claim each job, so only one of them runs it; the others wait
+  for its segments to appear in the cache.
+
+Transcodes seek exactly and force keyframes at the nominal SEGMENT_SECONDS
+boundaries, so a job may start at any segment. Stream copies can only cut
+at keyframes, and where ffmpeg cuts depends on where the job started: the
+input seek lands on the keyframe at or before the start time, and the
+hls muxer cuts at the first keyframe each SEGMENT_SECONDS after that. So
+source jobs always start at fixed blocks of JOB_SEGMENTS segments, and
+with a keyframe index the playlist lists the segments exactly as ffmpeg
+will cut them; every job of a block produces the same segments.
+"""
+
+import os
+import re
+import math
+import time
+import bisect
+import shutil
+import hashlib
+import logging
+import threading
+import subprocess
+from typing import IO, Any, Dict, List, Optional, Sequence, Tuple
+
+import ladder
+from disk_cache import DiskCache, DEFAULT_CACHE_ROOT
+from ladder import Rendition, SOURCE
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+FFMPEG_BINARY = os.environ.get('MEDIA_SERVER_FFMPEG', 'ffmpeg')
+SEGMENT_SECONDS = 6
+JOB_SEGMENTS = 10           # segments produced per ffmpeg job (one minute)
+PREFETCH_SEGMENTS = 3       # start the next job when playback is this close to the end of a job
+WAIT_AHEAD_SEGMENTS = 3     # wait for a running job if it is at most this many segments behind
+SEGMENT_TIMEOUT = 30.0      # seconds to wait for a segment before giving up
+FAILURE_RETRY_SECONDS = 300.0  # a rendition whose job failed is tried again after this long
+DEFAULT_MAX_JOBS = int(os.environ.get('MEDIA_SERVER_HLS_JOBS', '2'))
+DEFAULT_MAX_TRANSCODES = int(os.environ.get('MEDIA_SERVER_TRANSCODE_JOBS', '1'))
+DEFAULT_CACHE_BYTES = int(os.environ.get('MEDIA_SERVER_HLS_CACHE_MB', '2048')) * 1024 * 1024
+DEFAULT_HLS_CACHE_DIR = os.path.join(DEFAULT_CACHE_ROOT, 'hls')
+
+INIT_SEGMENT = 'init.mp4'
+FFMPEG_LOG = 'ffmpeg.log'   # stderr of a job, in its working directory
+_SEGMENT_RE = re.compile(r'^seg_(\d+)\.m4s$')
+
+
+class HLSUnavailable(Exception):
+    """ffmpeg is missing or a segment could not be produced in time."""
+
+
+def segment_count(duration: float) -> int:
+    return max(1, int(-(-duration // SEGMENT_SECONDS)))  # ceil
+
+
+def video_key(path: str, st: os.stat_result, rendition: Rendition = SOURCE) -> str:
+    """Cache directory name for a rendition of a video in its current version."""
+    identity = f"{path}\0{st.st_size}\0{st.st_mtime_ns}".encode('utf-8', 'surrogateescape')
+    key = hashlib.blake2b(identity, digest_size=10).hexdigest()
+    return key if rendition.is_source else f"{key}-{rendition.name}"
+
+
+class SegmentPlan:
+    """
+    Segment start times of a rendition of a video. `blocks` lists the first
+    segment of each fixed job block (stream copies), None when a job may
+    start at any segment.
+    """
+
+    def __init__(self, starts: List[float], duration: float, blocks: Optional[List[int]] = None) -> None:
+        self.starts = starts
+        self.duration = duration
+        self.blocks = blocks
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def end(self, index: int) -> float:
+        return self.starts[index + 1] if index + 1 < len(self.starts) else self.duration
+
+    def length(self, index: int) -> float:
+        return max(self.end(index) - self.starts[index], 0.001)
+
+    def job_span(self, index: int) -> Tuple[int, int]:
+        """First and last segment of the job that produces segment `index`."""
+        if self.blocks is None:
+            return index, min(index + JOB_SEGMENTS, len(self.starts)) - 1
+        block = bisect.bisect_right(self.blocks, index) - 1
+        following = self.blocks[block + 1] if block + 1 < len(self.blocks) else len(self.starts)
+        return self.blocks[block], following - 1
+
+
+def plan_segments(duration: float, rendition: Rendition = SOURCE,
+                  keyframe_times: Optional[Sequence[float]] = None) -> SegmentPlan:
+    """
+    Plans the segments of a rendition. Transcodes and stream copies without
+    a keyframe index get nominal SEGMENT_SECONDS segments; stream copies
+    with one get the cuts ffmpeg makes in each job block.
+    """
+    nominal = [index * SEGMENT_SECONDS for index in range(segment_count(duration))]
+    if not rendition.is_source:
+        return SegmentPlan(nominal, duration)
+    if not keyframe_times:
+        return SegmentPlan(nominal, duration, list(range(0, len(nominal), JOB_SEGMENTS)))
+
+    block_seconds = JOB_SEGMENTS * SEGMENT_SECONDS
+    block_starts = sorted({0.0} | {
+        keyframe_times[max(0, bisect.bisect_right(keyframe_times, block * block_seconds) - 1)]
+        for block in range(1, math.ceil(duration / block_seconds))})
+    starts: List[float] = []
+    blocks: List[int] = []
+    for number, block_start in enumerate(block_starts):
+        block_end = block_starts[number + 1] if number + 1 < len(block_starts) else duration
+        blocks.append(len(starts))
+        starts.append(block_start)
+        # The hls muxer cuts at the first keyframe at least SEGMENT_SECONDS
+        # per segment written so far after the block's first packet
+        first = bisect.bisect_right(keyframe_times, block_start)
+        last = bisect.bisect_left(keyframe_times, block_end)
+        for keyframe in keyframe_times[first:last]:
+            if keyframe - block_start >= (len(starts) - blocks[-1]) * SEGMENT_SECONDS:
+                starts.append(keyframe)
+    return SegmentPlan(starts, duration, blocks)
+
+
+def build_playlist(plan: SegmentPlan, rendition: Rendition = SOURCE) -> str:
+    """Returns a VOD media playlist for a rendition planned as `plan`."""
+    query = '' if rendition.is_source else f'?rendition={rendition.name}'
+    lengths = [plan.length(index) for index in range(len(plan))]
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:7',
+        f'#EXT-X-TARGETDURATION:{max(SEGMENT_SECONDS, math.ceil(max(lengths)))}',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+        '#EXT-X-INDEPENDENT-SEGMENTS',
+        f'#EXT-X-MAP:URI="{INIT_SEGMENT}{query}"',
+    ]
+    for index, length in enumerate(lengths):
+        lines.append(f'#EXTINF:{length:.3f},')
+        lines.append(f'seg_{index}.m4s{query}')
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+class _Job:
+    """One ffmpeg process writing segments [first, last] of a video rendition."""
+
+    def __init__(self, key: str, rendition: Rendition, first: int, last: int, workdir: str,
+                 process: subprocess.Popen, claim: IO) -> None:
+        self.key = key
+        self.rendition = rendition
+        self.first = first
+        self.last = last
+        self.workdir = workdir
+        self.process = process
+        self.claim = claim
+        self.produced = first - 1   # highest segment moved into the cache so far
+        self.stopped = False
+        self.last_wanted = time.monotonic()
+
+
+class HLSPipeline:
+    """Produces and caches HLS segments on demand."""
+
+    def __init__(self, cache_dir: str = DEFAULT_HLS_CACHE_DIR, max_cache_bytes: int = DEFAULT_CACHE_BYTES,
+                 max_jobs: int = DEFAULT_MAX_JOBS, ffmpeg: str = FFMPEG_BINARY,
+                 max_transcodes: int = DEFAULT_MAX_TRANSCODES) -> None:
+        self.cache = DiskCache(cache_dir, max_cache_bytes)
+        self.ffmpeg = shutil.which(ffmpeg)
+        self.max_jobs = max_jobs
+        self.max_transcodes = max(1, min(max_transcodes, max_jobs))
+        self._jobs: List[_Job] = []
+        self._failed: Dict[str, Tuple[str, float]] = {}   # video key (one per rendition) -> (ffmpeg error, when)
+        self._cond = threading.Condition()
+        self.jobs_started = 0
+        self.transcodes_started = 0
+        if self.ffmpeg is None:
+            logger.warning(f"'{ffmpeg}' not found, HLS remuxing is disabled")
+
+    @property
+    def available(self) -> bool:
+        return self.ffmpeg is not None
+
+    def failed(self, path: str, st: os.stat_result, rendition: Rendition) -> bool:
+        """Whether a job for this rendition of the video has failed (e.g. an ffmpeg without libx264)."""
+        with self._cond:
+            return self._failure(video_key(path, st, rendition)) is not None
+
+    def _failure(self, key: str) -> Optional[str]:
+        """The error of a failed job for `key` if it is recent enough to not retry. Caller holds the condition."""
+        failure = self._failed.get(key)
+        if failure is None:
+            return None
+        if time.monotonic() - failure[1] >= FAILURE_RETRY_SECONDS:
+            del self._failed[key]
+            return None
+        return failure[0]
+
+    # --- Segments ---
+    def get_segment(self, path: str, st: os.stat_result, plan: SegmentPlan, name: str,
+                    rendition: Rendition = SOURCE, timeout: float = SEGMENT_TIMEOUT) -> str:
+        """
+        Returns the cached file for segment `name` (INIT_SEGMENT or
+        "seg_<n>.m4s") of a rendition planned as `plan`, producing it first
+        if needed. Raises HLSUnavailable or ValueError (unknown segment).
+        """
+        if name == INIT_SEGMENT:
+            index = 0
+        else:
+            match = _SEGMENT_RE.match(name)
+            if not match or int(match.group(1)) >= len(plan):
+                raise ValueError(f"No segment {name}")
+            index = int(match.group(1))
+
+        key = video_key(path, st, rendition)
+        cache_key = f"{key}/{name}"
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self._prefetch(key, rendition, path, plan, index)
+            return cached
+        if not self.available:
+            raise HLSUnavailable("ffmpeg is not installed")
+
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if cache_key in self.cache:
+                    break
+                error = self._failure(key)
+                if error is not None:
+                    raise HLSUnavailable(error)
+                job = self._covering_job(key, plan, index, name == INIT_SEGMENT)
+                if job is None:
+                    self._start_job(key, rendition, path, plan, index)
+                else:
+                    job.last_wanted = time.monotonic()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise HLSUnavailable(f"Timed out waiting for {name}")
+                self._cond.wait(min(remaining, 1.0))
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            raise HLSUnavailable(f"{name} was evicted before it could be served")
+        return cached
+
+    def _prefetch(self, key: str, rendition: Rendition, path: str, plan: SegmentPlan, index: int) -> None:
+        """Starts the next job when playback gets close to the end of the produced segments."""
+        if not self.available:
+            return
+        with self._cond:
+            if self._failure(key) is not None:
+                return
+            for ahead in range(index + 1, min(index + 1 + PREFETCH_SEGMENTS, len(plan))):
+                if f"{key}/seg_{ahead}.m4s" not in self.cache:
+                    job = self._covering_job(key, plan, ahead, False)
+                    if job is None:
+                        self._start_job(key, rendition, path, plan, ahead)
+                    else:
+                        job.last_wanted = time.monotonic()
+                    return
+
+    # --- Jobs (called with the condition held) ---
+    def _covering_job(self, key: str, plan: SegmentPlan, index: int, any_job: bool) -> Optional[_Job]:
+        """A running job that will produce segment `index` soon (any job of the video for the init segment)."""
+        for job in self._jobs:
+            if job.key != key or job.stopped or not (any_job or job.first <= index <= job.last):
+                continue
+            # A block job is the only one that can produce its segments
+            if any_job or plan.blocks is not None or index - job.produced <= WAIT_AHEAD_SEGMENTS:
+                return job
+        return None
+
+    def _start_job(self, key: str, rendition: Rendition, path: str, plan: SegmentPlan, index: int) -> None:
+        first, last = plan.job_span(index)
+        claim = self.cache.claim(f'{key}-{first}')
+        if claim is None:
+            # Another process sharing the cache runs this job; its segments
+            # show up in the cache
+            return
+        transcodes = [job for job in self._jobs if not job.rendition.is_source]
+        if not rendition.is_source and len(transcodes) >= self.max_transcodes:
+            competing = transcodes
+        elif len(self._jobs) >= self.max_jobs:
+            competing = self._jobs
+        else:
+            competing = []
+        if competing:
+            # Make room by stopping the job nobody has waited on for longest
+            idle = min(competing, key=lambda job: job.last_wanted)
+            self._jobs.remove(idle)
+            self._stop_job(idle)
+
+        if plan.blocks is None:
+            # Skip segments already cached at the start of the window
+            while first < last and f"{key}/seg_{first}.m4s" in self.cache:
+                first += 1
+        try:
+            workdir = self.cache.make_workdir(prefix=f'{key}-')
+        except OSError as e:
+            self.cache.release(claim)
+            raise HLSUnavailable(f"Could not create a working directory: {e}")
+        start_time = plan.starts[first]
+        # Input positions, nudged by a millisecond so rounding cannot move
+        # the seek onto the previous keyframe or read the next job's first one
+        seek_time = start_time + 0.001 if plan.blocks is not None and start_time > 0 else start_time
+        command = [
+            self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin',
+            '-ss', f'{seek_time:.3f}', '-to', f'{plan.end(last) - 0.001:.3f}', '-i', path, '-copyts',
+            '-map', '0:v:0', '-map', '0:a:0?',
+            *ladder.encoder_args(rendition, start_time, SEGMENT_SECONDS),
+            '-f', 'hls', '-hls_time', str(SEGMENT_SECONDS), '-hls_list_size', '0',
+            '-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', INIT_SEGMENT,
+            '-hls_flags', 'independent_segments+temp_file',
+            '-start_number', str(first),
+            '-hls_segment_filename', os.path.join(workdir, 'seg_%d.m4s'),
+            os.path.join(workdir, 'job.m3u8'),
+        ]
+        try:
+            # stderr goes to a file: a pipe nobody reads until the process
+            # exits would stall ffmpeg once its buffer fills up
+            with open(os.path.join(workdir, FFMPEG_LOG), 'wb') as log:
+                process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                           stderr=log)
+        except OSError as e:
+            shutil.rmtree(workdir, ignore_errors=True)
+            self.cache.release(claim)
+            raise HLSUnavailable(f"Could not start ffmpeg: {e}")
+        job = _Job(key, rendition, first, last, workdir, process, claim)
+        self._jobs.append(job)
+        self.jobs_started += 1
+        if not rendition.is_source:
+            self.transcodes_started += 1
+        logger.info(f"HLS job for {os.path.basename(path)} ({rendition.name}): segments {first}-{last}")
+        threading.Thread(target=self._collect, args=(job,), name='hls-job', daemon=True).start()
+
+    def _stop_job(self, job: _Job) -> None:
+        job.stopped = True
+        if job.process.poll() is None:
+            job.process.terminate()
+
+    # --- Job output ---
+    def _collect_finished(self, job: _Job) -> None:
+        """Moves completed segments of a job into the cache."""
+        try:
+            names = os.listdir(job.workdir)
+        except OSError:
+            return
+        moved = False
+        for name in names:
+            if name == INIT_SEGMENT:
+                if f"{job.key}/{INIT_SEGMENT}" not in self.cache:
+                    self.cache.put_file(f"{job.key}/{INIT_SEGMENT}", os.path.join(job.workdir, name))
+                    moved = True
+                continue
+            match = _SEGMENT_RE.match(name)
+            if match:
+                self.cache.put_file(f"{job.key}/{name}", os.path.join(job.workdir, name))
+                job.produced = max(job.produced, int(match.group(1)))
+                moved = True
+        if moved:
+            with self._cond:
+                self._cond.notify_all()
+
+    def _collect(self, job: _Job) -> None:
+        while job.process.poll() is None:
+            self._collect_finished(job)
+            time.sleep(0.1)
+        # Segments finished before a stop are complete files too (ffmpeg
+        # writes to .tmp names and renames when a segment is done)
+        self._collect_finished(job)
+        try:
+            with open(os.path.join(job.workdir, FFMPEG_LOG), 'rb') as log:
+                log.seek(max(0, os.fstat(log.fileno()).st_size - 4096))
+                stderr = log.read().decode('utf-8', 'replace').strip()
+        except OSError:
+            stderr = ''
+        failed = job.process.returncode not in (0, None) and not job.stopped
+        if failed:
+            logger.error(f"ffmpeg failed (exit {job.process.returncode}): {stderr[-500:]}")
+        shutil.rmtree(job.workdir, ignore_errors=True)
+        self.cache.release(job.claim)
+        with self._cond:
+            if failed:
+                # Waiting requests fail now; restarting would fail the same way
+                self._failed[job.key] = (f"ffmpeg failed (exit {job.process.returncode}): {stderr[-200:]}",
+                                         time.monotonic())
+            job.stopped = True
+            if job in self._jobs:
+                self._jobs.remove(job)
+            self._cond.notify_all()
+
+    # --- Maintenance ---
+    def shutdown(self) -> None:
+        with self._cond:
+            for job in self._jobs:
+                self._stop_job(job)
+            self._jobs.clear()
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            running: List[Dict[str, Any]] = [
+                {"rendition": job.rendition.name, "first": job.first, "last": job.last, "produced": job.produced}
+                for job in self._jobs]
+        return {"available": self.available, "jobs_started": self.jobs_started,
+                "transcodes_started": self.transcodes_started, "max_transcodes": self.max_transcodes,
+                "running_jobs": running, "failed": len(self._failed), "cache": self.cache.stats()}
@@ -0,0 +1,319 @@
+"""
+Keyframe index: presentation time -> byte offset of every sync sample.
+
+A browser translates a seek into a guessed byte range, which usually lands
+mid-GOP and costs follow-up range requests before playback resumes. With
+the index a client asks for a time instead (/stream/<video>?t=<seconds>)
+and the response starts at the nearest preceding keyframe.
+
+- MP4/MOV: the video track's sample tables. `stss` lists the sync samples
+  (every sample is one without it); `stts`, `ctts` and the first `elst`
+  edit give their presentation times; `stsc`, `stsz` and `stco`/`co64`
+  their byte offsets.
+- Matroska/WebM: the `Cues` of the video track. Cue points address the
+  cluster containing the keyframe, so offsets are cluster starts.
+
+Indexes are two parallel arrays (float64 times, uint64 offsets), built
+once per file and persisted as a blob next to the probed metadata (see
+metadata_store.py). Offsets are file offsets; callers translate them when
+serving a virtual faststart layout.
+"""
+
+import os
+import sys
+import struct
+import bisect
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+import containers
+from containers import ContainerError, find_box, iter_boxes, iter_ebml, _ebml_uint
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+MAX_ENTRIES = 1024  # indexes kept in memory
+
+MKV_CUE_POINT = 0xBB
+MKV_CUE_TIME = 0xB3
+MKV_CUE_TRACK_POSITIONS = 0xB7
+MKV_CUE_TRACK = 0xF7
+MKV_CUE_CLUSTER_POSITION = 0xF1
+MKV_TRACK_NUMBER = 0xD7
+
+
+class KeyframeIndex:
+    """Keyframe times (seconds) and byte offsets, sorted by time."""
+    __slots__ = ('times', 'offsets')
+
+    def __init__(self, times: 'array[float]', offsets: 'array[int]') -> None:
+        self.times = times
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def find(self, seconds: float) -> Tuple[float, int]:
+        """Returns (time, offset) of the last keyframe at or before `seconds` (the first one before it)."""
+        i = max(0, bisect.bisect_right(self.times, seconds) - 1)
+        return self.times[i], self.offsets[i]
+
+    def to_bytes(self) -> bytes:
+        return struct.pack('<I', len(self.times)) + self.times.tobytes() + self.offsets.tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> 'KeyframeIndex':
+        count = struct.unpack_from('<I', blob)[0]
+        times, offsets = array('d'), array('Q')
+        times.frombytes(blob[4:4 + count * 8])
+        offsets.frombytes(blob[4 + count * 8:4 + count * 16])
+        return cls(times, offsets)
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[float, int]]) -> Optional['KeyframeIndex']:
+        ordered = sorted(set(pairs))
+        if not ordered:
+            return None
+        return cls(array('d', (t for t, _ in ordered)), array('Q', (o for _, o in ordered)))
+
+
+# --- MP4 / MOV ---
+def _table(data: memoryview, box: Optional[Tuple[int, int]], code: str, fields: int,
+           header: int = 8) -> 'array[int]':
+    """Reads the big-endian entry table of a full box: `fields` values of type `code` per entry."""
+    if box is None:
+        return array(code)
+    count = struct.unpack_from('>I', data, box[0] + header - 4)[0] * fields
+    start = box[0] + header
+    values = array(code)
+    if start + count * values.itemsize > box[1]:
+        raise ContainerError("Truncated sample table")
+    values.frombytes(data[start:start + count * values.itemsize])
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+def _runs(table: 'array[int]') -> Tuple[List[int], List[int]]:
+    """For (count, value) pairs: the first sample of every run and the run values."""
+    firsts, values = [], []
+    sample = 0
+    for i in range(0, len(table), 2):
+        firsts.append(sample)
+        values.append(table[i + 1])
+        sample += table[i]
+    return firsts, values
+
+
+def mp4_keyframes(moov: bytes) -> Optional[KeyframeIndex]:
+    """Builds the keyframe index of the first video track in a complete `moov` box."""
+    data = memoryview(moov)
+    _, moov_start, moov_end = next(iter_boxes(data))
+    for box_type, trak_start, trak_end in iter_boxes(data, moov_start, moov_end):
+        if box_type != b'trak':
+            continue
+        hdlr = find_box(data, [b'mdia', b'hdlr'], trak_start, trak_end)
+        if not hdlr or bytes(data[hdlr[0] + 8:hdlr[0] + 12]) != b'vide':
+            continue
+        mdhd = find_box(data, [b'mdia', b'mdhd'], trak_start, trak_end)
+        stbl = find_box(data, [b'mdia', b'minf', b'stbl'], trak_start, trak_end)
+        if not mdhd or not stbl:
+            return None
+        timescale = struct.unpack_from('>I', data, mdhd[0] + (20 if data[mdhd[0]] == 1 else 12))[0]
+        if not timescale:
+            return None
+        boxes = {box: find_box(data, [box], stbl[0], stbl[1])
+                 for box in (b'stss', b'stts', b'ctts', b'stsc', b'stsz', b'stco', b'co64')}
+
+        # Presentation times: decode time (stts) + composition offset (ctts) - first edit's media time
+        stts_firsts, stts_deltas = _runs(_table(data, boxes[b'stts'], 'I', 2))
+        stts_starts = [0]
+        for i in range(1, len(stts_firsts)):
+            stts_starts.append(stts_starts[-1] + (stts_firsts[i] - stts_firsts[i - 1]) * stts_deltas[i - 1])
+        ctts_firsts, ctts_offsets = _runs(_table(data, boxes[b'ctts'], 'I', 2))
+        # Negative offsets (version 1) are stored as two's complement
+        ctts_offsets = [offset - (1 << 32) if offset >= 1 << 31 else offset for offset in ctts_offsets]
+        media_time = 0
+        elst = find_box(data, [b'edts', b'elst'], trak_start, trak_end)
+        if elst:
+            version = data[elst[0]]
+            entry_format, entry_size = ('>Qq', 20) if version == 1 else ('>Ii', 12)
+            for i in range(struct.unpack_from('>I', data, elst[0] + 4)[0]):
+                edit_media_time = struct.unpack_from(entry_format, data, elst[0] + 8 + i * entry_size)[1]
+                if edit_media_time >= 0:  # -1 marks an empty edit
+                    media_time = edit_media_time
+                    break
+
+        # Byte offsets: chunk offset (stco/co64) + sizes of the earlier samples in the chunk (stsc, stsz)
+        chunk_offsets = _table(data, boxes[b'co64'], 'Q', 1) if boxes[b'co64'] else _table(data, boxes[b'stco'], 'I', 1)
+        stsc = _table(data, boxes[b'stsc'], 'I', 3)
+        if not boxes[b'stsz'] or not chunk_offsets or not stsc:
+            return None
+        uniform_size, sample_count = struct.unpack_from('>II', data, boxes[b'stsz'][0] + 4)
+        sizes = _table(data, boxes[b'stsz'], 'I', 1, header=12) if not uniform_size else None
+        stsc_first_samples, stsc_first_chunks, stsc_per_chunk = [], [], []
+        sample = 0
+        for i in range(0, len(stsc), 3):
+            first_chunk, per_chunk = stsc[i] - 1, stsc[i + 1]
+            if stsc_first_chunks:
+                sample += (first_chunk - stsc_first_chunks[-1]) * stsc_per_chunk[-1]
+            stsc_first_samples.append(sample)
+            stsc_first_chunks.append(first_chunk)
+            stsc_per_chunk.append(per_chunk)
+
+        sync_samples = ([n - 1 for n in _table(data, boxes[b'stss'], 'I', 1)] if boxes[b'stss']
+                        else range(sample_count))
+        pairs = []
+        for n in sync_samples:
+            if not 0 <= n < sample_count:
+                continue
+            run = bisect.bisect_right(stts_firsts, n) - 1
+            dts = stts_starts[run] + (n - stts_firsts[run]) * stts_deltas[run] if run >= 0 else 0
+            run = bisect.bisect_right(ctts_firsts, n) - 1
+            pts = dts + (ctts_offsets[run] if run >= 0 else 0) - media_time
+
+            run = bisect.bisect_right(stsc_first_samples, n) - 1
+            if run < 0 or not stsc_per_chunk[run]:
+                continue
+            chunks_in, within = divmod(n - stsc_first_samples[run], stsc_per_chunk[run])
+            chunk = stsc_first_chunks[run] + chunks_in
+            if chunk >= len(chunk_offsets):
+                continue
+            before = uniform_size * within if sizes is None else sum(sizes[n - within:n])
+            pairs.append((max(0.0, pts / timescale), chunk_offsets[chunk] + before))
+        return KeyframeIndex.from_pairs(pairs)
+    return None
+
+
+def _mp4_index(f: BinaryIO, file_size: int) -> Optional[KeyframeIndex]:
+    found = containers.read_top_level_box(f, b'moov', file_size)
+    return mp4_keyframes(found[1]) if found is not None else None
+
+
+# --- Matroska / WebM ---
+def _matroska_index(f: BinaryIO, file_size: int) -> Optional[KeyframeIndex]:
+    segment_start, elements = containers.find_mkv_segment_elements(
+        f, file_size, (containers.MKV_INFO, containers.MKV_TRACKS, containers.MKV_CUES))
+    cues = elements.get(containers.MKV_CUES)
+    if cues is None:
+        return None
+    timecode_scale = 1000000
+    for element_id, start, stop in iter_ebml(elements.get(containers.MKV_INFO, b'')):
+        if element_id == containers.MKV_TIMECODE_SCALE:
+            timecode_scale = _ebml_uint(elements[containers.MKV_INFO], start, stop)
+    video_track = None
+    tracks = elements.get(containers.MKV_TRACKS, b'')
+    for element_id, start, stop in iter_ebml(tracks):
+        if element_id != containers.MKV_TRACK_ENTRY:
+            continue
+        number = track_type = 0
+        for child_id, c_start, c_stop in iter_ebml(tracks, start, stop):
+            if child_id == MKV_TRACK_NUMBER:
+                number = _ebml_uint(tracks, c_start, c_stop)
+            elif child_id == containers.MKV_TRACK_TYPE:
+                track_type = _ebml_uint(tracks, c_start, c_stop)
+        if track_type == 1:
+            video_track = number
+            break
+
+    pairs = []
+    for element_id, start, stop in iter_ebml(cues):
+        if element_id != MKV_CUE_POINT:
+            continue
+        cue_time = None
+        positions = []
+        for child_id, c_start, c_stop in iter_ebml(cues, start, stop):
+            if child_id == MKV_CUE_TIME:
+                cue_time = _ebml_uint(cues, c_start, c_stop)
+            elif child_id == MKV_CUE_TRACK_POSITIONS:
+                track = cluster = None
+                for pos_id, p_start, p_stop in iter_ebml(cues, c_start, c_stop):
+                    if pos_id == MKV_CUE_TRACK:
+                        track = _ebml_uint(cues, p_start, p_stop)
+                    elif pos_id == MKV_CUE_CLUSTER_POSITION:
+                        cluster = _ebml_uint(cues, p_start, p_stop)
+                positions.append((track, cluster))
+        for track, cluster in positions:
+            if cue_time is not None and cluster is not None and (video_track is None or track == video_track):
+                pairs.append((cue_time * timecode_scale / 1e9, segment_start + cluster))
+    return KeyframeIndex.from_pairs(pairs)
+
+
+_BUILDERS = {
+    'mp4': _mp4_index,
+    'matroska': _matroska_index,
+}
+
+
+def build_index(path: str) -> Optional[KeyframeIndex]:
+    """Reads the keyframe index from the container, or None if it has none we can use."""
+    try:
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            builder = _BUILDERS.get(containers.detect_container(f.read(12)))
+            if builder is None:
+                return None
+            return builder(f, file_size)
+    except (OSError, ContainerError, struct.error, ValueError, StopIteration) as e:
+        logger.debug(f"No keyframe index for {path}: {e}")
+        return None
+
+
+class KeyframeCache:
+    """
+    Keyframe indexes per file path, validated against the file's size and
+    mtime, backed by the persistent metadata store when one is given.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[Tuple[int, int], Optional[KeyframeIndex]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loaded = 0
+        self.built = 0
+
+    def get(self, path: str, st: os.stat_result, store: Any = None) -> Optional[KeyframeIndex]:
+        """Returns the index of a file (None if it has none), loading or building it on first use."""
+        identity = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == identity:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+        index = None
+        blob = store.get_keyframes(path, st) if store is not None else None
+        if blob is not None:
+            index = KeyframeIndex.from_bytes(blob) if blob else None
+            with self._lock:
+                self.loaded += 1
+        else:
+            # Built outside the lock; concurrent first requests may both do the work
+            index = build_index(path)
+            with self._lock:
+                self.built += 1
+            if store is not None:
+                store.put_keyframes(path, index.to_bytes() if index is not None else b'', st)
+        with self._lock:
+            self._entries[path] = (identity, index)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+    def invalidate(self, paths: Iterable[str]) -> None:
+        with self._lock:
+            for path in paths:
+                self._entries.pop(path, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"files": len(self._entries), "hits": self.hits, "loaded": self.loaded, "built": self.built}
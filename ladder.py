@@ -0,0 +1,191 @@
+"""
+Bitrate ladder for on-the-fly transcoding.
+
+Remote clients on weak links cannot sustain the bitrate of the original
+files. Besides the stream-copy SOURCE rendition, the HLS pipeline
+(hls.py) can produce lower resolution renditions, encoded with libx264
+and AAC on the CPU. The ladder is configured as MEDIA_SERVER_HLS_LADDER,
+a comma separated list of <height>p:<video kbps> rungs; a video is offered
+the rungs below its own height.
+
+A rendition is chosen
+- by the player: master.m3u8 lists every rendition with its bandwidth and
+  resolution, and HLS players switch between them on the throughput they
+  measure,
+- by the client: ?rendition=<name> on the media playlist,
+- by the server: ?rendition=auto picks the best rendition that fits in
+  SAFETY_FACTOR of the throughput measured while sending this client its
+  recent segments (ThroughputMeter), or START_RENDITION without a
+  measurement. The choice is made when the playlist is loaded.
+
+Transcoded segments start with a keyframe forced at every SEGMENT_SECONDS
+boundary, so unlike stream copies they are cut exactly on time.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+# --- Configuration ---
+DEFAULT_LADDER = os.environ.get('MEDIA_SERVER_HLS_LADDER', '1080p:5000,720p:2800,480p:1400,360p:800')
+DEFAULT_TRANSCODE_THREADS = int(os.environ.get('MEDIA_SERVER_TRANSCODE_THREADS', '2'))
+X264_PRESET = os.environ.get('MEDIA_SERVER_X264_PRESET', 'veryfast')
+AUDIO_BITRATE = 128_000
+START_RENDITION = '480p'    # for ?rendition=auto before the client's throughput is known
+SAFETY_FACTOR = 0.7         # share of the measured throughput a rendition may use
+THROUGHPUT_TTL = 300.0      # measurements older than this are forgotten
+MAX_CLIENTS = 1024
+_EWMA_WEIGHT = 0.3
+# H.264 High profile level 4.0 and AAC-LC, as encoded below
+TRANSCODE_CODECS = 'avc1.640028,mp4a.40.2'
+
+
+class Rendition(NamedTuple):
+    """One rung of the ladder; height 0 is the source, stream copied."""
+    name: str
+    height: int
+    video_bitrate: int      # bits per second
+
+    @property
+    def is_source(self) -> bool:
+        return self.height == 0
+
+    @property
+    def bandwidth(self) -> int:
+        """Peak bits per second, as advertised in the master playlist."""
+        return int(self.video_bitrate * 1.1) + AUDIO_BITRATE
+
+
+SOURCE = Rendition('source', 0, 0)
+
+
+def parse_ladder(spec: str) -> List[Rendition]:
+    """Parses "<height>p:<kbps>,..." into renditions, highest first. Raises ValueError."""
+    rungs = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, kbps = item.partition(':')
+        if not name.endswith('p') or not name[:-1].isdigit() or not kbps.isdigit():
+            raise ValueError(f"Invalid ladder rung '{item}', expected e.g. 720p:2800")
+        height = int(name[:-1])
+        if height <= 0 or height % 2 or int(kbps) <= 0:
+            raise ValueError(f"Invalid ladder rung '{item}': height must be even, bitrate positive")
+        rungs.append(Rendition(name, height, int(kbps) * 1000))
+    return sorted(rungs, key=lambda rendition: rendition.height, reverse=True)
+
+
+LADDER: List[Rendition] = parse_ladder(DEFAULT_LADDER)
+
+
+def renditions_for(height: Optional[int]) -> List[Rendition]:
+    """The renditions offered for a video of `height` pixels (all rungs if unknown), source first."""
+    return [SOURCE] + [rendition for rendition in LADDER if not height or rendition.height < height]
+
+
+def find(renditions: List[Rendition], name: str) -> Optional[Rendition]:
+    for rendition in renditions:
+        if rendition.name == name:
+            return rendition
+    return None
+
+
+def scaled_size(rendition: Rendition, width: Optional[int], height: Optional[int]) -> Tuple[int, int]:
+    """Output (width, height) of a rendition, keeping the source aspect ratio (16:9 if unknown)."""
+    if rendition.is_source:
+        return width or 0, height or 0
+    if width and height:
+        scaled_width = int(round(width * rendition.height / height / 2)) * 2
+    else:
+        scaled_width = int(round(rendition.height * 16 / 9 / 2)) * 2
+    return max(scaled_width, 2), rendition.height
+
+
+def encoder_args(rendition: Rendition, start_time: float, segment_seconds: int,
+                 threads: int = DEFAULT_TRANSCODE_THREADS) -> List[str]:
+    """ffmpeg codec arguments producing a rendition from a job starting at `start_time`."""
+    if rendition.is_source:
+        return ['-c', 'copy']
+    bitrate = rendition.video_bitrate
+    return [
+        '-vf', f'scale=-2:{rendition.height}', '-pix_fmt', 'yuv420p',
+        '-c:v', 'libx264', '-preset', X264_PRESET, '-profile:v', 'high', '-level:v', '4.0',
+        '-b:v', str(bitrate), '-maxrate', str(int(bitrate * 1.1)), '-bufsize', str(bitrate * 2),
+        # Timestamps are kept (-copyts), so boundaries count from the job start
+        '-force_key_frames', f'expr:gte(t,{start_time:.3f}+n_forced*{segment_seconds})', '-sc_threshold', '0',
+        '-c:a', 'aac', '-b:a', str(AUDIO_BITRATE), '-ac', '2',
+        '-threads', str(threads),
+    ]
+
+
+def build_master_playlist(renditions: List[Rendition], width: Optional[int], height: Optional[int],
+                          source_bandwidth: Optional[int]) -> str:
+    """Returns a master playlist listing each rendition's media playlist."""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-INDEPENDENT-SEGMENTS']
+    for rendition in renditions:
+        if rendition.is_source:
+            if not source_bandwidth:
+                continue
+            attributes = f'BANDWIDTH={source_bandwidth}'
+            if width and height:
+                attributes += f',RESOLUTION={width}x{height}'
+        else:
+            scaled_width, scaled_height = scaled_size(rendition, width, height)
+            attributes = (f'BANDWIDTH={rendition.bandwidth},RESOLUTION={scaled_width}x{scaled_height},'
+                          f'CODECS="{TRANSCODE_CODECS}"')
+        lines.append(f'#EXT-X-STREAM-INF:{attributes}')
+        lines.append(f'index.m3u8?rendition={rendition.name}')
+    return '\n'.join(lines) + '\n'
+
+
+def pick(renditions: List[Rendition], throughput: Optional[float], source_bandwidth: Optional[int]) -> Rendition:
+    """
+    The highest rendition whose bandwidth fits in SAFETY_FACTOR of a
+    client's `throughput` (bits per second), START_RENDITION if unknown.
+    """
+    if throughput is None:
+        return find(renditions, START_RENDITION) or renditions[-1]
+    budget = throughput * SAFETY_FACTOR
+    if source_bandwidth and source_bandwidth <= budget:
+        return SOURCE
+    for rendition in renditions:
+        if not rendition.is_source and rendition.bandwidth <= budget:
+            return rendition
+    return renditions[-1]
+
+
+class ThroughputMeter:
+    """Moving average of the delivery rate per client, from the segments sent to it."""
+
+    def __init__(self, max_clients: int = MAX_CLIENTS) -> None:
+        self.max_clients = max_clients
+        self._clients: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()  # client -> (bits/s, updated)
+        self._lock = threading.Lock()
+
+    def record(self, client: str, nbytes: int, seconds: float) -> None:
+        if nbytes <= 0 or seconds <= 0:
+            return
+        rate = nbytes * 8 / seconds
+        now = time.monotonic()
+        with self._lock:
+            previous = self._clients.pop(client, None)
+            if previous is not None and now - previous[1] <= THROUGHPUT_TTL:
+                rate = previous[0] + _EWMA_WEIGHT * (rate - previous[0])
+            self._clients[client] = (rate, now)
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+
+    def estimate(self, client: str) -> Optional[float]:
+        """Bits per second recently measured for a client, or None."""
+        with self._lock:
+            entry = self._clients.get(client)
+        if entry is None or time.monotonic() - entry[1] > THROUGHPUT_TTL:
+            return None
+        return entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clients.clear()
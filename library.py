@@ -0,0 +1,233 @@
+"""
+Video library scanning and watching.
+
+scan_library() walks one or more library roots recursively with
+os.scandir, reusing the stat information cached on each DirEntry.
+LibraryWatcher keeps a snapshot of (size, mtime_ns, inode) per file and
+rescans either periodically or when the optional `watchdog` package reports
+filesystem events (inotify on Linux), handing only the added, removed and
+changed files to a callback.
+"""
+
+import os
+import re
+import logging
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Define common video extensions
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv', '.webm')
+
+# Filesystem events are coalesced for this long before a rescan runs.
+WATCH_DEBOUNCE = 2.0
+
+
+# --- Natural Sort Helper ---
+def natural_sort_key(s: str, _nsre=re.compile(r'([0-9]+)')) -> List[Any]:
+    """Key for natural sorting (handles numbers in strings properly)."""
+    return [int(text) if text.isdigit() else text.lower() for text in _nsre.split(s)]
+
+
+# --- Scanning ---
+def scan_directory(directory_path: str, prefix: str = '',
+                   extensions: Tuple[str, ...] = VIDEO_EXTENSIONS) -> List[Dict[str, Any]]:
+    """
+    Recursively collects video files under `directory_path`. Filenames are
+    paths relative to the directory using '/' separators, optionally
+    prefixed. Hidden directories and symlinked directories are skipped.
+    """
+    video_files: List[Dict[str, Any]] = []
+    root = os.path.abspath(directory_path)
+    pending = [root]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not entry.name.startswith('.'):
+                                pending.append(entry.path)
+                            continue
+                        if not entry.name.lower().endswith(extensions) or not entry.is_file():
+                            continue
+                        st = entry.stat()
+                    except OSError as e:
+                        logger.warning(f"Skipping {entry.path}: {e}")
+                        continue
+                    relative = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                    video_files.append({
+                        "filename": prefix + relative,
+                        "path": entry.path,
+                        "size": st.st_size,
+                        "mtime_ns": st.st_mtime_ns,
+                        "ino": st.st_ino,
+                    })
+        except OSError as e:
+            logger.warning(f"Could not scan {current}: {e}")
+    return video_files
+
+
+def root_prefixes(roots: List[str]) -> List[str]:
+    """
+    Filename prefixes of the library roots: none for a single root, else
+    each root's directory name, extended with parent directories while
+    roots share it (/a/movies and /b/movies become a/movies/ and b/movies/).
+    """
+    if len(roots) <= 1:
+        return [''] * len(roots)
+    parts = [os.path.abspath(root).strip(os.sep).split(os.sep) for root in roots]
+    depths = [1] * len(roots)
+    while True:
+        prefixes = ['/'.join(components[-depth:]) for components, depth in zip(parts, depths)]
+        counts = Counter(prefixes)
+        colliding = [i for i, prefix in enumerate(prefixes) if counts[prefix] > 1 and depths[i] < len(parts[i])]
+        if not colliding:
+            return [prefix + '/' for prefix in prefixes]
+        for i in colliding:
+            depths[i] += 1
+
+
+def scan_library(roots: List[str]) -> List[Dict[str, Any]]:
+    """
+    Scans every library root and returns the videos in natural sort order.
+    With several roots, filenames are prefixed with the root's directory
+    name (see root_prefixes) to keep them unique.
+    """
+    roots = list(dict.fromkeys(os.path.abspath(root) for root in roots))  # a root listed twice is scanned once
+    video_files: List[Dict[str, Any]] = []
+    seen = set()
+    for root, prefix in zip(roots, root_prefixes(roots)):
+        for video in scan_directory(root, prefix):
+            # Only possible when a root's prefix matches a directory in another root
+            if video['filename'] in seen:
+                logger.warning(f"Skipping {video['path']}: {video['filename']} is already taken by another root")
+                continue
+            seen.add(video['filename'])
+            video_files.append(video)
+    video_files.sort(key=lambda video: natural_sort_key(video['filename']))
+    return video_files
+
+
+# --- Incremental rescans ---
+class LibraryChanges(NamedTuple):
+    added: List[Dict[str, Any]]
+    removed: List[Dict[str, Any]]
+    changed: List[Dict[str, Any]]
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+    def summary(self) -> Dict[str, int]:
+        return {"added": len(self.added), "removed": len(self.removed), "changed": len(self.changed)}
+
+
+def _identity(video: Dict[str, Any]) -> Tuple[int, int, int]:
+    return video['size'], video['mtime_ns'], video['ino']
+
+
+class LibraryWatcher:
+    """
+    Tracks the library roots and reports differences between scans.
+    Rescans run on a single background thread (periodic and/or triggered
+    by filesystem events) or on demand via rescan().
+    """
+
+    def __init__(self, roots: List[str], on_changes: Callable[[LibraryChanges], None],
+                 interval: Optional[float] = 60.0) -> None:
+        self.roots = roots
+        self.interval = interval
+        self._on_changes = on_changes
+        self._snapshot: Dict[str, Dict[str, Any]] = {}
+        self._scan_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._observer: Any = None
+
+    def seed(self, video_files: Iterable[Dict[str, Any]]) -> None:
+        """Sets the initial snapshot, stat'ing files the scan did not describe."""
+        snapshot: Dict[str, Dict[str, Any]] = {}
+        for video in video_files:
+            if 'mtime_ns' not in video:
+                try:
+                    st = os.stat(video['path'])
+                except OSError:
+                    continue
+                video = dict(video, size=st.st_size, mtime_ns=st.st_mtime_ns, ino=st.st_ino)
+            snapshot[video['filename']] = video
+        self._snapshot = snapshot
+
+    def rescan(self) -> LibraryChanges:
+        """Scans the roots, reports and returns the differences to the last snapshot."""
+        with self._scan_lock:
+            current = {video['filename']: video for video in scan_library(self.roots)}
+            previous = self._snapshot
+            changes = LibraryChanges(
+                added=[video for name, video in current.items() if name not in previous],
+                removed=[video for name, video in previous.items() if name not in current],
+                changed=[video for name, video in current.items()
+                         if name in previous and _identity(previous[name]) != _identity(video)],
+            )
+            self._snapshot = current
+            if changes:
+                logger.info(f"Library rescan: {changes.summary()}")
+                self._on_changes(changes)
+            return changes
+
+    # --- Background watching ---
+    def start(self, use_fs_events: bool = True) -> None:
+        """Starts the watcher thread and, if available, filesystem event watching."""
+        if use_fs_events:
+            self._start_observer()
+        if self._observer is None and not self.interval:
+            return
+        self._thread = threading.Thread(target=self._run, name='library-watcher', daemon=True)
+        self._thread.start()
+
+    def _start_observer(self) -> None:
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            logger.debug("watchdog is not installed, using periodic rescans only")
+            return
+
+        wake = self._wake
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if not event.is_directory or event.event_type in ('created', 'deleted', 'moved'):
+                    wake.set()
+
+        observer = Observer()
+        for root in self.roots:
+            observer.schedule(_Handler(), root, recursive=True)
+        observer.daemon = True
+        observer.start()
+        self._observer = observer
+        logger.info(f"Watching {len(self.roots)} library root(s) for changes")
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            triggered = self._wake.wait(self.interval or None)
+            if self._stopped.is_set():
+                break
+            if triggered:
+                # Let bursts of events (e.g. a file being copied in) settle
+                self._stopped.wait(WATCH_DEBOUNCE)
+                self._wake.clear()
+            try:
+                self.rescan()
+            except Exception as e:
+                logger.error(f"Library rescan failed: {e}")
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
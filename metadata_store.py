@@ -0,0 +1,196 @@
+"""
+Persistent metadata cache.
+
+Probed metadata is stored in a SQLite database keyed by file path and
+validated against the file identity (size, mtime_ns, inode). On restart the
+whole table is loaded with one query and matched against a single stat pass
+over the library, so only new or changed files need to be probed again.
+Keyframe indexes (see keyframes.py) are stored alongside, under the same
+validation, and loaded on demand.
+
+The store is only a cache: a database file that is not a valid SQLite
+database is moved aside (to <path>.corrupt) and started over, and lookups
+or writes that fail, e.g. while another process holds the database locked
+for longer than BUSY_TIMEOUT, count as misses and are logged.
+"""
+
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+DEFAULT_DB_PATH = os.environ.get(
+    'MEDIA_SERVER_METADATA_DB',
+    os.path.join(os.path.expanduser('~'), '.cache', 'media-server', 'metadata.sqlite3'))
+
+BUSY_TIMEOUT = 5.0  # seconds to wait for a lock held by another connection
+
+# Bump whenever the shape of the probed metadata changes; entries written by
+# another version are discarded when the store is opened.
+METADATA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS video_metadata (
+    path     TEXT PRIMARY KEY,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode    INTEGER NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS video_keyframes (
+    path      TEXT PRIMARY KEY,
+    size      INTEGER NOT NULL,
+    mtime_ns  INTEGER NOT NULL,
+    inode     INTEGER NOT NULL,
+    keyframes BLOB NOT NULL
+)
+"""
+
+FileIdentity = Tuple[int, int, int]
+
+
+def file_identity(st: os.stat_result) -> FileIdentity:
+    """Returns the (size, mtime_ns, inode) triple a cache entry is valid for."""
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class MetadataStore:
+    """SQLite-backed metadata cache, safe to use from several threads."""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH) -> None:
+        self.db_path = db_path
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        try:
+            self._conn = self._open()
+        except sqlite3.DatabaseError as e:
+            if db_path == ':memory:' or isinstance(e, sqlite3.OperationalError):
+                raise
+            logger.warning(f"Metadata cache {db_path} is corrupt ({e}), moving it to {db_path}.corrupt")
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(db_path + suffix):
+                    os.replace(db_path + suffix, db_path + '.corrupt' + suffix)
+            self._conn = self._open()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != METADATA_VERSION:
+                logger.info(f"Metadata cache {self.db_path} has version {version}, clearing it")
+                conn.execute('DELETE FROM video_metadata')
+                conn.execute('DELETE FROM video_keyframes')
+                conn.execute(f'PRAGMA user_version = {METADATA_VERSION}')
+            conn.commit()
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+
+    def load_valid(self, stats: Dict[str, os.stat_result]) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns cached metadata for every path in `stats` whose stored
+        identity still matches the given stat result.
+        """
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    'SELECT path, size, mtime_ns, inode, metadata FROM video_metadata').fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read metadata cache {self.db_path}: {e}")
+            return {}
+        valid: Dict[str, Dict[str, Any]] = {}
+        stale = 0
+        for path, size, mtime_ns, inode, metadata in rows:
+            st = stats.get(path)
+            if st is None:
+                continue
+            if file_identity(st) != (size, mtime_ns, inode):
+                stale += 1
+                continue
+            try:
+                valid[path] = json.loads(metadata)
+            except ValueError:
+                stale += 1
+        logger.info(f"Metadata cache {self.db_path}: {len(valid)} valid, {stale} stale entries")
+        return valid
+
+    def get(self, path: str, st: os.stat_result) -> Optional[Dict[str, Any]]:
+        """Returns cached metadata for one file if it is still valid."""
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    'SELECT size, mtime_ns, inode, metadata FROM video_metadata WHERE path = ?',
+                    (path,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read cached metadata for {path}: {e}")
+            return None
+        if row is None or tuple(row[:3]) != file_identity(st):
+            return None
+        return json.loads(row[3])
+
+    def put(self, path: str, metadata: Dict[str, Any], st: Optional[os.stat_result] = None) -> None:
+        """Stores metadata for a file, replacing any previous entry."""
+        try:
+            if st is None:
+                st = os.stat(path)
+        except OSError as e:
+            logger.warning(f"Not caching metadata for {path}: {e}")
+            return
+        size, mtime_ns, inode = file_identity(st)
+        self._write(f"metadata for {path}",
+                    'INSERT OR REPLACE INTO video_metadata (path, size, mtime_ns, inode, metadata) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(path, size, mtime_ns, inode, json.dumps(metadata))])
+
+    def get_keyframes(self, path: str, st: os.stat_result) -> Optional[bytes]:
+        """Returns the stored keyframe index blob of a file if it is still valid (b'' if it has none)."""
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    'SELECT size, mtime_ns, inode, keyframes FROM video_keyframes WHERE path = ?',
+                    (path,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read the cached keyframe index of {path}: {e}")
+            return None
+        if row is None or tuple(row[:3]) != file_identity(st):
+            return None
+        return bytes(row[3])
+
+    def put_keyframes(self, path: str, keyframes: bytes, st: os.stat_result) -> None:
+        """Stores the keyframe index blob of a file, replacing any previous entry."""
+        size, mtime_ns, inode = file_identity(st)
+        self._write(f"the keyframe index of {path}",
+                    'INSERT OR REPLACE INTO video_keyframes (path, size, mtime_ns, inode, keyframes) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(path, size, mtime_ns, inode, keyframes)])
+
+    def delete(self, paths: Iterable[str]) -> None:
+        """Removes entries for files that left the library."""
+        rows = [(path,) for path in paths]
+        self._write("removed files", 'DELETE FROM video_metadata WHERE path = ?', rows,
+                    'DELETE FROM video_keyframes WHERE path = ?')
+
+    def _write(self, what: str, sql: str, rows: List[tuple], *more_sql: str) -> None:
+        """Runs `sql` (then `more_sql`) for every row in one transaction; failures are logged."""
+        with self._lock:
+            try:
+                for statement in (sql,) + more_sql:
+                    self._conn.executemany(statement, rows)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                logger.warning(f"Could not cache {what} in {self.db_path}: {e}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,319 @@
+"""
+Prometheus-style metrics and access logging.
+
+Counters, gauges and histograms are sharded per thread: every thread
+updates its own dict without taking a lock, and a scrape of /metrics sums
+the shards (copying a dict is atomic in CPython). Shards of threads that
+have exited are folded into a retired total, so thread-per-request servers
+do not grow the shard list. Label sets are capped per metric
+(MAX_SERIES); further ones are counted under the OVERFLOW_LABEL value.
+
+Per-request log lines are a noticeable cost at high request rates.
+MEDIA_SERVER_ACCESS_LOG selects how requests are logged:
+
+  verbose     the detailed per-request lines at INFO (default)
+  sampled     detail lines at DEBUG, one access line per
+              MEDIA_SERVER_ACCESS_LOG_SAMPLE requests at INFO
+  structured  detail lines at DEBUG, one JSON access line per request
+  off         detail lines at DEBUG, no access lines
+
+Access lines go to the 'media_server.access' logger.
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import itertools
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+access_logger = logging.getLogger('media_server.access')
+
+# --- Configuration ---
+MAX_SERIES = int(os.environ.get('MEDIA_SERVER_METRICS_MAX_SERIES', '1000'))
+OVERFLOW_LABEL = '__other__'
+
+ACCESS_LOG_MODES = ('verbose', 'sampled', 'structured', 'off')
+ACCESS_LOG = os.environ.get('MEDIA_SERVER_ACCESS_LOG', 'verbose')
+ACCESS_LOG_SAMPLE = max(1, int(os.environ.get('MEDIA_SERVER_ACCESS_LOG_SAMPLE', '100')))
+# Level of the detailed per-request lines (see set_access_log)
+REQUEST_LOG_LEVEL = logging.INFO
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROBE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric:
+    """Per-thread shards of {label values: value}, summed on collection."""
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._lock = threading.Lock()  # shard registration and series admission only
+        self._shards: List[Tuple[threading.Thread, Dict[LabelValues, Any]]] = []
+        self._retired: Dict[LabelValues, Any] = {}
+        self._series: set = set()
+
+    def _shard(self) -> Dict[LabelValues, Any]:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _admit(self, labels: LabelValues) -> LabelValues:
+        """Called once per thread and label set: caps the number of series."""
+        with self._lock:
+            if labels in self._series:
+                return labels
+            if len(self._series) < MAX_SERIES:
+                self._series.add(labels)
+                return labels
+        return tuple(OVERFLOW_LABEL for _ in labels)
+
+    def _merge(self, total: Dict[LabelValues, Any], shard: Dict[LabelValues, Any]) -> None:
+        for labels, value in shard.items():
+            total[labels] = total.get(labels, 0) + value
+
+    def collect(self) -> Dict[LabelValues, Any]:
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard.copy())
+            self._shards = live
+            total: Dict[LabelValues, Any] = {}
+            self._merge(total, self._retired)
+            shards = [shard.copy() for _, shard in live]
+        for shard in shards:
+            self._merge(total, shard)
+        return total
+
+
+class Counter(_Metric):
+    """A monotonically increasing value."""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, labels: LabelValues = ()) -> None:
+        shard = self._shard()
+        if labels not in shard:
+            labels = self._admit(labels)
+        shard[labels] = shard.get(labels, 0) + amount
+
+
+class Gauge(Counter):
+    """A value that goes up and down; increments and decrements may come from different threads."""
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1, labels: LabelValues = ()) -> None:
+        self.inc(-amount, labels)
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative `le` buckets, with their sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, labels: LabelValues = ()) -> None:
+        shard = self._shard()
+        cells = shard.get(labels)
+        if cells is None:
+            labels = self._admit(labels)
+            cells = shard.get(labels)
+            if cells is None:
+                # One count per bucket plus +Inf, then the sum
+                cells = shard[labels] = [0] * (len(self.buckets) + 2)
+        cells[bisect.bisect_left(self.buckets, value)] += 1
+        cells[-1] += value
+
+    def _merge(self, total: Dict[LabelValues, Any], shard: Dict[LabelValues, Any]) -> None:
+        for labels, cells in shard.items():
+            cells = list(cells)
+            merged = total.get(labels)
+            total[labels] = cells if merged is None else [a + b for a, b in zip(merged, cells)]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+MetricT = TypeVar('MetricT', bound=_Metric)
+
+
+class Registry:
+    """The metrics exposed on /metrics, in the Prometheus text format (0.0.4)."""
+
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: 'MetricT') -> 'MetricT':
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            samples = metric.collect()
+            if not samples and not metric.labelnames:
+                samples = {(): [0] * (len(metric.buckets) + 2) if isinstance(metric, Histogram) else 0}
+            for labels, value in sorted(samples.items()):
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float('inf'),), value[:-1]):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        label_text = _format_labels(metric.labelnames + ('le',), labels + (le,))
+                        lines.append(f"{metric.name}_bucket{label_text} {cumulative}")
+                    label_text = _format_labels(metric.labelnames, labels)
+                    lines.append(f"{metric.name}_sum{label_text} {_format_value(value[-1])}")
+                    lines.append(f"{metric.name}_count{label_text} {cumulative}")
+                else:
+                    lines.append(f"{metric.name}{_format_labels(metric.labelnames, labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# --- Server metrics ---
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'media_server_http_requests_total', "Responses by endpoint and status code", ('endpoint', 'status')))
+STREAM_BYTES = REGISTRY.register(Counter(
+    'media_server_stream_bytes_total',
+    "Bytes of video served by /stream (ranges handed to sendfile are counted when handed over)", ('video',)))
+ACTIVE_STREAMS = REGISTRY.register(Gauge(
+    'media_server_active_streams', "Response bodies of /stream currently being sent"))
+STREAM_LATENCY = REGISTRY.register(Histogram(
+    'media_server_stream_request_seconds', "Time to build a /stream response (stat, validators, layout, ranges)"))
+TIME_TO_FIRST_BYTE = REGISTRY.register(Histogram(
+    'media_server_stream_ttfb_seconds',
+    "Time from the start of a /stream request until its first body byte is handed to the server, "
+    "by whether the bytes were prefetched (yes or no)", ('prefetched',)))
+METADATA_CACHE = REGISTRY.register(Counter(
+    'media_server_metadata_cache_requests_total', "Metadata lookups by result (hit or miss)", ('result',)))
+PROBE_DURATION = REGISTRY.register(Histogram(
+    'media_server_probe_seconds', "Metadata probe duration by method (header, opencv or failed)", ('method',),
+    buckets=PROBE_BUCKETS))
+
+
+# --- Stream tracking ---
+def _iter_tracked(body: Iterable[bytes], labels: LabelValues, started: float,
+                  ttfb_labels: LabelValues) -> Iterator[bytes]:
+    ACTIVE_STREAMS.inc()
+    try:
+        first = True
+        for chunk in body:
+            if first:
+                TIME_TO_FIRST_BYTE.observe(time.perf_counter() - started, ttfb_labels)
+                first = False
+            STREAM_BYTES.inc(len(chunk), labels)
+            yield chunk
+    finally:
+        ACTIVE_STREAMS.dec()
+        close = getattr(body, 'close', None)
+        if close is not None:
+            close()
+
+
+def track_stream(body: Any, direct_passthrough: bool, video: str, length: int, started: float,
+                 prefetched: bool = False) -> Any:
+    """
+    Counts a /stream response body in the stream metrics. Generator bodies
+    are wrapped and measured as they are sent. A `wsgi.file_wrapper` must
+    reach the server as it is, so its `length` bytes are counted up front
+    and it stays an active stream until the server closes it. `prefetched`
+    tells whether the first bytes were warmed by the prefetcher.
+    """
+    labels = (video,)
+    ttfb_labels = ('yes' if prefetched else 'no',)
+    if not direct_passthrough:
+        return _iter_tracked(body, labels, started, ttfb_labels)
+    TIME_TO_FIRST_BYTE.observe(time.perf_counter() - started, ttfb_labels)
+    STREAM_BYTES.inc(length, labels)
+    ACTIVE_STREAMS.inc()
+    close = body.close
+    closed = []
+
+    def close_and_count() -> None:
+        try:
+            close()
+        finally:
+            if not closed:
+                closed.append(True)
+                ACTIVE_STREAMS.dec()
+    try:
+        body.close = close_and_count
+    except AttributeError:  # wrapper without an instance dict, not tracked while sending
+        ACTIVE_STREAMS.dec()
+    return body
+
+
+# --- Access logging ---
+_request_counter = itertools.count()
+
+
+def set_access_log(mode: str) -> None:
+    """Selects the access log mode and the level of the detailed per-request lines."""
+    global ACCESS_LOG, REQUEST_LOG_LEVEL
+    if mode not in ACCESS_LOG_MODES:
+        raise ValueError(f"Unknown access log mode '{mode}', expected one of {ACCESS_LOG_MODES}")
+    ACCESS_LOG = mode
+    REQUEST_LOG_LEVEL = logging.INFO if mode == 'verbose' else logging.DEBUG
+
+
+def log_access(environ: Dict[str, Any], status: int, content_length: Optional[int], duration: float) -> None:
+    """Writes the access line for a finished request, as the mode asks."""
+    if ACCESS_LOG == 'verbose' or ACCESS_LOG == 'off':
+        return
+    if ACCESS_LOG == 'sampled':
+        if next(_request_counter) % ACCESS_LOG_SAMPLE:
+            return
+        query = environ.get('QUERY_STRING')
+        path = environ.get('PATH_INFO', '') + (f"?{query}" if query else '')
+        access_logger.info(f"{environ.get('REMOTE_ADDR', '-')} {environ.get('REQUEST_METHOD', '-')} {path} "
+                           f"{status} {content_length if content_length is not None else '-'} "
+                           f"{duration * 1000:.2f}ms (1 in {ACCESS_LOG_SAMPLE})")
+        return
+    entry = {
+        'time': round(time.time(), 3),
+        'remote': environ.get('REMOTE_ADDR'),
+        'method': environ.get('REQUEST_METHOD'),
+        'path': environ.get('PATH_INFO'),
+        'query': environ.get('QUERY_STRING') or None,
+        'status': status,
+        'bytes': content_length,
+        'range': environ.get('HTTP_RANGE'),
+        'duration_ms': round(duration * 1000, 3),
+        'user_agent': environ.get('HTTP_USER_AGENT'),
+    }
+    access_logger.info(json.dumps(entry, separators=(',', ':')))
+
+
+set_access_log(ACCESS_LOG if ACCESS_LOG in ACCESS_LOG_MODES else 'verbose')
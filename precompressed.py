@@ -0,0 +1,122 @@
+"""
+Pre-rendered, pre-compressed responses.
+
+Bodies that only change with the catalog (the index page, metadata JSON)
+are rendered once and compressed once, at their best levels, into every
+encoding the server offers: identity, gzip and, when the optional `brotli`
+package is installed, br. Requests then only negotiate Accept-Encoding and
+copy bytes out.
+
+Each encoding gets its own ETag, the body's ETag with the encoding
+appended, since RFC 7232 requires different representations to differ.
+With MEDIA_SERVER_RENDER_CACHE=0 bodies are rendered per request and sent
+uncompressed, as before.
+"""
+
+import os
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from flask import Response
+from werkzeug.http import quote_etag, unquote_etag
+
+import conditional
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only
+    brotli = None
+
+# --- Configuration ---
+ENABLED = os.environ.get('MEDIA_SERVER_RENDER_CACHE', '1') != '0'
+MIN_COMPRESS_BYTES = 512  # smaller bodies are not worth a Content-Encoding
+DEFAULT_MAX_ENTRIES = 4096
+
+ENCODINGS: Tuple[str, ...] = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+class PrecompressedBody:
+    """A response body with all its encodings computed up front."""
+    __slots__ = ('mimetype', 'etag', 'weak', 'last_modified', 'variants')
+
+    def __init__(self, data: bytes, mimetype: str, etag: Optional[str] = None, last_modified: str = '') -> None:
+        """`etag` is an ETag header value (weak or strong), by default a hash of the body."""
+        self.mimetype = mimetype
+        if etag is None:
+            self.etag, self.weak = hashlib.blake2b(data, digest_size=12).hexdigest(), False
+        else:
+            self.etag, self.weak = unquote_etag(etag)
+        self.last_modified = last_modified
+        self.variants: Dict[str, bytes] = {'identity': data}
+        if ENABLED and len(data) >= MIN_COMPRESS_BYTES:
+            compressed = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed['br'] = brotli.compress(data, quality=11)
+            # Only keep encodings that actually save bytes
+            self.variants.update({name: body for name, body in compressed.items() if len(body) < len(data)})
+
+    def negotiate(self, accept_encodings) -> str:
+        """Picks the encoding to send for a werkzeug Accept-Encoding header object."""
+        for encoding in ENCODINGS:
+            if encoding in self.variants and accept_encodings[encoding] > 0:
+                return encoding
+        return 'identity'
+
+    def etag_for(self, encoding: str) -> str:
+        tag = self.etag if encoding == 'identity' else f'{self.etag}-{encoding}'
+        return quote_etag(tag, self.weak)
+
+    def response(self, request, headers: Optional[Dict[str, str]] = None) -> Response:
+        """Builds the response for a request, answering 304 when its validators match."""
+        encoding = self.negotiate(request.accept_encodings)
+        etag = self.etag_for(encoding)
+        response_headers = {'ETag': etag, 'Vary': 'Accept-Encoding'}
+        if self.last_modified:
+            response_headers['Last-Modified'] = self.last_modified
+        if headers:
+            response_headers.update(headers)
+        if conditional.is_not_modified(request.headers, etag, self.last_modified):
+            return Response(status=304, headers=response_headers)
+        if encoding != 'identity':
+            response_headers['Content-Encoding'] = encoding
+        return Response(self.variants[encoding], mimetype=self.mimetype, headers=response_headers)
+
+
+class RenderCache:
+    """LRU of pre-compressed bodies by key (include everything the body depends on in it)."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Hashable, PrecompressedBody]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, render: Callable[[], PrecompressedBody]) -> PrecompressedBody:
+        """Returns the cached body for `key`, calling `render` on a miss."""
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return body
+            self.misses += 1
+        body = render()
+        if ENABLED:
+            with self._lock:
+                self._entries[key] = body
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return body
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {"enabled": ENABLED, "entries": len(self._entries), "hits": self.hits,
+                    "misses": self.misses, "encodings": list(ENCODINGS)}
@@ -0,0 +1,294 @@
+"""
+Predictive prefetch of the next video in the playlist.
+
+The playlist plays in natural filename order, so when a client's stream
+nears the end of a video (a range request starts within the last
+LEAD_SECONDS of playback, after the client's previous one) the next one is
+very likely requested soon. Its first request would hit cold storage;
+instead a background worker warms it:
+
+- whatever the server derives from the file before serving it, through
+  the `prepare` callback (the faststart layout, which reads the `moov`
+  box wherever it is, the keyframe index and the metadata),
+- the byte ranges `prepare` returns: the header and the first
+  WARM_SECONDS of playback, read through the block cache when it is
+  enabled, otherwise into the page cache.
+
+Prefetching must not slow down actual viewers. There is one worker, it
+reads in CHUNK_SIZE pieces under its own rate limit (MEDIA_SERVER_PREFETCH_RATE_MBPS),
+as a bulk reader of the fair-share scheduler when one is configured
+(shaping.py), and pauses for QUIET_SECONDS after every foreground request.
+A job is cancelled when its video is requested meanwhile, or when it is
+superseded; only MAX_QUEUED jobs wait at a time.
+
+Whether a first request found its video warmed is recorded (use counts
+and the time to first byte of prefetched versus cold starts, metrics.py).
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import metrics
+import streaming
+from shaping import FairScheduler, TokenBucket, PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+ENABLED = os.environ.get('MEDIA_SERVER_PREFETCH', '1') != '0'
+LEAD_SECONDS = float(os.environ.get('MEDIA_SERVER_PREFETCH_LEAD_SECONDS', '60'))
+WARM_SECONDS = float(os.environ.get('MEDIA_SERVER_PREFETCH_SECONDS', '10'))
+DEFAULT_RATE = float(os.environ.get('MEDIA_SERVER_PREFETCH_RATE_MBPS', '200')) * 1e6 / 8
+NEAR_END_FRACTION = 0.95       # without a known bitrate: ranges starting past this share of the file
+PROBE_BYTES = 1024 * 1024      # requests this short (and at most 1% of the file) are index probes, not playback
+HEADER_BYTES = 1024 * 1024
+DEFAULT_WARM_BYTES = 16 * 1024 * 1024  # first bytes warmed when the bitrate is unknown
+MAX_WARM_BYTES = 256 * 1024 * 1024
+CHUNK_SIZE = 256 * 1024
+QUIET_SECONDS = 0.25
+MAX_QUEUED = 4
+WARM_TTL = 600.0               # a warmed video counts as prefetched for this long
+MAX_TRACKED = 256
+SCHEDULER_CLIENT = 'prefetch'  # the prefetcher's name in the fair-share scheduler
+
+# prepare(path, st, duration) -> file byte ranges (offset, length) to warm
+PrepareFunc = Callable[[str, os.stat_result, Optional[float]], Iterable[Tuple[int, int]]]
+
+PREFETCH_JOBS = metrics.REGISTRY.register(metrics.Counter(
+    'media_server_prefetch_jobs_total', "Prefetch jobs by outcome (done, cancelled, failed)", ('outcome',)))
+PREFETCH_BYTES = metrics.REGISTRY.register(metrics.Counter(
+    'media_server_prefetch_bytes_total', "Bytes read ahead by the prefetcher"))
+PREFETCH_USE = metrics.REGISTRY.register(metrics.Counter(
+    'media_server_prefetch_requests_total',
+    "Prefetched videos by use: requested while warm (used) or not requested in time (unused)", ('result',)))
+
+
+def warm_length(file_size: int, bitrate: Optional[float]) -> int:
+    """Bytes covering the first WARM_SECONDS of playback."""
+    if bitrate:
+        return int(min(max(bitrate * WARM_SECONDS, HEADER_BYTES), MAX_WARM_BYTES, file_size))
+    return min(DEFAULT_WARM_BYTES, file_size)
+
+
+def is_probe(length: int, file_size: int) -> bool:
+    """Whether a request is too short to be playback: a probe for the moov box, cues or another index."""
+    return length <= min(PROBE_BYTES, file_size // 100)
+
+
+def near_end(position: int, length: int, file_size: int, bitrate: Optional[float],
+             previous: Optional[int]) -> bool:
+    """
+    Whether a request for `length` bytes from `position` shows playback in
+    the last LEAD_SECONDS of the video (in the second half of shorter ones).
+    Players request ranges at their read position, open-ended ones included,
+    so the start of a request tells how far a viewer got, provided playback
+    came there from `previous`, the start of the client's last playback
+    request of the video. Short requests are probes for an index at the
+    tail (a trailing moov, Matroska cues), and a first request near the end
+    is a seek or a resume, not playback nearing the end.
+    """
+    if position <= 0 or is_probe(length, file_size) or previous is None or previous >= position:
+        return False
+    if bitrate:
+        return file_size - position <= min(bitrate * LEAD_SECONDS, file_size / 2)
+    return position >= file_size * NEAR_END_FRACTION
+
+
+class _Job:
+    __slots__ = ('path', 'duration', 'cancelled')
+
+    def __init__(self, path: str, duration: Optional[float]) -> None:
+        self.path = path
+        self.duration = duration
+        self.cancelled = threading.Event()
+
+
+class Prefetcher:
+    """Warms the start of videos on one background thread, yielding to foreground reads."""
+
+    def __init__(self, prepare: PrepareFunc, rate: float = DEFAULT_RATE,
+                 scheduler: Optional[FairScheduler] = None) -> None:
+        self.prepare = prepare
+        self.bucket = TokenBucket(rate) if rate > 0 else None
+        self.scheduler = scheduler
+        self._cond = threading.Condition()
+        self._queue: List[_Job] = []
+        self._running: Optional[_Job] = None
+        # path -> (file identity, warmed ranges, warmed at), most recent last
+        self._warm: 'OrderedDict[str, Tuple[Tuple[int, int], List[Tuple[int, int]], float]]' = OrderedDict()
+        # (client, path) -> start of the client's last playback request, most recent last
+        self._playheads: 'OrderedDict[Tuple[str, str], int]' = OrderedDict()
+        self._last_foreground = 0.0
+        self._stopped = False
+        self._thread = threading.Thread(target=self._worker, name='prefetch', daemon=True)
+        self._thread.start()
+
+    # --- Requests ---
+    def submit(self, path: str, duration: Optional[float] = None) -> bool:
+        """
+        Queues a video (of `duration` seconds, if known) for warming unless it
+        is warm, queued or running already.
+        """
+        with self._cond:
+            if self._stopped or path in self._warm:
+                return False
+            if (self._running is not None and self._running.path == path) or any(j.path == path for j in self._queue):
+                return False
+            if len(self._queue) >= MAX_QUEUED:
+                superseded = self._queue.pop(0)
+                PREFETCH_JOBS.inc(labels=('cancelled',))
+                logger.debug(f"Prefetch of {superseded.path} superseded")
+            self._queue.append(_Job(path, duration))
+            self._cond.notify()
+        return True
+
+    def observe(self, path: str, st: os.stat_result, start: int) -> bool:
+        """
+        Records a foreground request for bytes from `start` of a file. Cancels
+        its pending prefetch, and returns True if the bytes were warmed by one.
+        """
+        now = time.monotonic()
+        self._last_foreground = now
+        identity = (st.st_size, st.st_mtime_ns)
+        with self._cond:
+            self._queue = [job for job in self._queue if job.path != path]
+            if self._running is not None and self._running.path == path:
+                self._running.cancelled.set()
+            warm = self._warm.pop(path, None)
+        if warm is None:
+            return False
+        warm_identity, ranges, warmed_at = warm
+        used = (warm_identity == identity and now - warmed_at <= WARM_TTL
+                and any(offset <= start < offset + length for offset, length in ranges))
+        PREFETCH_USE.inc(labels=('used' if used else 'unused',))
+        return used
+
+    def playback(self, client: str, path: str, start: int, length: int, file_size: int,
+                 bitrate: Optional[float]) -> bool:
+        """
+        Records a client's request for `length` bytes from `start` of a video
+        and returns whether it shows playback nearing the end (near_end).
+        """
+        key = (client, path)
+        with self._cond:
+            previous = self._playheads.pop(key, None)
+            playhead = previous if is_probe(length, file_size) else start
+            if playhead is not None:
+                self._playheads[key] = playhead
+                while len(self._playheads) > MAX_TRACKED:
+                    self._playheads.popitem(last=False)
+        return near_end(start, length, file_size, bitrate, previous)
+
+    # --- Worker ---
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                job = self._running = self._queue.pop(0)
+            try:
+                outcome = self._run(job)
+            except Exception as e:
+                logger.warning(f"Prefetch of {job.path} failed: {e}")
+                outcome = 'failed'
+            finally:
+                with self._cond:
+                    self._running = None
+            PREFETCH_JOBS.inc(labels=(outcome,))
+
+    def _run(self, job: _Job) -> str:
+        st = os.stat(job.path)
+        self._yield_to_foreground(job)
+        if job.cancelled.is_set():
+            return 'cancelled'
+        ranges = [(offset, length) for offset, length in self.prepare(job.path, st, job.duration) if length > 0]
+        warmed: List[Tuple[int, int]] = []
+        if self.scheduler is not None:
+            self.scheduler.open(SCHEDULER_CLIENT)
+        try:
+            for offset, length in ranges:
+                done = sum(self._read(job, offset, length, st))
+                if done:
+                    warmed.append((offset, done))
+                if job.cancelled.is_set():
+                    return 'cancelled'
+        finally:
+            if self.scheduler is not None:
+                self.scheduler.close(SCHEDULER_CLIENT)
+        with self._cond:
+            self._warm[job.path] = ((st.st_size, st.st_mtime_ns), warmed, time.monotonic())
+            while len(self._warm) > MAX_TRACKED:
+                self._warm.popitem(last=False)
+                PREFETCH_USE.inc(labels=('unused',))
+        logger.debug(f"Prefetched {sum(length for _, length in warmed)} bytes of {os.path.basename(job.path)}")
+        return 'done'
+
+    def _read(self, job: _Job, offset: int, length: int, st: os.stat_result):
+        """Reads a range chunk by chunk under the rate limit; yields the bytes read per chunk."""
+        position, end = offset, offset + length
+        while position < end and not job.cancelled.is_set():
+            self._yield_to_foreground(job)
+            size = min(CHUNK_SIZE, end - position)
+            if self.scheduler is not None:
+                self.scheduler.acquire(SCHEDULER_CLIENT, PRIORITY_BULK)
+            nbytes = 0
+            try:
+                for data in streaming.iter_file_range(job.path, position, size, size, st, adaptive=False):
+                    nbytes += len(data)
+            finally:
+                if self.scheduler is not None:
+                    self.scheduler.release(SCHEDULER_CLIENT, nbytes)
+            if not nbytes:
+                return
+            PREFETCH_BYTES.inc(nbytes)
+            position += nbytes
+            yield nbytes
+            if self.bucket is not None:
+                delay = self.bucket.reserve(nbytes)
+                if delay > 0:
+                    job.cancelled.wait(delay)
+
+    def _yield_to_foreground(self, job: _Job) -> None:
+        while not job.cancelled.is_set():
+            quiet_for = time.monotonic() - self._last_foreground
+            if quiet_for >= QUIET_SECONDS:
+                return
+            job.cancelled.wait(QUIET_SECONDS - quiet_for)
+
+    # --- Maintenance ---
+    def forget(self, paths: Iterable[str]) -> None:
+        """Cancels and forgets prefetches of changed or removed files."""
+        paths = set(paths)
+        with self._cond:
+            self._queue = [job for job in self._queue if job.path not in paths]
+            if self._running is not None and self._running.path in paths:
+                self._running.cancelled.set()
+            for path in paths:
+                self._warm.pop(path, None)
+            for key in [key for key in self._playheads if key[1] in paths]:
+                del self._playheads[key]
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._queue.clear()
+            if self._running is not None:
+                self._running.cancelled.set()
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "enabled": ENABLED,
+                "queued": len(self._queue),
+                "running": os.path.basename(self._running.path) if self._running is not None else None,
+                "warm": len(self._warm),
+                "rate_mbps": self.bucket.rate * 8 / 1e6 if self.bucket is not None else 0.0,
+            }
+
@@ -0,0 +1,189 @@
+"""
+Background metadata probing.
+
+MetadataProber runs a probe function (server.get_video_info) for every
+catalog entry on a bounded thread or process pool, so the server can accept
+requests immediately after startup. Requests for metadata that is not yet
+cached either wait for the in-flight probe or, if the probe has not started
+yet, run it inline instead of queueing behind the whole library.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Keep this low for spinning disks / NAS mounts, each probe seeks around the file.
+DEFAULT_PROBE_WORKERS = int(os.environ.get('MEDIA_SERVER_PROBE_WORKERS', '4'))
+# 'thread' suits OpenCV (releases the GIL while demuxing), 'process' isolates crashes.
+DEFAULT_PROBE_EXECUTOR = os.environ.get('MEDIA_SERVER_PROBE_EXECUTOR', 'thread')
+PROGRESS_LOG_INTERVAL = 5.0  # seconds between progress log lines
+
+ProbeFunc = Callable[[str], Optional[Dict[str, Any]]]
+# Called as on_result(filename, path, metadata, st) for every successful probe,
+# with the file's stat result taken before the probe read it
+ResultCallback = Callable[[str, str, Dict[str, Any], os.stat_result], None]
+
+
+def _stat_and_probe(probe_func: ProbeFunc, path: str) -> Tuple[Optional[os.stat_result], Optional[Dict[str, Any]]]:
+    """
+    Stats a file, then probes it. The metadata is stored against this stat
+    result: a file replaced during the probe then fails validation and is
+    probed again, instead of being cached under the new file's identity.
+    """
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        logger.warning(f"Cannot probe {path}: {e}")
+        return None, None
+    return st, probe_func(path)
+
+
+class MetadataProber:
+    """Probes video metadata on a bounded pool and stores results in `cache`."""
+
+    def __init__(self, probe_func: ProbeFunc, cache: Dict[str, Dict[str, Any]],
+                 max_workers: int = DEFAULT_PROBE_WORKERS,
+                 executor_kind: str = DEFAULT_PROBE_EXECUTOR,
+                 on_result: Optional[ResultCallback] = None) -> None:
+        self._probe_func = probe_func
+        self._cache = cache
+        self._on_result = on_result
+        self._max_workers = max(1, max_workers)
+        self._executor: Executor
+        if executor_kind == 'process':
+            self._executor = ProcessPoolExecutor(max_workers=self._max_workers)
+        elif executor_kind == 'thread':
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                                thread_name_prefix='metadata-probe')
+        else:
+            raise ValueError(f"Unknown probe executor '{executor_kind}', expected 'thread' or 'process'")
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+        self._total = 0
+        self._done = 0
+        self._failed = 0
+        self._started_at = 0.0
+        self._finished_at: Optional[float] = None
+        self._last_log = 0.0
+        self._all_done = threading.Event()
+
+    # --- Scheduling ---
+    def start(self, videos: Iterable[Any]) -> None:
+        """Queues a probe for every video (objects with .filename and .path)."""
+        self._started_at = self._last_log = time.monotonic()
+        pending = [video for video in videos if video.filename not in self._cache]
+        if not pending:
+            self._finish()
+            return
+        logger.info(f"Probing metadata for {len(pending)} videos with {self._max_workers} workers")
+        self.submit(pending)
+
+    def submit(self, videos: Iterable[Any]) -> None:
+        """Queues probes for additional videos, e.g. files found by a rescan."""
+        videos = list(videos)
+        if not videos:
+            return
+        with self._lock:
+            # Count everything up front so early completions don't look final
+            self._total += len(videos)
+            self._all_done.clear()
+            self._finished_at = None
+        for video in videos:
+            with self._lock:
+                future = self._executor.submit(_stat_and_probe, self._probe_func, video.path)
+                self._futures[video.filename] = future
+            future.add_done_callback(lambda f, name=video.filename, path=video.path: self._on_done(name, path, f))
+
+    def _on_done(self, filename: str, path: str, future: Future) -> None:
+        st = metadata = None
+        if not future.cancelled():
+            try:
+                st, metadata = future.result()
+            except Exception as e:
+                logger.error(f"Error caching metadata for {path}: {e}")
+        if metadata:
+            self._store(filename, path, metadata, st)
+            logger.debug(f"Cached metadata for {filename}")
+        elif not future.cancelled():
+            logger.warning(f"Could not get metadata for {path}")
+
+        with self._lock:
+            self._futures.pop(filename, None)
+            self._done += 1
+            if not metadata and not future.cancelled():
+                self._failed += 1
+            finished = self._done >= self._total
+            now = time.monotonic()
+            should_log = now - self._last_log >= PROGRESS_LOG_INTERVAL
+            if should_log:
+                self._last_log = now
+        if should_log and not finished:
+            logger.info(f"Metadata probing: {self._done}/{self._total} done")
+        if finished:
+            self._finish()
+
+    def _finish(self) -> None:
+        self._finished_at = time.monotonic()
+        if self._total:
+            logger.info(f"Metadata probing finished: {self._done - self._failed}/{self._total} videos "
+                        f"in {self._finished_at - self._started_at:.2f}s ({self._failed} failed)")
+        self._all_done.set()
+
+    # --- Lookups ---
+    def get(self, filename: str, path: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Returns metadata for a video, probing it on demand if needed.
+        A queued probe that has not started is cancelled and run inline.
+        """
+        metadata = self._cache.get(filename)
+        if metadata is not None:
+            return metadata
+
+        with self._lock:
+            future = self._futures.get(filename)
+        if future is not None and not future.cancel():
+            try:
+                return future.result(timeout=timeout)[1]
+            except Exception as e:
+                logger.error(f"Error probing metadata for {path}: {e}")
+                return None
+
+        st, metadata = _stat_and_probe(self._probe_func, path)
+        if metadata:
+            self._store(filename, path, metadata, st)
+        return metadata
+
+    def _store(self, filename: str, path: str, metadata: Dict[str, Any], st: os.stat_result) -> None:
+        self._cache[filename] = metadata
+        if self._on_result is not None:
+            try:
+                self._on_result(filename, path, metadata, st)
+            except Exception as e:
+                logger.error(f"Error storing metadata for {path}: {e}")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until every queued probe has finished. Returns False on timeout."""
+        return self._all_done.wait(timeout)
+
+    def progress(self) -> Dict[str, Any]:
+        """Returns a snapshot of the probing progress."""
+        with self._lock:
+            end = self._finished_at if self._finished_at is not None else time.monotonic()
+            return {
+                "total": self._total,
+                "done": self._done,
+                "failed": self._failed,
+                "finished": self._all_done.is_set(),
+                "workers": self._max_workers,
+                "elapsed": round(end - self._started_at, 3) if self._started_at else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        """Cancels queued probes and releases the pool without waiting."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,118 @@
+"""
+HTTP byte-range parsing (RFC 7233).
+
+parse_range_header() turns a `Range` header into a sorted tuple of
+inclusive (start, end) spans, with:
+
+- suffix ranges (`bytes=-500`, the last 500 bytes),
+- open-ended ranges (`bytes=100-`),
+- multiple ranges, coalesced when they overlap or are separated by a gap
+  smaller than the per-part multipart overhead,
+- last-byte positions past EOF clamped to the file size.
+
+Syntactically invalid headers are ignored (the caller serves the full
+representation with 200), headers where no span is satisfiable raise
+RangeNotSatisfiable (the caller answers 416).
+
+cap_open_ended() shortens a single open-ended range to a configurable
+size: players ask for `bytes=N-` on every seek and abandon the response
+long before EOF, and the client simply requests the next range when it
+needs more.
+"""
+
+import os
+import re
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+# --- Configuration ---
+# Requests with more ranges than this are ignored rather than served as a
+# multipart response with thousands of tiny parts.
+MAX_RANGES = 64
+# Gaps smaller than a multipart part header are cheaper to send than to skip.
+COALESCE_GAP = 80
+# Longest response to an open-ended `bytes=N-` request, 0 = up to EOF.
+OPEN_ENDED_RANGE_CAP = int(os.environ.get('MEDIA_SERVER_OPEN_RANGE_CAP_MB', '0')) * 1024 * 1024
+
+_BYTES_UNIT_RE = re.compile(r'^\s*bytes\s*=\s*(.*)$', re.IGNORECASE)
+_RANGE_SPEC_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+ByteRange = Tuple[int, int]
+
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested byte ranges overlap the file."""
+
+
+def coalesce_ranges(spans: List[ByteRange], gap: int = COALESCE_GAP) -> Tuple[ByteRange, ...]:
+    """Sorts spans and merges those that overlap or are closer than `gap` bytes."""
+    merged: List[List[int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1] + 1 + gap:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return tuple((start, end) for start, end in merged)
+
+
+@lru_cache(maxsize=1024)
+def parse_range_header(range_header: str, file_size: int) -> Optional[Tuple[ByteRange, ...]]:
+    """
+    Parses a Range header against a file of `file_size` bytes.
+    Returns the satisfiable spans, None if the header should be ignored,
+    or raises RangeNotSatisfiable.
+    """
+    unit_match = _BYTES_UNIT_RE.match(range_header)
+    if not unit_match:
+        return None
+    specs = unit_match.group(1).split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+
+    spans: List[ByteRange] = []
+    seen_spec = False
+    for spec in specs:
+        if not spec.strip():
+            continue  # Tolerate empty list elements ("bytes=0-1,,5-6")
+        seen_spec = True
+        spec_match = _RANGE_SPEC_RE.match(spec)
+        if not spec_match:
+            return None
+        first, last = spec_match.groups()
+        if first:
+            start = int(first)
+            end = int(last) if last else file_size - 1
+            if last and end < start:
+                return None  # Invalid spec, the whole header is ignored
+            if start >= file_size:
+                continue  # Unsatisfiable, but others may still be
+            spans.append((start, min(end, file_size - 1)))
+        elif last:
+            suffix_length = int(last)
+            if suffix_length == 0 or file_size == 0:
+                continue
+            spans.append((max(file_size - suffix_length, 0), file_size - 1))
+        else:
+            return None  # "bytes=-"
+
+    if not seen_spec:
+        return None
+    if not spans:
+        raise RangeNotSatisfiable(range_header)
+    return coalesce_ranges(spans)
+
+
+def cap_open_ended(range_header: str, spans: Tuple[ByteRange, ...],
+                   cap: Optional[int] = None) -> Tuple[ByteRange, ...]:
+    """
+    Limits a single open-ended range (`bytes=N-`) to `cap` bytes (default
+    OPEN_ENDED_RANGE_CAP). Explicit and suffix ranges are returned as is.
+    """
+    cap = OPEN_ENDED_RANGE_CAP if cap is None else cap
+    if cap <= 0 or len(spans) != 1 or not range_header.rstrip().endswith('-') or ',' in range_header:
+        return spans
+    start, end = spans[0]
+    if end - start + 1 <= cap:
+        return spans
+    return ((start, start + cap - 1),)
@@ -0,0 +1,100 @@
+"""
+Adaptive chunk sizing and kernel read-ahead hints for streaming.
+
+AdaptiveChunker picks the read size for each chunk of a response. It starts
+from the video's bitrate (about a quarter second of playback per chunk, when
+the duration is known) and then follows the throughput the client actually
+achieves, measured between consecutive chunks: a WSGI server resumes the
+body iterator only after the previous chunk was handed to the socket. Fast
+clients get large chunks (fewer read and send calls), slow ones small
+chunks (less memory held per connection, quicker first byte).
+
+The same estimate sizes the read-ahead window: advise_sequential() and
+advise_willneed() wrap posix_fadvise so the kernel reads the upcoming part
+of the file ahead of playback. The hints are no-ops where posix_fadvise is
+unavailable (Windows, macOS).
+"""
+
+import os
+import time
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = int(os.environ.get('MEDIA_SERVER_MAX_CHUNK_KB', '1024')) * 1024
+DEFAULT_CHUNK_SIZE = 64 * 1024
+TARGET_CHUNK_SECONDS = 0.05    # aim for one chunk per 50ms of client throughput
+BITRATE_CHUNK_SECONDS = 0.25   # initial chunk: this much playback at the video bitrate
+READAHEAD_SECONDS = 2.0        # read-ahead window, in seconds of client throughput
+MIN_READAHEAD = 256 * 1024
+MAX_READAHEAD = 16 * 1024 * 1024
+_EWMA_WEIGHT = 0.3
+
+HAS_FADVISE = hasattr(os, 'posix_fadvise')
+
+
+def video_bitrate(file_size: int, duration: Optional[float]) -> Optional[float]:
+    """Average bitrate in bytes per second, or None if the duration is unknown."""
+    if not duration or duration <= 0 or file_size <= 0:
+        return None
+    return file_size / duration
+
+
+def _clamp_chunk(size: float) -> int:
+    size = int(min(max(size, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE))
+    return size - size % 4096  # page aligned reads
+
+
+def readahead_window(throughput: Optional[float]) -> int:
+    """Bytes to keep read ahead for a reader consuming `throughput` bytes/s."""
+    if throughput is None:
+        return MIN_READAHEAD
+    return int(min(max(throughput * READAHEAD_SECONDS, MIN_READAHEAD), MAX_READAHEAD))
+
+
+def advise_sequential(fd: int, offset: int, length: int) -> None:
+    """Tells the kernel the range will be read sequentially (larger read-ahead)."""
+    if HAS_FADVISE:
+        try:
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+def advise_willneed(fd: int, offset: int, length: int) -> None:
+    """Starts asynchronous read-ahead of the range into the page cache."""
+    if HAS_FADVISE and length > 0:
+        try:
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+
+
+class AdaptiveChunker:
+    """Per-response chunk size and read-ahead window, driven by observed throughput."""
+    __slots__ = ('chunk_size', 'throughput', '_last_time', '_last_bytes')
+
+    def __init__(self, bitrate: Optional[float] = None, initial: int = DEFAULT_CHUNK_SIZE) -> None:
+        self.chunk_size = _clamp_chunk(bitrate * BITRATE_CHUNK_SECONDS) if bitrate else initial
+        self.throughput: Optional[float] = bitrate
+        self._last_time: Optional[float] = None
+        self._last_bytes = 0
+
+    def sent(self, nbytes: int) -> None:
+        """Records that a chunk of `nbytes` is about to be handed to the server."""
+        now = time.monotonic()
+        if self._last_time is not None:
+            elapsed = now - self._last_time
+            if elapsed > 0:
+                sample = self._last_bytes / elapsed
+                self.throughput = (sample if self.throughput is None
+                                   else (1 - _EWMA_WEIGHT) * self.throughput + _EWMA_WEIGHT * sample)
+                self.chunk_size = _clamp_chunk(self.throughput * TARGET_CHUNK_SECONDS)
+        self._last_time = now
+        self._last_bytes = nbytes
+
+    def readahead_window(self) -> int:
+        return readahead_window(self.throughput)
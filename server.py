@@ -1,187 +1,600 @@
 import os
-import re
+import time
 import mimetypes
+import sqlite3
+import hmac
 import logging
-from flask import Flask, Response, render_template, request, jsonify, abort
-from typing import List, Dict, Optional, Tuple, Any
-import cv2 # For video metadata
+import threading
+import urllib.parse
+from flask import Flask, Response, render_template, request, jsonify, abort, send_file, g, redirect
+from typing import List, Dict, Optional, Sequence, Tuple, Any
 import utils # Assuming utils.py contains get_primary_ip_address
+import streaming
+import serving
+import ranges
+import conditional
+import containers
+import readahead
+import faststart
+from faststart import FaststartLayout, LayoutCache
+from keyframes import KeyframeCache, KeyframeIndex
+import catalog
+from catalog import CursorError, VideoCatalog, VideoEntry
+import probing
+from probing import MetadataProber
+import metadata_store
+from metadata_store import MetadataStore
+from library import LibraryChanges, LibraryWatcher, natural_sort_key
+import hls
+from hls import HLSPipeline, HLSUnavailable
+import ladder
+from ladder import Rendition, ThroughputMeter
+import thumbnails
+from thumbnails import ThumbnailService, ThumbnailError
+import metrics
+import prefetch
+from prefetch import Prefetcher
+import cluster
+from cluster import Cluster, MetadataChanges
+from precompressed import PrecompressedBody, RenderCache
 
 # --- Globals ---
 app = Flask(__name__, template_folder='templates')
 logger = logging.getLogger(__name__)
 
-# To store the list of available video files
-# Each item will be a dictionary: {'filename': str, 'path': str}
-AVAILABLE_VIDEOS: List[Dict[str, str]] = []
+# The available video files, indexed by filename and ID (see catalog.py)
+CATALOG: VideoCatalog = VideoCatalog()
 # To cache metadata for videos to avoid re-reading
 VIDEO_METADATA_CACHE: Dict[str, Dict[str, Any]] = {}
+# Generations of the metadata, for the delta fetches of cluster peers (see cluster.py)
+METADATA_CHANGES: MetadataChanges = MetadataChanges()
+# Virtual moov-first layouts of MP4s stored without faststart (see faststart.py)
+FASTSTART_CACHE: LayoutCache = LayoutCache()
+# Keyframe indexes for time-based seeking (see keyframes.py)
+KEYFRAMES: KeyframeCache = KeyframeCache()
+# Rendered, pre-compressed index page and metadata JSON (see precompressed.py)
+RENDER_CACHE: RenderCache = RenderCache()
+# Background metadata probing, created by init_server_state
+PROBER: Optional[MetadataProber] = None
+# Persistent metadata cache, opened by init_server_state
+METADATA_STORE: Optional[MetadataStore] = None
+# Incremental rescans of the library roots, created by init_server_state
+LIBRARY_WATCHER: Optional[LibraryWatcher] = None
+# On-demand HLS remuxing with its segment cache, created by init_server_state
+HLS_PIPELINE: Optional[HLSPipeline] = None
+# Delivery rate of HLS segments per client, for ?rendition=auto (see ladder.py)
+THROUGHPUT: ThroughputMeter = ThroughputMeter()
+# Poster and seek-preview sprite generation, created by init_server_state
+THUMBNAILS: Optional[ThumbnailService] = None
+# Warms the next playlist item near the end of a stream (see prefetch.py), created by init_server_state
+PREFETCHER: Optional[Prefetcher] = None
+# This node's view of the other nodes in cluster mode (see cluster.py), created by init_server_state
+CLUSTER: Optional[Cluster] = None
+# Whether this process runs the background services; false in all gunicorn workers but one (see serving.py)
+BACKGROUND: bool = True
+# Touched by a process after it applied library changes, so the other
+# processes sharing the metadata cache rescan too (see _follow_library_changes)
+LIBRARY_STAMP: Optional[str] = None
+LIBRARY_STAMP_INTERVAL = 2.0   # seconds between checks of the stamp
+_library_stamp_seen: Optional[int] = None
+_library_stamp_checked = 0.0
 
 
 # --- Server State Initialization ---
-def init_server_state(video_files: List[Dict[str, str]]) -> None:
+def init_server_state(video_files: List[Dict[str, Any]], probe_workers: Optional[int] = None,
+                      wait_for_metadata: bool = False, metadata_db: Optional[str] = None,
+                      library_roots: Optional[List[str]] = None,
+                      rescan_interval: Optional[float] = None,
+                      hls_cache_dir: Optional[str] = None,
+                      thumbnail_cache_dir: Optional[str] = None,
+                      cluster_nodes: Optional[List[str]] = None,
+                      cluster_self: Optional[str] = None, background: bool = True) -> None:
     """
-    Initializes the server state with the list of available video files.
-    Pre-caches metadata for all videos.
+    Initializes the server state with the list of available video files
+    (dictionaries with 'filename' and 'path') by building the catalog.
+    Metadata still valid in the persistent cache (see metadata_store.py) is
+    loaded after a single stat pass; everything else is probed in the
+    background on a bounded pool (see probing.py). Pass
+    wait_for_metadata=True to block until probing is done.
+    When library_roots are given they can be rescanned incrementally via
+    /api/admin/rescan, and watched (every rescan_interval seconds and on
+    filesystem events when watchdog is installed) if rescan_interval is set.
+    HLS segments are cached in hls_cache_dir (see hls.py), thumbnails in
+    thumbnail_cache_dir (see thumbnails.py).
+    With cluster_nodes (base URLs, this node's cluster_self among them,
+    both defaulting to MEDIA_SERVER_CLUSTER_*) the server joins a cluster
+    sharing the library of all nodes (see cluster.py).
+    With background=False (gunicorn workers other than the leader, see
+    serving.py) nothing is probed or rescanned in the background: metadata
+    comes from the persistent cache the leader fills or is probed on
+    demand, and the library is rescanned after another process changed it.
     """
-    global AVAILABLE_VIDEOS, VIDEO_METADATA_CACHE
-    AVAILABLE_VIDEOS = video_files
+    global CATALOG, VIDEO_METADATA_CACHE, PROBER, METADATA_STORE, LIBRARY_WATCHER, HLS_PIPELINE, THUMBNAILS, PREFETCHER
+    global CLUSTER, METADATA_CHANGES, BACKGROUND, LIBRARY_STAMP, _library_stamp_seen
+    BACKGROUND = background
+    CATALOG = VideoCatalog(video_files)
     VIDEO_METADATA_CACHE = {} # Clear previous cache
+    METADATA_CHANGES = MetadataChanges()
+    FASTSTART_CACHE.clear()
+    KEYFRAMES.clear()
+    RENDER_CACHE.clear()
+    if PROBER is not None:
+        PROBER.shutdown()
 
-    if not AVAILABLE_VIDEOS:
+    db_path = metadata_db or metadata_store.DEFAULT_DB_PATH
+    if METADATA_STORE is None or METADATA_STORE.db_path != db_path:
+        if METADATA_STORE is not None:
+            METADATA_STORE.close()
+        try:
+            METADATA_STORE = MetadataStore(db_path)
+        except (OSError, sqlite3.Error) as e:
+            logger.error(f"Could not open metadata cache {db_path}, metadata will not persist: {e}")
+            METADATA_STORE = None
+
+    if METADATA_STORE is not None and CATALOG:
+        stats = {}
+        for video_data in CATALOG:
+            try:
+                stats[video_data.path] = os.stat(video_data.path)
+            except OSError:
+                pass
+        persisted = METADATA_STORE.load_valid(stats)
+        for video_data in CATALOG:
+            if video_data.path in persisted:
+                VIDEO_METADATA_CACHE[video_data.filename] = persisted[video_data.path]
+
+    PROBER = MetadataProber(get_video_info, VIDEO_METADATA_CACHE,
+                            max_workers=probe_workers or probing.DEFAULT_PROBE_WORKERS,
+                            on_result=_persist_metadata)
+
+    if not CATALOG:
         logger.warning("Server initialized with no video files.")
     else:
-        logger.info(f"Server initialized with {len(AVAILABLE_VIDEOS)} video files.")
-        # Pre-cache metadata for all videos
-        for video_data in AVAILABLE_VIDEOS:
-            try:
-                metadata = get_video_info(video_data['path'])
-                if metadata:
-                    VIDEO_METADATA_CACHE[video_data['filename']] = metadata
-                    logger.debug(f"Cached metadata for {video_data['filename']}")
-                else:
-                    logger.warning(f"Could not get metadata for {video_data['path']}")
-            except Exception as e:
-                logger.error(f"Error caching metadata for {video_data['path']}: {e}")
-
-def get_video_by_filename(filename: str) -> Optional[Dict[str, str]]:
-    """Finds a video in AVAILABLE_VIDEOS by its filename."""
-    for video in AVAILABLE_VIDEOS:
-        if video['filename'] == filename:
-            return video
-    return None
+        logger.info(f"Server initialized with {len(CATALOG)} video files "
+                    f"({len(VIDEO_METADATA_CACHE)} with cached metadata).")
+    if background:
+        PROBER.start(CATALOG)
+
+    hls_dir = hls_cache_dir or hls.DEFAULT_HLS_CACHE_DIR
+    if HLS_PIPELINE is None or HLS_PIPELINE.cache.root != os.path.abspath(hls_dir):
+        if HLS_PIPELINE is not None:
+            HLS_PIPELINE.shutdown()
+        try:
+            HLS_PIPELINE = HLSPipeline(hls_dir)
+        except OSError as e:
+            logger.error(f"Could not open HLS segment cache {hls_dir}, HLS is disabled: {e}")
+            HLS_PIPELINE = None
+
+    thumbnail_dir = thumbnail_cache_dir or thumbnails.DEFAULT_THUMBNAIL_CACHE_DIR
+    if THUMBNAILS is None or THUMBNAILS.cache.root != os.path.abspath(thumbnail_dir):
+        if THUMBNAILS is not None:
+            THUMBNAILS.shutdown()
+        try:
+            THUMBNAILS = ThumbnailService(thumbnail_dir, keyframes=_keyframe_times)
+        except OSError as e:
+            logger.error(f"Could not open thumbnail cache {thumbnail_dir}, thumbnails are disabled: {e}")
+            THUMBNAILS = None
+
+    if PREFETCHER is not None:
+        PREFETCHER.shutdown()
+        PREFETCHER = None
+    if prefetch.ENABLED:
+        PREFETCHER = Prefetcher(_prefetch_ranges, scheduler=streaming.SHAPER.scheduler)
+
+    if LIBRARY_WATCHER is not None:
+        LIBRARY_WATCHER.stop()
+        LIBRARY_WATCHER = None
+    if library_roots:
+        LIBRARY_WATCHER = LibraryWatcher(library_roots, apply_library_changes, interval=rescan_interval)
+        LIBRARY_WATCHER.seed(video_files)
+        if rescan_interval and background:
+            LIBRARY_WATCHER.start()
+    LIBRARY_STAMP = f"{db_path}.library" if library_roots and db_path != ':memory:' else None
+    _library_stamp_seen = _library_stamp()
+
+    if CLUSTER is not None:
+        CLUSTER.stop()
+        CLUSTER = None
+    try:
+        nodes = cluster_nodes if cluster_nodes is not None else cluster.parse_nodes(cluster.DEFAULT_NODES)
+        if nodes:
+            CLUSTER = Cluster(nodes, cluster_self or cluster.DEFAULT_SELF, lambda: CATALOG)
+            CLUSTER.start()
+            logger.info(f"Cluster mode: {CLUSTER.self_url} in a cluster of {len(nodes)} node(s), "
+                        f"{CLUSTER.routing} routing")
+    except ValueError as e:
+        logger.error(f"Invalid cluster configuration, serving the local library only: {e}")
+
+    if wait_for_metadata and background:
+        PROBER.wait()
+
+def shutdown_server_state() -> None:
+    """Stops background work (probing, library watching, remuxing, thumbnails, prefetching, cluster health checks), closes the metadata cache and pooled files."""
+    global PROBER, METADATA_STORE, LIBRARY_WATCHER, HLS_PIPELINE, THUMBNAILS, PREFETCHER, CLUSTER
+    if LIBRARY_WATCHER is not None:
+        LIBRARY_WATCHER.stop()
+        LIBRARY_WATCHER = None
+    if CLUSTER is not None:
+        CLUSTER.stop()
+        CLUSTER = None
+    if PREFETCHER is not None:
+        PREFETCHER.shutdown()
+        PREFETCHER = None
+    if PROBER is not None:
+        PROBER.shutdown()
+        PROBER = None
+    if METADATA_STORE is not None:
+        METADATA_STORE.close()
+        METADATA_STORE = None
+    if HLS_PIPELINE is not None:
+        HLS_PIPELINE.shutdown()
+        HLS_PIPELINE = None
+    if THUMBNAILS is not None:
+        THUMBNAILS.shutdown()
+        THUMBNAILS = None
+    streaming.HANDLE_POOL.close_all()
+
+def apply_library_changes(changes: LibraryChanges) -> None:
+    """
+    Applies the result of an incremental rescan: swaps in an updated catalog
+    and drops or re-probes metadata for only the affected files. Streams in
+    flight keep the path they resolved and are not interrupted.
+    """
+    global CATALOG
+    removed = [video['filename'] for video in changes.removed]
+    CATALOG = CATALOG.updated(changes.added, removed, sort_key=natural_sort_key, changed=changes.changed)
+
+    for video in changes.removed + changes.changed:
+        VIDEO_METADATA_CACHE.pop(video['filename'], None)
+    streaming.HANDLE_POOL.invalidate(video['path'] for video in changes.removed + changes.changed)
+    FASTSTART_CACHE.invalidate(video['path'] for video in changes.removed + changes.changed)
+    KEYFRAMES.invalidate(video['path'] for video in changes.removed + changes.changed)
+    if THUMBNAILS is not None:
+        THUMBNAILS.forget([video['path'] for video in changes.removed + changes.changed])
+    if PREFETCHER is not None:
+        PREFETCHER.forget(video['path'] for video in changes.removed + changes.changed)
+    if METADATA_STORE is not None and changes.removed:
+        METADATA_STORE.delete(video['path'] for video in changes.removed)
+
+    to_probe = [CATALOG.get(video['filename']) for video in changes.added + changes.changed]
+    to_probe = [entry for entry in to_probe if entry is not None]
+    if PROBER is not None and BACKGROUND and to_probe:
+        PROBER.submit(to_probe)
+    _touch_library_stamp()
+
+def _library_stamp() -> Optional[int]:
+    if LIBRARY_STAMP is None:
+        return None
+    try:
+        return os.stat(LIBRARY_STAMP).st_mtime_ns
+    except OSError:
+        return None
+
+def _touch_library_stamp() -> None:
+    global _library_stamp_seen
+    if LIBRARY_STAMP is None:
+        return
+    try:
+        with open(LIBRARY_STAMP, 'a'):
+            pass
+        os.utime(LIBRARY_STAMP)
+    except OSError as e:
+        logger.warning(f"Could not touch {LIBRARY_STAMP}, other workers will not rescan: {e}")
+    _library_stamp_seen = _library_stamp()
+
+def _rescan_library() -> None:
+    try:
+        LIBRARY_WATCHER.rescan()
+    except Exception as e:
+        logger.error(f"Library rescan failed: {e}")
+
+@app.before_request
+def _follow_library_changes():
+    """Rescans in the background once another process (gunicorn worker) has applied library changes."""
+    global _library_stamp_seen, _library_stamp_checked
+    now = time.monotonic()
+    if LIBRARY_WATCHER is None or LIBRARY_STAMP is None or now - _library_stamp_checked < LIBRARY_STAMP_INTERVAL:
+        return
+    _library_stamp_checked = now
+    stamp = _library_stamp()
+    if stamp is not None and stamp != _library_stamp_seen:
+        _library_stamp_seen = stamp
+        threading.Thread(target=_rescan_library, name='library-follow', daemon=True).start()
+
+def _persist_metadata(filename: str, path: str, metadata: Dict[str, Any], st: os.stat_result) -> None:
+    """
+    Writes freshly probed metadata to the persistent cache, valid for the
+    file as it was stat'ed before the probe, and publishes it to cluster peers.
+    """
+    METADATA_CHANGES.record(filename)
+    if METADATA_STORE is not None:
+        METADATA_STORE.put(path, metadata, st)
+
+def get_video_by_filename(filename: str) -> Optional[VideoEntry]:
+    """Finds a video in the catalog by its filename."""
+    return CATALOG.get(filename)
+
+def listing_catalog() -> VideoCatalog:
+    """The videos the playlist lists: the local catalog, or the whole cluster's in cluster mode."""
+    if CLUSTER is None:
+        return CATALOG
+    return CLUSTER.listing()
+
+def listed_metadata(filename: str) -> Optional[Dict[str, Any]]:
+    """Cached metadata of a listed video, local or held by another node."""
+    if CLUSTER is None or filename in CATALOG:
+        return VIDEO_METADATA_CACHE.get(filename)
+    return CLUSTER.remote_metadata(filename)
+
+def get_video_metadata(video_data: VideoEntry) -> Optional[Dict[str, Any]]:
+    """Returns cached metadata, probing on demand (or awaiting the background probe) if needed."""
+    metadata = VIDEO_METADATA_CACHE.get(video_data.filename)
+    metrics.METADATA_CACHE.inc(labels=('hit' if metadata is not None else 'miss',))
+    if metadata is None and METADATA_STORE is not None:
+        # Probed by another process (the gunicorn leader) since this one started
+        try:
+            metadata = METADATA_STORE.get(video_data.path, os.stat(video_data.path))
+        except (OSError, sqlite3.Error, ValueError):
+            metadata = None
+        if metadata is not None:
+            VIDEO_METADATA_CACHE[video_data.filename] = metadata
+    if metadata is None and PROBER is not None:
+        metadata = PROBER.get(video_data.filename, video_data.path)
+    elif metadata is None:
+        metadata = get_video_info(video_data.path)
+    return metadata
+
+def get_keyframes(video_path: str, st: os.stat_result) -> Tuple[Optional[KeyframeIndex], Optional[FaststartLayout]]:
+    """
+    Returns the keyframe index of a file and the faststart layout it is
+    served in (if any), whose offsets the index's file offsets map to.
+    """
+    index = KEYFRAMES.get(video_path, st, METADATA_STORE)
+    layout = None
+    if index is not None and faststart.ENABLED and faststart.is_candidate(video_path):
+        layout = FASTSTART_CACHE.get(video_path, st)
+    return index, layout
+
+def _keyframe_times(video_path: str) -> Optional[Sequence[float]]:
+    """Keyframe times of a file, for snapping sprite tiles (see thumbnails.py); None without an index."""
+    index = KEYFRAMES.get(video_path, os.stat(video_path), METADATA_STORE)
+    return index.times if index is not None else None
+
+# --- Prefetching ---
+def _prefetch_ranges(video_path: str, st: os.stat_result, duration: Optional[float]) -> List[Tuple[int, int]]:
+    """
+    Prepares a video the way its first /stream request would (faststart
+    layout, keyframe index) and returns the file ranges holding the first
+    seconds of it as served, for the prefetcher to read.
+    """
+    layout = None
+    if faststart.ENABLED and faststart.is_candidate(video_path):
+        layout = FASTSTART_CACHE.get(video_path, st)
+    KEYFRAMES.get(video_path, st, METADATA_STORE)
+    bitrate = readahead.video_bitrate(st.st_size, duration)
+    length = prefetch.warm_length(st.st_size, bitrate)
+    if layout is None:
+        return [(0, length)]
+    return [(offset, size) for offset, size, data in layout.map_range(0, length) if data is None]
+
+def _observe_playback(video_label: str, video_path: str, st: os.stat_result, start: int, length: int,
+                      bitrate: Optional[float], layout: Optional[FaststartLayout]) -> bool:
+    """
+    Tells the prefetcher about a stream request for `length` bytes from
+    `start` (in the layout served) and queues the next playlist item once
+    playback nears the end. Returns whether the requested bytes had been
+    prefetched.
+    """
+    if PREFETCHER is None:
+        return False
+    # Warmed ranges are file offsets (see _prefetch_ranges)
+    file_start = start
+    if layout is not None:
+        offsets = [offset for offset, _, data in layout.map_range(start, max(length, 1)) if data is None]
+        file_start = offsets[0] if offsets else layout.moov_offset
+    prefetched = PREFETCHER.observe(video_path, st, file_start)
+    if PREFETCHER.playback(request.remote_addr or '', video_path, start, length, st.st_size, bitrate):
+        next_video = CATALOG.next_after(video_label)
+        if next_video is not None:
+            metadata = VIDEO_METADATA_CACHE.get(next_video.filename)
+            PREFETCHER.submit(next_video.path, metadata.get('duration') if metadata else None)
+    return prefetched
 
 # --- Video Metadata ---
+def guess_video_mime_type(video_path: str) -> str:
+    """Guesses the MIME type of a video file from its extension."""
+    mime_type, _ = mimetypes.guess_type(video_path)
+    if not mime_type:
+        # Fallback if mime type can't be guessed based on extension
+        if video_path.lower().endswith(('.mp4', '.m4v')):
+            mime_type = 'video/mp4'
+        elif video_path.lower().endswith('.mkv'):
+            mime_type = 'video/x-matroska' # Common, though not always standard
+        elif video_path.lower().endswith('.webm'):
+            mime_type = 'video/webm'
+        elif video_path.lower().endswith('.mov'):
+            mime_type = 'video/quicktime'
+        else:
+            mime_type = 'application/octet-stream' # Generic fallback
+    return mime_type
+
 def get_video_info(video_path: str) -> Optional[Dict[str, Any]]:
     """
-    Retrieves video metadata (resolution, duration, FPS) for a given video file path.
+    Retrieves video metadata (resolution, duration, FPS, codec) for a given video file path.
+    The container headers are parsed directly when possible (see containers.py),
+    OpenCV is only used for formats the header parser does not handle.
     """
     if not os.path.exists(video_path):
         logger.error(f"Video file not found at path: {video_path}")
         return None
-    try:
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            logger.error(f"Could not open video file: {video_path}")
-            return None
-
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        duration = frame_count / fps if fps > 0 else 0
-        
-        cap.release()
-
-        # Guess mime type
-        mime_type, _ = mimetypes.guess_type(video_path)
-        if not mime_type:
-             # Fallback if mime type can't be guessed based on extension
-            if video_path.lower().endswith(('.mp4', '.m4v')):
-                mime_type = 'video/mp4'
-            elif video_path.lower().endswith('.mkv'):
-                mime_type = 'video/x-matroska' # Common, though not always standard
-            elif video_path.lower().endswith('.webm'):
-                mime_type = 'video/webm'
-            elif video_path.lower().endswith('.mov'):
-                mime_type = 'video/quicktime'
-            else:
-                mime_type = 'application/octet-stream' # Generic fallback
-
-        info = {
-            "filename": os.path.basename(video_path),
-            "path": video_path,
-            "width": width,
-            "height": height,
-            "fps": fps,
-            "duration": duration,
-            "frame_count": frame_count,
-            "mime_type": mime_type
-        }
-        logger.info(f"Retrieved video info for {video_path}: W={width}, H={height}, Dur={duration:.2f}s, FPS={fps:.2f}, Mime={mime_type}")
-        return info
-    except Exception as e:
-        logger.error(f"Error getting video info for {video_path} using OpenCV: {e}")
-        return None
+
+    started = time.perf_counter()
+    info, probe = _probe_video(video_path)
+    metrics.PROBE_DURATION.observe(time.perf_counter() - started, (probe if info else 'failed',))
+    return info
+
+def _probe_video(video_path: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """Probes a video for get_video_info(); returns (info, probe method)."""
+    probe = 'header'
+    header_info = containers.probe_container(video_path)
+    if header_info is not None:
+        width = header_info['width']
+        height = header_info['height']
+        fps = header_info['fps']
+        frame_count = header_info['frame_count']
+        duration = header_info['duration']
+        codec = header_info['codec']
+    else:
+        probe = 'opencv'
+        try:
+            import cv2  # imported on first use, most containers never need it
+            cap = cv2.VideoCapture(video_path)
+            if not cap.isOpened():
+                logger.error(f"Could not open video file: {video_path}")
+                return None, probe
+
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            duration = frame_count / fps if fps > 0 else 0
+            fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+            codec = fourcc.to_bytes(4, 'little').decode('latin-1').strip('\x00 ') if fourcc > 0 else ''
+
+            cap.release()
+        except Exception as e:
+            logger.error(f"Error getting video info for {video_path} using OpenCV: {e}")
+            return None, probe
+
+    mime_type = guess_video_mime_type(video_path)
+
+    info = {
+        "filename": os.path.basename(video_path),
+        "path": video_path,
+        "width": width,
+        "height": height,
+        "fps": fps,
+        "duration": duration,
+        "frame_count": frame_count,
+        "codec": codec,
+        "mime_type": mime_type
+    }
+    logger.info(f"Retrieved video info for {video_path} ({probe}): W={width}, H={height}, Dur={duration:.2f}s, FPS={fps:.2f}, Mime={mime_type}")
+    return info, probe
 
 # --- HTTP Byte-Range Streaming Logic ---
-def send_video_range_request(video_path: str, range_header: Optional[str]) -> Response:
+def send_video_range_request(video_path: str, range_header: Optional[str],
+                             duration: Optional[float] = None, video_label: Optional[str] = None) -> Response:
     """
     Handles serving a video file with support for HTTP byte range requests.
-    Takes the full path to the video file.
+    Takes the full path to the video file. Single ranges are answered with a
+    206, several ranges with a multipart/byteranges 206, unsatisfiable ranges
+    with a 416 and missing or malformed Range headers with the full file.
+    Conditional headers (If-None-Match, If-Modified-Since, If-Range) are
+    evaluated against the file's ETag and Last-Modified. The video's
+    `duration`, when known, tunes chunk sizes and read-ahead to its bitrate.
+    MP4s with the moov box at the end are served in their faststart layout.
+    Bodies are counted in the stream metrics under `video_label` (by default
+    the file name).
     """
-    if not os.path.exists(video_path):
+    started = g.get('request_started', time.perf_counter())
+    video_label = video_label or os.path.basename(video_path)
+    try:
+        st = os.stat(video_path)
+    except OSError:
         logger.error(f"Video file not found for streaming: {video_path}")
         return Response("Video file not found.", status=404)
 
-    file_size = os.path.getsize(video_path)
-    _, mime_type = mimetypes.guess_type(video_path)
-    if mime_type is None: # Fallback for unknown types
-        mime_type = 'application/octet-stream'
-        logger.warning(f"Could not guess MIME type for {video_path}, using {mime_type}")
+    file_size = st.st_size
+    bitrate = readahead.video_bitrate(file_size, duration)
+    mime_type = guess_video_mime_type(video_path)
+    layout: Optional[FaststartLayout] = None
+    if faststart.ENABLED and faststart.is_candidate(video_path):
+        layout = FASTSTART_CACHE.get(video_path, st)
+    etag, last_modified = conditional.file_validators(st, variant='fs' if layout is not None else '')
 
     headers = {
         'Content-Type': mime_type,
         'Content-Length': str(file_size),
-        'Accept-Ranges': 'bytes'
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Cache-Control': conditional.CACHE_CONTROL_STREAM
     }
 
+    if conditional.is_not_modified(request.headers, etag, last_modified):
+        del headers['Content-Length']
+        return Response(status=304, headers=headers)
+
+    if range_header and not conditional.if_range_allows(request.headers, etag, last_modified):
+        logger.debug(f"If-Range validator is stale for {os.path.basename(video_path)}, sending full file")
+        range_header = None
+
+    spans = None
     if range_header:
-        range_match = re.search(r'bytes=(\d+)-(\d*)', range_header)
-        if range_match:
-            start_byte = int(range_match.group(1))
-            end_byte_str = range_match.group(2)
-            
-            if end_byte_str:
-                end_byte = int(end_byte_str)
-            else:
-                # If no end byte, serve a chunk (e.g., 1MB or 2MB) or to the end of file if small
-                # For robust streaming, clients usually specify the end or request small chunks
-                # Let's define a sensible chunk size, or go to end if it's the last part.
-                # Many players request specific small ranges or up to end of file.
-                end_byte = file_size - 1 # Default to serving till the end of the file
-
-            # Ensure range is valid
-            if start_byte >= file_size or end_byte >= file_size or start_byte > end_byte:
-                logger.warning(f"Invalid range request: {range_header} for file size {file_size}")
-                return Response("Requested Range Not Satisfiable", status=416, headers={'Content-Range': f'bytes */{file_size}'})
-
-            length = end_byte - start_byte + 1
-            headers['Content-Length'] = str(length)
-            headers['Content-Range'] = f'bytes {start_byte}-{end_byte}/{file_size}'
-            
-            status_code = 206 # Partial Content
-
-            def generate_chunks():
-                with open(video_path, 'rb') as f:
-                    f.seek(start_byte)
-                    bytes_to_send = length
-                    while bytes_to_send > 0:
-                        chunk_size = min(bytes_to_send, 65536) # 64KB chunks
-                        data_chunk = f.read(chunk_size)
-                        if not data_chunk:
-                            break
-                        yield data_chunk
-                        bytes_to_send -= len(data_chunk)
-            
-            logger.info(f"Serving range: {start_byte}-{end_byte} for {os.path.basename(video_path)}")
-            return Response(generate_chunks(), status=status_code, headers=headers)
-        else:
+        try:
+            spans = ranges.parse_range_header(range_header, file_size)
+        except ranges.RangeNotSatisfiable:
+            logger.warning(f"Invalid range request: {range_header} for file size {file_size}")
+            return Response("Requested Range Not Satisfiable", status=416, headers={'Content-Range': f'bytes */{file_size}'})
+        if spans is None:
+            # RFC 7233: a Range header we cannot parse is ignored
             logger.warning(f"Malformed Range header: {range_header}")
-            # Fall through to serving the full file if range is malformed, or return error
-            # For simplicity, let's serve full file if range parsing fails but header exists
-            pass # This will lead to serving the full file below
+        else:
+            spans = ranges.cap_open_ended(range_header, spans)
+
+    start, length = (spans[0][0], spans[0][1] - spans[0][0] + 1) if spans else (0, file_size)
+    prefetched = _observe_playback(video_label, video_path, st, start, length, bitrate, layout)
+
+    if spans and len(spans) == 1:
+        start_byte, end_byte = spans[0]
+        length = end_byte - start_byte + 1
+        headers['Content-Length'] = str(length)
+        headers['Content-Range'] = f'bytes {start_byte}-{end_byte}/{file_size}'
+
+        body, direct_passthrough = streaming.open_range_body(request.environ, video_path, start_byte, length,
+                                                             st, bitrate, layout)
+        body = metrics.track_stream(body, direct_passthrough, video_label, length, started, prefetched)
+        logger.log(metrics.REQUEST_LOG_LEVEL, f"Serving range: {start_byte}-{end_byte} for {os.path.basename(video_path)}")
+        return Response(body, status=206, headers=headers, direct_passthrough=direct_passthrough)
+
+    if spans:
+        body, content_type, content_length = streaming.build_multipart_ranges(video_path, spans, file_size, mime_type,
+                                                                                  st, layout, request.environ)
+        body = streaming.SHAPER.shape(body, request.remote_addr or '', content_length)
+        body = metrics.track_stream(body, False, video_label, content_length, started, prefetched)
+        headers['Content-Type'] = content_type
+        headers['Content-Length'] = str(content_length)
+        logger.log(metrics.REQUEST_LOG_LEVEL, f"Serving {len(spans)} ranges as multipart/byteranges for {os.path.basename(video_path)}")
+        return Response(body, status=206, headers=headers)
 
     # If no range_header or malformed, serve the full file
-    logger.info(f"Serving full file: {os.path.basename(video_path)}")
-    def generate_full_file():
-        with open(video_path, 'rb') as f:
-            while True:
-                data_chunk = f.read(65536) # 64KB chunks
-                if not data_chunk:
-                    break
-                yield data_chunk
-    return Response(generate_full_file(), status=200, headers=headers)
+    logger.log(metrics.REQUEST_LOG_LEVEL, f"Serving full file: {os.path.basename(video_path)}")
+    body, direct_passthrough = streaming.open_range_body(request.environ, video_path, 0, file_size, st, bitrate, layout)
+    body = metrics.track_stream(body, direct_passthrough, video_label, file_size, started, prefetched)
+    return Response(body, status=200, headers=headers, direct_passthrough=direct_passthrough)
+
+
+# --- Instrumentation ---
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_request(response: Response) -> Response:
+    """Counts the response in the metrics and writes its access log line."""
+    duration = time.perf_counter() - g.get('request_started', time.perf_counter())
+    endpoint = request.endpoint or 'unmatched'
+    metrics.HTTP_REQUESTS.inc(labels=(endpoint, str(response.status_code)))
+    if endpoint == 'stream_video':
+        metrics.STREAM_LATENCY.observe(duration)
+    metrics.log_access(request.environ, response.status_code, response.content_length, duration)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Exposes counters and histograms in the Prometheus text format."""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 
 # --- Flask Routes ---
@@ -189,67 +602,508 @@ def send_video_range_request(video_path: str, range_header: Optional[str]) -> Re
 @app.route('/')
 def index():
     """Serves the main HTML page with the video gallery."""
-    if not AVAILABLE_VIDEOS:
+    current = listing_catalog()
+    if not current:
         logger.warning("Index route called but no videos available.")
         # Create a simple message or render a 'no_video_loaded_yet.html' if you want
         # For now, let's pass an empty list to index.html, which should handle it.
         return render_template('no_video.html', message="No video directory has been loaded by the server.")
 
-    # Prepare a list of video filenames for the template
-    # The template will use these filenames to construct stream and info URLs
-    video_filenames_for_template = [v['filename'] for v in AVAILABLE_VIDEOS]
-    
-    logger.info(f"Serving index page with {len(video_filenames_for_template)} videos.")
-    
+    # The playlist is loaded page by page from /api/videos by the template
+    logger.log(metrics.REQUEST_LOG_LEVEL, f"Serving index page with {len(current)} videos.")
+
     # Get primary IP for constructing full URLs if needed by template (e.g. for QR code in future)
     # For now, template will use relative URLs for /stream and /api/video_info
-    server_ip = utils.get_local_ip() # Changed from get_primary_ip_address
+    server_ip = utils.get_cached_local_ip()
+    video_count = len(current)
 
-    return render_template(
-        'index.html',
-        videos=video_filenames_for_template,
-        server_ip=server_ip # Pass server IP if template needs it for full URLs
-    )
+    # Rendered once per catalog version and address, and revalidated by the body hash
+    page = RENDER_CACHE.get(('index', current.version, server_ip), lambda: PrecompressedBody(
+        render_template('index.html', video_count=video_count, server_ip=server_ip).encode('utf-8'),
+        'text/html'))
+    return page.response(request, {'Cache-Control': conditional.CACHE_CONTROL_METADATA})
 
 @app.route('/stream/<path:video_filename>')
 def stream_video(video_filename: str):
-    """Streams the specified video file with byte-range support."""
-    logger.info(f"Received stream request for: {video_filename}")
-    
+    """
+    Streams the specified video file with byte-range support.
+    ?t=<seconds> without a Range header answers as if `Range: bytes=<offset>-`
+    had been sent for the keyframe at or before t: a 206 the client did not
+    ask a range for, which RFC 9110 does not provide for. It is meant for
+    players that open the URL directly (a redirect cannot add a Range
+    header); the Content-Range tells where the body starts, X-Keyframe-Time
+    the time it starts at. With a Range header t is ignored.
+    """
+    logger.log(metrics.REQUEST_LOG_LEVEL, f"Received stream request for: {video_filename}")
+    routed = route_to_node(video_filename, allow_redirect=True)
+    if routed is not None:
+        return routed
+
     video_data = get_video_by_filename(video_filename)
     if not video_data:
         logger.error(f"Video '{video_filename}' not found in available videos.")
         abort(404, description="Video not found")
         
-    video_path = video_data['path']
+    video_path = video_data.path
     range_header = request.headers.get('Range', None)
-    
-    return send_video_range_request(video_path, range_header)
+    metadata = VIDEO_METADATA_CACHE.get(video_filename)
+    duration = metadata.get('duration') if metadata else None
+
+    # ?t=<seconds> without a Range header: start at the keyframe at or before t
+    keyframe_time = None
+    seek = request.args.get('t')
+    if seek is not None and range_header is None:
+        try:
+            seconds = float(seek)
+        except ValueError:
+            seconds = -1.0
+        if not 0 <= seconds < float('inf'):
+            abort(400, description="t must be a non-negative number of seconds")
+        offset = None
+        try:
+            st = os.stat(video_path)
+            index, layout = get_keyframes(video_path, st)
+        except OSError:
+            st, index, layout = None, None, None
+        if index is not None:
+            keyframe_time, offset = index.find(seconds)
+            if layout is not None:
+                offset = layout.virtual_offset(offset)
+        elif duration and st is not None:
+            # No index (e.g. AVI): estimate the offset from the average bitrate, as a browser would
+            offset = int(st.st_size * min(seconds / duration, 1.0))
+        if offset is not None:
+            range_header = f'bytes={offset}-'
+
+    response = send_video_range_request(video_path, range_header, duration, video_filename)
+    if keyframe_time is not None and response.status_code == 206:
+        response.headers['X-Keyframe-Time'] = f"{keyframe_time:.3f}"
+    return response
+
+@app.route('/api/keyframes/<path:video_filename>')
+def api_keyframes(video_filename: str):
+    """
+    Returns the keyframes of a video as [time in seconds, byte offset] pairs,
+    with offsets in the layout /stream serves. 404 if the container has no
+    usable index.
+    """
+    routed = route_to_node(video_filename)
+    if routed is not None:
+        return routed
+    video_data = get_video_by_filename(video_filename)
+    if not video_data:
+        abort(404, description="Video not found")
+    try:
+        st = os.stat(video_data.path)
+    except OSError:
+        abort(404, description="Video not found")
+    index, layout = get_keyframes(video_data.path, st)
+    if index is None:
+        abort(404, description="No keyframe index for this video")
+    etag, last_modified = conditional.file_validators(st, weak=True, variant='kf-fs' if layout is not None else 'kf')
+
+    def render() -> PrecompressedBody:
+        offsets = list(index.offsets) if layout is None else [layout.virtual_offset(o) for o in index.offsets]
+        body = jsonify({"filename": video_filename, "count": len(index),
+                        "keyframes": [[round(t, 6), o] for t, o in zip(index.times, offsets)]})
+        return PrecompressedBody(body.get_data(), 'application/json', etag, last_modified)
+    body = RENDER_CACHE.get(('keyframes', video_filename, etag), render)
+    return body.response(request, {'Cache-Control': conditional.CACHE_CONTROL_METADATA})
 
 @app.route('/api/video_info/<path:video_filename>')
 def api_video_info(video_filename: str):
     """Returns metadata for the specified video file as JSON."""
-    logger.info(f"Received API video info request for: {video_filename}")
+    logger.log(metrics.REQUEST_LOG_LEVEL, f"Received API video info request for: {video_filename}")
+    routed = route_to_node(video_filename)
+    if routed is not None:
+        return routed
 
-    # Check if metadata is already cached
-    if video_filename in VIDEO_METADATA_CACHE:
-        logger.debug(f"Returning cached metadata for {video_filename}")
-        return jsonify(VIDEO_METADATA_CACHE[video_filename])
-
-    # If not cached (should have been by init_server_state, but as a fallback)
     video_data = get_video_by_filename(video_filename)
     if not video_data:
         logger.error(f"Video '{video_filename}' not found for info request.")
         abort(404, description="Video not found")
 
-    metadata = get_video_info(video_data['path'])
+    try:
+        etag, last_modified = conditional.file_validators(os.stat(video_data.path), weak=True)
+    except OSError:
+        logger.error(f"Video file for '{video_filename}' is missing at {video_data.path}")
+        abort(404, description="Video not found")
+    if conditional.is_not_modified(request.headers, etag, last_modified):
+        return Response(status=304, headers={'ETag': etag, 'Last-Modified': last_modified,
+                                             'Cache-Control': conditional.CACHE_CONTROL_METADATA,
+                                             'Vary': 'Accept-Encoding'})
+
+    # Served from the cache once the background probe has finished, otherwise
+    # probed on demand (or awaited if the probe is already running)
+    metadata = get_video_metadata(video_data)
     if metadata:
-        VIDEO_METADATA_CACHE[video_filename] = metadata # Cache it now
-        return jsonify(metadata)
+        # Serialized (and compressed) once per file version
+        body = RENDER_CACHE.get(('video_info', video_filename, etag), lambda: PrecompressedBody(
+            jsonify(metadata).get_data(), 'application/json', etag, last_modified))
+        return body.response(request, {'Cache-Control': conditional.CACHE_CONTROL_METADATA})
     else:
-        logger.error(f"Could not retrieve metadata for {video_filename} at {video_data['path']}")
+        logger.error(f"Could not retrieve metadata for {video_filename} at {video_data.path}")
         abort(500, description="Could not retrieve video metadata")
 
+# --- Catalog listing ---
+LISTING_DEFAULT_LIMIT = 50
+LISTING_MAX_LIMIT = 500
+BULK_METADATA_MAX_IDS = 500
+
+@app.route('/api/videos')
+def api_videos():
+    """
+    Lists the catalog a page at a time.
+    Query parameters: limit, cursor (from the previous page's next_cursor),
+    sort (name, size or mtime, prefixed with '-' for descending), q
+    (substring of the filename) and prefix (of the filename or basename).
+    The ETag is the catalog version, so unchanged listings revalidate with 304.
+    """
+    current = listing_catalog()  # rescans swap the catalog, keep one version per request
+    etag = f'"catalog-{current.version}"'
+    headers = {'ETag': etag, 'Cache-Control': conditional.CACHE_CONTROL_METADATA}
+    if conditional.is_not_modified(request.headers, etag, ''):
+        return Response(status=304, headers=headers)
+
+    sort = request.args.get('sort', 'name')
+    descending = sort.startswith('-')
+    order = sort.lstrip('-')
+    if order not in catalog.SORT_ORDERS:
+        abort(400, description=f"Unknown sort order, expected one of {', '.join(catalog.SORT_ORDERS)}")
+    limit = request.args.get('limit', LISTING_DEFAULT_LIMIT, type=int)
+    if limit is None or limit < 1:
+        abort(400, description="limit must be a positive integer")
+    limit = min(limit, LISTING_MAX_LIMIT)
+    query = request.args.get('q', '').strip()
+    prefix = request.args.get('prefix', '').strip()
+
+    try:
+        entries, next_cursor, total = current.page(order, descending, limit, request.args.get('cursor'),
+                                                   query, prefix)
+    except CursorError as e:
+        abort(400, description=str(e))
+    response = jsonify({
+        "version": current.version,
+        "total": total,
+        "videos": [entry.summary() for entry in entries],
+        "next_cursor": next_cursor,
+    })
+    response.headers.update(headers)
+    return response
+
+@app.route('/api/videos/metadata')
+def api_videos_metadata():
+    """
+    Returns cached metadata for many videos in one call: ?ids=1,2,3 (numeric
+    IDs). Videos whose metadata is not probed yet map to null; unknown IDs
+    are listed separately.
+    """
+    try:
+        ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        abort(400, description="ids must be a comma separated list of numeric video IDs")
+    if len(ids) > BULK_METADATA_MAX_IDS:
+        abort(400, description=f"At most {BULK_METADATA_MAX_IDS} ids per request")
+    current = listing_catalog()
+    videos: Dict[str, Optional[Dict[str, Any]]] = {}
+    unknown: List[int] = []
+    for video_id in ids:
+        entry = current.get_by_id(video_id)
+        if entry is None:
+            unknown.append(video_id)
+        else:
+            videos[str(video_id)] = listed_metadata(entry.filename)
+    response = jsonify({"videos": videos, "unknown": unknown})
+    response.headers['Cache-Control'] = conditional.CACHE_CONTROL_METADATA
+    return response
+
+# --- HLS ---
+def _hls_video(video_filename: str) -> Tuple[VideoEntry, Dict[str, Any]]:
+    """Resolves a video and its metadata for the HLS routes, aborting if it cannot be remuxed."""
+    video_data = get_video_by_filename(video_filename)
+    if not video_data:
+        logger.error(f"Video '{video_filename}' not found for HLS request.")
+        abort(404, description="Video not found")
+    if HLS_PIPELINE is None or not HLS_PIPELINE.available:
+        abort(503, description="HLS remuxing requires ffmpeg")
+    metadata = get_video_metadata(video_data)
+    if not metadata or not metadata.get('duration'):
+        abort(500, description="Video duration unknown, cannot build HLS playlist")
+    return video_data, metadata
+
+def _source_bandwidth(video_data: VideoEntry, metadata: Dict[str, Any]) -> Optional[int]:
+    """Average bits per second of the original file."""
+    try:
+        bitrate = readahead.video_bitrate(os.path.getsize(video_data.path), metadata.get('duration'))
+    except OSError:
+        return None
+    return int(bitrate * 8) if bitrate else None
+
+def _working_renditions(video_data: VideoEntry, metadata: Dict[str, Any]) -> List[Rendition]:
+    """The ladder of a video without the transcodes whose ffmpeg jobs have failed."""
+    renditions = ladder.renditions_for(metadata.get('height'))
+    try:
+        st = os.stat(video_data.path)
+    except OSError:
+        return renditions
+    return [rendition for rendition in renditions
+            if rendition.is_source or not HLS_PIPELINE.failed(video_data.path, st, rendition)]
+
+def _hls_rendition(video_data: VideoEntry, metadata: Dict[str, Any]) -> Rendition:
+    """The rendition named by ?rendition= (the source by default; 'auto' picks one by throughput)."""
+    name = request.args.get('rendition', ladder.SOURCE.name)
+    if name == 'auto':
+        throughput = THROUGHPUT.estimate(request.remote_addr or '')
+        return ladder.pick(_working_renditions(video_data, metadata), throughput,
+                           _source_bandwidth(video_data, metadata))
+    renditions = ladder.renditions_for(metadata.get('height'))
+    rendition = ladder.find(renditions, name)
+    if rendition is None:
+        abort(404, description=f"No rendition '{name}' for this video")
+    return rendition
+
+def _hls_plan(video_data: VideoEntry, st: os.stat_result, metadata: Dict[str, Any],
+              rendition: Rendition) -> hls.SegmentPlan:
+    """Segments of a rendition; stream copies are cut at the keyframes of the index."""
+    index = KEYFRAMES.get(video_data.path, st, METADATA_STORE) if rendition.is_source else None
+    return hls.plan_segments(metadata['duration'], rendition, index.times if index is not None else None)
+
+@app.route('/hls/<path:video_filename>/master.m3u8')
+def hls_master_playlist(video_filename: str):
+    """Returns the HLS master playlist listing the source and transcoded renditions of a video."""
+    routed = route_to_node(video_filename)
+    if routed is not None:
+        return routed
+    video_data, metadata = _hls_video(video_filename)
+    playlist = ladder.build_master_playlist(_working_renditions(video_data, metadata), metadata.get('width'),
+                                            metadata.get('height'), _source_bandwidth(video_data, metadata))
+    response = Response(playlist, mimetype='application/vnd.apple.mpegurl')
+    response.headers['Cache-Control'] = conditional.CACHE_CONTROL_METADATA
+    return response
+
+@app.route('/hls/<path:video_filename>/index.m3u8')
+def hls_playlist(video_filename: str):
+    """Returns the HLS playlist of a video rendition; segments are remuxed or transcoded when requested."""
+    routed = route_to_node(video_filename)
+    if routed is not None:
+        return routed
+    video_data, metadata = _hls_video(video_filename)
+    rendition = _hls_rendition(video_data, metadata)
+    try:
+        plan = _hls_plan(video_data, os.stat(video_data.path), metadata, rendition)
+    except OSError:
+        abort(404, description="Video not found")
+    response = Response(hls.build_playlist(plan, rendition), mimetype='application/vnd.apple.mpegurl')
+    response.headers['Cache-Control'] = conditional.CACHE_CONTROL_METADATA
+    if request.args.get('rendition') == 'auto':
+        response.headers['X-Rendition'] = rendition.name
+    return response
+
+@app.route('/hls/<path:video_filename>/<segment_name>')
+def hls_segment(video_filename: str, segment_name: str):
+    """Serves the init segment or a media segment, remuxing or transcoding it first if it is not cached."""
+    routed = route_to_node(video_filename)
+    if routed is not None:
+        return routed
+    video_data, metadata = _hls_video(video_filename)
+    rendition = _hls_rendition(video_data, metadata)
+    try:
+        st = os.stat(video_data.path)
+        plan = _hls_plan(video_data, st, metadata, rendition)
+        for attempt in range(2):
+            segment_path = HLS_PIPELINE.get_segment(video_data.path, st, plan, segment_name, rendition)
+            try:
+                response = send_file(segment_path, mimetype='video/mp4', conditional=True, max_age=3600)
+                break
+            except FileNotFoundError:
+                # Evicted (by this or another worker) between the lookup and the open:
+                # the next lookup produces it again
+                if attempt:
+                    raise
+    except (OSError, ValueError):
+        abort(404, description="Segment not found")
+    except HLSUnavailable as e:
+        logger.error(f"HLS segment {segment_name} of {video_filename} ({rendition.name}) unavailable: {e}")
+        abort(503, description=str(e))
+    if response.status_code == 200 and response.content_length:
+        _measure_throughput(response, request.remote_addr or '')
+    return response
+
+
+def _measure_throughput(response: Response, client: str) -> None:
+    """Records how fast a ready segment is sent to a client, for ?rendition=auto."""
+    size, sending = response.content_length, time.perf_counter()
+
+    def record() -> None:
+        THROUGHPUT.record(client, size, time.perf_counter() - sending)
+    if not response.direct_passthrough:
+        response.call_on_close(record)
+        return
+    # A wsgi.file_wrapper reaches the server as it is; the server closes it when the send is done
+    body = response.response
+    close = body.close
+
+    def close_and_record() -> None:
+        try:
+            close()
+        finally:
+            record()
+    try:
+        body.close = close_and_record
+    except AttributeError:  # wrapper without an instance dict, not measured
+        pass
+
+@app.route('/api/hls_stats')
+def api_hls_stats():
+    """Returns HLS job and segment cache statistics as JSON."""
+    if HLS_PIPELINE is None:
+        return jsonify({"available": False})
+    return jsonify(HLS_PIPELINE.stats())
+
+# --- Thumbnails ---
+_THUMBNAIL_MIME_TYPES = {thumbnails.POSTER: 'image/jpeg', thumbnails.SPRITE: 'image/jpeg',
+                         thumbnails.SPRITE_VTT: 'text/vtt'}
+
+@app.route('/thumbnails/<path:video_filename>/<asset>')
+def thumbnail_asset(video_filename: str, asset: str):
+    """
+    Serves a video's poster, sprite sheet or sprite WebVTT index. Assets not
+    generated yet are queued and answered with 202 Accepted and Retry-After.
+    """
+    routed = route_to_node(video_filename)
+    if routed is not None:
+        return routed
+    video_data = get_video_by_filename(video_filename)
+    if not video_data or asset not in _THUMBNAIL_MIME_TYPES:
+        abort(404, description="Thumbnail not found")
+    if THUMBNAILS is None:
+        abort(503, description="Thumbnails are disabled")
+    try:
+        key, asset_path = THUMBNAILS.get(video_data.path, os.stat(video_data.path), asset)
+    except (OSError, ThumbnailError) as e:
+        logger.debug(f"No {asset} for {video_filename}: {e}")
+        abort(404, description="Thumbnail not available")
+    if asset_path is not None:
+        try:
+            return send_file(asset_path, mimetype=_THUMBNAIL_MIME_TYPES[asset], conditional=True,
+                             etag=f"{key}-{asset}", max_age=3600)
+        except FileNotFoundError:
+            # Evicted since the lookup (by this or another worker): the retry queues it again
+            pass
+    return Response(status=202, headers={'Retry-After': '2', 'Cache-Control': 'no-store'})
+
+@app.route('/api/thumbnail_stats')
+def api_thumbnail_stats():
+    """Returns thumbnail queue and cache statistics as JSON."""
+    if THUMBNAILS is None:
+        return jsonify({"enabled": False})
+    return jsonify(THUMBNAILS.stats())
+
+def _admin_request_allowed() -> bool:
+    """
+    Admin endpoints require the MEDIA_SERVER_ADMIN_TOKEN in an X-Admin-Token
+    header when the token is configured, and a local client otherwise.
+    """
+    token = os.environ.get('MEDIA_SERVER_ADMIN_TOKEN')
+    if token:
+        return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+@app.route('/api/admin/rescan', methods=['POST'])
+def api_admin_rescan():
+    """Rescans the library roots and applies only the differences."""
+    if not _admin_request_allowed():
+        abort(403, description="Admin access denied")
+    if LIBRARY_WATCHER is None:
+        abort(409, description="Server was started without library roots, nothing to rescan")
+    changes = LIBRARY_WATCHER.rescan()
+    logger.info(f"Admin rescan requested: {changes.summary()}")
+    return jsonify(dict(changes.summary(), total=len(CATALOG)))
+
+@app.route('/api/probe_status')
+def api_probe_status():
+    """Returns the progress of the background metadata probing as JSON."""
+    if PROBER is None:
+        return jsonify({"total": 0, "done": 0, "failed": 0, "finished": True})
+    return jsonify(PROBER.progress())
+
+@app.route('/api/cache_stats')
+def api_cache_stats():
+    """Returns the block cache, file handle pool, faststart layout, keyframe index, render cache and prefetch counters as JSON."""
+    return jsonify({"block_cache": streaming.BLOCK_CACHE.stats(),
+                    "handle_pool": streaming.HANDLE_POOL.stats(),
+                    "faststart": FASTSTART_CACHE.stats(),
+                    "keyframes": KEYFRAMES.stats(),
+                    "render": RENDER_CACHE.stats(),
+                    "prefetch": PREFETCHER.stats() if PREFETCHER is not None else {"enabled": False}})
+
+@app.route('/api/stream_stats')
+def api_stream_stats():
+    """Returns bandwidth shaping and fair-share scheduler metrics as JSON."""
+    return jsonify(streaming.SHAPER.stats())
+
+# --- Cluster ---
+def route_to_node(video_filename: str, allow_redirect: bool = False) -> Optional[Response]:
+    """
+    In cluster mode, sends a request for a video held by another node there:
+    a 307 redirect if `allow_redirect` and the cluster routes by redirects,
+    otherwise the proxied response. Returns None when the video is served
+    (or not found) here, and for requests another node routed already.
+    """
+    if CLUSTER is None or request.headers.get(cluster.HOP_HEADER) or request.args.get(cluster.HOP_PARAM):
+        return None
+    node = CLUSTER.locate(video_filename)
+    if node is None or node == CLUSTER.self_url:
+        cluster.CLUSTER_ROUTED.inc(labels=('local',))
+        return None
+    query = request.query_string.decode('latin-1')
+    if allow_redirect and CLUSTER.routing == 'redirect':
+        cluster.CLUSTER_ROUTED.inc(labels=('redirect',))
+        query = f"{query}&{cluster.HOP_PARAM}=1" if query else f"{cluster.HOP_PARAM}=1"
+        return redirect(f"{node}{urllib.parse.quote(request.path)}?{query}", code=307)
+    cluster.CLUSTER_ROUTED.inc(labels=('proxy',))
+    url = f"{node}{urllib.parse.quote(request.path)}" + (f"?{query}" if query else '')
+    headers = {name: request.headers[name] for name in cluster.PROXIED_REQUEST_HEADERS if name in request.headers}
+    try:
+        status, response_headers, body = cluster.forward(url, headers)
+    except OSError as e:
+        logger.error(f"Cluster node {node} unreachable for {video_filename}: {e}")
+        abort(502, description="The node holding this video is unreachable")
+    return Response(body, status=status, headers=response_headers)
+
+@app.route('/api/cluster/health')
+def api_cluster_health():
+    """Health check polled by the other nodes, with the catalog version and the metadata generation."""
+    return jsonify({"node": CLUSTER.self_url if CLUSTER is not None else None,
+                    "version": CATALOG.version, "metadata": METADATA_CHANGES.token()})
+
+@app.route('/api/cluster/videos')
+def api_cluster_videos():
+    """
+    This node's catalog with its cached metadata, for the listings of the
+    other nodes. With ?since=<metadata token> only the videos whose metadata
+    changed after it are listed ("delta": true), unless the token is stale.
+    """
+    current = CATALOG
+    token = METADATA_CHANGES.token()  # taken first: later changes are listed again next time
+    since = request.args.get('since')
+    changed = METADATA_CHANGES.since(since) if since else None
+    entries = list(current) if changed is None else [current.get(filename) for filename in changed if filename in current]
+    return jsonify({
+        "version": current.version,
+        "metadata": token,
+        "delta": changed is not None,
+        "videos": [{"filename": entry.filename, "size": entry.size, "mtime_ns": entry.mtime_ns,
+                    "metadata": VIDEO_METADATA_CACHE.get(entry.filename)} for entry in entries],
+    })
+
+@app.route('/api/cluster/status')
+def api_cluster_status():
+    """Returns the ring, peer health and how the local files match their owners as JSON."""
+    if CLUSTER is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(CLUSTER.stats(), enabled=True, placement=CLUSTER.placement()))
+
 
 # --- Old single video related code - To be removed or commented out ---
 # VIDEO_FILE_PATH: Optional[str] = None
@@ -301,7 +1155,6 @@ if __name__ == '__main__':
          logger.warning(f"Could not create/find dummy videos in {test_video_dir} for testing.")
          logger.warning("Please create some files like 'test1.mp4', 'test2.mkv' in a subdirectory for server.py direct testing.")
 
-    init_server_state(video_files=created_video_files_for_test)
     
     # A simple IP for testing if utils isn't fully set up or get_primary_ip_address fails
     try:
@@ -314,9 +1167,9 @@ if __name__ == '__main__':
     port = 5005 # Use a different port for direct testing
     print(f"\n --- Server.py Direct Test Mode --- ")
     print(f"Open your browser to http://{server_ip_test}:{port}/")
-    if AVAILABLE_VIDEOS:
+    if created_video_files_for_test:
         print("Available videos for testing:")
-        for v_test in AVAILABLE_VIDEOS:
+        for v_test in created_video_files_for_test:
             print(f"  - {v_test['filename']}")
             print(f"    Stream: http://{server_ip_test}:{port}/stream/{v_test['filename']}")
             print(f"    Info:   http://{server_ip_test}:{port}/api/video_info/{v_test['filename']}")
@@ -324,4 +1177,7 @@ if __name__ == '__main__':
         print("No test videos loaded. Index page may be empty or show an error.")
     print(" ---------------------------------- ")
 
-    app.run(host='0.0.0.0', port=port, debug=True, threaded=True) 
\ No newline at end of file
+    # MEDIA_SERVER_ENGINE=gunicorn|waitress exercises the production engines
+    serving.run(app, serving.ServingConfig.from_env(port=port, debug=True),
+                init_state=lambda **kwargs: init_server_state(video_files=created_video_files_for_test, **kwargs),
+                shutdown_state=shutdown_server_state)
@@ -0,0 +1,239 @@
+"""
+Serving engines.
+
+The Flask development server (`app.run(threaded=True)`) spawns an unbounded
+thread per connection. For real deployments pick one of:
+
+- ``gunicorn``: pre-fork workers, each with a bounded thread pool (gthread),
+  per-worker connection limit, keep-alive and graceful shutdown. Responses
+  built by streaming.open_range_body are sent with os.sendfile. One worker,
+  the one holding the leader lock, runs the background services (probing,
+  library watching); the others keep only the state requests need.
+- ``waitress``: single process with a fixed thread pool and a connection
+  limit; works on Windows.
+- ``asyncio``: single process, event-loop connection handling (see
+  aio_server); file responses go out with loop.sendfile, so thousands of
+  idle or slow playback connections don't each hold a thread.
+- ``dev``: the Werkzeug development server, for local testing.
+
+gunicorn, waitress and the asyncio engine are imported only when selected.
+"""
+
+import os
+import math
+import signal
+import tempfile
+import logging
+import multiprocessing
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+ENGINE_DEV = 'dev'
+ENGINE_GUNICORN = 'gunicorn'
+ENGINE_WAITRESS = 'waitress'
+ENGINE_ASYNCIO = 'asyncio'
+ENGINES = (ENGINE_DEV, ENGINE_GUNICORN, ENGINE_WAITRESS, ENGINE_ASYNCIO)
+
+
+def leader_lock_path(port: int) -> str:
+    """Lock file electing the gunicorn worker that runs the background services."""
+    return os.path.join(tempfile.gettempdir(), f'media-server-{port}.leader')
+
+
+def _claim_leadership(path: str) -> Optional[Any]:
+    """Returns the open lock file if this process became the leader, None if another one is."""
+    import fcntl  # gunicorn only runs on POSIX
+    handle = open(path, 'a')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+def _default_workers() -> int:
+    # Streaming is I/O bound; a couple of processes per core is plenty
+    return min(max(2, multiprocessing.cpu_count()), 8)
+
+
+@dataclass
+class ServingConfig:
+    """Settings shared by all engines; engines ignore what they don't support."""
+    engine: str = ENGINE_DEV
+    host: str = '0.0.0.0'
+    port: int = 5000
+    workers: int = 0               # worker processes (gunicorn), 0 = automatic
+    threads: int = 16              # request threads per worker
+    max_connections: int = 1000    # simultaneous client connections per worker
+    keepalive: float = 5.0         # seconds an idle keep-alive connection is kept
+    graceful_timeout: float = 30.0 # seconds to finish in-flight requests on shutdown
+    backlog: int = 2048            # listen() backlog
+    debug: bool = False
+
+    @classmethod
+    def from_env(cls, **overrides: Any) -> 'ServingConfig':
+        """Builds a config from MEDIA_SERVER_* environment variables, then overrides."""
+        env_fields: Dict[str, Callable[[str], Any]] = {
+            'engine': str, 'host': str, 'port': int, 'workers': int, 'threads': int,
+            'max_connections': int, 'keepalive': float, 'graceful_timeout': float, 'backlog': int,
+        }
+        values: Dict[str, Any] = {}
+        for name, convert in env_fields.items():
+            raw = os.environ.get(f'MEDIA_SERVER_{name.upper()}')
+            if raw:
+                values[name] = convert(raw)
+        values.update({k: v for k, v in overrides.items() if v is not None})
+        return cls(**values)
+
+    def validate(self) -> None:
+        if self.engine not in ENGINES:
+            raise ValueError(f"Unknown serving engine '{self.engine}', expected one of {ENGINES}")
+        if not 1 <= self.port <= 65535:
+            raise ValueError(f"Invalid port {self.port}")
+
+
+# --- Engines ---
+def _run_dev(app, config: ServingConfig, init_state: Callable[..., None],
+             shutdown_state: Callable[..., None]) -> None:
+    init_state()
+    try:
+        app.run(host=config.host, port=config.port, threaded=True, debug=config.debug, use_reloader=False)
+    finally:
+        shutdown_state()
+
+
+def _run_waitress(app, config: ServingConfig, init_state: Callable[..., None],
+                  shutdown_state: Callable[..., None]) -> None:
+    try:
+        from waitress import create_server
+    except ImportError:
+        raise RuntimeError("The 'waitress' engine requires the waitress package (pip install waitress)")
+    init_state()
+    server = create_server(
+        app,
+        host=config.host,
+        port=config.port,
+        threads=config.threads,
+        connection_limit=config.max_connections,
+        channel_timeout=max(int(config.keepalive), 1),
+        backlog=config.backlog,
+        ident='media-server',
+    )
+
+    def handle_sigterm(signum, frame):
+        logger.info("SIGTERM received, closing waitress server")
+        server.close()
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    logger.info(f"waitress serving on {config.host}:{config.port} with {config.threads} threads")
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        shutdown_state()
+
+
+def _run_gunicorn(app, config: ServingConfig, init_state: Callable[..., None],
+                  shutdown_state: Callable[..., None]) -> None:
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise RuntimeError("The 'gunicorn' engine requires the gunicorn package (pip install gunicorn)")
+
+    lock_path = leader_lock_path(config.port)
+
+    def post_worker_init(worker) -> None:
+        # Background threads don't survive fork, so state is built per
+        # worker. Only the worker holding the lock runs the background
+        # services; the lock is released when it exits and the worker
+        # replacing it takes over.
+        worker.leader_lock = _claim_leadership(lock_path)
+        if worker.leader_lock is not None:
+            logger.info(f"Worker {os.getpid()} runs the background services")
+        init_state(background=worker.leader_lock is not None)
+
+    def worker_exit(server, worker) -> None:
+        shutdown_state()
+
+    options = {
+        'bind': f'{config.host}:{config.port}',
+        'workers': config.workers or _default_workers(),
+        'worker_class': 'gthread',
+        'threads': config.threads,
+        'worker_connections': config.max_connections,
+        # gunicorn only accepts whole seconds
+        'keepalive': max(int(math.ceil(config.keepalive)), 1),
+        'graceful_timeout': max(int(math.ceil(config.graceful_timeout)), 1),
+        'backlog': config.backlog,
+        # Long video responses are written by worker threads; the heartbeat
+        # timeout only has to cover a stuck worker process.
+        'timeout': 120,
+        'post_worker_init': post_worker_init,
+        'worker_exit': worker_exit,
+    }
+
+    class MediaServerApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    logger.info(f"gunicorn serving on {options['bind']} with {options['workers']} workers "
+                f"x {config.threads} threads")
+    MediaServerApplication().run()
+
+
+def _run_asyncio(app, config: ServingConfig, init_state: Callable[..., None],
+                 shutdown_state: Callable[..., None]) -> None:
+    import aio_server
+    import shaping
+    init_state()
+    logger.info(f"asyncio engine on {config.host}:{config.port}, {config.threads} app threads, "
+                f"up to {config.max_connections} connections")
+    if shaping.DEFAULT_CLIENT_RATE > 0 or shaping.DEFAULT_GLOBAL_RATE > 0:
+        # Throttled bodies sleep on the app threads (see shaping.py)
+        logger.warning(f"Rate limits are on: each throttled stream holds one of the {config.threads} app "
+                       f"threads while it waits; raise --threads above the expected concurrent streams")
+    try:
+        aio_server.serve(
+            app,
+            host=config.host,
+            port=config.port,
+            threads=config.threads,
+            max_connections=config.max_connections,
+            keepalive=config.keepalive,
+            backlog=config.backlog,
+            graceful_timeout=config.graceful_timeout,
+        )
+    finally:
+        shutdown_state()
+
+
+_ENGINE_RUNNERS = {
+    ENGINE_DEV: _run_dev,
+    ENGINE_WAITRESS: _run_waitress,
+    ENGINE_GUNICORN: _run_gunicorn,
+    ENGINE_ASYNCIO: _run_asyncio,
+}
+
+
+def run(app, config: ServingConfig, init_state: Optional[Callable[..., None]] = None,
+        shutdown_state: Optional[Callable[..., None]] = None) -> None:
+    """
+    Serves `app` with the configured engine. `init_state` prepares the
+    server state (e.g. server.init_server_state) and `shutdown_state`
+    releases it; they run once in a single-process engine and once per
+    worker in a pre-fork engine. Pre-fork workers other than the leader
+    call init_state(background=False): they must not start background
+    services.
+    """
+    config.validate()
+    runner = _ENGINE_RUNNERS[config.engine]
+    runner(app, config, init_state or (lambda **_: None), shutdown_state or (lambda: None))
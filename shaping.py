@@ -0,0 +1,253 @@
+"""
+Bandwidth shaping and fair-share I/O scheduling for /stream.
+
+Without it, one client pulling whole files over a fast link (VLC
+prefetching through the "Open in VLC" link, a download manager) keeps the
+disk busy and every other viewer's seek waits behind its reads.
+
+- FairScheduler bounds the number of concurrent chunk reads (I/O slots).
+  When readers queue, interactive reads go first (small ranges, and the
+  first bytes of every response, which decide the time to first byte).
+  Within a class, the client with the least service so far goes next
+  (start-time fair queueing on bytes read per client).
+- TokenBucket caps the rate per client (remote address) and globally.
+
+Shaping needs Python to see every chunk, so while it is enabled ranges
+are streamed by the generator backend even where sendfile is available.
+A throttled chunk is delayed with time.sleep in the thread iterating the
+body. Under gunicorn, waitress and the dev server that thread serves only
+this response anyway; the asyncio engine iterates bodies on its app thread
+pool, so there every throttled stream holds one of its --threads while it
+waits, and the pool must be sized for the throttled streams expected at
+once plus the API requests.
+All knobs default to off:
+
+  MEDIA_SERVER_IO_SLOTS          concurrent chunk reads (0 = no scheduler)
+  MEDIA_SERVER_CLIENT_RATE_MBPS  per-client cap in Mbit/s (0 = none)
+  MEDIA_SERVER_GLOBAL_RATE_MBPS  server-wide cap in Mbit/s (0 = none)
+  MEDIA_SERVER_INTERACTIVE_KB    interactive threshold (default 1024)
+"""
+
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+DEFAULT_IO_SLOTS = int(os.environ.get('MEDIA_SERVER_IO_SLOTS', '0'))
+DEFAULT_CLIENT_RATE = float(os.environ.get('MEDIA_SERVER_CLIENT_RATE_MBPS', '0')) * 1e6 / 8
+DEFAULT_GLOBAL_RATE = float(os.environ.get('MEDIA_SERVER_GLOBAL_RATE_MBPS', '0')) * 1e6 / 8
+INTERACTIVE_BYTES = int(os.environ.get('MEDIA_SERVER_INTERACTIVE_KB', '1024')) * 1024
+CLIENT_IDLE_TIMEOUT = 60.0  # forget per-client buckets unused for this long
+MAX_TRACKED_CLIENTS = 1024  # per-client byte counters kept for the metrics
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+_PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BULK: 'bulk'}
+
+
+class TokenBucket:
+    """Rate limiter allowing `rate` bytes/s with bursts of up to `burst` bytes."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1 << 20)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.last_used = self._last
+
+    def reserve(self, nbytes: int) -> float:
+        """Takes `nbytes` tokens, going into debt if needed; returns the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = self.last_used = now
+            self._tokens -= nbytes
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+
+class _Waiter:
+    __slots__ = ('priority', 'vtime', 'seq', 'client')
+
+    def __init__(self, priority: int, vtime: float, seq: int, client: str) -> None:
+        self.priority = priority
+        self.vtime = vtime
+        self.seq = seq
+        self.client = client
+
+    def __lt__(self, other: '_Waiter') -> bool:
+        return (self.priority, self.vtime, self.seq) < (other.priority, other.vtime, other.seq)
+
+
+class FairScheduler:
+    """Grants a bounded number of I/O slots, interactive first, then fair share by bytes."""
+
+    def __init__(self, slots: int) -> None:
+        self.slots = slots
+        self._free = slots
+        self._cond = threading.Condition()
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._vclock = 0.0                     # virtual time of the last dispatched read
+        self._vtime: Dict[str, float] = {}     # bytes served per active client
+        self._active: Dict[str, int] = {}      # open shaped responses per client
+        # Metrics
+        self.bytes_by_client: Dict[str, int] = {}
+        self.wait_seconds = {PRIORITY_INTERACTIVE: 0.0, PRIORITY_BULK: 0.0}
+        self.grants = {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 0}
+        self.max_wait = {PRIORITY_INTERACTIVE: 0.0, PRIORITY_BULK: 0.0}
+
+    def open(self, client: str) -> None:
+        with self._cond:
+            if not self._active.get(client):
+                # A (re)joining client starts at the current virtual time, so
+                # it gets its fair share without a credit for its idle period
+                self._vtime[client] = max(self._vtime.get(client, 0.0), self._vclock)
+            self._active[client] = self._active.get(client, 0) + 1
+
+    def close(self, client: str) -> None:
+        with self._cond:
+            remaining = self._active.get(client, 1) - 1
+            if remaining <= 0:
+                self._active.pop(client, None)
+                self._vtime.pop(client, None)
+                if len(self.bytes_by_client) > MAX_TRACKED_CLIENTS:
+                    self.bytes_by_client = {c: n for c, n in self.bytes_by_client.items() if c in self._active}
+            else:
+                self._active[client] = remaining
+
+    def acquire(self, client: str, priority: int) -> None:
+        started = time.monotonic()
+        with self._cond:
+            if self._free > 0 and not self._queue:
+                self._free -= 1
+            else:
+                waiter = _Waiter(priority, self._vtime.get(client, self._vclock), next(self._seq), client)
+                heapq.heappush(self._queue, waiter)
+                while not (self._free > 0 and self._queue[0] is waiter):
+                    self._cond.wait()
+                heapq.heappop(self._queue)
+                self._free -= 1
+                self._vclock = max(self._vclock, waiter.vtime)
+                # Others may be eligible too if several slots are free
+                self._cond.notify_all()
+            waited = time.monotonic() - started
+            self.grants[priority] += 1
+            self.wait_seconds[priority] += waited
+            self.max_wait[priority] = max(self.max_wait[priority], waited)
+
+    def release(self, client: str, nbytes: int) -> None:
+        with self._cond:
+            self._free += 1
+            if client in self._vtime:
+                self._vtime[client] += nbytes
+            self.bytes_by_client[client] = self.bytes_by_client.get(client, 0) + nbytes
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            served = [count for count in self.bytes_by_client.values() if count > 0]
+            # Jain's index over bytes served per client: 1.0 is perfectly even;
+            # lower values are expected when clients differ in demand
+            jain = (sum(served) ** 2 / (len(served) * sum(x * x for x in served))) if served else 1.0
+            return {
+                "slots": self.slots,
+                "in_use": self.slots - self._free,
+                "queued": len(self._queue),
+                "active_clients": len(self._active),
+                "fairness_index": round(jain, 4),
+                "bytes_by_client": dict(self.bytes_by_client),
+                "grants": {_PRIORITY_NAMES[p]: n for p, n in self.grants.items()},
+                "mean_wait_ms": {_PRIORITY_NAMES[p]: round(self.wait_seconds[p] / self.grants[p] * 1000, 3)
+                                 if self.grants[p] else 0.0 for p in self.grants},
+                "max_wait_ms": {_PRIORITY_NAMES[p]: round(w * 1000, 3) for p, w in self.max_wait.items()},
+            }
+
+
+class Shaper:
+    """Applies the scheduler and rate limits to response bodies."""
+
+    def __init__(self, io_slots: int = DEFAULT_IO_SLOTS, client_rate: float = DEFAULT_CLIENT_RATE,
+                 global_rate: float = DEFAULT_GLOBAL_RATE, interactive_bytes: int = INTERACTIVE_BYTES) -> None:
+        self.scheduler = FairScheduler(io_slots) if io_slots > 0 else None
+        self.client_rate = client_rate
+        self.global_bucket = TokenBucket(global_rate) if global_rate > 0 else None
+        self.interactive_bytes = interactive_bytes
+        self._client_buckets: Dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+        self.throttled_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.scheduler is not None or self.client_rate > 0 or self.global_bucket is not None
+
+    def _client_bucket(self, client: str) -> Optional[TokenBucket]:
+        if self.client_rate <= 0:
+            return None
+        with self._buckets_lock:
+            bucket = self._client_buckets.get(client)
+            if bucket is None:
+                now = time.monotonic()
+                for key in [k for k, b in self._client_buckets.items() if now - b.last_used > CLIENT_IDLE_TIMEOUT]:
+                    del self._client_buckets[key]
+                bucket = self._client_buckets[client] = TokenBucket(self.client_rate)
+            return bucket
+
+    def shape(self, body: Iterable[bytes], client: str, length: int) -> Iterable[bytes]:
+        """Wraps a body iterator of `length` bytes for `client`; returns it as is when disabled."""
+        if not self.enabled:
+            return body
+        return self._shaped(iter(body), client, length)
+
+    def _shaped(self, chunks: Iterator[bytes], client: str, length: int) -> Iterator[bytes]:
+        scheduler = self.scheduler
+        bucket = self._client_bucket(client)
+        small_range = length <= self.interactive_bytes
+        sent = 0
+        if scheduler is not None:
+            scheduler.open(client)
+        try:
+            while True:
+                priority = PRIORITY_INTERACTIVE if small_range or sent < self.interactive_bytes else PRIORITY_BULK
+                if scheduler is not None:
+                    scheduler.acquire(client, priority)
+                    chunk = None
+                    try:
+                        chunk = next(chunks, None)  # the disk read happens here
+                    finally:
+                        scheduler.release(client, len(chunk) if chunk else 0)
+                else:
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                delay = 0.0
+                if bucket is not None:
+                    delay = bucket.reserve(len(chunk))
+                if self.global_bucket is not None:
+                    delay = max(delay, self.global_bucket.reserve(len(chunk)))
+                if delay > 0:
+                    self.throttled_seconds += delay
+                    time.sleep(delay)
+                sent += len(chunk)
+                yield chunk
+        finally:
+            if scheduler is not None:
+                scheduler.close(client)
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "client_rate_mbps": self.client_rate * 8 / 1e6,
+            "global_rate_mbps": self.global_bucket.rate * 8 / 1e6 if self.global_bucket else 0.0,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "scheduler": self.scheduler.stats() if self.scheduler is not None else None,
+        }
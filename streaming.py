@@ -0,0 +1,334 @@
+"""
+Streaming backends for serving byte ranges of video files.
+
+Three backends are available, and ``auto`` (the default) picks among them:
+
+- ``sendfile``: hands the open file (positioned at the range start) to the
+  WSGI server through ``wsgi.file_wrapper``. gunicorn, waitress and the
+  asyncio engine (aio_server) recognise the wrapper and copy the bytes with
+  ``os.sendfile``, limited to the response ``Content-Length``, so the data
+  never passes through Python. The file is wrapped so that it ends with the
+  range, for servers that read the wrapper to its end instead.
+- ``generator``: the original path, reading 64KB chunks in Python and
+  yielding them through Werkzeug. Used whenever the server does not offer a
+  file wrapper (e.g. the Werkzeug development server).
+- ``cache``: like the generator, but reads go through the shared block
+  cache (block_cache.py) even when sendfile is available. Worth selecting
+  when videos live on slow storage (NAS, USB) and are watched by several
+  clients at once.
+
+With the block cache enabled (MEDIA_SERVER_BLOCK_CACHE_MB > 0, the
+default) the generator and multipart paths read through it as well, and the
+default ``auto`` backend trades sendfile for the cache where the cache
+pays off: a single range goes through the cache when it starts in a cached
+block or when MEDIA_SERVER_HOT_READERS clients (default 2, 0 to always use
+sendfile) read the file within a minute; cold ranges of a single viewer
+keep the zero-copy sendfile path. Cached reads use descriptors shared
+through handle_pool.HandlePool; the sendfile backend opens a private file
+per response because servers position sendfile with the descriptor's file
+offset.
+
+Partial cache blocks are yielded as memoryview slices. Servers that write
+any bytes-like chunk (aio_server) mark the environ with BUFFER_CHUNKS_KEY
+and get them as they are; PEP 3333 servers require bytes, so for them the
+slices are copied on the way out.
+
+Generator reads are sized adaptively and every backend issues
+posix_fadvise read-ahead hints (see readahead.py). By default (block cache
+enabled) chunks are whole cache blocks and adaptive sizing applies to the
+reads that fill cache misses, several blocks at a time for fast clients;
+without the cache it sizes the chunks themselves. When bandwidth
+shaping is configured (shaping.py), ranges always take the generator path.
+
+Ranges of a virtual faststart layout (faststart.py) are translated to file
+offsets; only those overlapping the relocated moov box need the generator.
+"""
+
+import os
+import logging
+import secrets
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import readahead
+import block_cache
+from faststart import FaststartLayout
+from block_cache import BlockCache, FileReaders
+from handle_pool import HandlePool
+from readahead import AdaptiveChunker
+from shaping import Shaper
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+CHUNK_SIZE = 65536  # 64KB chunks for the generator backend
+
+BACKEND_AUTO = 'auto'
+BACKEND_SENDFILE = 'sendfile'
+BACKEND_GENERATOR = 'generator'
+BACKEND_CACHE = 'cache'
+BACKENDS = (BACKEND_AUTO, BACKEND_SENDFILE, BACKEND_GENERATOR, BACKEND_CACHE)
+
+# 'auto' uses sendfile when the WSGI server supports it, else the generator.
+STREAM_BACKEND = os.environ.get('MEDIA_SERVER_STREAM_BACKEND', BACKEND_AUTO)
+# Size generator chunks from the client's throughput instead of CHUNK_SIZE.
+ADAPTIVE_CHUNKS = os.environ.get('MEDIA_SERVER_ADAPTIVE_CHUNKS', '1') != '0'
+# Environ key of servers that accept any bytes-like body chunk, not only bytes
+BUFFER_CHUNKS_KEY = 'media_server.buffer_chunks'
+
+Chunk = Union[bytes, memoryview]
+
+# Shared by all requests in the process; a block cache budget of 0 disables it.
+HANDLE_POOL = HandlePool()
+BLOCK_CACHE = BlockCache(handles=HANDLE_POOL)
+FILE_READERS = FileReaders()
+SHAPER = Shaper()
+
+
+def set_stream_backend(backend: str) -> None:
+    """Selects the streaming backend used by open_range_body()."""
+    global STREAM_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown stream backend '{backend}', expected one of {BACKENDS}")
+    STREAM_BACKEND = backend
+
+
+# --- Generator backend ---
+def iter_file_range(video_path: str, start: int, length: int, chunk_size: int = CHUNK_SIZE,
+                    st: Optional[os.stat_result] = None, bitrate: Optional[float] = None,
+                    adaptive: Optional[bool] = None) -> Iterator[Chunk]:
+    """
+    Yields `length` bytes of the file starting at `start`, in chunks (bytes
+    or, for partial cache blocks, memoryviews; see wsgi_chunks()). Reads
+    go through the block cache when it is enabled; `st` (the file's stat
+    result, if the caller has one) saves the cache a stat call.
+    Unless `adaptive` is False, read sizes follow the client's throughput
+    (starting from the video's `bitrate` in bytes/s, if known): uncached
+    reads yield chunks of that size, cached ones yield whole blocks and
+    fill misses with reads of that size. Either way the kernel is kept
+    reading ahead of the client.
+    """
+    if adaptive is None:
+        adaptive = ADAPTIVE_CHUNKS
+    chunker = AdaptiveChunker(bitrate, chunk_size) if adaptive else None
+    if BLOCK_CACHE.enabled:
+        yield from BLOCK_CACHE.iter_range(video_path, start, length, st, chunker)
+        return
+    with HANDLE_POOL.open(video_path, st) as handle:
+        readahead.advise_sequential(handle.fd, start, length)
+        end = start + length
+        advised_until = start
+        position = start
+        while position < end:
+            size = chunker.chunk_size if chunker is not None else chunk_size
+            # Keep a window ahead of the reader in flight, renewed at half-way
+            window = chunker.readahead_window() if chunker is not None else readahead.MIN_READAHEAD
+            if advised_until < end and position + window // 2 >= advised_until:
+                readahead.advise_willneed(handle.fd, advised_until, min(position + window, end) - advised_until)
+                advised_until = min(position + window, end)
+            data_chunk = handle.pread(min(end - position, size), position)
+            if not data_chunk:
+                break
+            if chunker is not None:
+                chunker.sent(len(data_chunk))
+            yield data_chunk
+            position += len(data_chunk)
+
+
+def iter_layout_range(video_path: str, layout: FaststartLayout, start: int, length: int,
+                      st: Optional[os.stat_result] = None, bitrate: Optional[float] = None) -> Iterator[Chunk]:
+    """Yields `length` bytes of a file's faststart layout starting at virtual offset `start`."""
+    for file_offset, piece_length, data in layout.map_range(start, length):
+        if data is not None:
+            yield data
+        else:
+            yield from iter_file_range(video_path, file_offset, piece_length, st=st, bitrate=bitrate)
+
+
+def _as_bytes(body: Iterable[Chunk]) -> Iterator[bytes]:
+    for chunk in body:
+        yield chunk if type(chunk) is bytes else bytes(chunk)
+
+
+def wsgi_chunks(environ: Dict[str, Any], body: Iterable[Chunk]) -> Iterable[Chunk]:
+    """Returns `body` as the server accepts it: memoryview chunks are copied unless it takes buffers."""
+    return body if environ.get(BUFFER_CHUNKS_KEY) else _as_bytes(body)
+
+
+# --- Multipart/byteranges ---
+def build_multipart_ranges(video_path: str, spans: Sequence[Tuple[int, int]], file_size: int,
+                           mime_type: str, st: Optional[os.stat_result] = None,
+                           layout: Optional[FaststartLayout] = None,
+                           environ: Optional[Dict[str, Any]] = None) -> Tuple[Iterable[Chunk], str, int]:
+    """
+    Prepares a multipart/byteranges body for several spans (of the
+    faststart `layout`, if given) for the server of `environ`. Returns
+    (body iterator, Content-Type header value, Content-Length).
+    """
+    boundary = secrets.token_hex(12)
+    part_headers: List[bytes] = [
+        (f"\r\n--{boundary}\r\n"
+         f"Content-Type: {mime_type}\r\n"
+         f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n").encode('ascii')
+        for start, end in spans
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode('ascii')
+    content_length = (sum(len(h) for h in part_headers) + len(closing)
+                      + sum(end - start + 1 for start, end in spans))
+
+    def generate_parts() -> Iterator[bytes]:
+        for header, (start, end) in zip(part_headers, spans):
+            yield header
+            if layout is not None:
+                yield from iter_layout_range(video_path, layout, start, end - start + 1, st=st)
+            else:
+                yield from iter_file_range(video_path, start, end - start + 1, st=st)
+        yield closing
+
+    return wsgi_chunks(environ or {}, generate_parts()), f"multipart/byteranges; boundary={boundary}", content_length
+
+
+# --- Sendfile backend ---
+class _RangeFile:
+    """
+    A binary file seen through a window [start, start + length): reads stop
+    and seeking to the end lands at the end of the window. fileno() is the
+    real descriptor, so servers can still sendfile from it.
+    """
+
+    mode = 'rb'
+
+    def __init__(self, f: Any, start: int, length: int) -> None:
+        self._f = f
+        self._end = start + length
+        f.seek(start)
+
+    def fileno(self) -> int:
+        return self._f.fileno()
+
+    def tell(self) -> int:
+        return self._f.tell()
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_END:
+            return self._f.seek(self._end + offset)
+        return self._f.seek(offset, whence)
+
+    def seekable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def _remaining(self) -> int:
+        return max(0, self._end - self._f.tell())
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        remaining = self._remaining()
+        return self._f.read(remaining if size is None or size < 0 else min(size, remaining))
+
+    def readinto(self, buffer: Any) -> int:
+        view = memoryview(buffer)
+        return self._f.readinto(view[:min(len(view), self._remaining())])
+
+    @property
+    def closed(self) -> bool:
+        return self._f.closed
+
+    def close(self) -> None:
+        self._f.close()
+
+
+def wrap_file_range(environ: Dict[str, Any], video_path: str, start: int, length: int = 0,
+                    bitrate: Optional[float] = None) -> Optional[Any]:
+    """
+    Returns a `wsgi.file_wrapper` over the file positioned at `start`, or None
+    if the server does not provide one. Servers that sendfile take the byte
+    count from the Content-Length header, so the caller must always set it;
+    with a `length`, the wrapped file also ends there for servers that read
+    it instead, and the kernel is asked to read the start of it ahead.
+    """
+    file_wrapper = environ.get('wsgi.file_wrapper')
+    if file_wrapper is None:
+        return None
+    f = open(video_path, 'rb')
+    try:
+        f.seek(start)
+        if length:
+            fd = f.fileno()
+            readahead.advise_sequential(fd, start, length)
+            readahead.advise_willneed(fd, start, min(length, readahead.readahead_window(bitrate)))
+            return file_wrapper(_RangeFile(f, start, length), CHUNK_SIZE)
+        return file_wrapper(f, CHUNK_SIZE)
+    except Exception:
+        f.close()
+        raise
+
+
+def _prefer_block_cache(environ: Dict[str, Any], video_path: str, start: int,
+                        st: Optional[os.stat_result]) -> bool:
+    """
+    Whether the auto backend reads a single range through the block cache
+    rather than handing it to sendfile: when it starts in a cached block,
+    or when block_cache.HOT_READERS clients read the file recently, so the
+    blocks they share come from storage once.
+    """
+    if not BLOCK_CACHE.enabled or block_cache.HOT_READERS <= 0:
+        return False
+    if FILE_READERS.record(video_path, environ.get('REMOTE_ADDR', '')) >= block_cache.HOT_READERS:
+        return True
+    try:
+        return BLOCK_CACHE.is_resident(video_path, st or os.stat(video_path), start)
+    except OSError:
+        return False
+
+
+def open_range_body(environ: Dict[str, Any], video_path: str, start: int, length: int,
+                    st: Optional[os.stat_result] = None, bitrate: Optional[float] = None,
+                    layout: Optional[FaststartLayout] = None):
+    """
+    Builds the response body for a single byte range using the configured
+    backend (auto: the block cache for cached or popular files, sendfile for
+    the rest). Returns (body, direct_passthrough); the flag must be passed to the
+    Response so Werkzeug hands a file wrapper to the server untouched.
+    `bitrate` (bytes/s) seeds chunk sizing and read-ahead when known. With a
+    faststart `layout`, `start` is an offset in the virtual layout.
+    """
+    if layout is not None:
+        pieces = layout.map_range(start, length)
+        if len(pieces) != 1 or pieces[0][2] is not None:
+            body = wsgi_chunks(environ, iter_layout_range(video_path, layout, start, length, st=st, bitrate=bitrate))
+            return SHAPER.shape(body, environ.get('REMOTE_ADDR', ''), length), False
+        # Contiguous in the file: served by any backend from the translated offset
+        start = pieces[0][0]
+    if SHAPER.enabled:
+        body = wsgi_chunks(environ, iter_file_range(video_path, start, length, st=st, bitrate=bitrate))
+        return SHAPER.shape(body, environ.get('REMOTE_ADDR', ''), length), False
+    if STREAM_BACKEND == BACKEND_CACHE or (
+            STREAM_BACKEND == BACKEND_AUTO and 'wsgi.file_wrapper' in environ
+            and _prefer_block_cache(environ, video_path, start, st)):
+        return wsgi_chunks(environ, iter_file_range(video_path, start, length, st=st, bitrate=bitrate)), False
+    if STREAM_BACKEND != BACKEND_GENERATOR:
+        wrapper = wrap_file_range(environ, video_path, start, length, bitrate)
+        if wrapper is not None:
+            return wrapper, True
+        if STREAM_BACKEND == BACKEND_SENDFILE:
+            logger.debug("Server offers no wsgi.file_wrapper, falling back to generator streaming")
+    return wsgi_chunks(environ, iter_file_range(video_path, start, length, st=st, bitrate=bitrate)), False
+
+
+def sendfile_range(sock, video_path: str, start: int, length: int) -> int:
+    """
+    Copies a byte range straight from the file to a connected socket with
+    os.sendfile. Returns the number of bytes sent. Used by servers that own
+    the socket themselves and by the benchmarks.
+    """
+    sent_total = 0
+    with open(video_path, 'rb') as f:
+        fd = f.fileno()
+        out_fd = sock.fileno()
+        while sent_total < length:
+            sent = os.sendfile(out_fd, fd, start + sent_total, length - sent_total)
+            if sent == 0:
+                break
+            sent_total += sent
+    return sent_total
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+# The server modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def serve(tmp_path):
+    """
+    Initializes the server over a library of files written to tmp_path
+    ({filename: bytes}, in playlist order) with its caches in tmp_path,
+    and returns a Flask test client. Nothing is probed in the background.
+    """
+    import server
+
+    def start(files, **kwargs):
+        videos = []
+        for filename, data in files.items():
+            path = tmp_path / 'library' / filename
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+            st = path.stat()
+            videos.append({'filename': filename, 'path': str(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns})
+        options = dict(metadata_db=str(tmp_path / 'metadata.db'), hls_cache_dir=str(tmp_path / 'hls'),
+                       thumbnail_cache_dir=str(tmp_path / 'thumbnails'), cluster_nodes=[], background=False)
+        options.update(kwargs)
+        server.init_server_state(videos, **options)
+        return server.app.test_client()
+
+    yield start
+    server.shutdown_server_state()
@@ -0,0 +1,154 @@
+import os
+
+import pytest
+from werkzeug.wsgi import FileWrapper
+
+import block_cache
+import streaming
+from block_cache import BlockCache, FileReaders
+from readahead import AdaptiveChunker
+
+BLOCK = 4096
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / 'video.mp4'
+    data = os.urandom(BLOCK * 10 + 100)
+    path.write_bytes(data)
+    return str(path), data
+
+
+class CountingCache(BlockCache):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.reads = []
+
+    def _read_blocks(self, fd: int, block_no: int, count: int) -> bytes:
+        self.reads.append((block_no, count))
+        return super()._read_blocks(fd, block_no, count)
+
+
+@pytest.mark.parametrize('start, length', [(0, BLOCK * 10 + 100), (100, BLOCK), (BLOCK * 3, 5), (BLOCK * 9 + 50, 10_000)])
+def test_ranges_match_the_file(video, start, length):
+    path, data = video
+    cache = BlockCache(budget=BLOCK * 100, block_size=BLOCK)
+    assert b''.join(cache.iter_range(path, start, length)) == data[start:start + length]
+    # Again, from the cache
+    assert b''.join(cache.iter_range(path, start, length)) == data[start:start + length]
+    assert cache.hits > 0
+
+
+def test_misses_read_one_block_without_a_chunker(video):
+    path, data = video
+    cache = CountingCache(budget=BLOCK * 100, block_size=BLOCK)
+    b''.join(cache.iter_range(path, 0, BLOCK * 4))
+    assert cache.reads == [(0, 1), (1, 1), (2, 1), (3, 1)]
+
+
+def test_chunker_fills_several_blocks_per_read(video):
+    path, data = video
+    cache = CountingCache(budget=BLOCK * 100, block_size=BLOCK)
+    chunker = AdaptiveChunker()
+    chunker.chunk_size = BLOCK * 4
+    assert b''.join(cache.iter_range(path, 0, BLOCK * 6, chunker=chunker)) == data[:BLOCK * 6]
+    # The second read stops at the end of the range
+    assert cache.reads == [(0, 4), (4, 2)]
+
+
+def test_fill_skips_cached_blocks(video):
+    path, data = video
+    cache = CountingCache(budget=BLOCK * 100, block_size=BLOCK)
+    b''.join(cache.iter_range(path, BLOCK * 2, BLOCK))
+    chunker = AdaptiveChunker()
+    chunker.chunk_size = BLOCK * 8
+    assert b''.join(cache.iter_range(path, 0, BLOCK * 4, chunker=chunker)) == data[:BLOCK * 4]
+    assert cache.reads == [(2, 1), (0, 2), (3, 1)]
+
+
+def test_budget_is_respected(video):
+    path, data = video
+    cache = BlockCache(budget=BLOCK * 3, block_size=BLOCK)
+    assert b''.join(cache.iter_range(path, 0, len(data))) == data
+    assert cache.stats()['bytes'] <= BLOCK * 3
+
+
+def test_partial_blocks_are_not_copied(video):
+    path, data = video
+    cache = BlockCache(budget=BLOCK * 100, block_size=BLOCK)
+    chunks = list(cache.iter_range(path, 100, BLOCK * 2))
+    assert [type(chunk) for chunk in chunks] == [memoryview, bytes, memoryview]
+    assert any(chunks[0].obj is block for block in cache._probation.values())
+    assert b''.join(chunks) == data[100:100 + BLOCK * 2]
+
+
+def test_residency(video):
+    path, _ = video
+    cache = BlockCache(budget=BLOCK * 100, block_size=BLOCK)
+    st = os.stat(path)
+    assert not cache.is_resident(path, st, BLOCK)
+    b''.join(cache.iter_range(path, BLOCK, 10))
+    assert cache.is_resident(path, st, BLOCK + 500) and not cache.is_resident(path, st, 0)
+    assert cache.stats()['hits'] == 0
+
+
+def test_file_readers_count_distinct_recent_clients():
+    readers = FileReaders(window=60.0)
+    assert readers.record('a.mp4', '10.0.0.1') == 1
+    assert readers.record('a.mp4', '10.0.0.1') == 1
+    assert readers.record('b.mp4', '10.0.0.2') == 1
+    assert readers.record('a.mp4', '10.0.0.2') == 2
+    readers.window = 0.0
+    assert readers.record('a.mp4', '10.0.0.3') == 1
+
+
+# --- Routing (streaming.open_range_body, auto backend) ---
+@pytest.fixture
+def routing(monkeypatch):
+    monkeypatch.setattr(streaming, 'BLOCK_CACHE', BlockCache(budget=BLOCK * 100, block_size=BLOCK))
+    monkeypatch.setattr(streaming, 'FILE_READERS', FileReaders())
+    monkeypatch.setattr(streaming, 'STREAM_BACKEND', streaming.BACKEND_AUTO)
+
+    def open_body(path, client, start=0, length=BLOCK, **environ):
+        environ = dict({'wsgi.file_wrapper': FileWrapper, 'REMOTE_ADDR': client}, **environ)
+        body, passthrough = streaming.open_range_body(environ, path, start, length)
+        chunks = list(body)
+        if passthrough:
+            body.close()
+        else:
+            assert all(type(chunk) is bytes for chunk in chunks)   # PEP 3333 servers need bytes
+        return passthrough, b''.join(chunks)
+    return open_body
+
+
+def test_single_viewer_gets_sendfile(video, routing):
+    path, data = video
+    assert routing(path, '10.0.0.1') == (True, data[:BLOCK])
+    assert routing(path, '10.0.0.1', BLOCK * 2) == (True, data[BLOCK * 2:BLOCK * 3])
+
+
+def test_popular_and_cached_ranges_go_through_the_cache(video, routing, monkeypatch):
+    path, data = video
+    routing(path, '10.0.0.1')
+    assert routing(path, '10.0.0.2', 100) == (False, data[100:BLOCK + 100])
+    # Blocks cached for the popular file are then read from the cache by anyone
+    monkeypatch.setattr(streaming, 'FILE_READERS', FileReaders())
+    assert routing(path, '10.0.0.3', 50)[0] is False
+    assert routing(path, '10.0.0.3', BLOCK * 5)[0] is True
+
+
+def test_hot_readers_zero_always_uses_sendfile(video, routing, monkeypatch):
+    path, _ = video
+    monkeypatch.setattr(block_cache, 'HOT_READERS', 0)
+    routing(path, '10.0.0.1')
+    assert routing(path, '10.0.0.2')[0] is True
+
+
+def test_servers_taking_buffers_get_memoryviews(video, routing, monkeypatch):
+    path, data = video
+    monkeypatch.setattr(streaming, 'STREAM_BACKEND', streaming.BACKEND_CACHE)
+    environ = {'REMOTE_ADDR': '10.0.0.1', streaming.BUFFER_CHUNKS_KEY: True}
+    chunks = list(streaming.open_range_body(environ, path, 100, BLOCK)[0])
+    assert memoryview in [type(chunk) for chunk in chunks] and b''.join(chunks) == data[100:BLOCK + 100]
+    chunks = list(streaming.open_range_body({'REMOTE_ADDR': '10.0.0.1'}, path, 100, BLOCK)[0])
+    assert all(type(chunk) is bytes for chunk in chunks)
@@ -0,0 +1,94 @@
+import pytest
+
+from catalog import CursorError, VideoCatalog
+from library import natural_sort_key
+
+
+def catalog(*filenames):
+    videos = [{'filename': name, 'path': f'/library/{name}', 'size': len(name), 'mtime_ns': i}
+              for i, name in enumerate(filenames)]
+    videos.sort(key=lambda video: natural_sort_key(video['filename']))
+    return VideoCatalog(videos)
+
+
+def names(entries):
+    return [entry.filename for entry in entries]
+
+
+def follow(current, limit, **kwargs):
+    pages, cursor = [], None
+    while True:
+        entries, cursor, _ = current.page(limit=limit, cursor=cursor, **kwargs)
+        pages.append(names(entries))
+        if cursor is None:
+            return pages
+
+
+def test_cursors_walk_every_entry_once():
+    current = catalog(*(f'Episode {i}.mkv' for i in range(1, 12)))
+    assert follow(current, 4) == [['Episode 1.mkv', 'Episode 2.mkv', 'Episode 3.mkv', 'Episode 4.mkv'],
+                                  ['Episode 5.mkv', 'Episode 6.mkv', 'Episode 7.mkv', 'Episode 8.mkv'],
+                                  ['Episode 9.mkv', 'Episode 10.mkv', 'Episode 11.mkv']]
+    descending = sum(follow(current, 4, order='mtime', descending=True), [])
+    assert descending == [f'Episode {i}.mkv' for i in range(11, 0, -1)]
+
+
+def test_cursor_survives_a_rescan():
+    before = catalog('a.mkv', 'c.mkv', 'e.mkv', 'g.mkv')
+    first, cursor, _ = before.page(limit=2)
+    assert names(first) == ['a.mkv', 'c.mkv']
+    # Files added before and after the cursor position, one seen file removed
+    after = before.updated([{'filename': 'b.mkv', 'path': '/library/b.mkv'},
+                            {'filename': 'f.mkv', 'path': '/library/f.mkv'}],
+                           ['c.mkv'], sort_key=natural_sort_key)
+    assert after.version != before.version
+    rest, cursor, total = after.page(limit=10, cursor=cursor)
+    assert names(rest) == ['e.mkv', 'f.mkv', 'g.mkv']
+    assert cursor is None and total == 5
+
+
+def test_cursor_of_another_order_is_rejected():
+    current = catalog('a.mkv', 'b.mkv', 'c.mkv')
+    _, cursor, _ = current.page(limit=1)
+    with pytest.raises(CursorError):
+        current.page(order='size', cursor=cursor)
+    with pytest.raises(CursorError):
+        current.page(descending=True, cursor=cursor)
+    with pytest.raises(CursorError):
+        current.page(cursor='not a cursor')
+
+
+def test_prefix_matches_filename_or_basename():
+    current = catalog('Show/S01/Pilot.mkv', 'Show/S01/Finale.mkv', 'Other/Pilot.mkv', 'pilot notes.mp4')
+    entries, _, total = current.page(prefix='pilot')
+    assert names(entries) == ['Other/Pilot.mkv', 'pilot notes.mp4', 'Show/S01/Pilot.mkv']
+    assert total == 3
+    entries, _, _ = current.page(prefix='show/s01/')
+    assert names(entries) == ['Show/S01/Finale.mkv', 'Show/S01/Pilot.mkv']
+    entries, _, _ = current.page(query='s01', prefix='pilot')
+    assert names(entries) == ['Show/S01/Pilot.mkv']
+
+
+def test_api_videos_pages_and_revalidates(serve):
+    client = serve({f'Episode {i}.mp4': b'x' * i for i in range(1, 6)})
+    page = client.get('/api/videos?limit=2&sort=-size')
+    assert page.status_code == 200
+    assert [video['filename'] for video in page.json['videos']] == ['Episode 5.mp4', 'Episode 4.mp4']
+    assert page.json['total'] == 5
+    rest = client.get(f"/api/videos?limit=10&sort=-size&cursor={page.json['next_cursor']}")
+    assert [video['size'] for video in rest.json['videos']] == [3, 2, 1]
+    assert rest.json['next_cursor'] is None
+
+    etag = page.headers['ETag']
+    assert etag == f'"catalog-{page.json["version"]}"'
+    revalidated = client.get('/api/videos?limit=2', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers['ETag'] == etag
+    assert client.get('/api/videos', headers={'If-None-Match': '"catalog-0"'}).status_code == 200
+
+
+def test_api_videos_rejects_bad_parameters(serve):
+    client = serve({'a.mp4': b'x'})
+    assert client.get('/api/videos?sort=rating').status_code == 400
+    assert client.get('/api/videos?limit=0').status_code == 400
+    assert client.get('/api/videos?cursor=garbage').status_code == 400
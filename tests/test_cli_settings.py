@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+import cli
+
+
+@pytest.fixture
+def settings_from(tmp_path, monkeypatch):
+    """Resolves settings from INI lines, MEDIA_SERVER_* variables and command line options."""
+    for name in list(os.environ):
+        if name.startswith('MEDIA_SERVER_'):
+            monkeypatch.delenv(name)
+
+    def resolve(ini=(), env=None, argv=()):
+        argv = list(argv)
+        if ini:
+            config = tmp_path / 'media-server.ini'
+            config.write_text('[media-server]\n' + '\n'.join(ini) + '\n')
+            argv += ['--config', str(config)]
+        for name, value in (env or {}).items():
+            monkeypatch.setenv(f'MEDIA_SERVER_{name.upper()}', value)
+        return cli.load_settings(cli.parse_args(argv))
+    return resolve
+
+
+@pytest.mark.parametrize('ini, env, argv, expected', [
+    (['port = 7000'], {}, [], 7000),
+    ([], {'port': '7001'}, [], 7001),
+    ([], {}, ['--port', '7002'], 7002),
+    (['port = 7000'], {'port': '7001'}, [], 7001),
+    (['port = 7000'], {}, ['--port', '7002'], 7002),
+    ([], {'port': '7001'}, ['--port', '7002'], 7002),
+    (['port = 7000'], {'port': '7001'}, ['--port', '7002'], 7002),
+    ([], {}, [], None),
+], ids=['ini', 'env', 'cli', 'env-over-ini', 'cli-over-ini', 'cli-over-env', 'cli-over-both', 'unset'])
+def test_precedence(settings_from, ini, env, argv, expected):
+    assert settings_from(ini, env, argv).get('port') == expected
+
+
+@pytest.mark.parametrize('ini, env, argv, expected', [
+    (['qr-code = no'], {}, [], False),
+    (['qr-code = no'], {'qr_code': 'yes'}, [], True),
+    ([], {'qr_code': 'yes'}, ['--no-qr-code'], False),
+])
+def test_boolean_precedence(settings_from, ini, env, argv, expected):
+    assert settings_from(ini, env, argv)['qr_code'] is expected
+
+
+def test_settings_are_merged_per_name(settings_from, tmp_path):
+    settings = settings_from(['engine = waitress', 'threads = 8', f'cache-dir = {tmp_path}/cache'],
+                             {'threads': '12'}, ['--workers', '3'])
+    assert (settings['engine'], settings['threads'], settings['workers']) == ('waitress', 12, 3)
+    assert settings['metadata_db'] == os.path.join(str(tmp_path), 'cache', 'metadata.sqlite3')
+    assert settings['hls_cache_dir'] == os.path.join(str(tmp_path), 'cache', 'hls')
+
+
+def test_libraries_from_the_command_line_replace_configured_ones(settings_from, tmp_path):
+    configured = settings_from([f'library = {tmp_path}/a{os.pathsep}{tmp_path}/b'])
+    assert configured['library'] == [str(tmp_path / 'a'), str(tmp_path / 'b')]
+    overridden = settings_from([f'library = {tmp_path}/a'], {}, ['--library', str(tmp_path / 'c')])
+    assert overridden['library'] == [str(tmp_path / 'c')]
+
+
+@pytest.mark.parametrize('ini, env', [
+    (['port = http'], {}),
+    ([], {'port': 'http'}),
+    (['colour = blue'], {}),
+    ([], {'cluster_nodes': 'not-a-url'}),
+])
+def test_invalid_values_are_reported(settings_from, ini, env):
+    with pytest.raises(ValueError):
+        settings_from(ini, env)
+
+
+def test_missing_config_file(settings_from, tmp_path):
+    with pytest.raises(ValueError):
+        settings_from(argv=['--config', str(tmp_path / 'missing.ini')])
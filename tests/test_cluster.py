@@ -0,0 +1,119 @@
+from collections import Counter
+
+import pytest
+
+import cluster
+from catalog import VideoCatalog
+from cluster import Cluster, HashRing, MetadataChanges
+
+NODES = [f"http://10.0.0.{i}:5000" for i in range(1, 6)]
+FILENAMES = [f"Show {i // 50:03d}/Episode {i % 50:02d}.mkv" for i in range(5000)]
+
+
+# --- Ring ---
+def test_preference_lists_every_node_once():
+    ring = HashRing(NODES)
+    for filename in FILENAMES[:100]:
+        preference = ring.preference(filename)
+        assert sorted(preference) == sorted(NODES)
+        assert ring.owners(filename, 2) == preference[:2]
+
+
+def test_placement_does_not_depend_on_node_order():
+    assert all(HashRing(NODES).preference(f) == HashRing(NODES[::-1]).preference(f) for f in FILENAMES[:200])
+
+
+def test_empty_ring_has_no_owners():
+    assert HashRing([]).preference('video.mkv') == []
+
+
+def test_join_moves_only_videos_to_the_new_node():
+    before, after = HashRing(NODES[:4]), HashRing(NODES)
+    moved = [f for f in FILENAMES if before.preference(f)[0] != after.preference(f)[0]]
+    assert all(after.preference(f)[0] == NODES[4] for f in moved)
+    assert 0.1 < len(moved) / len(FILENAMES) < 0.3   # about 1/5
+
+
+def test_leave_moves_only_videos_of_the_leaving_node():
+    before, after = HashRing(NODES), HashRing(NODES[1:])
+    for filename in FILENAMES:
+        old = before.preference(filename)
+        # The next node in the old preference order takes over
+        assert after.preference(filename) == [node for node in old if node != NODES[0]]
+
+
+def test_ring_is_balanced():
+    ring = HashRing(NODES)
+    load = Counter(ring.preference(f)[0] for f in FILENAMES)
+    share = len(FILENAMES) / len(NODES)
+    assert max(load.values()) < 1.5 * share and min(load.values()) > 0.5 * share
+
+
+# --- Routing ---
+def catalog(*filenames):
+    return VideoCatalog({'filename': f, 'path': f'/videos/{f}'} for f in filenames)
+
+
+@pytest.fixture
+def node():
+    local = catalog('local.mkv', 'both.mkv')
+    instance = Cluster(NODES[:3], NODES[0], lambda: local)
+    for url, videos in ((NODES[1], ['both.mkv', 'remote.mkv']), (NODES[2], ['remote.mkv', 'down.mkv'])):
+        peer = instance._peers[url]
+        peer.healthy = url != NODES[2]
+        peer.videos = {f: {'filename': f} for f in videos}
+    instance._ring = HashRing([NODES[0], NODES[1]])
+    return instance
+
+
+def test_locate(node):
+    assert node.locate('local.mkv') == NODES[0]
+    assert node.locate('remote.mkv') == NODES[1]
+    assert node.locate('down.mkv') is None        # only on a node that left the ring
+    assert node.locate('missing.mkv') is None
+    owner = node._ring.preference('both.mkv')[0]
+    assert node.locate('both.mkv') == owner       # held by both: its owner serves it
+
+
+# --- Metadata generations ---
+def test_metadata_changes_since_a_token():
+    changes = MetadataChanges()
+    changes.record('a.mkv')
+    token = changes.token()
+    assert changes.since(token) == []
+    changes.record('b.mkv')
+    changes.record('a.mkv')
+    assert sorted(changes.since(token)) == ['a.mkv', 'b.mkv']
+
+
+@pytest.mark.parametrize('token', ['other.0', 'garbage', ''])
+def test_foreign_tokens_get_everything(token):
+    changes = MetadataChanges()
+    assert changes.since(token) is None
+    assert changes.since(f"{changes.epoch}.5") is None   # a generation this instance never had
+
+
+def test_peer_metadata_is_fetched_as_a_delta(node, monkeypatch):
+    peer = node._peers[NODES[1]]
+    peer.version, peer.metadata = 'v1', 'epoch.1'
+    requests = []
+    responses = {
+        f"{NODES[1]}/api/cluster/health": {'node': NODES[1], 'version': 'v1', 'metadata': 'epoch.2'},
+        f"{NODES[1]}/api/cluster/videos?since=epoch.1": {
+            'version': 'v1', 'metadata': 'epoch.2', 'delta': True,
+            'videos': [{'filename': 'remote.mkv', 'metadata': {'duration': 5.0}}]},
+    }
+
+    def get_json(url):
+        requests.append(url)
+        return responses[url]
+    monkeypatch.setattr(cluster, '_get_json', get_json)
+    node._check_peer(peer)
+    assert requests == [f"{NODES[1]}/api/cluster/health", f"{NODES[1]}/api/cluster/videos?since=epoch.1"]
+    assert sorted(peer.videos) == ['both.mkv', 'remote.mkv']
+    assert node.remote_metadata('remote.mkv') == {'duration': 5.0}
+    # Unchanged generation: only the health check
+    requests.clear()
+    responses[f"{NODES[1]}/api/cluster/health"]['metadata'] = 'epoch.2'
+    node._check_peer(peer)
+    assert requests == [f"{NODES[1]}/api/cluster/health"]
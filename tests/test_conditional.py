@@ -0,0 +1,77 @@
+import os
+
+from conditional import file_validators, if_range_allows, is_not_modified
+
+ETAG = '"1a-3e8-5f5e100"'
+LAST_MODIFIED = 'Tue, 01 Sep 2026 10:00:00 GMT'
+
+
+def test_file_validators_change_with_the_file(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'x' * 10)
+    st = os.stat(path)
+    etag, last_modified = file_validators(st)
+    assert etag.startswith('"') and etag.endswith('"')
+    assert last_modified.endswith('GMT')
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert file_validators(os.stat(path))[0] != etag
+
+
+def test_weak_and_variant_validators(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'x')
+    etag, _ = file_validators(os.stat(path), weak=True, variant='fs')
+    assert etag.startswith('W/"') and etag.endswith('-fs"')
+
+
+def test_if_none_match_matches():
+    assert is_not_modified({'If-None-Match': ETAG}, ETAG, LAST_MODIFIED)
+
+
+def test_if_none_match_uses_weak_comparison():
+    assert is_not_modified({'If-None-Match': 'W/' + ETAG}, ETAG, LAST_MODIFIED)
+    assert is_not_modified({'If-None-Match': ETAG}, 'W/' + ETAG, LAST_MODIFIED)
+
+
+def test_if_none_match_list_and_star():
+    assert is_not_modified({'If-None-Match': '"other", ' + ETAG}, ETAG, LAST_MODIFIED)
+    assert is_not_modified({'If-None-Match': '*'}, ETAG, LAST_MODIFIED)
+
+
+def test_if_none_match_mismatch():
+    assert not is_not_modified({'If-None-Match': '"other"'}, ETAG, LAST_MODIFIED)
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since():
+    headers = {'If-None-Match': '"other"', 'If-Modified-Since': LAST_MODIFIED}
+    assert not is_not_modified(headers, ETAG, LAST_MODIFIED)
+
+
+def test_if_modified_since():
+    assert is_not_modified({'If-Modified-Since': LAST_MODIFIED}, ETAG, LAST_MODIFIED)
+    assert is_not_modified({'If-Modified-Since': 'Wed, 02 Sep 2026 10:00:00 GMT'}, ETAG, LAST_MODIFIED)
+    assert not is_not_modified({'If-Modified-Since': 'Mon, 31 Aug 2026 10:00:00 GMT'}, ETAG, LAST_MODIFIED)
+
+
+def test_invalid_if_modified_since_is_ignored():
+    assert not is_not_modified({'If-Modified-Since': 'yesterday'}, ETAG, LAST_MODIFIED)
+
+
+def test_no_conditional_headers():
+    assert not is_not_modified({}, ETAG, LAST_MODIFIED)
+
+
+def test_range_without_if_range():
+    assert if_range_allows({}, ETAG, LAST_MODIFIED)
+
+
+def test_if_range_etag_uses_strong_comparison():
+    assert if_range_allows({'If-Range': ETAG}, ETAG, LAST_MODIFIED)
+    assert not if_range_allows({'If-Range': '"other"'}, ETAG, LAST_MODIFIED)
+    assert not if_range_allows({'If-Range': 'W/' + ETAG}, ETAG, LAST_MODIFIED)
+    assert not if_range_allows({'If-Range': ETAG}, 'W/' + ETAG, LAST_MODIFIED)
+
+
+def test_if_range_date_must_match_exactly():
+    assert if_range_allows({'If-Range': LAST_MODIFIED}, ETAG, LAST_MODIFIED)
+    assert not if_range_allows({'If-Range': 'Wed, 02 Sep 2026 10:00:00 GMT'}, ETAG, LAST_MODIFIED)
@@ -0,0 +1,209 @@
+import struct
+
+import pytest
+
+import containers
+from containers import ContainerError, UNKNOWN_SIZE, iter_boxes, iter_ebml, read_vint
+
+
+# --- MP4 builders ---
+def box(box_type: bytes, payload: bytes = b'') -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type: bytes, payload: bytes, version: int = 0) -> bytes:
+    return box(box_type, bytes([version, 0, 0, 0]) + payload)
+
+
+def mp4_moov(width=640, height=360, timescale=12800, stts=((100, 512), (50, 512)), codec=b'avc1',
+             mdhd_version=0) -> bytes:
+    frames = sum(count * delta for count, delta in stts)
+    mvhd = full_box(b'mvhd', struct.pack('>III', 0, 0, 1000) + struct.pack('>I', frames * 1000 // timescale)
+                    + bytes(80))
+    tkhd = full_box(b'tkhd', bytes(72) + struct.pack('>II', width << 16, height << 16))
+    if mdhd_version == 1:
+        mdhd = full_box(b'mdhd', struct.pack('>QQIQ', 0, 0, timescale, frames) + bytes(4), version=1)
+    else:
+        mdhd = full_box(b'mdhd', struct.pack('>IIII', 0, 0, timescale, frames) + bytes(4))
+    hdlr = full_box(b'hdlr', bytes(4) + b'vide' + bytes(12) + b'video\0')
+    entry = struct.pack('>I4s', 86, codec) + bytes(78)
+    stsd = full_box(b'stsd', struct.pack('>I', 1) + entry)
+    stts_box = full_box(b'stts', struct.pack('>I', len(stts)) + b''.join(struct.pack('>II', *e) for e in stts))
+    stbl = box(b'stbl', stsd + stts_box)
+    mdia = box(b'mdia', mdhd + hdlr + box(b'minf', stbl))
+    return box(b'moov', mvhd + box(b'trak', tkhd + mdia))
+
+
+FTYP = box(b'ftyp', b'isom' + bytes(4) + b'isomavc1')
+
+
+def test_iter_boxes_walks_siblings():
+    data = memoryview(box(b'free', b'abc') + box(b'skip'))
+    assert [(t, s, e) for t, s, e in iter_boxes(data)] == [(b'free', 8, 11), (b'skip', 19, 19)]
+
+
+def test_iter_boxes_largesize_header():
+    payload = b'x' * 4
+    data = memoryview(struct.pack('>I4sQ', 1, b'mdat', 16 + len(payload)) + payload)
+    assert list(iter_boxes(data)) == [(b'mdat', 16, 20)]
+
+
+def test_iter_boxes_size_zero_extends_to_end():
+    data = memoryview(struct.pack('>I4s', 0, b'mdat') + b'rest')
+    assert list(iter_boxes(data)) == [(b'mdat', 8, 12)]
+
+
+@pytest.mark.parametrize('data', [
+    box(b'free', b'abcd')[:-1],                          # box longer than its parent
+    struct.pack('>I4s', 4, b'free'),                     # size smaller than the header
+    struct.pack('>I4sI', 1, b'mdat', 0),                 # truncated largesize header
+])
+def test_iter_boxes_rejects_invalid_boxes(data):
+    with pytest.raises(ContainerError):
+        list(iter_boxes(memoryview(data)))
+
+
+def test_parse_mp4_moov():
+    info = containers.parse_mp4_moov(mp4_moov())
+    assert info == {'width': 640, 'height': 360, 'fps': 25.0, 'duration': 6.0, 'frame_count': 150,
+                    'codec': 'avc1'}
+
+
+def test_parse_mp4_moov_version_1_mdhd():
+    info = containers.parse_mp4_moov(mp4_moov(mdhd_version=1))
+    assert info['duration'] == 6.0 and info['frame_count'] == 150
+
+
+def test_parse_mp4_moov_truncated_stts():
+    moov = bytearray(mp4_moov(stts=((150, 512),)))
+    position = moov.index(b'stts') + 8  # entry count of the stts box
+    moov[position:position + 4] = struct.pack('>I', 1000)
+    with pytest.raises(ContainerError):
+        containers.parse_mp4_moov(bytes(moov))
+
+
+@pytest.mark.parametrize('layout', ['faststart', 'trailing'])
+def test_probe_mp4_file(tmp_path, layout):
+    mdat = box(b'mdat', bytes(1000))
+    content = FTYP + (mp4_moov() + mdat if layout == 'faststart' else mdat + mp4_moov())
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(content)
+    assert containers.probe_container(str(path))['frame_count'] == 150
+
+
+def test_probe_truncated_mp4_returns_none(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(FTYP + box(b'mdat', bytes(100)) + mp4_moov()[:-20])
+    assert containers.probe_container(str(path)) is None
+
+
+# --- EBML ---
+@pytest.mark.parametrize('data, keep_marker, expected', [
+    (b'\x81', False, (1, 1)),
+    (b'\x40\x02', False, (2, 2)),
+    (b'\x1a\x45\xdf\xa3', True, (0x1A45DFA3, 4)),
+    (b'\xff', False, (UNKNOWN_SIZE, 1)),
+    (b'\x01\xff\xff\xff\xff\xff\xff\xff', False, (UNKNOWN_SIZE, 8)),
+    (b'\xff', True, (0xFF, 1)),
+])
+def test_read_vint(data, keep_marker, expected):
+    assert read_vint(data, 0, keep_marker) == expected
+
+
+@pytest.mark.parametrize('data', [b'', b'\x00', b'\x40'])
+def test_read_vint_invalid(data):
+    with pytest.raises(ContainerError):
+        read_vint(data, 0, keep_marker=False)
+
+
+def element(element_id: int, payload: bytes) -> bytes:
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+    return id_bytes + b'\x01' + len(payload).to_bytes(7, 'big') + payload
+
+
+def test_iter_ebml_rejects_overrun():
+    data = element(0x83, b'\x01')[:-1]
+    with pytest.raises(ContainerError):
+        list(iter_ebml(data))
+
+
+def matroska(tracks_after_cluster: bool) -> bytes:
+    header = element(containers.EBML_ID, element(containers.EBML_DOCTYPE, b'webm'))
+    info = element(containers.MKV_INFO, element(containers.MKV_TIMECODE_SCALE, (1000000).to_bytes(3, 'big'))
+                   + element(containers.MKV_DURATION, struct.pack('>d', 5000.0)))
+    video = element(containers.MKV_VIDEO, element(containers.MKV_PIXEL_WIDTH, (640).to_bytes(2, 'big'))
+                    + element(containers.MKV_PIXEL_HEIGHT, (360).to_bytes(2, 'big')))
+    entry = element(containers.MKV_TRACK_ENTRY, element(containers.MKV_TRACK_TYPE, b'\x01')
+                    + element(containers.MKV_CODEC_ID, b'V_VP9')
+                    + element(containers.MKV_DEFAULT_DURATION, (40000000).to_bytes(4, 'big')) + video)
+    tracks = element(containers.MKV_TRACKS, entry)
+    cluster = element(containers.MKV_CLUSTER, bytes(64))
+    if not tracks_after_cluster:
+        return header + element(containers.MKV_SEGMENT, info + tracks + cluster)
+
+    def seekhead(position: int) -> bytes:
+        seek = element(containers.MKV_SEEK, element(containers.MKV_SEEK_ID, containers.MKV_TRACKS.to_bytes(4, 'big'))
+                       + element(containers.MKV_SEEK_POSITION, position.to_bytes(4, 'big')))
+        return element(containers.MKV_SEEKHEAD, seek)
+    position = len(seekhead(0)) + len(info) + len(cluster)
+    return header + element(containers.MKV_SEGMENT, seekhead(position) + info + cluster + tracks)
+
+
+@pytest.mark.parametrize('tracks_after_cluster', [False, True])
+def test_probe_matroska(tmp_path, tracks_after_cluster):
+    path = tmp_path / 'video.mkv'
+    path.write_bytes(matroska(tracks_after_cluster))
+    assert containers.probe_container(str(path)) == {'width': 640, 'height': 360, 'fps': 25.0, 'duration': 5.0,
+                                                     'frame_count': 125, 'codec': 'V_VP9'}
+
+
+def test_probe_truncated_matroska_returns_none(tmp_path):
+    path = tmp_path / 'video.mkv'
+    path.write_bytes(matroska(False)[:60])
+    assert containers.probe_container(str(path)) is None
+
+
+# --- AVI ---
+def chunk(chunk_id: bytes, payload: bytes) -> bytes:
+    return struct.pack('<4sI', chunk_id, len(payload)) + payload + (b'\0' if len(payload) % 2 else b'')
+
+
+def riff_list(list_type: bytes, payload: bytes) -> bytes:
+    return chunk(b'LIST', list_type + payload)
+
+
+def avi(odml_frames: int = 0) -> bytes:
+    avih = struct.pack('<IIIIIIIIII', 33333, 0, 0, 0, 100, 0, 1, 0, 320, 240) + bytes(16)
+    strh = b'vids' + b'H264' + bytes(12) + struct.pack('<III', 1, 30, 0) + struct.pack('<I', 100) + bytes(20)
+    hdrl = chunk(b'avih', avih) + riff_list(b'strl', chunk(b'strh', strh))
+    if odml_frames:
+        hdrl += riff_list(b'odml', chunk(b'dmlh', struct.pack('<I', odml_frames)))
+    body = b'AVI ' + riff_list(b'hdrl', hdrl) + riff_list(b'movi', b'')
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def test_probe_avi(tmp_path):
+    path = tmp_path / 'video.avi'
+    path.write_bytes(avi())
+    info = containers.probe_container(str(path))
+    assert (info['width'], info['height'], info['fps'], info['frame_count'], info['codec']) == (320, 240, 30.0, 100,
+                                                                                                 'H264')
+    assert info['duration'] == pytest.approx(100 / 30)
+
+
+def test_probe_avi_prefers_opendml_frame_count(tmp_path):
+    path = tmp_path / 'video.avi'
+    path.write_bytes(avi(odml_frames=900))
+    assert containers.probe_container(str(path))['frame_count'] == 900
+
+
+# --- Dispatch ---
+@pytest.mark.parametrize('head, expected', [
+    (containers.EBML_ID.to_bytes(4, 'big') + bytes(8), 'matroska'),
+    (b'RIFF\0\0\0\0AVI ', 'avi'),
+    (FTYP[:12], 'mp4'),
+    (b'not a video!', None),
+    (b'', None),
+])
+def test_detect_container(head, expected):
+    assert containers.detect_container(head) == expected
@@ -0,0 +1,54 @@
+import os
+
+from disk_cache import DiskCache
+
+
+def put(cache, key, data):
+    workdir = cache.make_workdir('test-')
+    source = os.path.join(workdir, 'entry')
+    with open(source, 'wb') as f:
+        f.write(data)
+    return cache.put_file(key, source)
+
+
+def test_workdirs_are_outside_the_indexed_root(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache'), 1000)
+    workdir = cache.make_workdir('job-')
+    with open(os.path.join(workdir, 'seg_0.m4s.tmp'), 'wb') as f:
+        f.write(b'partial')
+    assert not os.path.realpath(workdir).startswith(cache.root + os.sep)
+    # Another process opening the cache neither indexes nor deletes work in progress
+    other = DiskCache(cache.root, 1000)
+    assert other.stats()['files'] == 0
+    assert os.listdir(workdir) == ['seg_0.m4s.tmp']
+
+
+def test_entries_of_other_processes_are_picked_up(tmp_path):
+    first = DiskCache(str(tmp_path / 'cache'), 1000)
+    second = DiskCache(str(tmp_path / 'cache'), 1000)
+    put(first, 'video/seg_0.m4s', b'x' * 100)
+    assert 'video/seg_0.m4s' in second
+    assert second.get('video/seg_0.m4s') == first.path_for('video/seg_0.m4s')
+    assert second.stats()['bytes'] == 100
+
+
+def test_entries_evicted_by_other_processes_are_dropped(tmp_path):
+    first = DiskCache(str(tmp_path / 'cache'), 250)
+    second = DiskCache(str(tmp_path / 'cache'), 250)
+    put(first, 'a', b'x' * 100)
+    assert second.get('a') is not None
+    put(first, 'b', b'x' * 100)
+    put(first, 'c', b'x' * 100)   # evicts a
+    assert second.get('a') is None
+    assert second.stats()['bytes'] == 0
+
+
+def test_claims_are_exclusive_until_released(tmp_path):
+    first = DiskCache(str(tmp_path / 'cache'), 1000)
+    second = DiskCache(str(tmp_path / 'cache'), 1000)
+    claim = first.claim('video-0')
+    assert claim is not None
+    assert second.claim('video-0') is None
+    assert second.claim('video-10') is not None
+    first.release(claim)
+    assert second.claim('video-0') is not None
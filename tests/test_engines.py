@@ -0,0 +1,93 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import http.client
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.urandom(300_000)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def start_server(tmp_path):
+    """Runs cli.py with an engine over a one-video library; returns a connection factory."""
+    processes = []
+
+    def start(engine, *args):
+        library = tmp_path / 'library'
+        library.mkdir(exist_ok=True)
+        (library / 'clip.mp4').write_bytes(DATA)
+        port = free_port()
+        env = {key: value for key, value in os.environ.items() if not key.startswith('MEDIA_SERVER_')}
+        process = subprocess.Popen(
+            [sys.executable, 'cli.py', '--headless', '--no-qr-code', '--engine', engine, '--host', '127.0.0.1',
+             '--port', str(port), '--library', str(library), '--cache-dir', str(tmp_path / 'cache'), *args],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        processes.append(process)
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    pytest.fail(f"{engine} did not start: {process.stderr.read().decode(errors='replace')[-2000:]}")
+                time.sleep(0.1)
+        return lambda: http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+
+    yield start
+    for process in processes:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        process.stderr.close()
+
+
+def get(connection, path, headers=None):
+    connection.request('GET', path, headers=headers or {})
+    response = connection.getresponse()
+    return response, response.read()
+
+
+ENGINES = [
+    pytest.param('dev', (), id='dev'),
+    pytest.param('gunicorn', ('--workers', '2'), id='gunicorn'),
+    pytest.param('waitress', (), id='waitress'),
+    pytest.param('asyncio', (), id='asyncio'),
+]
+
+
+@pytest.mark.parametrize('engine, args', ENGINES)
+def test_engine_serves_ranges(start_server, engine, args):
+    if engine in ('gunicorn', 'waitress'):
+        pytest.importorskip(engine)
+    connect = start_server(engine, *args)
+    connection = connect()
+    response, body = get(connection, '/stream/clip.mp4', {'Range': 'bytes=100-1099'})
+    assert response.status == 206
+    assert response.getheader('Content-Length') == '1000'
+    assert response.getheader('Content-Range') == f'bytes 100-1099/{len(DATA)}'
+    assert body == DATA[100:1100]
+    # The same keep-alive connection, an open-ended range to the end of the file
+    response, body = get(connection, '/stream/clip.mp4', {'Range': f'bytes={len(DATA) - 5000}-'})
+    assert response.status == 206 and body == DATA[-5000:]
+    connection.close()
+
+    response, body = get(connect(), '/stream/clip.mp4')
+    assert response.status == 200
+    assert response.getheader('Content-Length') == str(len(DATA)) and body == DATA
+    response, _ = get(connect(), '/stream/clip.mp4', {'Range': f'bytes={len(DATA)}-'})
+    assert response.status == 416
@@ -0,0 +1,178 @@
+import os
+import struct
+
+import pytest
+
+import faststart
+from containers import ContainerError, find_box, iter_boxes
+from faststart import LayoutCache
+
+
+def box(box_type: bytes, payload: bytes = b'') -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type: bytes, payload: bytes) -> bytes:
+    return box(box_type, bytes(4) + payload)
+
+
+def chunk_table(table_type: bytes, offsets) -> bytes:
+    code = 'I' if table_type == b'stco' else 'Q'
+    return full_box(table_type, struct.pack(f'>I{len(offsets)}{code}', len(offsets), *offsets))
+
+
+def trak(table: bytes) -> bytes:
+    return box(b'trak', box(b'mdia', box(b'minf', box(b'stbl', table))))
+
+
+def moov(stco, co64) -> bytes:
+    """A moov with one track using stco and one using co64."""
+    return box(b'moov', full_box(b'mvhd', bytes(96)) + trak(chunk_table(b'stco', stco))
+               + trak(chunk_table(b'co64', co64)))
+
+
+def chunk_offsets(moov_data: bytes):
+    """(stco offsets, co64 offsets) of a moov built by moov()."""
+    data = memoryview(moov_data)
+    _, start, end = next(iter_boxes(data))
+    tables = []
+    for box_type, trak_start, trak_end in iter_boxes(data, start, end):
+        if box_type != b'trak':
+            continue
+        stbl = find_box(data, [b'mdia', b'minf', b'stbl'], trak_start, trak_end)
+        table_type, table_start, _ = next(iter_boxes(data, *stbl))
+        count = struct.unpack_from('>I', data, table_start + 4)[0]
+        tables.append(list(struct.unpack_from(f'>{count}{"I" if table_type == b"stco" else "Q"}', data,
+                                              table_start + 8)))
+    return tuple(tables)
+
+
+FTYP = box(b'ftyp', b'isom' + bytes(4) + b'isomavc1')
+PAYLOAD = bytes(range(256)) * 8
+CHUNKS = [0, 300, 900, 1500]   # chunk positions in the mdat payload
+
+
+def write_trailing_moov(path) -> bytes:
+    """Writes [ftyp][mdat][moov] and returns the moov as written."""
+    first = len(FTYP) + 8
+    original = moov([first + c for c in CHUNKS[:2]], [first + c for c in CHUNKS[2:]])
+    path.write_bytes(FTYP + box(b'mdat', PAYLOAD) + original)
+    return original
+
+
+def read_virtual(path, layout, start: int, length: int) -> bytes:
+    data = b''
+    with open(path, 'rb') as f:
+        for offset, size, patched in layout.map_range(start, length):
+            if patched is not None:
+                data += patched
+            else:
+                f.seek(offset)
+                data += f.read(size)
+    return data
+
+
+# --- Layouts ---
+def test_trailing_moov_is_moved_in_front_of_mdat(tmp_path):
+    path = tmp_path / 'video.mp4'
+    original = write_trailing_moov(path)
+    layout = faststart.analyze(str(path))
+    assert layout is not None
+    assert (layout.insert_at, layout.moov_offset) == (len(FTYP), len(FTYP) + 8 + len(PAYLOAD))
+    virtual = read_virtual(path, layout, 0, layout.size)
+    assert len(virtual) == os.path.getsize(path)
+    assert virtual == FTYP + layout.moov + box(b'mdat', PAYLOAD)
+    assert len(layout.moov) == len(original)
+
+
+def test_patched_offsets_point_at_the_same_chunks(tmp_path):
+    path = tmp_path / 'video.mp4'
+    original = write_trailing_moov(path)
+    layout = faststart.analyze(str(path))
+    on_disk = path.read_bytes()
+    virtual = read_virtual(path, layout, 0, layout.size)
+    for before, after in zip(sum(chunk_offsets(original), []), sum(chunk_offsets(layout.moov), [])):
+        assert after == before + len(original)
+        assert virtual[after:after + 100] == on_disk[before:before + 100]
+
+
+def test_virtual_offset_translates_file_offsets(tmp_path):
+    path = tmp_path / 'video.mp4'
+    original = write_trailing_moov(path)
+    layout = faststart.analyze(str(path))
+    assert layout.virtual_offset(0) == 0
+    assert layout.virtual_offset(len(FTYP)) == len(FTYP) + len(original)
+    assert layout.virtual_offset(layout.moov_offset) is None
+
+
+def test_map_range_splits_at_the_moov(tmp_path):
+    path = tmp_path / 'video.mp4'
+    write_trailing_moov(path)
+    layout = faststart.analyze(str(path))
+    pieces = layout.map_range(len(FTYP) - 4, len(layout.moov) + 8)
+    assert [(offset, size) for offset, size, _ in pieces] == [(len(FTYP) - 4, 4), (0, len(layout.moov)),
+                                                              (len(FTYP), 4)]
+    assert pieces[1][2] == layout.moov
+
+
+@pytest.mark.parametrize('content', [
+    FTYP + moov([100], [200]) + box(b'mdat', PAYLOAD),                              # already faststart
+    FTYP + box(b'moof') + box(b'mdat', PAYLOAD) + moov([100], [200]),               # fragmented
+    FTYP + box(b'mdat', PAYLOAD) + moov([100], [200]) + moov([100], [200]),         # two moov boxes
+    FTYP + box(b'mdat', PAYLOAD) + moov([100], [200])[:-10],                        # truncated moov
+])
+def test_files_served_as_they_are(tmp_path, content):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(content)
+    assert faststart.analyze(str(path)) is None
+
+
+# --- Offset patching ---
+def test_patch_only_offsets_in_the_moved_region():
+    data = bytearray(moov([50, 100, 199, 200], [10, 150]))
+    assert faststart._patch_chunk_offsets(data, 100, 200, 1000) == 2
+    assert chunk_offsets(bytes(data)) == ([50, 1100, 1199, 200], [10, 1150])
+
+
+def test_patch_co64_beyond_32_bits():
+    large = 6 * 2 ** 30
+    data = bytearray(moov([], [large, large + 4096]))
+    faststart._patch_chunk_offsets(data, 2 ** 30, 2 ** 33, 2 ** 32)
+    assert chunk_offsets(bytes(data))[1] == [large + 2 ** 32, large + 4096 + 2 ** 32]
+
+
+def test_patch_rejects_stco_overflow():
+    data = bytearray(moov([0xFFFFFF00], []))
+    with pytest.raises(ContainerError):
+        faststart._patch_chunk_offsets(data, 0, 0xFFFFFFFF, 0x1000)
+
+
+def test_patch_rejects_truncated_tables():
+    data = bytearray(moov([100, 200], [300]))
+    position = data.index(b'stco') + 8   # entry count of the stco box
+    data[position:position + 4] = struct.pack('>I', 1000)
+    with pytest.raises(ContainerError):
+        faststart._patch_chunk_offsets(data, 0, 1000, 10)
+
+
+def test_truncated_table_gets_no_layout(tmp_path):
+    path = tmp_path / 'video.mp4'
+    original = bytearray(write_trailing_moov(path))
+    position = original.index(b'co64') + 8
+    original[position:position + 4] = struct.pack('>I', 1000)
+    path.write_bytes(FTYP + box(b'mdat', PAYLOAD) + bytes(original))
+    assert faststart.analyze(str(path)) is None
+
+
+# --- Cache ---
+def test_layout_cache_revalidates_changed_files(tmp_path):
+    path = tmp_path / 'video.mp4'
+    write_trailing_moov(path)
+    cache = LayoutCache()
+    st = os.stat(path)
+    assert cache.get(str(path), st) is cache.get(str(path), st)
+    assert (cache.hits, cache.misses) == (1, 1)
+    path.write_bytes(FTYP + moov([100], [200]) + box(b'mdat', PAYLOAD))
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert cache.get(str(path), os.stat(path)) is None
+    assert cache.stats()['moov_bytes'] == 0
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+from handle_pool import HandlePool
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f'video{i}.mp4'
+        path.write_bytes(bytes([i]) * 100)
+        paths.append(str(path))
+    return paths
+
+
+def test_handles_are_shared_and_reference_counted(files):
+    pool = HandlePool(max_handles=4)
+    first = pool.acquire(files[0])
+    second = pool.acquire(files[0])
+    assert first is second and first.refs == 2
+    assert first.pread(4, 10) == b'\0' * 4
+    pool.release(first)
+    pool.release(second)
+    assert first.refs == 0 and first.fd >= 0   # idle handles stay open
+    with pool.open(files[0]) as handle:
+        assert handle is first and handle.refs == 1
+    assert pool.stats()['hits'] == 2 and pool.stats()['opens'] == 1
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_pread_does_not_move_a_file_position(files, use_mmap):
+    pool = HandlePool(use_mmap=use_mmap)
+    with pool.open(files[1]) as handle:
+        assert handle.pread(10, 95) == b'\1' * 5
+        assert handle.pread(3, 0) == b'\1' * 3
+
+
+def test_evicted_handles_close_when_the_last_reader_releases(files):
+    pool = HandlePool(max_handles=1)
+    busy = pool.acquire(files[0])
+    idle = pool.acquire(files[1])
+    pool.release(idle)
+    # Over the limit: the least recently used handle in use stays, the idle one goes
+    third = pool.acquire(files[2])
+    assert idle.fd == -1
+    assert busy.fd >= 0 and not busy.retired
+    pool.release(third)
+    pool.release(busy)
+    pool.acquire(files[1])
+    assert busy.fd == -1 and third.fd == -1   # idle now, least recently used first
+    assert pool.stats()['evictions'] == 3 and pool.stats()['open'] == 1
+
+
+def test_changed_file_gets_a_new_handle(files):
+    pool = HandlePool()
+    reader = pool.acquire(files[0])
+    with open(files[0], 'ab') as f:
+        f.write(b'more')
+    replacement = pool.acquire(files[0])
+    assert replacement is not reader and replacement.size == 104
+    assert reader.retired and reader.fd >= 0    # the old reader keeps its descriptor
+    assert reader.pread(1, 0) == b'\0'
+    pool.release(reader)
+    assert reader.fd == -1
+    assert pool.stats()['invalidations'] == 1
+
+
+def test_invalidate_and_close_all_wait_for_readers(files):
+    pool = HandlePool()
+    reader = pool.acquire(files[0])
+    idle = pool.acquire(files[1])
+    pool.release(idle)
+    pool.invalidate([files[0]])
+    assert reader.retired and reader.fd >= 0
+    pool.close_all()
+    assert idle.fd == -1
+    pool.release(reader)
+    assert reader.fd == -1
+    assert pool.stats()['open'] == 0
+
+
+def test_idle_handles_are_swept(files, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('handle_pool.time.monotonic', lambda: clock[0])
+    pool = HandlePool(idle_timeout=10)
+    idle = pool.acquire(files[0])
+    pool.release(idle)
+    clock[0] += 11
+    pool.acquire(files[1], os.stat(files[1]))
+    assert idle.fd == -1 and pool.stats()['open'] == 1
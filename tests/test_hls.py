@@ -0,0 +1,183 @@
+import os
+import stat
+import time
+
+import pytest
+
+import hls
+from hls import HLSPipeline, HLSUnavailable, JOB_SEGMENTS, SEGMENT_SECONDS, plan_segments
+from ladder import Rendition, SOURCE
+
+RENDITION_360 = Rendition('360p', 360, 800_000)
+
+# Writes the init segment and the segments of its job, logging its arguments;
+# the first run stops after three segments
+FAKE_FFMPEG = '''#!/bin/sh
+echo "$@" >> "$0.log"
+start=0; pattern=''
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -start_number) start=$2; shift ;;
+        -hls_segment_filename) pattern=$2; shift ;;
+    esac
+    shift
+done
+count=10
+[ "$(wc -l < "$0.log")" -eq 1 ] && count=3
+dir=$(dirname "$pattern")
+printf init > "$dir/init.mp4"
+i=0
+while [ $i -lt $count ]; do printf segment > "$dir/seg_$((start + i)).m4s"; i=$((i + 1)); done
+'''
+
+FAILING_FFMPEG = '''#!/bin/sh
+echo "$@" >> "$0.log"
+echo "Invalid data found when processing input" >&2
+exit 1
+'''
+
+# Stream copies work, encoding fails like a build without libx264
+NO_X264_FFMPEG = '''#!/bin/sh
+case "$*" in
+    *libx264*) echo "$@" >> "$0.log"; echo "Unknown encoder 'libx264'" >&2; exit 1 ;;
+esac
+''' + FAKE_FFMPEG.split('\n', 1)[1]
+
+
+def make_ffmpeg(tmp_path, script: str) -> str:
+    path = tmp_path / 'ffmpeg'
+    path.write_text(script)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def invocations(ffmpeg: str):
+    with open(ffmpeg + '.log') as f:
+        return [line.split() for line in f]
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / 'video.mkv'
+    path.write_bytes(b'x' * 100)
+    return str(path)
+
+
+# --- Planning ---
+def test_transcodes_get_nominal_segments_starting_anywhere():
+    plan = plan_segments(100.0, RENDITION_360)
+    assert plan.starts == [index * SEGMENT_SECONDS for index in range(17)]
+    assert plan.blocks is None
+    assert plan.job_span(5) == (5, 5 + JOB_SEGMENTS - 1)
+    assert plan.length(16) == pytest.approx(4.0)
+
+
+def test_source_without_index_uses_fixed_blocks():
+    plan = plan_segments(130.0)
+    assert plan.blocks == [0, JOB_SEGMENTS, 2 * JOB_SEGMENTS]
+    assert plan.job_span(13) == (JOB_SEGMENTS, 2 * JOB_SEGMENTS - 1)
+    assert plan.job_span(22) == (2 * JOB_SEGMENTS, 21)
+
+
+def test_source_segments_follow_keyframes():
+    # A keyframe every 2.5 seconds: each segment ends at the first keyframe
+    # at least SEGMENT_SECONDS per segment after the block start
+    keyframes = [index * 2.5 for index in range(60)]
+    plan = plan_segments(150.0, SOURCE, keyframes)
+    block_seconds = JOB_SEGMENTS * SEGMENT_SECONDS
+    assert plan.starts[:4] == [0.0, 7.5, 12.5, 20.0]
+    # The second block starts at the keyframe at or before its nominal start
+    second = plan.blocks[1]
+    assert plan.starts[second] == max(t for t in keyframes if t <= block_seconds)
+    assert all(start in keyframes for start in plan.starts)
+    assert plan.end(len(plan) - 1) == 150.0
+
+
+def test_sparse_keyframes_merge_blocks():
+    keyframes = [0.0, 100.0]
+    plan = plan_segments(130.0, SOURCE, keyframes)
+    assert plan.starts == [0.0, 100.0]
+    assert plan.blocks == [0, 1]
+
+
+def test_playlist_lists_planned_segments():
+    plan = plan_segments(20.0, SOURCE, [0.0, 9.0, 15.0])
+    playlist = hls.build_playlist(plan)
+    assert '#EXT-X-TARGETDURATION:9' in playlist
+    assert '#EXTINF:9.000,\nseg_0.m4s' in playlist
+    assert '#EXTINF:5.000,\nseg_2.m4s' in playlist
+    assert 'seg_3.m4s' not in playlist
+
+
+def test_playlist_of_rendition_links_its_segments():
+    playlist = hls.build_playlist(plan_segments(10.0, RENDITION_360), RENDITION_360)
+    assert 'init.mp4?rendition=360p' in playlist and 'seg_1.m4s?rendition=360p' in playlist
+
+
+# --- Jobs ---
+def test_block_jobs_start_at_the_block(tmp_path, video):
+    ffmpeg = make_ffmpeg(tmp_path, FAKE_FFMPEG)
+    pipeline = HLSPipeline(str(tmp_path / 'cache'), 10 ** 8, ffmpeg=ffmpeg)
+    plan = plan_segments(130.0, SOURCE, [index * 2.0 for index in range(65)])
+    st = os.stat(video)
+    pipeline.get_segment(video, st, plan, 'seg_1.m4s', timeout=5)
+    # Segment 4 belongs to the same block, so its job starts from the block's
+    # first segment even though the first ones are cached
+    pipeline.get_segment(video, st, plan, 'seg_4.m4s', timeout=5)
+    pipeline.shutdown()
+    starts = [args[args.index('-start_number') + 1] for args in invocations(ffmpeg)]
+    assert starts == ['0', '0']
+
+
+def test_failed_job_fails_waiting_requests_at_once(tmp_path, video):
+    ffmpeg = make_ffmpeg(tmp_path, FAILING_FFMPEG)
+    pipeline = HLSPipeline(str(tmp_path / 'cache'), 10 ** 8, ffmpeg=ffmpeg)
+    plan = plan_segments(60.0)
+    st = os.stat(video)
+    started = time.monotonic()
+    with pytest.raises(HLSUnavailable, match='Invalid data'):
+        pipeline.get_segment(video, st, plan, 'seg_0.m4s', timeout=10)
+    with pytest.raises(HLSUnavailable):
+        pipeline.get_segment(video, st, plan, 'seg_5.m4s', timeout=10)
+    assert time.monotonic() - started < 5
+    assert len(invocations(ffmpeg)) == 1
+    assert pipeline.stats()['failed'] == 1
+
+
+def test_failed_transcode_leaves_other_renditions_working(tmp_path, video):
+    ffmpeg = make_ffmpeg(tmp_path, NO_X264_FFMPEG)
+    pipeline = HLSPipeline(str(tmp_path / 'cache'), 10 ** 8, ffmpeg=ffmpeg)
+    st = os.stat(video)
+    transcode = plan_segments(60.0, RENDITION_360)
+    with pytest.raises(HLSUnavailable, match='libx264'):
+        pipeline.get_segment(video, st, transcode, 'seg_3.m4s', RENDITION_360, timeout=10)
+    with pytest.raises(HLSUnavailable):
+        pipeline.get_segment(video, st, transcode, 'seg_0.m4s', RENDITION_360, timeout=10)
+    assert pipeline.failed(video, st, RENDITION_360) and not pipeline.failed(video, st, SOURCE)
+    assert pipeline.get_segment(video, st, plan_segments(60.0), 'seg_0.m4s', timeout=5)
+    pipeline.shutdown()
+    assert pipeline.stats()['transcodes_started'] == 1
+
+
+def test_failed_rendition_is_retried_later(tmp_path, video):
+    ffmpeg = make_ffmpeg(tmp_path, FAILING_FFMPEG)
+    pipeline = HLSPipeline(str(tmp_path / 'cache'), 10 ** 8, ffmpeg=ffmpeg)
+    plan = plan_segments(60.0)
+    st = os.stat(video)
+    with pytest.raises(HLSUnavailable):
+        pipeline.get_segment(video, st, plan, 'seg_0.m4s', timeout=10)
+    for key, (error, failed_at) in pipeline._failed.items():
+        pipeline._failed[key] = (error, failed_at - hls.FAILURE_RETRY_SECONDS)
+    assert not pipeline.failed(video, st, SOURCE)
+    with pytest.raises(HLSUnavailable):
+        pipeline.get_segment(video, st, plan, 'seg_0.m4s', timeout=10)
+    assert len(invocations(ffmpeg)) == 2
+
+
+def test_verbose_ffmpeg_does_not_stall(tmp_path, video):
+    # More stderr output than a pipe buffer holds, before any segment is written
+    chatty = FAKE_FFMPEG.replace('count=10\n', 'count=10\nhead -c 200000 /dev/zero | tr "\\\\0" x >&2\n')
+    ffmpeg = make_ffmpeg(tmp_path, chatty)
+    pipeline = HLSPipeline(str(tmp_path / 'cache'), 10 ** 8, ffmpeg=ffmpeg)
+    assert pipeline.get_segment(video, os.stat(video), plan_segments(60.0), 'seg_0.m4s', timeout=5)
+    pipeline.shutdown()
@@ -0,0 +1,209 @@
+import struct
+
+import pytest
+
+import containers
+import keyframes
+from keyframes import KeyframeIndex, build_index, mp4_keyframes
+
+
+# --- MP4 builders ---
+def box(box_type: bytes, payload: bytes = b'') -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type: bytes, payload: bytes, version: int = 0) -> bytes:
+    return box(box_type, bytes([version, 0, 0, 0]) + payload)
+
+
+def table(box_type: bytes, code: str, entries, version: int = 0) -> bytes:
+    return full_box(box_type, struct.pack('>I', len(entries)) + b''.join(struct.pack(code, *e) for e in entries),
+                    version)
+
+
+SIZES = [10 + i for i in range(10)]
+
+
+def mp4_moov(chunk_offsets=(1000, 2000, 3000), co64=False, stss=(1, 7, 10), ctts=((10, 200),), ctts_version=0,
+             edits=((1000, 200),), elst_version=0, with_audio=False, timescale=1000) -> bytes:
+    """
+    A video track of 10 samples, 100 ticks apart, in chunks of 4, 4 and 2
+    samples (sample i is 10 + i bytes). Sync samples are 1-based.
+    """
+    mdhd = full_box(b'mdhd', struct.pack('>IIII', 0, 0, timescale, 1000) + bytes(4))
+    stbl = (full_box(b'stsd', struct.pack('>I', 0))
+            + table(b'stts', '>II', [(10, 100)])
+            + (table(b'ctts', '>II' if ctts_version == 0 else '>Ii', ctts, ctts_version) if ctts else b'')
+            + (table(b'stss', '>I', [(n,) for n in stss]) if stss is not None else b'')
+            + table(b'stsc', '>III', [(1, 4, 1), (3, 2, 1)])
+            + full_box(b'stsz', struct.pack('>II', 0, len(SIZES)) + b''.join(struct.pack('>I', s) for s in SIZES))
+            + (table(b'co64', '>Q', [(o,) for o in chunk_offsets]) if co64
+               else table(b'stco', '>I', [(o,) for o in chunk_offsets])))
+    trak = box(b'trak', (box(b'edts', table(b'elst', '>IiI' if elst_version == 0 else '>QqI',
+                                           [(duration, media_time, 1 << 16) for duration, media_time in edits],
+                                           elst_version)) if edits else b'')
+               + box(b'mdia', mdhd + full_box(b'hdlr', bytes(4) + b'vide' + bytes(12) + b'video\0')
+                     + box(b'minf', box(b'stbl', stbl))))
+    audio = box(b'trak', box(b'mdia', full_box(b'hdlr', bytes(4) + b'soun' + bytes(12) + b'audio\0')))
+    return box(b'moov', (audio if with_audio else b'') + trak)
+
+
+def pairs(index):
+    return [(round(t, 6), o) for t, o in zip(index.times, index.offsets)]
+
+
+def test_mp4_sync_samples_with_composition_offsets_and_edit():
+    # ctts +200 and an edit starting at media time 200 cancel out: pts = dts
+    index = mp4_keyframes(mp4_moov())
+    # Sample 6 is the third of chunk 2 (after samples of 14 and 15 bytes), sample 9 the second of chunk 3
+    assert pairs(index) == [(0.0, 1000), (0.6, 2029), (0.9, 3018)]
+
+
+def test_mp4_empty_edit_is_skipped():
+    index = mp4_keyframes(mp4_moov(edits=((500, -1), (1000, 100)), ctts=None))
+    assert pairs(index) == [(0.0, 1000), (0.5, 2029), (0.8, 3018)]   # dts - 100, clamped at 0
+
+
+def test_mp4_version_1_edit_list():
+    index = mp4_keyframes(mp4_moov(edits=((1000, 200),), elst_version=1))
+    assert pairs(index) == [(0.0, 1000), (0.6, 2029), (0.9, 3018)]
+
+
+def test_mp4_negative_composition_offsets():
+    index = mp4_keyframes(mp4_moov(ctts=((10, -100),), ctts_version=1, edits=()))
+    assert pairs(index) == [(0.0, 1000), (0.5, 2029), (0.8, 3018)]
+
+
+def test_mp4_without_stss_every_sample_is_a_keyframe():
+    index = mp4_keyframes(mp4_moov(stss=None, ctts=None, edits=()))
+    assert len(index) == 10
+    assert pairs(index)[:5] == [(0.0, 1000), (0.1, 1010), (0.2, 1021), (0.3, 1033), (0.4, 2000)]
+
+
+def test_mp4_co64_offsets():
+    base = 5 << 30
+    index = mp4_keyframes(mp4_moov(chunk_offsets=(base, base + 1000, base + 2000), co64=True))
+    assert pairs(index) == [(0.0, base), (0.6, base + 1029), (0.9, base + 2018)]
+
+
+def test_mp4_video_track_is_found_after_audio():
+    assert pairs(mp4_keyframes(mp4_moov(with_audio=True)))[0] == (0.0, 1000)
+
+
+def test_mp4_truncated_table_is_an_error():
+    moov = bytearray(mp4_moov())
+    position = moov.index(b'stss') + 8   # entry count
+    moov[position:position + 4] = struct.pack('>I', 1000)
+    with pytest.raises(containers.ContainerError):
+        mp4_keyframes(bytes(moov))
+
+
+# --- Matroska builders ---
+def element(element_id: int, payload: bytes) -> bytes:
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+    return id_bytes + b'\x01' + len(payload).to_bytes(7, 'big') + payload
+
+
+def uint(element_id: int, value: int) -> bytes:
+    return element(element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'big'))
+
+
+def matroska(cues, timecode_scale=1000000) -> bytes:
+    """A WebM file with an audio track (1) and a video track (2); cues are (time, track, cluster position)."""
+    header = element(containers.EBML_ID, element(containers.EBML_DOCTYPE, b'webm'))
+    info = element(containers.MKV_INFO, uint(containers.MKV_TIMECODE_SCALE, timecode_scale))
+    tracks = element(containers.MKV_TRACKS,
+                     element(containers.MKV_TRACK_ENTRY, uint(keyframes.MKV_TRACK_NUMBER, 1)
+                             + uint(containers.MKV_TRACK_TYPE, 2))
+                     + element(containers.MKV_TRACK_ENTRY, uint(keyframes.MKV_TRACK_NUMBER, 2)
+                               + uint(containers.MKV_TRACK_TYPE, 1)))
+    points = b''.join(element(keyframes.MKV_CUE_POINT, uint(keyframes.MKV_CUE_TIME, time)
+                              + element(keyframes.MKV_CUE_TRACK_POSITIONS,
+                                        uint(keyframes.MKV_CUE_TRACK, track)
+                                        + uint(keyframes.MKV_CUE_CLUSTER_POSITION, position)))
+                      for time, track, position in cues)
+    cluster = element(containers.MKV_CLUSTER, bytes(64))
+    return header + element(containers.MKV_SEGMENT, info + tracks + element(containers.MKV_CUES, points) + cluster)
+
+
+def segment_start(data: bytes) -> int:
+    return data.index(containers.MKV_SEGMENT.to_bytes(4, 'big')) + 12
+
+
+def test_matroska_cues_of_the_video_track(tmp_path):
+    data = matroska([(0, 2, 500), (0, 1, 480), (2000, 2, 9000), (4500, 2, 20000)])
+    path = tmp_path / 'video.webm'
+    path.write_bytes(data)
+    start = segment_start(data)
+    assert pairs(build_index(str(path))) == [(0.0, start + 500), (2.0, start + 9000), (4.5, start + 20000)]
+
+
+def test_matroska_timecode_scale(tmp_path):
+    data = matroska([(1000, 2, 100)], timecode_scale=500000)
+    path = tmp_path / 'video.mkv'
+    path.write_bytes(data)
+    assert pairs(build_index(str(path))) == [(0.5, segment_start(data) + 100)]
+
+
+def test_matroska_without_cues(tmp_path):
+    path = tmp_path / 'video.mkv'
+    path.write_bytes(matroska([]))
+    assert build_index(str(path)) is None
+
+
+# --- Index ---
+def test_find_returns_the_keyframe_at_or_before():
+    index = KeyframeIndex.from_pairs([(2.0, 200), (0.0, 0), (4.0, 400)])
+    assert index.find(0.0) == (0.0, 0)
+    assert index.find(3.999) == (2.0, 200)
+    assert index.find(4.0) == (4.0, 400)
+    assert index.find(100) == (4.0, 400)
+    assert pairs(KeyframeIndex.from_bytes(index.to_bytes())) == pairs(index)
+
+
+# --- Routes ---
+def mp4_file(moov_first: bool) -> bytes:
+    ftyp = box(b'ftyp', b'isom' + bytes(4) + b'isomavc1')
+    payload = bytes(range(256)) * 2
+    moov_size = len(mp4_moov())
+    mdat_start = len(ftyp) + (moov_size if moov_first else 0) + 8
+    moov = mp4_moov(chunk_offsets=(mdat_start, mdat_start + 100, mdat_start + 200))
+    mdat = box(b'mdat', payload)
+    return ftyp + moov + mdat if moov_first else ftyp + mdat + moov
+
+
+@pytest.mark.parametrize('moov_first', [True, False])
+def test_api_keyframes_offsets_address_the_served_bytes(serve, moov_first):
+    data = mp4_file(moov_first)
+    client = serve({'clip.mp4': data})
+    response = client.get('/api/keyframes/clip.mp4')
+    assert response.status_code == 200
+    listed = response.json['keyframes']
+    assert [t for t, _ in listed] == [0.0, 0.6, 0.9]
+    file_offsets = pairs(mp4_keyframes(data[data.index(b'moov') - 4:][:len(mp4_moov())]))
+    for (_, served), (_, original) in zip(listed, file_offsets):
+        chunk = client.get('/stream/clip.mp4', headers={'Range': f'bytes={served}-{served + 9}'})
+        assert chunk.data == data[original:original + 10]
+    assert client.get('/api/keyframes/clip.mp4',
+                      headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_api_keyframes_without_an_index(serve):
+    client = serve({'clip.avi': b'RIFF' + bytes(4) + b'AVI ' + bytes(100)})
+    assert client.get('/api/keyframes/clip.avi').status_code == 404
+    assert client.get('/api/keyframes/missing.mp4').status_code == 404
+
+
+def test_stream_t_starts_at_the_keyframe(serve):
+    data = mp4_file(True)
+    client = serve({'clip.mp4': data})
+    response = client.get('/stream/clip.mp4?t=0.7')
+    assert response.status_code == 206
+    assert response.headers['X-Keyframe-Time'] == '0.600'
+    offset = pairs(mp4_keyframes(data[data.index(b'moov') - 4:][:len(mp4_moov())]))[1][1]
+    assert response.headers['Content-Range'] == f'bytes {offset}-{len(data) - 1}/{len(data)}'
+    assert response.data == data[offset:]
+    # An explicit range wins over t
+    ranged = client.get('/stream/clip.mp4?t=0.7', headers={'Range': 'bytes=0-9'})
+    assert ranged.data == data[:10] and 'X-Keyframe-Time' not in ranged.headers
+    assert client.get('/stream/clip.mp4?t=-1').status_code == 400
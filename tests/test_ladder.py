@@ -0,0 +1,100 @@
+import pytest
+
+import ladder
+from ladder import SOURCE, Rendition, ThroughputMeter, parse_ladder
+
+LADDER = parse_ladder('480p:1400,1080p:5000,720p:2800,360p:800')
+P1080, P720, P480, P360 = LADDER
+
+
+@pytest.fixture(autouse=True)
+def default_ladder(monkeypatch):
+    monkeypatch.setattr(ladder, 'LADDER', LADDER)
+    monkeypatch.setattr(ladder, 'X264_PRESET', 'veryfast')
+
+
+def test_parse_ladder_sorts_highest_first():
+    assert [r.name for r in LADDER] == ['1080p', '720p', '480p', '360p']
+    assert P720 == Rendition('720p', 720, 2_800_000)
+    assert P720.bandwidth == 3_208_000   # 10% peak allowance plus audio
+
+
+@pytest.mark.parametrize('spec', ['720', '720p', '720p:fast', '721p:2800', '0p:100', '720p:0'])
+def test_parse_ladder_rejects_invalid_rungs(spec):
+    with pytest.raises(ValueError):
+        parse_ladder(spec)
+
+
+def test_renditions_below_the_source_height():
+    assert ladder.renditions_for(720) == [SOURCE, P480, P360]
+    assert ladder.renditions_for(None) == [SOURCE] + LADDER
+    assert ladder.renditions_for(240) == [SOURCE]
+
+
+def test_pick_fits_the_throughput():
+    offered = ladder.renditions_for(1080)   # source, 720p, 480p, 360p
+    source_bandwidth = 8_000_000
+    assert ladder.pick(offered, None, source_bandwidth) == P480          # unmeasured: START_RENDITION
+    assert ladder.pick(offered, 20_000_000, source_bandwidth) == SOURCE  # 14 Mbit/s budget
+    assert ladder.pick(offered, 10_000_000, source_bandwidth) == P720    # 7 Mbit/s: 720p (3.2) fits
+    assert ladder.pick(offered, 2_500_000, source_bandwidth) == P480     # 1.75 Mbit/s: 480p (1.67) fits
+    assert ladder.pick(offered, 100_000, source_bandwidth) == P360       # nothing fits: the lowest
+    assert ladder.pick(offered, 20_000_000, None) == P720                # unknown source bitrate
+
+
+def test_pick_without_the_start_rendition():
+    offered = [SOURCE, P1080, P720]
+    assert ladder.pick(offered, None, None) == P720
+
+
+def test_source_is_stream_copied():
+    assert ladder.encoder_args(SOURCE, 12.0, 6) == ['-c', 'copy']
+
+
+def test_transcode_arguments():
+    assert ladder.encoder_args(P720, 12.0, 6, threads=3) == [
+        '-vf', 'scale=-2:720', '-pix_fmt', 'yuv420p',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'high', '-level:v', '4.0',
+        '-b:v', '2800000', '-maxrate', '3080000', '-bufsize', '5600000',
+        '-force_key_frames', 'expr:gte(t,12.000+n_forced*6)', '-sc_threshold', '0',
+        '-c:a', 'aac', '-b:a', '128000', '-ac', '2',
+        '-threads', '3',
+    ]
+
+
+def test_scaled_size_keeps_the_aspect_ratio():
+    assert ladder.scaled_size(P480, 1920, 800) == (1152, 480)
+    assert ladder.scaled_size(P360, 1440, 1080) == (480, 360)
+    assert ladder.scaled_size(P360, None, None) == (640, 360)
+    assert ladder.scaled_size(SOURCE, 1920, 1080) == (1920, 1080)
+
+
+def test_master_playlist():
+    playlist = ladder.build_master_playlist([SOURCE, P720], 1920, 1080, 6_000_000)
+    assert playlist.splitlines() == [
+        '#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-INDEPENDENT-SEGMENTS',
+        '#EXT-X-STREAM-INF:BANDWIDTH=6000000,RESOLUTION=1920x1080',
+        'index.m3u8?rendition=source',
+        f'#EXT-X-STREAM-INF:BANDWIDTH=3208000,RESOLUTION=1280x720,CODECS="{ladder.TRANSCODE_CODECS}"',
+        'index.m3u8?rendition=720p',
+    ]
+    # The source is left out when its bitrate is unknown
+    assert 'rendition=source' not in ladder.build_master_playlist([SOURCE, P720], 1920, 1080, None)
+
+
+def test_throughput_meter_smooths_and_expires(monkeypatch):
+    now = [500.0]
+    monkeypatch.setattr('ladder.time.monotonic', lambda: now[0])
+    meter = ThroughputMeter(max_clients=2)
+    meter.record('a', 1_000_000, 1.0)
+    assert meter.estimate('a') == 8_000_000
+    meter.record('a', 1_000_000, 2.0)
+    assert meter.estimate('a') == pytest.approx(8_000_000 + 0.3 * (4_000_000 - 8_000_000))
+    meter.record('a', 0, 1.0)   # ignored
+    now[0] += ladder.THROUGHPUT_TTL + 1
+    assert meter.estimate('a') is None
+    meter.record('a', 1_000_000, 1.0)
+    assert meter.estimate('a') == 8_000_000   # a stale estimate is not averaged in
+    meter.record('b', 1, 1.0)
+    meter.record('c', 1, 1.0)
+    assert meter.estimate('a') is None        # least recently updated client dropped
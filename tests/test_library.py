@@ -0,0 +1,36 @@
+import os
+
+import library
+
+
+def test_single_root_has_no_prefix():
+    assert library.root_prefixes(['/media/movies']) == ['']
+
+
+def test_prefixes_are_directory_names():
+    assert library.root_prefixes(['/media/movies', '/media/tv']) == ['movies/', 'tv/']
+
+
+def test_colliding_prefixes_get_parent_directories():
+    assert library.root_prefixes(['/a/movies', '/b/movies', '/c/tv']) == ['a/movies/', 'b/movies/', 'tv/']
+    assert library.root_prefixes(['/m/a/movies', '/n/a/movies']) == ['m/a/movies/', 'n/a/movies/']
+
+
+def test_roots_with_the_same_directory_name_do_not_shadow_each_other(tmp_path):
+    for parent in ('a', 'b'):
+        os.makedirs(tmp_path / parent / 'movies')
+        (tmp_path / parent / 'movies' / 'x.mp4').write_bytes(b'')
+    videos = library.scan_library([str(tmp_path / 'a' / 'movies'), str(tmp_path / 'b' / 'movies')])
+    assert [video['filename'] for video in videos] == ['a/movies/x.mp4', 'b/movies/x.mp4']
+
+
+def test_root_listed_twice_is_scanned_once(tmp_path):
+    (tmp_path / 'x.mp4').write_bytes(b'')
+    videos = library.scan_library([str(tmp_path), str(tmp_path) + os.sep])
+    assert [video['filename'] for video in videos] == ['x.mp4']
+
+
+def test_natural_sort_order(tmp_path):
+    for name in ('ep10.mp4', 'ep2.mkv', 'Ep1.avi', 'notes.txt'):
+        (tmp_path / name).write_bytes(b'')
+    assert [video['filename'] for video in library.scan_library([str(tmp_path)])] == ['Ep1.avi', 'ep2.mkv', 'ep10.mp4']
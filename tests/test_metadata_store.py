@@ -0,0 +1,122 @@
+import os
+import sqlite3
+
+import pytest
+
+import metadata_store
+import server
+from metadata_store import MetadataStore
+
+METADATA = {'width': 640, 'height': 360, 'duration': 5.0}
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'x' * 100)
+    return str(path)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MetadataStore(str(tmp_path / 'metadata.db'))
+    yield store
+    store.close()
+
+
+def test_entries_survive_a_restart(tmp_path, video):
+    first = MetadataStore(str(tmp_path / 'metadata.db'))
+    first.put(video, METADATA)
+    first.put_keyframes(video, b'index', os.stat(video))
+    first.close()
+    second = MetadataStore(str(tmp_path / 'metadata.db'))
+    assert second.load_valid({video: os.stat(video)}) == {video: METADATA}
+    assert second.get(video, os.stat(video)) == METADATA
+    assert second.get_keyframes(video, os.stat(video)) == b'index'
+    second.close()
+
+
+@pytest.mark.parametrize('change', ['size', 'mtime'])
+def test_changed_file_invalidates_its_entries(store, video, change):
+    store.put(video, METADATA)
+    store.put_keyframes(video, b'index', os.stat(video))
+    if change == 'size':
+        with open(video, 'ab') as f:
+            f.write(b'y')
+    else:
+        st = os.stat(video)
+        os.utime(video, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    st = os.stat(video)
+    assert store.get(video, st) is None
+    assert store.get_keyframes(video, st) is None
+    assert store.load_valid({video: st}) == {}
+
+
+def test_put_uses_the_identity_it_is_given(store, video):
+    before = os.stat(video)
+    with open(video, 'ab') as f:
+        f.write(b'changed while probing')
+    store.put(video, METADATA, before)
+    assert store.get(video, os.stat(video)) is None   # probed from the old content, probed again
+    assert store.get(video, before) == METADATA
+
+
+def test_delete(store, video):
+    store.put(video, METADATA)
+    store.put_keyframes(video, b'index', os.stat(video))
+    store.delete([video])
+    assert store.get(video, os.stat(video)) is None
+    assert store.get_keyframes(video, os.stat(video)) is None
+
+
+def test_other_version_is_cleared(tmp_path, video):
+    path = str(tmp_path / 'metadata.db')
+    store = MetadataStore(path)
+    store.put(video, METADATA)
+    store.close()
+    conn = sqlite3.connect(path)
+    conn.execute(f'PRAGMA user_version = {metadata_store.METADATA_VERSION + 1}')
+    conn.close()
+    store = MetadataStore(path)
+    assert store.get(video, os.stat(video)) is None
+    store.close()
+
+
+def test_corrupt_database_is_started_over(tmp_path, video):
+    path = tmp_path / 'metadata.db'
+    path.write_bytes(b'this is not a database' * 100)
+    store = MetadataStore(str(path))
+    store.put(video, METADATA)
+    assert store.get(video, os.stat(video)) == METADATA
+    store.close()
+    assert (tmp_path / 'metadata.db.corrupt').read_bytes().startswith(b'this is not a database')
+
+
+def test_locked_database_skips_writes(tmp_path, video, monkeypatch, caplog):
+    monkeypatch.setattr(metadata_store, 'BUSY_TIMEOUT', 0.05)
+    path = str(tmp_path / 'metadata.db')
+    store = MetadataStore(path)
+    store.put(video, METADATA)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute('BEGIN EXCLUSIVE')   # another process writing
+    try:
+        store.put(video, {'width': 1})
+        store.put_keyframes(video, b'index', os.stat(video))
+        store.delete([video])
+        assert 'database is locked' in caplog.text
+        # Readers are not blocked by a writer in WAL mode
+        assert store.get(video, os.stat(video)) == METADATA
+        assert store.get_keyframes(video, os.stat(video)) is None
+    finally:
+        other.execute('ROLLBACK')
+        other.close()
+    store.put(video, {'width': 1})
+    assert store.get(video, os.stat(video)) == {'width': 1}
+    store.close()
+
+
+def test_server_runs_without_a_store_it_cannot_open(serve, tmp_path):
+    (tmp_path / 'not a directory').write_bytes(b'')
+    client = serve({'a.mp4': b'x' * 10}, metadata_db=str(tmp_path / 'not a directory' / 'metadata.db'))
+    assert server.METADATA_STORE is None
+    assert client.get('/stream/a.mp4').data == b'x' * 10
@@ -0,0 +1,187 @@
+import io
+import json
+import logging
+import threading
+import time
+
+import pytest
+
+import metrics
+
+
+def samples(text):
+    """{'name{labels}': value} of a /metrics scrape."""
+    result = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            result[name] = float(value)
+    return result
+
+
+def scrape(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    return samples(response.get_data(as_text=True))
+
+
+def test_stream_requests_are_counted(serve):
+    client = serve({'clip.mp4': bytes(range(256)) * 40})
+    before = scrape(client)
+    assert client.get('/stream/clip.mp4', headers={'Range': 'bytes=100-1099'}).status_code == 206
+    assert len(client.get('/stream/clip.mp4').data) == 10240
+    after = scrape(client)
+
+    def delta(name):
+        return after.get(name, 0) - before.get(name, 0)
+    assert delta('media_server_http_requests_total{endpoint="stream_video",status="206"}') == 1
+    assert delta('media_server_http_requests_total{endpoint="stream_video",status="200"}') == 1
+    assert delta('media_server_stream_bytes_total{video="clip.mp4"}') == 1000 + 10240
+    assert delta('media_server_stream_request_seconds_count') == 2
+    assert delta('media_server_stream_request_seconds_bucket{le="+Inf"}') == 2
+    assert delta('media_server_stream_ttfb_seconds_count{prefetched="no"}') == 2
+    assert after['media_server_active_streams'] == before.get('media_server_active_streams', 0)
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram('test_seconds', "Test", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+    registry = metrics.Registry()
+    registry.register(histogram)
+    assert samples(registry.render()) == {
+        'test_seconds_bucket{le="0.1"}': 1, 'test_seconds_bucket{le="1.0"}': 3,
+        'test_seconds_bucket{le="+Inf"}': 4, 'test_seconds_sum': 6.05, 'test_seconds_count': 4}
+
+
+def test_shards_of_all_threads_are_summed():
+    counter = metrics.Counter('test_total', "Test", ('kind',))
+    ready, done = threading.Barrier(5), threading.Event()
+
+    def work(kind):
+        for _ in range(1000):
+            counter.inc(labels=(kind,))
+        ready.wait()
+        done.wait()
+
+    threads = [threading.Thread(target=work, args=(kind,)) for kind in ('a', 'b', 'a', 'b')]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    assert counter.collect() == {('a',): 2000, ('b',): 2000}   # live shards
+    done.set()
+    for thread in threads:
+        thread.join()
+    counter.inc(labels=('a',))
+    assert counter.collect() == {('a',): 2001, ('b',): 2000}   # folded into the retired total
+    assert len(counter._shards) == 1
+
+
+def test_series_are_capped(monkeypatch):
+    monkeypatch.setattr(metrics, 'MAX_SERIES', 2)
+    counter = metrics.Counter('test_total', "Test", ('video',))
+    for video in ('a', 'b', 'c', 'd'):
+        counter.inc(labels=(video,))
+    assert counter.collect() == {('a',): 1, ('b',): 1, (metrics.OVERFLOW_LABEL,): 2}
+
+
+class _SlottedBody:
+    __slots__ = ('closed',)
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def active_streams():
+    return metrics.ACTIVE_STREAMS.collect().get((), 0)
+
+
+def test_file_wrapper_stays_active_until_closed():
+    before = active_streams()
+    body = io.BytesIO(b'x' * 100)
+    tracked = metrics.track_stream(body, True, 'test.mp4', 100, time.perf_counter())
+    assert tracked is body
+    assert active_streams() == before + 1
+    tracked.close()
+    tracked.close()
+    assert body.closed
+    assert active_streams() == before
+
+
+def test_file_wrapper_without_instance_dict_is_not_tracked():
+    before = active_streams()
+    body = _SlottedBody()
+    tracked = metrics.track_stream(body, True, 'test.mp4', 100, time.perf_counter())
+    assert tracked is body
+    assert active_streams() == before
+    tracked.close()
+    assert body.closed and active_streams() == before
+
+
+def test_generator_body_is_measured_and_closed():
+    closed = []
+
+    def body():
+        try:
+            yield b'abc'
+            yield b'de'
+        finally:
+            closed.append(True)
+
+    before = metrics.STREAM_BYTES.collect().get(('gen.mp4',), 0)
+    tracked = metrics.track_stream(body(), False, 'gen.mp4', 5, time.perf_counter())
+    assert next(tracked) == b'abc'
+    tracked.close()
+    assert closed
+    assert metrics.STREAM_BYTES.collect()[('gen.mp4',)] == before + 3
+
+
+@pytest.fixture
+def access_log(monkeypatch, caplog):
+    def select(mode):
+        monkeypatch.setattr(metrics, 'ACCESS_LOG', metrics.ACCESS_LOG)
+        monkeypatch.setattr(metrics, 'REQUEST_LOG_LEVEL', metrics.REQUEST_LOG_LEVEL)
+        metrics.set_access_log(mode)
+        caplog.set_level(logging.INFO, logger='media_server.access')
+        return caplog
+    return select
+
+
+ENVIRON = {'REMOTE_ADDR': '10.0.0.5', 'REQUEST_METHOD': 'GET', 'PATH_INFO': '/stream/a.mp4',
+           'QUERY_STRING': 't=5', 'HTTP_RANGE': 'bytes=0-99'}
+
+
+def test_structured_access_log(access_log):
+    log = access_log('structured')
+    assert metrics.REQUEST_LOG_LEVEL == logging.DEBUG
+    metrics.log_access(ENVIRON, 206, 100, 0.0125)
+    entry = json.loads(log.records[-1].getMessage())
+    assert entry['path'] == '/stream/a.mp4' and entry['query'] == 't=5'
+    assert (entry['status'], entry['bytes'], entry['range']) == (206, 100, 'bytes=0-99')
+    assert entry['duration_ms'] == 12.5
+
+
+def test_sampled_access_log(access_log, monkeypatch):
+    monkeypatch.setattr(metrics, 'ACCESS_LOG_SAMPLE', 3)
+    log = access_log('sampled')
+    for _ in range(9):
+        metrics.log_access(ENVIRON, 200, None, 0.001)
+    lines = [record.getMessage() for record in log.records if record.name == 'media_server.access']
+    assert len(lines) == 3
+    assert lines[0].startswith('10.0.0.5 GET /stream/a.mp4?t=5 200 - ')
+
+
+@pytest.mark.parametrize('mode, level', [('verbose', logging.INFO), ('off', logging.DEBUG)])
+def test_modes_without_access_lines(access_log, mode, level):
+    log = access_log(mode)
+    assert metrics.REQUEST_LOG_LEVEL == level
+    metrics.log_access(ENVIRON, 200, 10, 0.001)
+    assert not [record for record in log.records if record.name == 'media_server.access']
+
+
+def test_unknown_access_log_mode():
+    with pytest.raises(ValueError):
+        metrics.set_access_log('loud')
@@ -0,0 +1,110 @@
+import gzip
+import os
+
+import pytest
+from flask import Flask, request
+
+import precompressed
+from precompressed import PrecompressedBody, RenderCache
+
+DATA = b'{"videos": [' + b','.join(b'"Episode %d.mkv"' % i for i in range(200)) + b']}'
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    body = PrecompressedBody(DATA, 'application/json', last_modified='Tue, 01 Sep 2026 10:00:00 GMT')
+
+    @app.route('/body')
+    def serve_body():
+        return body.response(request, {'Cache-Control': 'no-cache'})
+    return app.test_client()
+
+
+def test_identity_without_accept_encoding(client):
+    response = client.get('/body', headers={'Accept-Encoding': ''})
+    assert response.data == DATA
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+
+def test_gzip_is_negotiated(client):
+    response = client.get('/body', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(response.data) == DATA
+    assert int(response.headers['Content-Length']) < len(DATA)
+    refused = client.get('/body', headers={'Accept-Encoding': 'gzip;q=0, identity'})
+    assert refused.data == DATA and 'Content-Encoding' not in refused.headers
+
+
+def test_each_encoding_has_its_own_etag(client):
+    identity = client.get('/body', headers={'Accept-Encoding': ''}).headers['ETag']
+    gzipped = client.get('/body', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+    assert identity != gzipped and gzipped == identity[:-1] + '-gzip"'
+    # A validator only matches the representation it was issued for
+    assert client.get('/body', headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzipped}).status_code == 304
+    assert client.get('/body', headers={'Accept-Encoding': 'gzip', 'If-None-Match': identity}).status_code == 200
+    not_modified = client.get('/body', headers={'Accept-Encoding': '', 'If-None-Match': identity})
+    assert not_modified.status_code == 304
+    assert not_modified.headers['ETag'] == identity and not_modified.headers['Vary'] == 'Accept-Encoding'
+
+
+def test_brotli_is_preferred_when_available(client):
+    brotli = pytest.importorskip('brotli')
+    response = client.get('/body', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == DATA
+    assert response.headers['ETag'].endswith('-br"')
+
+
+def test_small_or_incompressible_bodies_stay_identity():
+    assert list(PrecompressedBody(b'{}', 'application/json').variants) == ['identity']
+    noise = bytes(range(256)) * 4
+    random = os.urandom(4096)
+    assert 'gzip' in PrecompressedBody(noise, 'text/plain').variants
+    assert list(PrecompressedBody(random, 'application/octet-stream').variants) == ['identity']
+
+
+def test_weak_etag_keeps_its_weakness():
+    body = PrecompressedBody(DATA, 'application/json', etag='W/"abc"')
+    assert body.etag_for('identity') == 'W/"abc"'
+    assert body.etag_for('gzip') == 'W/"abc-gzip"'
+
+
+def test_render_cache_is_an_lru():
+    cache = RenderCache(max_entries=2)
+    renders = []
+
+    def render(name):
+        def build():
+            renders.append(name)
+            return PrecompressedBody(name.encode(), 'text/plain')
+        return build
+
+    for key in ('a', 'b', 'a', 'c', 'b'):
+        cache.get(key, render(key))
+    assert renders == ['a', 'b', 'c', 'b']   # 'b' was evicted by 'c', 'a' was used more recently
+    assert cache.stats()['hits'] == 1
+
+
+def test_disabled_render_cache_renders_every_time(monkeypatch):
+    monkeypatch.setattr(precompressed, 'ENABLED', False)
+    cache = RenderCache()
+    renders = []
+    for _ in range(2):
+        cache.get('a', lambda: renders.append(1) or PrecompressedBody(DATA, 'application/json'))
+    assert len(renders) == 2
+    assert list(PrecompressedBody(DATA, 'application/json').variants) == ['identity']
+
+
+def test_index_page_is_served_compressed(serve):
+    client = serve({f'Episode {i}.mp4': b'x' for i in range(3)})
+    plain = client.get('/', headers={'Accept-Encoding': ''})
+    compressed = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == plain.data
+    assert compressed.headers['ETag'] != plain.headers['ETag']
+    assert client.get('/', headers={'Accept-Encoding': 'gzip',
+                                    'If-None-Match': compressed.headers['ETag']}).status_code == 304
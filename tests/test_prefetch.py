@@ -0,0 +1,67 @@
+import pytest
+
+import prefetch
+from prefetch import LEAD_SECONDS, PROBE_BYTES, Prefetcher, near_end
+
+MB = 1024 * 1024
+SIZE = 1000 * MB
+BITRATE = MB   # bytes per second: LEAD_SECONDS before the end is SIZE - LEAD_SECONDS * MB
+
+
+@pytest.mark.parametrize('position, length, previous, expected', [
+    (SIZE - 30 * MB, 30 * MB, 0, True),                        # playback reached the last minute
+    (SIZE - 30 * MB, 30 * MB, SIZE - 90 * MB, True),
+    (SIZE - 300 * MB, 300 * MB, 0, False),                     # still well before the end
+    (SIZE - 30 * MB, 30 * MB, None, False),                    # first request: a seek or resume
+    (SIZE - 30 * MB, 30 * MB, SIZE - 10 * MB, False),          # seeked backwards
+    (SIZE - PROBE_BYTES, PROBE_BYTES, 0, False),               # tail probe
+    (0, SIZE, None, False),
+])
+def test_near_end_with_bitrate(position, length, previous, expected):
+    assert near_end(position, length, SIZE, BITRATE, previous) is expected
+
+
+def test_short_videos_are_near_the_end_in_their_second_half():
+    size = int(LEAD_SECONDS / 2) * MB   # half a lead of playback
+    assert not near_end(size // 4, size - size // 4, size, BITRATE, 0)
+    assert near_end(size // 2 + MB, size // 2, size, BITRATE, 0)
+
+
+def test_near_end_without_bitrate_uses_the_file_fraction():
+    position = int(SIZE * prefetch.NEAR_END_FRACTION)
+    assert near_end(position, SIZE - position, SIZE, None, 0)
+    assert not near_end(position - MB, SIZE - position, SIZE, None, 0)
+
+
+@pytest.fixture
+def prefetcher():
+    instance = Prefetcher(lambda path, st, duration: [])
+    yield instance
+    instance.shutdown()
+
+
+def test_playback_requires_an_earlier_request_of_the_client(prefetcher):
+    near = SIZE - 30 * MB
+    assert not prefetcher.playback('a', 'video.mp4', near, 30 * MB, SIZE, BITRATE)
+    assert not prefetcher.playback('b', 'video.mp4', 0, SIZE, SIZE, BITRATE)
+    assert not prefetcher.playback('b', 'other.mp4', near, 30 * MB, SIZE, BITRATE)
+    assert prefetcher.playback('b', 'video.mp4', near, 30 * MB, SIZE, BITRATE)
+
+
+def test_tail_probes_do_not_move_the_playhead(prefetcher):
+    assert not prefetcher.playback('a', 'video.mp4', 0, SIZE, SIZE, BITRATE)
+    assert not prefetcher.playback('a', 'video.mp4', SIZE - MB, MB, SIZE, BITRATE)
+    # Playback continuing after the probe still counts from the first request
+    assert prefetcher.playback('a', 'video.mp4', SIZE - 30 * MB, 30 * MB, SIZE, BITRATE)
+
+
+def test_forget_drops_playheads(prefetcher):
+    prefetcher.playback('a', 'video.mp4', 0, SIZE, SIZE, BITRATE)
+    prefetcher.forget(['video.mp4'])
+    assert not prefetcher.playback('a', 'video.mp4', SIZE - 30 * MB, 30 * MB, SIZE, BITRATE)
+
+
+def test_probe_length_scales_with_small_files():
+    assert prefetch.is_probe(PROBE_BYTES, SIZE) and not prefetch.is_probe(PROBE_BYTES + 1, SIZE)
+    small = 20 * MB
+    assert prefetch.is_probe(small // 100, small) and not prefetch.is_probe(small // 20, small)
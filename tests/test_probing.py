@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from probing import MetadataProber
+
+
+def videos(tmp_path, count):
+    result = []
+    for i in range(count):
+        path = tmp_path / f'video{i}.mp4'
+        path.write_bytes(b'x' * (i + 1))
+        result.append(SimpleNamespace(filename=path.name, path=str(path)))
+    return result
+
+
+class SlowProbe:
+    """Probe that records how many calls run at once."""
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.running = 0
+        self.peak = 0
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, path):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            self.calls.append(path)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+        return {'size': os.path.getsize(path)}
+
+
+def test_concurrency_is_bounded(tmp_path):
+    probe = SlowProbe()
+    cache = {}
+    prober = MetadataProber(probe, cache, max_workers=3)
+    prober.start(videos(tmp_path, 12))
+    assert prober.wait(5)
+    assert probe.peak == 3
+    assert len(cache) == 12 and cache['video4.mp4'] == {'size': 5}
+    assert prober.progress()['done'] == 12 and prober.progress()['failed'] == 0
+    prober.shutdown()
+
+
+def test_cached_videos_are_not_probed(tmp_path):
+    probe = SlowProbe(0)
+    items = videos(tmp_path, 3)
+    prober = MetadataProber(probe, {'video1.mp4': {'size': 2}}, max_workers=1)
+    prober.start(items)
+    assert prober.wait(5)
+    assert sorted(os.path.basename(path) for path in probe.calls) == ['video0.mp4', 'video2.mp4']
+    prober.shutdown()
+
+
+def test_results_carry_the_identity_from_before_the_probe(tmp_path):
+    item = videos(tmp_path, 1)[0]
+    before = os.stat(item.path)
+
+    def probe(path):
+        with open(path, 'ab') as f:   # the file changes while it is probed
+            f.write(b'more')
+        return {'probed': True}
+
+    results = []
+    prober = MetadataProber(probe, {}, max_workers=1, on_result=lambda *args: results.append(args))
+    prober.start([item])
+    assert prober.wait(5)
+    (filename, path, metadata, st), = results
+    assert (filename, metadata) == (item.filename, {'probed': True})
+    assert (st.st_size, st.st_mtime_ns) == (before.st_size, before.st_mtime_ns)
+    prober.shutdown()
+
+
+def test_queued_probe_runs_inline_on_request(tmp_path):
+    release = threading.Event()
+    calls = []
+
+    def probe(path):
+        calls.append(os.path.basename(path))
+        if path.endswith('video0.mp4'):
+            release.wait(5)
+        return {'path': path}
+
+    items = videos(tmp_path, 3)
+    results = []
+    prober = MetadataProber(probe, {}, max_workers=1, on_result=lambda *args: results.append(args[0]))
+    prober.start(items)
+    # video0 occupies the only worker; video2 is asked for and jumps the queue
+    assert prober.get('video2.mp4', items[2].path) == {'path': items[2].path}
+    assert calls[-1] == 'video2.mp4' and 'video1.mp4' not in calls
+    release.set()
+    assert prober.wait(5)
+    assert results.count('video2.mp4') == 1
+    prober.shutdown()
+
+
+def test_failed_and_missing_files_are_counted(tmp_path):
+    items = videos(tmp_path, 2) + [SimpleNamespace(filename='gone.mp4', path=str(tmp_path / 'gone.mp4'))]
+
+    def probe(path):
+        if path.endswith('video1.mp4'):
+            raise RuntimeError('broken file')
+        return {'ok': True} if os.path.exists(path) else None
+
+    prober = MetadataProber(probe, {}, max_workers=2)
+    prober.start(items)
+    assert prober.wait(5)
+    assert prober.progress()['failed'] == 2
+    assert prober.get('gone.mp4', str(tmp_path / 'gone.mp4')) is None
+    prober.shutdown()
+
+
+def test_unknown_executor():
+    with pytest.raises(ValueError):
+        MetadataProber(lambda path: None, {}, executor_kind='fiber')
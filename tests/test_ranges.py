@@ -0,0 +1,100 @@
+import pytest
+
+import ranges
+from ranges import RangeNotSatisfiable, cap_open_ended, coalesce_ranges, parse_range_header
+
+
+def test_single_range():
+    assert parse_range_header('bytes=0-99', 1000) == ((0, 99),)
+
+
+def test_open_ended_range():
+    assert parse_range_header('bytes=900-', 1000) == ((900, 999),)
+
+
+def test_suffix_range():
+    assert parse_range_header('bytes=-100', 1000) == ((900, 999),)
+
+
+def test_suffix_longer_than_file_covers_whole_file():
+    assert parse_range_header('bytes=-5000', 1000) == ((0, 999),)
+
+
+def test_last_byte_past_eof_is_clamped():
+    assert parse_range_header('bytes=500-5000', 1000) == ((500, 999),)
+
+
+def test_whitespace_and_unit_case_are_tolerated():
+    assert parse_range_header(' Bytes = 0 - 9 , 500-509', 1000) == ((0, 9), (500, 509))
+
+
+def test_overlapping_ranges_are_merged():
+    assert parse_range_header('bytes=0-499,200-699', 1000) == ((0, 699),)
+
+
+def test_ranges_are_sorted_and_small_gaps_merged():
+    gap = ranges.COALESCE_GAP
+    header = f'bytes=500-599,0-99,{99 + gap}-{199 + gap}'
+    assert parse_range_header(header, 1000) == ((0, 199 + gap), (500, 599))
+
+
+def test_distant_ranges_stay_separate():
+    assert parse_range_header('bytes=0-9,500-509', 1000) == ((0, 9), (500, 509))
+
+
+def test_unsatisfiable_spans_are_dropped_if_others_remain():
+    assert parse_range_header('bytes=2000-2100,0-9', 1000) == ((0, 9),)
+
+
+@pytest.mark.parametrize('header', ['bytes=1000-', 'bytes=5000-6000', 'bytes=-0'])
+def test_nothing_satisfiable_raises(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(header, 1000)
+
+
+def test_suffix_of_empty_file_is_not_satisfiable():
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header('bytes=-10', 0)
+
+
+@pytest.mark.parametrize('header', ['items=0-9', 'bytes=9-0', 'bytes=-', 'bytes=a-b', 'bytes=', 'bytes=,,', '0-9'])
+def test_invalid_headers_are_ignored(header):
+    assert parse_range_header(header, 1000) is None
+
+
+def test_empty_list_elements_are_tolerated():
+    assert parse_range_header('bytes=0-1,,5-6', 1000) == ((0, 6),)
+
+
+def test_too_many_ranges_are_ignored():
+    header = 'bytes=' + ','.join(f'{i * 200}-{i * 200}' for i in range(ranges.MAX_RANGES + 1))
+    assert parse_range_header(header, 10 ** 9) is None
+
+
+def test_coalesce_contained_range():
+    assert coalesce_ranges([(0, 100), (10, 20)], gap=0) == ((0, 100),)
+
+
+def test_coalesce_adjacent_ranges():
+    assert coalesce_ranges([(10, 19), (0, 9)], gap=0) == ((0, 19),)
+
+
+def test_cap_open_ended_range():
+    assert cap_open_ended('bytes=100-', ((100, 999),), cap=200) == ((100, 299),)
+
+
+def test_cap_keeps_short_open_ended_range():
+    assert cap_open_ended('bytes=900-', ((900, 999),), cap=200) == ((900, 999),)
+
+
+@pytest.mark.parametrize('header, spans', [
+    ('bytes=0-999', ((0, 999),)),               # explicit
+    ('bytes=-900', ((100, 999),)),              # suffix
+    ('bytes=0-9,100-', ((0, 9), (100, 999))),   # several
+])
+def test_cap_leaves_other_ranges_alone(header, spans):
+    assert cap_open_ended(header, spans, cap=200) == spans
+
+
+def test_cap_disabled():
+    assert cap_open_ended('bytes=0-', ((0, 999),), cap=0) == ((0, 999),)
@@ -0,0 +1,78 @@
+import pytest
+
+import readahead
+from readahead import AdaptiveChunker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('readahead.time.monotonic', lambda: now[0])
+    return now
+
+
+def send(chunker, clock, seconds):
+    """Hands the next chunk over `seconds` after the previous one (the first one is not measured)."""
+    clock[0] += seconds
+    chunker.sent(chunker.chunk_size)
+
+
+def test_initial_chunk_follows_the_bitrate():
+    assert AdaptiveChunker().chunk_size == readahead.DEFAULT_CHUNK_SIZE
+    assert AdaptiveChunker(bitrate=1_000_000).chunk_size == 249856   # 0.25 s, page aligned
+    assert AdaptiveChunker(bitrate=1000).chunk_size == readahead.MIN_CHUNK_SIZE
+    assert AdaptiveChunker(bitrate=1e12).chunk_size == readahead.MAX_CHUNK_SIZE
+
+
+def test_chunks_grow_for_fast_clients(clock):
+    chunker = AdaptiveChunker()
+    sizes = []
+    for _ in range(8):
+        send(chunker, clock, 0.001)   # every chunk taken within a millisecond
+        sizes.append(chunker.chunk_size)
+    assert sizes == sorted(sizes)
+    assert sizes[-1] == readahead.MAX_CHUNK_SIZE
+    assert chunker.readahead_window() == readahead.MAX_READAHEAD
+
+
+def test_chunks_shrink_for_slow_clients(clock):
+    chunker = AdaptiveChunker(bitrate=4_000_000)
+    start = chunker.chunk_size
+    sizes = []
+    for _ in range(20):
+        send(chunker, clock, 10.0)
+        sizes.append(chunker.chunk_size)
+    assert sizes[0] == start and sizes[1] < start   # measured from the second chunk on
+    assert sizes == sorted(sizes, reverse=True)
+    assert sizes[-1] == readahead.MIN_CHUNK_SIZE
+    assert chunker.readahead_window() == readahead.MIN_READAHEAD
+
+
+def test_throughput_is_smoothed(clock):
+    chunker = AdaptiveChunker(initial=65536)
+    send(chunker, clock, 0)
+    send(chunker, clock, 1.0)   # first sample: 64 KiB/s
+    assert chunker.throughput == 65536
+    send(chunker, clock, 0.5)   # 128 KiB/s, weighted 0.3
+    assert chunker.throughput == pytest.approx(65536 * 0.7 + 65536 / 0.5 * 0.3)
+
+
+def test_readahead_window_bounds():
+    assert readahead.readahead_window(None) == readahead.MIN_READAHEAD
+    assert readahead.readahead_window(1_000_000) == 2_000_000
+    assert readahead.readahead_window(1e12) == readahead.MAX_READAHEAD
+
+
+def test_video_bitrate():
+    assert readahead.video_bitrate(1000, 10.0) == 100
+    assert readahead.video_bitrate(1000, None) is None
+    assert readahead.video_bitrate(1000, 0) is None
+
+
+def test_advice_on_a_real_file(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'x' * 8192)
+    with open(path, 'rb') as f:
+        readahead.advise_sequential(f.fileno(), 0, 8192)
+        readahead.advise_willneed(f.fileno(), 0, 8192)
+        readahead.advise_willneed(f.fileno(), 0, 0)
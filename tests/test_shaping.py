@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pytest
+
+from shaping import FairScheduler, PRIORITY_BULK, PRIORITY_INTERACTIVE, Shaper, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('shaping.time.monotonic', lambda: now[0])
+    return now
+
+
+def test_token_bucket_burst_then_debt(clock):
+    bucket = TokenBucket(rate=1000, burst=2000)
+    assert bucket.reserve(1500) == 0.0
+    assert bucket.reserve(500) == 0.0
+    assert bucket.reserve(500) == pytest.approx(0.5)   # 500 tokens in debt at 1000/s
+    assert bucket.reserve(500) == pytest.approx(1.0)
+
+
+def test_token_bucket_refills_up_to_the_burst(clock):
+    bucket = TokenBucket(rate=1000, burst=2000)
+    bucket.reserve(2500)
+    clock[0] += 0.5
+    assert bucket.reserve(0) == 0.0                   # debt repaid
+    clock[0] += 60
+    assert bucket.reserve(2000) == 0.0                # refilled, capped at the burst
+    assert bucket.reserve(1) == pytest.approx(0.001)
+
+
+def test_token_bucket_default_burst():
+    assert TokenBucket(rate=100).burst == 1 << 20
+    assert TokenBucket(rate=4 << 20).burst == 4 << 20
+
+
+def grant_order(scheduler, waiters):
+    """Queues (client, priority) waiters behind a held slot and returns the order they are granted in."""
+    order = []
+    scheduler.acquire('holder', PRIORITY_BULK)
+    threads = []
+    for client, priority in waiters:
+        def wait(client=client, priority=priority):
+            scheduler.acquire(client, priority)
+            order.append(client)
+            scheduler.release(client, 0)
+        thread = threading.Thread(target=wait)
+        thread.start()
+        threads.append(thread)
+        while scheduler.stats()['queued'] < len(threads):   # queue them in this order
+            time.sleep(0.001)
+    scheduler.release('holder', 0)
+    for thread in threads:
+        thread.join(5)
+    return order
+
+
+def test_interactive_reads_go_first():
+    scheduler = FairScheduler(1)
+    order = grant_order(scheduler, [('bulk1', PRIORITY_BULK), ('seek', PRIORITY_INTERACTIVE),
+                                    ('bulk2', PRIORITY_BULK)])
+    assert order == ['seek', 'bulk1', 'bulk2']
+    stats = scheduler.stats()
+    assert stats['grants'] == {'interactive': 1, 'bulk': 3}
+    assert stats['in_use'] == 0 and stats['queued'] == 0
+
+
+def test_least_served_client_goes_next():
+    scheduler = FairScheduler(1)
+    for client in ('heavy', 'light'):
+        scheduler.open(client)
+    scheduler.acquire('heavy', PRIORITY_BULK)
+    scheduler.release('heavy', 10_000_000)
+    scheduler.acquire('light', PRIORITY_BULK)
+    scheduler.release('light', 1000)
+    order = grant_order(scheduler, [('heavy', PRIORITY_BULK), ('light', PRIORITY_BULK)])
+    assert order == ['light', 'heavy']
+    assert scheduler.stats()['bytes_by_client'] == {'heavy': 10_000_000, 'light': 1000, 'holder': 0}
+
+
+def test_returning_client_gets_no_credit_for_its_idle_time():
+    scheduler = FairScheduler(1)
+    scheduler.open('a')
+    scheduler.open('b')
+    for _ in range(3):
+        scheduler.acquire('b', PRIORITY_BULK)
+        scheduler.release('b', 1000)
+    scheduler.close('a')
+    scheduler.close('b')
+    scheduler.open('a')
+    scheduler.open('b')
+    # Both restart from the current virtual time: first come, first served
+    assert grant_order(scheduler, [('b', PRIORITY_BULK), ('a', PRIORITY_BULK)]) == ['b', 'a']
+
+
+def test_shaper_is_a_passthrough_when_disabled():
+    shaper = Shaper(io_slots=0, client_rate=0, global_rate=0)
+    body = [b'a', b'b']
+    assert not shaper.enabled
+    assert shaper.shape(body, 'client', 2) is body
+
+
+def test_shaped_body_is_rate_limited_and_closed(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr('shaping.time.sleep', sleeps.append)
+    closed = []
+
+    def body():
+        try:
+            for _ in range(4):
+                yield b'x' * 1000
+        finally:
+            closed.append(True)
+
+    shaper = Shaper(io_slots=2, client_rate=1000, global_rate=0, interactive_bytes=1500)
+    shaper._client_buckets['client'] = TokenBucket(1000, burst=2000)
+    assert b''.join(shaper.shape(body(), 'client', 4000)) == b'x' * 4000
+    assert closed
+    assert sleeps == [pytest.approx(1.0, abs=0.05), pytest.approx(2.0, abs=0.05)]
+    assert shaper.stats()['throttled_seconds'] == pytest.approx(3.0, abs=0.1)
+    scheduler = shaper.stats()['scheduler']
+    assert scheduler['bytes_by_client'] == {'client': 4000}
+    assert scheduler['active_clients'] == 0
+    # Reads before the first 1500 bytes were sent are interactive, the rest (and the final empty read) bulk
+    assert scheduler['grants'] == {'interactive': 2, 'bulk': 3}
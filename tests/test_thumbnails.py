@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+import thumbnails
+from thumbnails import ThumbnailError, ThumbnailService, tile_times
+
+
+def test_tiles_without_keyframes_sample_the_middle():
+    assert tile_times(10.0, 3) == [5.0, 15.0, 25.0]
+
+
+def test_tiles_snap_to_the_keyframe_closest_to_the_middle():
+    keyframes = [0.0, 2.0, 9.0, 12.0, 30.0]
+    # [20, 30) holds no keyframe: 30 starts the next interval
+    assert tile_times(10.0, 4, keyframes) == [2.0, 12.0, 25.0, 30.0]
+
+
+@pytest.fixture
+def service(tmp_path):
+    instance = ThumbnailService(str(tmp_path / 'cache'), keyframes=lambda path: [0.0, 4.0])
+    yield instance
+    instance.shutdown()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_sprites_are_rendered_at_keyframes(service, tmp_path, monkeypatch):
+    video = tmp_path / 'video.mkv'
+    video.write_bytes(b'x' * 1000)
+    rendered = []
+
+    def render_sprite(path, out_dir, keyframe_times=None):
+        rendered.append(keyframe_times)
+        for name in (thumbnails.SPRITE, thumbnails.SPRITE_VTT):
+            with open(f"{out_dir}/{name}", 'w') as f:
+                f.write(name)
+    monkeypatch.setattr(thumbnails, 'render_sprite', render_sprite)
+    st = video.stat()
+    assert service.get(str(video), st, thumbnails.SPRITE)[1] is None
+    wait_for(lambda: service.get(str(video), st, thumbnails.SPRITE_VTT)[1] is not None)
+    assert rendered == [[0.0, 4.0]]
+
+
+def test_failures_expire(service, tmp_path, monkeypatch):
+    video = tmp_path / 'broken.mkv'
+    video.write_bytes(b'x' * 1000)
+    st = video.stat()
+
+    def render_poster(path, out_dir):
+        raise ThumbnailError("No decodable frame")
+    monkeypatch.setattr(thumbnails, 'render_poster', render_poster)
+    assert service.get(str(video), st, thumbnails.POSTER)[1] is None
+    wait_for(lambda: service.stats()['failed'] == 1)
+    with pytest.raises(ThumbnailError):
+        service.get(str(video), st, thumbnails.POSTER)
+    for key, (error, failed_at) in service._failed.items():
+        service._failed[key] = (error, failed_at - thumbnails.FAILURE_RETRY_SECONDS)
+    assert service.get(str(video), st, thumbnails.POSTER)[1] is None   # queued again
+    assert service.stats()['failed'] == 0
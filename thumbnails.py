@@ -0,0 +1,329 @@
+"""
+Poster thumbnails and seek-preview sprites.
+
+Frames are decoded with OpenCV on a small pool of worker threads, never on
+the request threads: a request for an asset that is not cached yet queues
+its generation and is answered with 202 Accepted, the page retries.
+
+Per video three assets are produced:
+
+- POSTER: a frame at POSTER_POSITION of the duration, POSTER_WIDTH wide.
+- SPRITE: up to MAX_TILES frames for even intervals (at least
+  MIN_TILE_INTERVAL seconds long), TILE_WIDTH wide, packed into one JPEG
+  sheet of SPRITE_COLUMNS columns. With a keyframe index (see keyframes.py)
+  each tile shows the keyframe closest to the middle of its interval, which
+  is decoded without decoding the frames before it; intervals without a
+  keyframe, and videos without an index, use the middle frame.
+- SPRITE_VTT: a WebVTT index mapping each time interval to its tile
+  (`sprite.jpg#xywh=x,y,w,h`), the format players use for scrub previews.
+
+Posters are queued ahead of sprites, so a playlist full of posters is not
+stuck behind sprite sheets of long videos. A video that cannot be decoded
+is not retried for FAILURE_RETRY_SECONDS. Assets are stored in a
+size-bounded DiskCache under a content address: a hash of the file size
+and its first and last SAMPLE_BYTES, so renamed or moved files keep their
+thumbnails and rewritten files get new ones.
+
+OpenCV and numpy are imported when the first thumbnail is rendered, so
+they cost nothing at startup or in processes that never render one.
+"""
+
+import os
+import math
+import time
+import queue
+import bisect
+import shutil
+import hashlib
+import logging
+import itertools
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from disk_cache import DiskCache, DEFAULT_CACHE_ROOT
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+DEFAULT_THUMBNAIL_WORKERS = int(os.environ.get('MEDIA_SERVER_THUMBNAIL_WORKERS', '1'))
+DEFAULT_CACHE_BYTES = int(os.environ.get('MEDIA_SERVER_THUMBNAIL_CACHE_MB', '256')) * 1024 * 1024
+DEFAULT_THUMBNAIL_CACHE_DIR = os.path.join(DEFAULT_CACHE_ROOT, 'thumbnails')
+POSTER_POSITION = 0.1       # fraction of the duration, skips black intros
+POSTER_WIDTH = 480
+TILE_WIDTH = 160
+SPRITE_COLUMNS = 10
+MAX_TILES = 100
+MIN_TILE_INTERVAL = 2.0     # seconds
+JPEG_QUALITY = 80
+SAMPLE_BYTES = 64 * 1024
+GRAB_AHEAD_FRAMES = 48      # decode forward instead of seeking when the next sample is this close
+FAILURE_RETRY_SECONDS = 600.0  # a video that could not be rendered is tried again after this long
+
+POSTER = 'poster.jpg'
+SPRITE = 'sprite.jpg'
+SPRITE_VTT = 'sprite.vtt'
+ASSETS = (POSTER, SPRITE, SPRITE_VTT)
+
+_PRIORITY = {POSTER: 0, SPRITE: 1, SPRITE_VTT: 1}
+
+
+class ThumbnailError(Exception):
+    """The video could not be decoded into thumbnails."""
+
+
+def content_key(path: str, st: os.stat_result) -> str:
+    """Content address of a video from its size and the bytes at both ends."""
+    digest = hashlib.blake2b(str(st.st_size).encode('ascii'), digest_size=12)
+    with open(path, 'rb') as f:
+        digest.update(f.read(SAMPLE_BYTES))
+        if st.st_size > 2 * SAMPLE_BYTES:
+            f.seek(st.st_size - SAMPLE_BYTES)
+        digest.update(f.read(SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def _vtt_timestamp(seconds: float) -> str:
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    return f"{hours:02d}:{minutes:02d}:{milliseconds / 1000:06.3f}"
+
+
+def tile_interval(duration: float) -> float:
+    return max(MIN_TILE_INTERVAL, duration / MAX_TILES)
+
+
+def tile_times(interval: float, count: int, keyframe_times: Optional[Sequence[float]] = None) -> List[float]:
+    """
+    Time of the frame shown by each sprite tile: the keyframe closest to the
+    middle of the tile's interval, or the middle when it holds no keyframe.
+    """
+    times = []
+    for i in range(count):
+        start, middle, end = i * interval, (i + 0.5) * interval, (i + 1) * interval
+        if keyframe_times:
+            first = bisect.bisect_left(keyframe_times, start)
+            last = bisect.bisect_left(keyframe_times, end)
+            if first < last:
+                middle = min(keyframe_times[first:last], key=lambda t: abs(t - middle))
+        times.append(middle)
+    return times
+
+
+def _resize(frame: 'np.ndarray', width: int) -> 'np.ndarray':
+    import cv2
+    height = max(2, int(round(frame.shape[0] * width / frame.shape[1] / 2)) * 2)
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def _encode_jpeg(image: 'np.ndarray', path: str) -> None:
+    import cv2
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise ThumbnailError("JPEG encoding failed")
+    with open(path, 'wb') as f:
+        f.write(encoded.tobytes())
+
+
+class _Capture:
+    """An OpenCV capture that reads frames at given times, seeking only when it pays off."""
+
+    def __init__(self, path: str) -> None:
+        import cv2
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise ThumbnailError(f"Could not open {path}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.duration = frame_count / self.fps if self.fps > 0 else 0.0
+        self.position = 0  # index of the next frame read() returns
+
+    def frame_at(self, seconds: float) -> Optional['np.ndarray']:
+        import cv2
+        if self.fps <= 0:
+            ok, frame = self.cap.read()
+            return frame if ok else None
+        # Rounded: a keyframe's time times the rate must not truncate to the frame before it
+        target = int(round(seconds * self.fps))
+        if not self.position <= target <= self.position + GRAB_AHEAD_FRAMES:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+            self.position = target
+        while self.position < target:
+            if not self.cap.grab():
+                return None
+            self.position += 1
+        ok, frame = self.cap.read()
+        self.position += 1
+        return frame if ok else None
+
+    def release(self) -> None:
+        self.cap.release()
+
+
+def render_poster(path: str, out_dir: str) -> None:
+    capture = _Capture(path)
+    try:
+        frame = capture.frame_at(capture.duration * POSTER_POSITION)
+        if frame is None:
+            frame = capture.frame_at(0)
+        if frame is None:
+            raise ThumbnailError(f"No decodable frame in {path}")
+        _encode_jpeg(_resize(frame, POSTER_WIDTH), os.path.join(out_dir, POSTER))
+    finally:
+        capture.release()
+
+
+def render_sprite(path: str, out_dir: str, keyframe_times: Optional[Sequence[float]] = None) -> None:
+    """Writes the sprite sheet and its WebVTT index, sampling keyframes from `keyframe_times` if given."""
+    import cv2
+    import numpy as np
+    capture = _Capture(path)
+    try:
+        duration = capture.duration
+        interval = tile_interval(duration)
+        count = max(1, min(MAX_TILES, math.ceil(duration / interval)))
+        tiles: List[Optional['np.ndarray']] = [capture.frame_at(t)
+                                               for t in tile_times(interval, count, keyframe_times)]
+    finally:
+        capture.release()
+    first = next((tile for tile in tiles if tile is not None), None)
+    if first is None:
+        raise ThumbnailError(f"No decodable frame in {path}")
+    tile_height = _resize(first, TILE_WIDTH).shape[0]
+    columns = min(SPRITE_COLUMNS, count)
+    rows = math.ceil(count / columns)
+    sheet = np.zeros((rows * tile_height, columns * TILE_WIDTH, 3), dtype=np.uint8)
+    cues = ['WEBVTT', '']
+    for i, tile in enumerate(tiles):
+        x, y = (i % columns) * TILE_WIDTH, (i // columns) * tile_height
+        if tile is not None:
+            sheet[y:y + tile_height, x:x + TILE_WIDTH] = cv2.resize(tile, (TILE_WIDTH, tile_height),
+                                                                    interpolation=cv2.INTER_AREA)
+        end = min((i + 1) * interval, duration) if duration else (i + 1) * interval
+        cues.append(f"{_vtt_timestamp(i * interval)} --> {_vtt_timestamp(end)}")
+        cues.append(f"{SPRITE}#xywh={x},{y},{TILE_WIDTH},{tile_height}")
+        cues.append('')
+    _encode_jpeg(sheet, os.path.join(out_dir, SPRITE))
+    with open(os.path.join(out_dir, SPRITE_VTT), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(cues))
+
+
+class ThumbnailService:
+    """Generates thumbnail assets on worker threads and serves them from a disk cache."""
+
+    def __init__(self, cache_dir: str = DEFAULT_THUMBNAIL_CACHE_DIR, max_cache_bytes: int = DEFAULT_CACHE_BYTES,
+                 workers: int = DEFAULT_THUMBNAIL_WORKERS,
+                 keyframes: Optional[Callable[[str], Optional[Sequence[float]]]] = None) -> None:
+        self.cache = DiskCache(cache_dir, max_cache_bytes)
+        # Keyframe times of a video path (None without an index), for sprite tiles
+        self._keyframes = keyframes
+        self._queue: 'queue.PriorityQueue[Tuple[int, int, str, Optional[str], str]]' = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._pending: Set[Tuple[str, str]] = set()           # (key, job) queued or running
+        self._failed: Dict[str, Tuple[str, float]] = {}       # key -> (error, when)
+        self._keys: Dict[str, Tuple[Tuple[int, int], str]] = {}  # path -> (identity, content key)
+        self.generated = 0
+        self._threads = [threading.Thread(target=self._worker, name=f'thumbnails-{i}', daemon=True)
+                         for i in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def key_for(self, path: str, st: os.stat_result) -> str:
+        identity = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            known = self._keys.get(path)
+        if known is not None and known[0] == identity:
+            return known[1]
+        key = content_key(path, st)
+        with self._lock:
+            self._keys[path] = (identity, key)
+        return key
+
+    def get(self, path: str, st: os.stat_result, name: str) -> Tuple[str, Optional[str]]:
+        """
+        Returns (content key, cached file of asset `name`), or (key, None)
+        after queueing its generation. Raises ThumbnailError if the video
+        could not be decoded, ValueError for unknown assets.
+        """
+        if name not in ASSETS:
+            raise ValueError(f"No thumbnail asset {name}")
+        key = self.key_for(path, st)
+        cached = self.cache.get(f"{key}/{name}")
+        if cached is not None:
+            return key, cached
+        with self._lock:
+            failure = self._failed.get(key)
+            if failure is not None:
+                if time.monotonic() - failure[1] < FAILURE_RETRY_SECONDS:
+                    raise ThumbnailError(failure[0])
+                del self._failed[key]
+            job = POSTER if name == POSTER else SPRITE
+            if (key, job) not in self._pending:
+                self._pending.add((key, job))
+                self._queue.put((_PRIORITY[job], next(self._seq), key, job, path))
+        return key, None
+
+    def _worker(self) -> None:
+        while True:
+            _, _, key, job, path = self._queue.get()
+            if job is None:
+                return
+            claim = self.cache.claim(f'{key}-{job}')
+            if claim is None:
+                # Another process sharing the cache renders it; the page's
+                # retry finds it there
+                with self._lock:
+                    self._pending.discard((key, job))
+                continue
+            workdir = None
+            try:
+                workdir = self.cache.make_workdir(prefix=f'{key}-')
+                if job == POSTER:
+                    render_poster(path, workdir)
+                else:
+                    render_sprite(path, workdir, self._keyframe_times(path))
+                for name in os.listdir(workdir):
+                    self.cache.put_file(f"{key}/{name}", os.path.join(workdir, name))
+                with self._lock:
+                    self.generated += 1
+                logger.info(f"Generated {job} for {os.path.basename(path)}")
+            except Exception as e:
+                logger.error(f"Thumbnail generation ({job}) failed for {path}: {e}")
+                with self._lock:
+                    self._failed[key] = (str(e), time.monotonic())
+            finally:
+                if workdir is not None:
+                    shutil.rmtree(workdir, ignore_errors=True)
+                self.cache.release(claim)
+                with self._lock:
+                    self._pending.discard((key, job))
+
+    def _keyframe_times(self, path: str) -> Optional[Sequence[float]]:
+        if self._keyframes is None:
+            return None
+        try:
+            return self._keyframes(path)
+        except Exception as e:
+            logger.debug(f"No keyframe index for {path}, sampling sprite tiles evenly: {e}")
+            return None
+
+    def forget(self, paths: List[str]) -> None:
+        """Drops remembered keys and failures of changed or removed files."""
+        with self._lock:
+            for path in paths:
+                known = self._keys.pop(path, None)
+                if known is not None:
+                    self._failed.pop(known[1], None)
+
+    def shutdown(self) -> None:
+        for _ in self._threads:
+            self._queue.put((-1, next(self._seq), '', None, ''))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"workers": len(self._threads), "queued": len(self._pending), "generated": self.generated,
+                    "failed": len(self._failed), "cache": self.cache.stats()}
@@ -3,6 +3,8 @@ import netifaces
 import logging
 import shutil
 import os
+import time
+import threading
 from typing import List # Kept if other utils might need it, but not for get_local_ip
 
 logger = logging.getLogger(__name__)
@@ -130,6 +132,43 @@ def get_local_ip() -> str:
         s.close()
     return IP
 
+# How often the interface addresses are compared for changes, and how long a
+# resolved address is trusted at most (routes can change without them)
+LOCAL_IP_CHECK_INTERVAL = 5.0
+LOCAL_IP_MAX_AGE = 300.0
+
+_local_ip_lock = threading.Lock()
+_local_ip_state = {'ip': None, 'signature': None, 'resolved_at': 0.0, 'checked_at': 0.0}
+
+def get_cached_local_ip() -> str:
+    """
+    Returns get_local_ip(), resolved once and reused.
+
+    The address is resolved again when the set of interface addresses
+    changes (compared at most every LOCAL_IP_CHECK_INTERVAL seconds) or
+    after LOCAL_IP_MAX_AGE seconds, so request handlers do not open a
+    socket per request.
+
+    Returns:
+        str: The primary local IP address
+    """
+    now = time.monotonic()
+    with _local_ip_lock:
+        state = _local_ip_state
+        expired = state['ip'] is None or now - state['resolved_at'] >= LOCAL_IP_MAX_AGE
+        if not expired and now - state['checked_at'] < LOCAL_IP_CHECK_INTERVAL:
+            return state['ip']
+        signature = tuple(sorted(get_local_ip_addresses()))
+        state['checked_at'] = now
+        if expired or signature != state['signature']:
+            previous = state['ip']
+            state['ip'] = get_local_ip()
+            state['signature'] = signature
+            state['resolved_at'] = now
+            if previous is not None and previous != state['ip']:
+                logger.info(f"Local IP address changed from {previous} to {state['ip']}")
+        return state['ip']
+
 # Placeholder for other potential utility functions:
 # def find_free_port(start_port: int, host: str = '127.0.0.1', max_attempts: int = 100) -> Optional[int]:
 #     """Finds an available TCP port starting from start_port."""